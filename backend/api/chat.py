@@ -4,24 +4,41 @@ Chat API - Xử lý tất cả các endpoint liên quan đến trò chuyện v
 Module này chứa:
 - POST /api/chat: Trò chuyện với AI Assistant (yêu cầu đơn lẻ)
 - Hỗ trợ cả trò chuyện thông thường (normal chat) và các hành động nhanh (quick action)
+- POST /api/chat/prefetch: Prefetch nền kết quả quick action khi user đang sửa code
+- POST /api/chat/stream: Trò chuyện dạng streaming (Server-Sent Events)
+- Tùy chọn trả về câu trả lời đã tách sẵn thành segments text/code (include_segments)
+- POST /api/chat/cancel: Hủy request đang chạy theo request_id
+- GET /api/chat/stats: Thống kê cache/prefetch của quick actions và việc hủy request
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response
 from flasgger import swag_from
+import json
 import traceback
 
+from services.cancellation_service import CancellationRegistry, RequestCancelled
+from services.quick_action_service import QuickActionService, QUICK_ACTION_PROMPTS
+from services.response_segmenter import StreamingSegmenter, segment_response
+
 # Tạo Blueprint cho API chat
 chat_bp = Blueprint('chat', __name__)
 
-def init_chat_api(ai_service):
+def init_chat_api(ai_service, cancellation_registry=None):
     """
     Khởi tạo chat API với dependency injection cho AI service
     
     Args:
         ai_service: Instance của AIService để xử lý các thao tác AI
+        cancellation_registry: CancellationRegistry dùng chung để hủy request theo request_id
     """
-    global _ai_service
+    global _ai_service, _quick_action_service, _cancellation_registry
     _ai_service = ai_service
+    _cancellation_registry = cancellation_registry or CancellationRegistry()
+    _quick_action_service = QuickActionService(ai_service, cancellation_registry=_cancellation_registry)
+
+def _get_request_id(data):
+    """Lấy request_id từ body hoặc header X-Request-ID (None nếu client không gửi)"""
+    return (data or {}).get('request_id') or request.headers.get('X-Request-ID')
 
 @chat_bp.route('/chat', methods=['POST'])
 @swag_from({
@@ -56,6 +73,16 @@ def init_chat_api(ai_service):
                         'type': 'boolean',
                         'description': 'True if this is a quick action (comment, debug, optimize, test)',
                         'example': False
+                    },
+                    'include_segments': {
+                        'type': 'boolean',
+                        'description': 'Optional: also return the response pre-split into text/code segments',
+                        'default': False
+                    },
+                    'request_id': {
+                        'type': 'string',
+                        'description': 'Optional: client-generated ID used to cancel the request via /api/chat/cancel (also accepted as X-Request-ID header)',
+                        'example': 'req-5f1c2a'
                     }
                 },
                 'required': ['message']
@@ -72,7 +99,32 @@ def init_chat_api(ai_service):
                     'response': {
                         'type': 'string', 
                         'example': 'Hello! I can help you explain code. Please share the code you want me to explain.'
-                    }
+                    },
+                    'segments': {
+                        'type': 'array',
+                        'description': 'Only when include_segments is true: response split into text/code segments',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'type': {'type': 'string', 'enum': ['text', 'code']},
+                                'language': {'type': 'string', 'example': 'java'},
+                                'content': {'type': 'string'}
+                            }
+                        }
+                    },
+                    'request_id': {'type': 'string', 'example': 'req-5f1c2a'}
+                }
+            }
+        },
+        '499': {
+            'description': 'Request cancelled (client disconnected or cancelled via /api/chat/cancel)',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean', 'example': False},
+                    'cancelled': {'type': 'boolean', 'example': True},
+                    'cancel_reason': {'type': 'string', 'example': 'client_disconnected'},
+                    'error': {'type': 'string', 'example': 'Request cancelled: client_disconnected'}
                 }
             }
         },
@@ -126,6 +178,7 @@ def chat():
         message = data['message']
         history = data.get('history', [])                    # Lịch sử trò chuyện để duy trì ngữ cảnh
         is_quick_action = data.get('is_quick_action', False) # Cờ để phân biệt hành động nhanh vs trò chuyện thông thường
+        include_segments = data.get('include_segments', False)
         
         if not message.strip():
             return jsonify({
@@ -133,14 +186,37 @@ def chat():
                 "error": "Message cannot be empty"
             }), 400
         
-        # Bước 2: Gọi AI service để xử lý
-        result = _ai_service.chat_with_ai(
-            message=message,
-            history=history,
-            is_quick_action=is_quick_action
-        )
+        # Bước 2: Quick action - ưu tiên kết quả đã cache/prefetch
+        result = None
+        if is_quick_action:
+            _quick_action_service.record_usage(message)
+            result = _quick_action_service.get_cached(message)
         
-        # Bước 3: Trả về phản hồi
+        # Bước 3: Gọi AI service để xử lý nếu chưa có trong cache
+        # Chạy trong worker thread để hủy request Azure khi client ngắt kết nối
+        token = _cancellation_registry.register(_get_request_id(data))
+        try:
+            if result is None:
+                result = _cancellation_registry.run(
+                    token, request.environ,
+                    _ai_service.chat_with_ai,
+                    message=message,
+                    history=history,
+                    is_quick_action=is_quick_action
+                )
+                if is_quick_action:
+                    _quick_action_service.store(message, result)
+        finally:
+            _cancellation_registry.unregister(token)
+        
+        result = dict(result, request_id=token.request_id)
+        if include_segments and result.get("success"):
+            result["segments"] = segment_response(result.get("response", ""))
+        
+        # Bước 4: Trả về phản hồi
+        if result.get("cancelled"):
+            _cancellation_registry.record_cancellation(result.get("cancel_reason"), result.get("tokens_saved", 0))
+            return jsonify(result), 499
         if result["success"]:
             return jsonify(result), 200
         else:
@@ -154,3 +230,321 @@ def chat():
             "success": False,
             "error": f"Error processing chat: {str(e)}"
         }), 500
+
+@chat_bp.route('/chat/stream', methods=['POST'])
+@swag_from({
+    'tags': ['chat'],
+    'summary': 'Chat with AI Assistant (streaming)',
+    'description': 'Same input as /api/chat but the answer is streamed as Server-Sent Events. '
+                   'Closing the connection aborts the upstream Azure OpenAI generation.',
+    'produces': ['text/event-stream'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'message': {'type': 'string', 'example': 'Explain the Java for-each loop'},
+                    'history': {'type': 'array', 'items': {'type': 'object'}},
+                    'is_quick_action': {'type': 'boolean', 'example': False},
+                    'include_segments': {'type': 'boolean', 'example': True},
+                    'request_id': {'type': 'string', 'example': 'req-5f1c2a'}
+                },
+                'required': ['message']
+            }
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Event stream. Each event is a JSON object with type start | delta | done | cancelled | error. '
+                           'With include_segments, segment_start | segment_delta | segment_end events mark '
+                           'text/code block boundaries and the done event carries the final segments'
+        },
+        '400': {
+            'description': 'Bad request - invalid input data',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean', 'example': False},
+                    'error': {'type': 'string', 'example': 'Message is required'}
+                }
+            }
+        }
+    }
+})
+def chat_stream():
+    """
+    Endpoint trò chuyện streaming - Trả về câu trả lời theo từng phần qua SSE
+    
+    Khi client ngắt kết nối, Werkzeug/Gunicorn đóng generator -> token bị hủy
+    và stream Azure OpenAI được đóng ngay, không generate phần còn lại.
+    """
+    data = request.get_json(silent=True)
+    
+    if not data or not str(data.get('message', '')).strip():
+        return jsonify({
+            "success": False,
+            "error": "Message is required"
+        }), 400
+    
+    message = data['message']
+    history = data.get('history', [])
+    is_quick_action = data.get('is_quick_action', False)
+    segmenter = StreamingSegmenter() if data.get('include_segments', False) else None
+    request_id = _get_request_id(data)
+    
+    def sse(event):
+        return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        # Đăng ký token khi generator bắt đầu chạy: response không bao giờ được đọc (client ngắt trước
+        # byte đầu tiên) thì cũng không có token nào cần gỡ; đã đăng ký thì finally luôn gỡ
+        token = _cancellation_registry.register(request_id)
+        events = None
+        max_tokens = 0
+        generated = []
+        finished = False
+        try:
+            events = _ai_service.stream_chat_with_ai(
+                message=message,
+                history=history,
+                is_quick_action=is_quick_action,
+                cancel_token=token
+            )
+            for event in events:
+                if event["type"] == "start":
+                    max_tokens = event["max_tokens"]
+                    event = dict(event, request_id=token.request_id)
+                elif event["type"] == "delta":
+                    generated.append(event["content"])
+                elif event["type"] == "done" and segmenter is not None:
+                    for segment_event in segmenter.finish():
+                        yield sse(segment_event)
+                    event = dict(event, segments=segment_response("".join(generated)))
+                yield sse(event)
+                if event["type"] == "delta" and segmenter is not None:
+                    for segment_event in segmenter.feed(event["content"]):
+                        yield sse(segment_event)
+            finished = True
+        except RequestCancelled as e:
+            finished = True
+            _cancellation_registry.record_cancellation(e.reason, e.tokens_saved)
+            yield sse({"type": "cancelled", "reason": e.reason})
+        except Exception as e:
+            finished = True
+            print(f"Error in chat stream: {str(e)}")
+            yield sse({"type": "error", "error": f"Error processing chat: {str(e)}"})
+        finally:
+            if not finished:
+                # Client ngắt kết nối giữa chừng -> đóng stream Azure
+                token.cancel("client_disconnected")
+                if events is not None:
+                    events.close()
+                _cancellation_registry.record_cancellation(
+                    "client_disconnected", _ai_service.estimate_tokens_saved(max_tokens, "".join(generated))
+                )
+            _cancellation_registry.unregister(token)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'   # Tắt buffering của nginx để event tới client ngay
+    })
+
+@chat_bp.route('/chat/cancel', methods=['POST'])
+@swag_from({
+    'tags': ['chat'],
+    'summary': 'Cancel an in-flight chat request',
+    'description': 'Abort a running /api/chat, /api/chat/stream or /api/knowledge-base/chat request by its request_id',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'request_id': {'type': 'string', 'example': 'req-5f1c2a'}
+                },
+                'required': ['request_id']
+            }
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Request cancelled',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean', 'example': True},
+                    'request_id': {'type': 'string', 'example': 'req-5f1c2a'}
+                }
+            }
+        },
+        '404': {
+            'description': 'No running request with this request_id',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean', 'example': False},
+                    'error': {'type': 'string', 'example': 'Request not found or already finished'}
+                }
+            }
+        }
+    }
+})
+def cancel_chat():
+    """
+    Endpoint hủy request - Dừng request AI đang chạy theo request_id
+    """
+    data = request.get_json(silent=True) or {}
+    request_id = data.get('request_id')
+    
+    if not request_id:
+        return jsonify({
+            "success": False,
+            "error": "request_id is required"
+        }), 400
+    
+    if not _cancellation_registry.cancel(request_id):
+        return jsonify({
+            "success": False,
+            "error": "Request not found or already finished"
+        }), 404
+    
+    return jsonify({
+        "success": True,
+        "request_id": request_id
+    }), 200
+
+@chat_bp.route('/chat/prefetch', methods=['POST'])
+@swag_from({
+    'tags': ['chat'],
+    'summary': 'Prefetch quick action result',
+    'description': 'Low-priority background computation of the most-used quick action for the code currently in the editor. '
+                   'The result is stored in the quick action cache so a later click returns almost instantly.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'session_id': {
+                        'type': 'string',
+                        'description': 'Editor session ID - a newer prefetch cancels the previous one of the same session',
+                        'example': 'editor-1a2b3c'
+                    },
+                    'code': {
+                        'type': 'string',
+                        'description': 'Current code in the editor',
+                        'example': 'function add(a, b) { return a + b; }'
+                    },
+                    'language': {
+                        'type': 'string',
+                        'description': 'Programming language of the code',
+                        'example': 'javascript'
+                    },
+                    'action': {
+                        'type': 'string',
+                        'enum': list(QUICK_ACTION_PROMPTS.keys()),
+                        'description': 'Optional: quick action to prefetch (default: most-used action)'
+                    }
+                },
+                'required': ['session_id', 'code', 'language']
+            }
+        }
+    ],
+    'responses': {
+        '202': {
+            'description': 'Prefetch accepted (scheduled, already cached or skipped by budget caps)',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean', 'example': True},
+                    'status': {'type': 'string', 'enum': ['scheduled', 'cached', 'skipped']},
+                    'action': {'type': 'string', 'example': 'comment'},
+                    'reason': {'type': 'string', 'example': 'Prefetch budget exhausted'}
+                }
+            }
+        },
+        '400': {
+            'description': 'Bad request - invalid input data',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean', 'example': False},
+                    'error': {'type': 'string', 'example': 'session_id, code and language are required'}
+                }
+            }
+        }
+    }
+})
+def prefetch_quick_action():
+    """
+    Endpoint prefetch - Tính trước kết quả quick action khi user đang sửa code
+    
+    Frontend gọi endpoint này (debounced) mỗi khi code trong editor thay đổi.
+    Kết quả được đưa vào cache của quick action, lần click tiếp theo với cùng code
+    sẽ trả về gần như ngay lập tức.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        session_id = data.get('session_id')
+        code = data.get('code')
+        language = data.get('language')
+        
+        if not session_id or code is None or not language:
+            return jsonify({
+                "success": False,
+                "error": "session_id, code and language are required"
+            }), 400
+        
+        result = _quick_action_service.prefetch(
+            session_id=session_id,
+            code=code,
+            language=language,
+            action=data.get('action')
+        )
+        
+        return jsonify(dict(result, success=True)), 202
+        
+    except Exception as e:
+        print(f"Error in prefetch endpoint: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return jsonify({
+            "success": False,
+            "error": f"Error scheduling prefetch: {str(e)}"
+        }), 500
+
+@chat_bp.route('/chat/stats', methods=['GET'])
+@swag_from({
+    'tags': ['chat'],
+    'summary': 'Chat performance statistics',
+    'description': 'Quick action cache hit rate, usage per action, prefetch counters and request cancellation counters',
+    'responses': {
+        '200': {
+            'description': 'Statistics returned successfully',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean', 'example': True},
+                    'quick_actions': {'type': 'object'},
+                    'cancellation': {'type': 'object'}
+                }
+            }
+        }
+    }
+})
+def chat_stats():
+    """
+    Endpoint thống kê - Cache hit rate, tần suất quick action, prefetch và số request bị hủy
+    """
+    return jsonify({
+        "success": True,
+        "quick_actions": _quick_action_service.get_stats(),
+        "cancellation": _cancellation_registry.get_stats()
+    }), 200
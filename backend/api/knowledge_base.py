@@ -2,33 +2,134 @@
 Knowledge Base API - Xử lý các endpoint liên quan đến quản lý knowledge base
 
 Module này chứa:
-- POST /api/knowledge-base/upload: Upload file PDF để xây dựng knowledge base
+- POST /api/knowledge-base/upload: Upload file PDF để xây dựng knowledge base (đồng bộ hoặc job nền)
+- POST /api/knowledge-base/upload/bulk: Upload nhiều file PDF hoặc archive zip (kèm manifest), ingest song song
+- POST /api/knowledge-base/uploads: Tạo phiên upload nhiều phần (resumable) cho file lớn
+- GET/DELETE /api/knowledge-base/uploads/<upload_id>: Trạng thái (phần còn thiếu) / hủy phiên upload
+- PUT /api/knowledge-base/uploads/<upload_id>/parts/<n>: Gửi 1 phần (body là bytes của phần, kèm checksum)
+- POST /api/knowledge-base/uploads/<upload_id>/complete: Hoàn tất upload và ingest file
+- GET /api/knowledge-base/jobs/<job_id>: Trạng thái và tiến độ của job ingestion
+- GET /api/knowledge-base/jobs/<job_id>/events: Theo dõi tiến độ job qua Server-Sent Events
 - GET /api/knowledge-base/files: Lấy danh sách file đã upload
+- GET /api/knowledge-base/stats: Thống kê vector database (số chunks, chống trùng file/chunk)
 - POST /api/knowledge-base/search: Tìm kiếm trong files cụ thể dựa trên list filename_uuid
 - GET /api/knowledge-base/chunks: Lấy tất cả chunks từ ChromaDB
 - POST /api/knowledge-base/reset: Reset ChromaDB - xóa tất cả chunks và tạo lại collection
 - POST /api/knowledge-base/clear: Xóa tất cả chunks nhưng giữ nguyên collection
+- POST /api/knowledge-base/reindex: Chia chunk lại và embed lại files từ text đã lưu (không parse lại PDF)
+- GET /api/knowledge-base/index: Tham số HNSW của vector index (đang dùng và theo cấu hình)
+- POST /api/knowledge-base/index/rebuild: Dựng lại vector index với tham số HNSW mới (không embed lại)
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response
 from flasgger import swag_from
+import json
+import time
 import traceback
+import zipfile
 
 # Import service
 from services.knowledge_base_service import KnowledgeBaseService
+from services.cancellation_service import CancellationRegistry, RequestCancelled, raise_if_cancelled
+from services.response_segmenter import segment_response
+from services.ingestion_jobs import IngestionJobQueue, FINISHED_STATUSES
+from services.file_hash_index import DUPLICATE_POLICIES, DUPLICATE_RETURN_EXISTING
+from services.file_catalog import FILE_SORT_FIELDS
+from services.bulk_upload import MANIFEST_FILENAME, parse_manifest, scan_archive, iter_archive_uploads, iter_form_uploads
+from services.upload_sessions import UploadSessionStore
 
 # Tạo Blueprint cho API knowledge base
 knowledge_base_bp = Blueprint('knowledge_base', __name__)
 
 # Global service instance
 _knowledge_base_service = None
+_cancellation_registry = None
+_ingestion_queue = None
+_upload_sessions = None
 
-def init_knowledge_base_api():
+# Phần multipart ngoài nội dung file (boundary, header, các field title/description)
+MULTIPART_OVERHEAD = 64 * 1024
+
+def init_knowledge_base_api(cancellation_registry=None, recover_jobs=True):
     """
     Khởi tạo knowledge base API
+    
+    Args:
+        cancellation_registry: CancellationRegistry dùng chung với chat API (hủy request theo request_id)
+        recover_jobs: Lấy lại job ingestion dang dở (False trong process cha của Werkzeug reloader)
     """
-    global _knowledge_base_service
+    global _knowledge_base_service, _cancellation_registry, _ingestion_queue, _upload_sessions
     _knowledge_base_service = KnowledgeBaseService()
+    _cancellation_registry = cancellation_registry or CancellationRegistry()
+    _ingestion_queue = IngestionJobQueue(_knowledge_base_service, max_workers=_knowledge_base_service.ingest_workers,
+                                         recover_jobs=recover_jobs)
+    _upload_sessions = UploadSessionStore(
+        _knowledge_base_service,
+        part_size=_knowledge_base_service.upload_part_size,
+        max_file_size=_knowledge_base_service.max_resumable_file_size
+    )
+
+def _is_truthy(value):
+    """Đọc cờ boolean từ form/query string"""
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+def _queue_saved_file(saved_file, title, description, on_duplicate):
+    """
+    Tạo job ingestion nền cho file đã lưu (file trùng nội dung dùng lại file/job đã có)
+    
+    Returns:
+        tuple: (response_body, status_code)
+    """
+    # Trùng nội dung -> không tạo job mới; nếu file gốc đang ingest thì trả về job của nó
+    is_duplicate, result_data, message, status_code = _knowledge_base_service.check_duplicate_upload(
+        saved_file, title, description, on_duplicate=on_duplicate, wait=False
+    )
+    if is_duplicate:
+        if result_data is None:
+            return {
+                "success": False,
+                "error": "Upload failed",
+                "message": message
+            }, status_code
+        
+        job = _ingestion_queue.find_active_job(result_data["duplicate_of"]) \
+            if result_data["ingestion_pending"] else None
+        if job is None:
+            return {
+                "success": True,
+                "message": message,
+                "data": result_data
+            }, status_code
+        
+        return {
+            "success": True,
+            "message": f"{message}, processing in background",
+            "job_id": job["job_id"],
+            "file_id": result_data["file_id"],
+            "status": job["status"],
+            "data": result_data,
+            "status_url": f"/api/knowledge-base/jobs/{job['job_id']}",
+            "events_url": f"/api/knowledge-base/jobs/{job['job_id']}/events"
+        }, 202
+    
+    queued, job, queue_error = _ingestion_queue.submit(saved_file, title, description)
+    if not queued:
+        _knowledge_base_service.discard_saved_file(saved_file)
+        return {
+            "success": False,
+            "error": "Upload failed",
+            "message": queue_error
+        }, 503
+    
+    return {
+        "success": True,
+        "message": "File uploaded, processing in background",
+        "job_id": job["job_id"],
+        "file_id": job["file_id"],
+        "status": job["status"],
+        "status_url": f"/api/knowledge-base/jobs/{job['job_id']}",
+        "events_url": f"/api/knowledge-base/jobs/{job['job_id']}/events"
+    }, 202
 
 @knowledge_base_bp.route('/knowledge-base/upload', methods=['POST'])
 @swag_from({
@@ -57,9 +158,42 @@ def init_knowledge_base_api():
             'type': 'string',
             'required': False,
             'description': 'Description of the document'
+        },
+        {
+            'name': 'async',
+            'in': 'formData',
+            'type': 'boolean',
+            'required': False,
+            'default': False,
+            'description': 'Process the file in a background job and return 202 with a job_id right away '
+                           '(also accepted as ?async=true)'
+        },
+        {
+            'name': 'on_duplicate',
+            'in': 'formData',
+            'type': 'string',
+            'required': False,
+            'enum': ['return_existing', 'alias'],
+            'default': 'return_existing',
+            'description': 'What to do when the same content (SHA-256) was already uploaded: return the existing '
+                           'file, or create an alias record with the new title/description sharing its chunks'
         }
     ],
     'responses': {
+        202: {
+            'description': 'File saved, ingestion job queued',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean'},
+                    'message': {'type': 'string'},
+                    'job_id': {'type': 'string'},
+                    'file_id': {'type': 'string'},
+                    'status_url': {'type': 'string'},
+                    'events_url': {'type': 'string'}
+                }
+            }
+        },
         200: {
             'description': 'File uploaded successfully',
             'schema': {
@@ -75,10 +209,14 @@ def init_knowledge_base_api():
                             'title': {'type': 'string'},
                             'file_size': {'type': 'integer'},
                             'file_hash': {'type': 'string'},
+                            'sha256': {'type': 'string'},
                             'pages_count': {'type': 'integer'},
                             'text_length': {'type': 'integer'},
                             'upload_time': {'type': 'string'},
-                            'description': {'type': 'string'}
+                            'description': {'type': 'string'},
+                            'alias_of': {'type': 'string'},
+                            'duplicate_of': {'type': 'string', 'description': 'Set when the upload was deduplicated'},
+                            'ingestion_pending': {'type': 'boolean'}
                         }
                     }
                 }
@@ -124,6 +262,16 @@ def upload_file():
     Upload PDF file để xây dựng knowledge base
     """
     try:
+        # Chặn sớm theo Content-Length, trước khi Werkzeug đọc toàn bộ multipart body
+        if request.content_length and \
+                request.content_length > _knowledge_base_service.max_file_size + MULTIPART_OVERHEAD:
+            return jsonify({
+                "success": False,
+                "error": "File too large",
+                "message": f"File size must be less than {_knowledge_base_service.max_file_size // (1024*1024)}MB, "
+                           f"use the resumable upload API (/api/knowledge-base/uploads) for larger files"
+            }), 413
+        
         # Kiểm tra có file trong request không
         if 'file' not in request.files:
             return jsonify({
@@ -144,9 +292,30 @@ def upload_file():
                 "message": "Please provide a title for the document"
             }), 400
         
+        on_duplicate = request.form.get('on_duplicate', request.args.get('on_duplicate', DUPLICATE_RETURN_EXISTING))
+        if on_duplicate not in DUPLICATE_POLICIES:
+            return jsonify({
+                "success": False,
+                "error": "Invalid on_duplicate",
+                "message": f"on_duplicate must be one of: {', '.join(DUPLICATE_POLICIES)}"
+            }), 400
+        
+        # Chế độ job nền: lưu file rồi trả về job_id ngay, pipeline chạy trong worker pool
+        if _is_truthy(request.form.get('async', request.args.get('async', 'false'))):
+            save_success, saved_file, save_error, status_code = _knowledge_base_service.save_uploaded_file(file)
+            if not save_success:
+                return jsonify({
+                    "success": False,
+                    "error": "Upload failed",
+                    "message": save_error
+                }), status_code
+            
+            body, status_code = _queue_saved_file(saved_file, title, description, on_duplicate)
+            return jsonify(body), status_code
+        
         # Sử dụng service để xử lý file
         success, result_data, error_message, status_code = _knowledge_base_service.process_uploaded_file(
-            file, title, description
+            file, title, description, on_duplicate=on_duplicate
         )
         
         if success:
@@ -173,14 +342,61 @@ def upload_file():
             "message": f"Failed to process file: {str(e)}"
         }), 500
 
-@knowledge_base_bp.route('/knowledge-base/files', methods=['GET'])
+@knowledge_base_bp.route('/knowledge-base/upload/bulk', methods=['POST'])
 @swag_from({
     'tags': ['knowledge-base'],
-    'summary': 'List uploaded files',
-    'description': 'Get list of all uploaded PDF files in knowledge base',
+    'summary': 'Upload multiple PDF files or a zip archive to knowledge base',
+    'description': 'Upload several PDF files (repeat the "files" field) or one zip archive of PDFs. '
+                   'Titles and descriptions come from a JSON manifest (form field, or manifest.json at the '
+                   'root of the archive); files without an entry use their filename as title. '
+                   'Files are saved one by one and ingested concurrently on a bounded worker pool '
+                   '(KB_INGEST_WORKERS, default: number of CPUs).',
+    'consumes': ['multipart/form-data'],
+    'parameters': [
+        {
+            'name': 'files',
+            'in': 'formData',
+            'type': 'file',
+            'required': False,
+            'description': 'PDF files (max 10MB each, field may be repeated)'
+        },
+        {
+            'name': 'archive',
+            'in': 'formData',
+            'type': 'file',
+            'required': False,
+            'description': 'Zip archive of PDF files (used instead of "files")'
+        },
+        {
+            'name': 'manifest',
+            'in': 'formData',
+            'type': 'string',
+            'required': False,
+            'description': 'JSON list [{"filename", "title", "description"}] or object '
+                           '{"filename": {"title", "description"}}; overrides manifest.json in the archive'
+        },
+        {
+            'name': 'async',
+            'in': 'formData',
+            'type': 'boolean',
+            'required': False,
+            'default': False,
+            'description': 'Queue one background job per file and return 202 with the job ids right away '
+                           '(also accepted as ?async=true)'
+        },
+        {
+            'name': 'on_duplicate',
+            'in': 'formData',
+            'type': 'string',
+            'required': False,
+            'enum': ['return_existing', 'alias'],
+            'default': 'return_existing',
+            'description': 'What to do when a file has the same content (SHA-256) as an existing one'
+        }
+    ],
     'responses': {
         200: {
-            'description': 'List of uploaded files',
+            'description': 'Files processed, one result per file (same format as the single upload endpoint)',
             'schema': {
                 'type': 'object',
                 'properties': {
@@ -189,65 +405,223 @@ def upload_file():
                     'data': {
                         'type': 'object',
                         'properties': {
+                            'total': {'type': 'integer'},
+                            'succeeded': {'type': 'integer'},
+                            'failed': {'type': 'integer'},
                             'files': {
                                 'type': 'array',
                                 'items': {
                                     'type': 'object',
                                     'properties': {
-                                        'file_id': {'type': 'string'},
                                         'filename': {'type': 'string'},
                                         'title': {'type': 'string'},
-                                        'file_size': {'type': 'integer'},
-                                        'pages_count': {'type': 'integer'},
-                                        'upload_time': {'type': 'string'},
-                                        'description': {'type': 'string'}
+                                        'success': {'type': 'boolean'},
+                                        'status_code': {'type': 'integer'},
+                                        'message': {'type': 'string'},
+                                        'data': {'type': 'object'},
+                                        'job_id': {'type': 'string', 'description': 'Set in async mode'},
+                                        'status_url': {'type': 'string'}
                                     }
                                 }
                             },
-                            'total_files': {'type': 'integer'}
+                            'skipped': {
+                                'type': 'array',
+                                'description': 'Archive members that were not PDF files',
+                                'items': {
+                                    'type': 'object',
+                                    'properties': {
+                                        'filename': {'type': 'string'},
+                                        'reason': {'type': 'string'}
+                                    }
+                                }
+                            }
                         }
                     }
                 }
             }
+        },
+        202: {
+            'description': 'Files saved, ingestion jobs queued (async mode, same body as 200)'
+        },
+        400: {
+            'description': 'No file, invalid archive or manifest, or no file could be processed'
+        },
+        413: {
+            'description': 'Too many files (KB_BULK_MAX_FILES)'
+        },
+        500: {
+            'description': 'Internal server error'
         }
     }
 })
-def list_files():
+def upload_bulk():
     """
-    Lấy danh sách các file đã upload
+    Upload nhiều file PDF (multipart) hoặc 1 archive zip, ingest song song
     """
+    zip_file = None
     try:
-        # Sử dụng service để lấy danh sách file
-        success, result_data, error_message = _knowledge_base_service.get_uploaded_files()
+        on_duplicate = request.form.get('on_duplicate', request.args.get('on_duplicate', DUPLICATE_RETURN_EXISTING))
+        if on_duplicate not in DUPLICATE_POLICIES:
+            return jsonify({
+                "success": False,
+                "error": "Invalid on_duplicate",
+                "message": f"on_duplicate must be one of: {', '.join(DUPLICATE_POLICIES)}"
+            }), 400
         
-        if success:
+        manifest_data = request.form.get('manifest')
+        if not manifest_data and 'manifest' in request.files:
+            manifest_data = request.files['manifest'].read()
+        
+        skipped = []
+        if 'archive' in request.files:
+            try:
+                zip_file = zipfile.ZipFile(request.files['archive'].stream)
+            except zipfile.BadZipFile:
+                return jsonify({
+                    "success": False,
+                    "error": "Invalid archive",
+                    "message": "The archive must be a zip file"
+                }), 400
+            members, manifest_info, skipped = scan_archive(zip_file, _knowledge_base_service.allowed_extensions)
+            # manifest gửi kèm form được ưu tiên hơn manifest.json trong archive
+            if manifest_info is not None and not manifest_data:
+                manifest_data = zip_file.read(manifest_info)
+            filenames = [info.filename for info in members]
+        else:
+            files = [file for file in request.files.getlist('files') + request.files.getlist('file') if file.filename]
+            filenames = [file.filename for file in files]
+        
+        manifest, manifest_error = parse_manifest(manifest_data)
+        if manifest_error:
             return jsonify({
-                "success": True,
-                "message": "Files retrieved successfully",
-                "data": result_data
-            }), 200
+                "success": False,
+                "error": "Invalid manifest",
+                "message": f"{manifest_error} ({MANIFEST_FILENAME} or manifest field)"
+            }), 400
+        
+        if not filenames:
+            return jsonify({
+                "success": False,
+                "error": "No file provided",
+                "message": "Please select PDF files or a zip archive of PDF files to upload",
+                "data": {"skipped": skipped}
+            }), 400
+        
+        if len(filenames) > _knowledge_base_service.bulk_max_files:
+            return jsonify({
+                "success": False,
+                "error": "Too many files",
+                "message": f"A bulk upload can contain at most {_knowledge_base_service.bulk_max_files} files"
+            }), 413
+        
+        if zip_file is not None:
+            uploads = iter_archive_uploads(zip_file, members, manifest)
+        else:
+            uploads = iter_form_uploads(files, manifest)
+        
+        results = []
+        if _is_truthy(request.form.get('async', request.args.get('async', 'false'))):
+            # Lưu lần lượt từng file rồi tạo job, pipeline chạy trong worker pool của hàng đợi
+            for upload in uploads:
+                save_success, saved_file, save_error, status_code = _knowledge_base_service.save_uploaded_file(
+                    upload.file, file_size=upload.file_size
+                )
+                if save_success:
+                    body, status_code = _queue_saved_file(saved_file, upload.title, upload.description, on_duplicate)
+                else:
+                    body = {"success": False, "error": "Upload failed", "message": save_error}
+                results.append(dict(body, filename=upload.filename, title=upload.title, status_code=status_code))
         else:
+            processed = _knowledge_base_service.process_uploaded_files(uploads, on_duplicate=on_duplicate)
+            for filename, (success, result_data, message, status_code) in zip(filenames, processed):
+                result = {"filename": filename, "success": success, "status_code": status_code, "message": message}
+                if success:
+                    result["data"] = result_data
+                else:
+                    result["error"] = "Upload failed"
+                results.append(result)
+        
+        succeeded = sum(1 for result in results if result["success"])
+        failed = len(results) - succeeded
+        print(f"📦 Bulk upload: {succeeded}/{len(results)} files succeeded, {len(skipped)} skipped")
+        
+        data = {
+            "total": len(results),
+            "succeeded": succeeded,
+            "failed": failed,
+            "files": results,
+            "skipped": skipped
+        }
+        if not succeeded:
             return jsonify({
                 "success": False,
-                "error": "Failed to list files",
-                "message": error_message
-            }), 500
+                "error": "Upload failed",
+                "message": "No file could be processed",
+                "data": data
+            }), 400
+        
+        status_code = 202 if any("job_id" in result for result in results) else 200
+        return jsonify({
+            "success": True,
+            "message": f"Processed {len(results)} files ({succeeded} succeeded, {failed} failed)",
+            "data": data
+        }), status_code
         
     except Exception as e:
+        # Log lỗi chi tiết
         error_trace = traceback.format_exc()
-        print(f"Error listing files: {error_trace}")
+        print(f"Error in bulk upload: {error_trace}")
         
         return jsonify({
             "success": False,
-            "error": "Failed to list files",
-            "message": str(e)
+            "error": "Upload failed",
+            "message": f"Failed to process files: {str(e)}"
         }), 500
+    finally:
+        if zip_file is not None:
+            zip_file.close()
 
-@knowledge_base_bp.route('/knowledge-base/search', methods=['POST'])
+def _upload_session_response(session):
+    """Thông tin session kèm URL gửi phần / hoàn tất"""
+    upload_url = f"/api/knowledge-base/uploads/{session['upload_id']}"
+    return dict(session, part_url=f"{upload_url}/parts/{{part_number}}", complete_url=f"{upload_url}/complete")
+
+_UPLOAD_SESSION_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'upload_id': {'type': 'string'},
+        'filename': {'type': 'string'},
+        'title': {'type': 'string'},
+        'file_size': {'type': 'integer'},
+        'part_size': {'type': 'integer'},
+        'parts_total': {'type': 'integer'},
+        'status': {'type': 'string', 'enum': ['uploading', 'completed']},
+        'parts': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'part_number': {'type': 'integer'},
+                    'size': {'type': 'integer'},
+                    'sha256': {'type': 'string'}
+                }
+            }
+        },
+        'missing_parts': {'type': 'array', 'items': {'type': 'integer'}},
+        'bytes_received': {'type': 'integer'},
+        'expires_at': {'type': 'string'},
+        'part_url': {'type': 'string', 'example': '/api/knowledge-base/uploads/<upload_id>/parts/{part_number}'},
+        'complete_url': {'type': 'string'}
+    }
+}
+
+@knowledge_base_bp.route('/knowledge-base/uploads', methods=['POST'])
 @swag_from({
     'tags': ['knowledge-base'],
-    'summary': 'Search in specific files',
-    'description': 'Search for content in specific files using list of filename_uuid',
+    'summary': 'Start a resumable upload',
+    'description': 'Create an upload session for a large PDF. The server picks the part size; send each part '
+                   'with PUT .../parts/{n} (any order, retry freely), check missing parts with GET, then call '
+                   '.../complete. Sessions expire 24h after their last part.',
     'parameters': [
         {
             'name': 'body',
@@ -255,119 +629,805 @@ def list_files():
             'required': True,
             'schema': {
                 'type': 'object',
+                'required': ['filename', 'file_size', 'title'],
                 'properties': {
-                    'query': {
-                        'type': 'string',
-                        'description': 'Search query or question',
-                        'example': 'What is machine learning?'
-                    },
-                    'filename_uuids': {
-                        'type': 'array',
-                        'items': {'type': 'string'},
-                        'description': 'List of filename_uuid (file_id) to search in',
-                        'example': ['uuid1', 'uuid2', 'uuid3']
-                    },
-                    'max_results': {
-                        'type': 'integer',
-                        'description': 'Maximum number of results to return',
-                        'default': 5,
-                        'example': 5
-                    }
-                },
-                'required': ['query', 'filename_uuids']
+                    'filename': {'type': 'string', 'example': 'manual.pdf'},
+                    'file_size': {'type': 'integer', 'example': 73400320},
+                    'title': {'type': 'string'},
+                    'description': {'type': 'string'},
+                    'sha256': {'type': 'string', 'description': 'SHA-256 of the whole file, checked on complete'},
+                    'on_duplicate': {'type': 'string', 'enum': ['return_existing', 'alias'],
+                                     'default': 'return_existing'}
+                }
             }
         }
     ],
     'responses': {
-        200: {
-            'description': 'Search completed successfully',
+        201: {
+            'description': 'Upload session created',
             'schema': {
                 'type': 'object',
                 'properties': {
                     'success': {'type': 'boolean'},
-                    'message': {'type': 'string'},
-                    'data': {
-                        'type': 'object',
-                        'properties': {
-                            'query': {'type': 'string'},
-                            'filename_uuids': {
-                                'type': 'array',
-                                'items': {'type': 'string'}
-                            },
-                            'results': {
-                                'type': 'array',
-                                'items': {
-                                    'type': 'object',
-                                    'properties': {
-                                        'content': {'type': 'string'},
-                                        'similarity_score': {'type': 'number'},
-                                        'source': {
-                                            'type': 'object',
-                                            'properties': {
-                                                'file_id': {'type': 'string'},
-                                                'filename_uuid': {'type': 'string'},
-                                                'title': {'type': 'string'},
-                                                'filename': {'type': 'string'},
-                                                'chunk_index': {'type': 'integer'},
-                                                'chunk_length': {'type': 'integer'}
-                                            }
-                                        }
-                                    }
-                                }
-                            },
-                            'total_results': {'type': 'integer'}
-                        }
-                    }
+                    'data': _UPLOAD_SESSION_SCHEMA
                 }
             }
         },
         400: {
-            'description': 'Bad request - Missing required fields',
+            'description': 'Invalid request (missing title, not a PDF...)'
+        },
+        413: {
+            'description': 'File larger than KB_MAX_RESUMABLE_FILE_SIZE_MB'
+        }
+    }
+})
+def create_upload_session():
+    """
+    Tạo phiên upload nhiều phần
+    """
+    data = request.get_json(silent=True) or {}
+    title = str(data.get('title') or '').strip()
+    if not title:
+        return jsonify({
+            "success": False,
+            "error": "Title is required",
+            "message": "Please provide a title for the document"
+        }), 400
+    
+    on_duplicate = data.get('on_duplicate', DUPLICATE_RETURN_EXISTING)
+    if on_duplicate not in DUPLICATE_POLICIES:
+        return jsonify({
+            "success": False,
+            "error": "Invalid on_duplicate",
+            "message": f"on_duplicate must be one of: {', '.join(DUPLICATE_POLICIES)}"
+        }), 400
+    
+    success, session, error_message, status_code = _upload_sessions.create(
+        data.get('filename'), data.get('file_size'), title, data.get('description', ''),
+        on_duplicate=on_duplicate, sha256=data.get('sha256')
+    )
+    if not success:
+        return jsonify({
+            "success": False,
+            "error": "Upload failed",
+            "message": error_message
+        }), status_code
+    
+    return jsonify({
+        "success": True,
+        "data": _upload_session_response(session)
+    }), status_code
+
+@knowledge_base_bp.route('/knowledge-base/uploads/<upload_id>', methods=['GET'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'Get resumable upload status',
+    'description': 'Received parts (with SHA-256) and missing parts, used to resume an interrupted upload',
+    'parameters': [
+        {
+            'name': 'upload_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Upload session',
             'schema': {
                 'type': 'object',
                 'properties': {
                     'success': {'type': 'boolean'},
-                    'error': {'type': 'string'},
-                    'message': {'type': 'string'}
+                    'data': _UPLOAD_SESSION_SCHEMA
                 }
             }
+        },
+        404: {
+            'description': 'Upload session not found or expired'
         }
     }
 })
-def search_in_specific_files():
+def get_upload_session(upload_id):
     """
-    Tìm kiếm trong các files cụ thể bằng list filename_uuid
+    Trạng thái phiên upload
     """
-    try:
-        # Lấy dữ liệu từ request
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({
-                "success": False,
-                "error": "Missing request body",
-                "message": "Please provide JSON request body"
-            }), 400
-        
-        query = data.get('query', '').strip()
-        filename_uuids = data.get('filename_uuids', [])
-        max_results = data.get('max_results', 5)
-        
-        # Validation
-        if not query:
-            return jsonify({
-                "success": False,
-                "error": "Missing query",
-                "message": "Please provide a search query"
-            }), 400
-        
-        if not filename_uuids or not isinstance(filename_uuids, list):
-            return jsonify({
-                "success": False,
-                "error": "Missing filename_uuids",
-                "message": "Please provide a list of filename_uuid to search in"
-            }), 400
-        
+    session = _upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({
+            "success": False,
+            "error": "Upload session not found"
+        }), 404
+    
+    return jsonify({
+        "success": True,
+        "data": _upload_session_response(session)
+    }), 200
+
+@knowledge_base_bp.route('/knowledge-base/uploads/<upload_id>', methods=['DELETE'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'Abort a resumable upload',
+    'parameters': [
+        {
+            'name': 'upload_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Upload session deleted'
+        },
+        404: {
+            'description': 'Upload session not found'
+        }
+    }
+})
+def abort_upload_session(upload_id):
+    """
+    Hủy phiên upload, xóa các phần đã nhận
+    """
+    if not _upload_sessions.abort(upload_id):
+        return jsonify({
+            "success": False,
+            "error": "Upload session not found"
+        }), 404
+    
+    return jsonify({
+        "success": True,
+        "message": "Upload session aborted"
+    }), 200
+
+@knowledge_base_bp.route('/knowledge-base/uploads/<upload_id>/parts/<int:part_number>', methods=['PUT'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'Upload one part of a resumable upload',
+    'description': 'Request body is the raw bytes of the part (not multipart). Every part except the last must be '
+                   'exactly part_size bytes. Re-sending a part overwrites it.',
+    'consumes': ['application/octet-stream'],
+    'parameters': [
+        {
+            'name': 'upload_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True
+        },
+        {
+            'name': 'part_number',
+            'in': 'path',
+            'type': 'integer',
+            'required': True,
+            'description': 'Part number, starting at 1'
+        },
+        {
+            'name': 'X-Part-SHA256',
+            'in': 'header',
+            'type': 'string',
+            'required': False,
+            'description': 'Hex SHA-256 of the part; the part is rejected when it does not match'
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {'type': 'string', 'format': 'binary'}
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Part stored',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean'},
+                    'data': {
+                        'type': 'object',
+                        'properties': {
+                            'part_number': {'type': 'integer'},
+                            'size': {'type': 'integer'},
+                            'sha256': {'type': 'string'}
+                        }
+                    }
+                }
+            }
+        },
+        400: {
+            'description': 'Checksum mismatch, incomplete body or invalid part number'
+        },
+        404: {
+            'description': 'Upload session not found'
+        },
+        409: {
+            'description': 'Upload already completed'
+        },
+        413: {
+            'description': 'Part larger than expected'
+        }
+    }
+})
+def upload_part(upload_id, part_number):
+    """
+    Nhận 1 phần của phiên upload (body được stream thẳng vào file spool)
+    """
+    try:
+        success, part, error_message, status_code = _upload_sessions.write_part(
+            upload_id, part_number, request.stream,
+            content_length=request.content_length,
+            checksum=request.headers.get('X-Part-SHA256')
+        )
+        if not success:
+            return jsonify({
+                "success": False,
+                "error": "Part rejected",
+                "message": error_message
+            }), status_code
+        
+        return jsonify({
+            "success": True,
+            "data": part
+        }), 200
+        
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error in upload part: {error_trace}")
+        
+        return jsonify({
+            "success": False,
+            "error": "Part rejected",
+            "message": f"Failed to store part: {str(e)}"
+        }), 500
+
+@knowledge_base_bp.route('/knowledge-base/uploads/<upload_id>/complete', methods=['POST'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'Complete a resumable upload',
+    'description': 'Check that every part was received, move the file into the knowledge base (no copy) and '
+                   'ingest it. Response is the same as the single upload endpoint.',
+    'parameters': [
+        {
+            'name': 'upload_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'async': {'type': 'boolean', 'default': False,
+                              'description': 'Ingest in a background job and return 202 with a job_id'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'File ingested (same body as POST /knowledge-base/upload)'
+        },
+        202: {
+            'description': 'Ingestion job queued'
+        },
+        400: {
+            'description': 'Missing parts or whole-file checksum mismatch'
+        },
+        404: {
+            'description': 'Upload session not found'
+        },
+        409: {
+            'description': 'Upload already completed'
+        }
+    }
+})
+def complete_upload_session(upload_id):
+    """
+    Hoàn tất phiên upload và ingest file
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        success, saved_file, session, error_message, status_code = _upload_sessions.complete(upload_id)
+        if not success:
+            body = {
+                "success": False,
+                "error": "Upload failed",
+                "message": error_message
+            }
+            if session is not None:
+                body["data"] = _upload_session_response(session)
+            return jsonify(body), status_code
+        
+        on_duplicate = session["on_duplicate"] or DUPLICATE_RETURN_EXISTING
+        if _is_truthy(data.get('async', request.args.get('async', 'false'))):
+            body, status_code = _queue_saved_file(saved_file, session["title"], session["description"], on_duplicate)
+            return jsonify(dict(body, upload_id=upload_id)), status_code
+        
+        success, result_data, message, status_code = _knowledge_base_service.process_saved_file(
+            saved_file, session["title"], session["description"], on_duplicate=on_duplicate
+        )
+        if not success:
+            return jsonify({
+                "success": False,
+                "error": "Upload failed",
+                "message": message,
+                "upload_id": upload_id
+            }), status_code
+        
+        return jsonify({
+            "success": True,
+            "message": message,
+            "upload_id": upload_id,
+            "data": result_data
+        }), status_code
+        
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error completing upload: {error_trace}")
+        
+        return jsonify({
+            "success": False,
+            "error": "Upload failed",
+            "message": f"Failed to process file: {str(e)}"
+        }), 500
+
+@knowledge_base_bp.route('/knowledge-base/jobs/<job_id>', methods=['GET'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'Get ingestion job status',
+    'description': 'Get stage and progress of a background ingestion job created by an async upload',
+    'parameters': [
+        {
+            'name': 'job_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'Job ID returned by the upload endpoint'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Job status',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean'},
+                    'data': {
+                        'type': 'object',
+                        'properties': {
+                            'job_id': {'type': 'string'},
+                            'file_id': {'type': 'string'},
+                            'status': {'type': 'string', 'enum': ['queued', 'running', 'completed', 'failed']},
+                            'stage': {'type': 'string', 'example': 'embedding'},
+                            'pages_total': {'type': 'integer'},
+                            'pages_processed': {'type': 'integer'},
+                            'chunks_total': {'type': 'integer'},
+                            'chunks_embedded': {'type': 'integer'},
+                            'attempts': {'type': 'integer'},
+                            'error': {'type': 'string'},
+                            'result': {'type': 'object'}
+                        }
+                    }
+                }
+            }
+        },
+        404: {
+            'description': 'Job not found'
+        }
+    }
+})
+def get_ingestion_job(job_id):
+    """
+    Lấy trạng thái và tiến độ của job ingestion
+    """
+    job = _ingestion_queue.get_job(job_id)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+    
+    return jsonify({
+        "success": True,
+        "data": job
+    }), 200
+
+@knowledge_base_bp.route('/knowledge-base/jobs/<job_id>/events', methods=['GET'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'Stream ingestion job progress',
+    'description': 'Server-Sent Events stream of job status. Emits an event whenever the job changes '
+                   'and closes after the job is completed or failed.',
+    'produces': ['text/event-stream'],
+    'parameters': [
+        {
+            'name': 'job_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'Job ID returned by the upload endpoint'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Event stream of job status objects'
+        },
+        404: {
+            'description': 'Job not found'
+        }
+    }
+})
+def stream_ingestion_job(job_id):
+    """
+    Theo dõi tiến độ job ingestion qua SSE (poll job table, chỉ gửi khi có thay đổi)
+    """
+    if _ingestion_queue.get_job(job_id) is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+    
+    poll_interval = 0.5
+    
+    def generate():
+        last_updated = None
+        while True:
+            job = _ingestion_queue.get_job(job_id)
+            if job is None:
+                return
+            if job["updated_at"] != last_updated:
+                last_updated = job["updated_at"]
+                yield f"data: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if job["status"] in FINISHED_STATUSES:
+                return
+            time.sleep(poll_interval)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@knowledge_base_bp.route('/knowledge-base/files', methods=['GET'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'List uploaded files',
+    'description': 'Get list of uploaded PDF files in knowledge base (paginated, sorted by an indexed field)',
+    'parameters': [
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'Maximum number of files returned (default: all files)',
+            'example': 50
+        },
+        {
+            'name': 'offset',
+            'in': 'query',
+            'type': 'integer',
+            'description': 'Number of files to skip',
+            'default': 0
+        },
+        {
+            'name': 'sort_by',
+            'in': 'query',
+            'type': 'string',
+            'enum': list(FILE_SORT_FIELDS),
+            'default': 'upload_time'
+        },
+        {
+            'name': 'order',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['asc', 'desc'],
+            'default': 'desc'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'List of uploaded files',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean'},
+                    'message': {'type': 'string'},
+                    'data': {
+                        'type': 'object',
+                        'properties': {
+                            'files': {
+                                'type': 'array',
+                                'items': {
+                                    'type': 'object',
+                                    'properties': {
+                                        'file_id': {'type': 'string'},
+                                        'filename': {'type': 'string'},
+                                        'title': {'type': 'string'},
+                                        'file_size': {'type': 'integer'},
+                                        'pages_count': {'type': 'integer'},
+                                        'upload_time': {'type': 'string'},
+                                        'description': {'type': 'string'}
+                                    }
+                                }
+                            },
+                            'total_files': {'type': 'integer'},
+                            'limit': {'type': 'integer'},
+                            'offset': {'type': 'integer'}
+                        }
+                    }
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid pagination or sort parameters'
+        }
+    }
+})
+def list_files():
+    """
+    Lấy danh sách các file đã upload (phân trang, sắp xếp từ file catalog)
+    """
+    try:
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if (limit is not None and limit < 0) or offset < 0:
+            return jsonify({
+                "success": False,
+                "error": "Invalid pagination",
+                "message": "limit and offset must be non-negative integers"
+            }), 400
+        
+        sort_by = request.args.get('sort_by', 'upload_time')
+        order = request.args.get('order', 'desc').lower()
+        if sort_by not in FILE_SORT_FIELDS or order not in ('asc', 'desc'):
+            return jsonify({
+                "success": False,
+                "error": "Invalid sort",
+                "message": f"sort_by must be one of {', '.join(FILE_SORT_FIELDS)} and order must be asc or desc"
+            }), 400
+        
+        # Sử dụng service để lấy danh sách file
+        success, result_data, error_message = _knowledge_base_service.get_uploaded_files(
+            limit=limit, offset=offset, sort_by=sort_by, descending=(order == 'desc')
+        )
+        
+        if success:
+            return jsonify({
+                "success": True,
+                "message": "Files retrieved successfully",
+                "data": result_data
+            }), 200
+        else:
+            return jsonify({
+                "success": False,
+                "error": "Failed to list files",
+                "message": error_message
+            }), 500
+        
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error listing files: {error_trace}")
+        
+        return jsonify({
+            "success": False,
+            "error": "Failed to list files",
+            "message": str(e)
+        }), 500
+
+@knowledge_base_bp.route('/knowledge-base/stats', methods=['GET'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'Knowledge base statistics',
+    'description': 'Get vector database statistics, including how much upload and chunk deduplication '
+                   'reduced the index (logical chunks vs chunks actually embedded and stored)',
+    'responses': {
+        200: {
+            'description': 'Knowledge base statistics',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean'},
+                    'data': {
+                        'type': 'object',
+                        'properties': {
+                            'total_chunks': {'type': 'integer'},
+                            'collection_name': {'type': 'string'},
+                            'deduplication': {'type': 'object'},
+                            'chunk_deduplication': {
+                                'type': 'object',
+                                'properties': {
+                                    'logical_chunks': {'type': 'integer'},
+                                    'stored_chunks': {'type': 'integer'},
+                                    'exact_duplicates': {'type': 'integer'},
+                                    'near_duplicates': {'type': 'integer'},
+                                    'index_size_reduction': {'type': 'number'}
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+})
+def get_knowledge_base_stats():
+    """
+    Thống kê vector database và hiệu quả chống trùng
+    """
+    try:
+        success, stats, error_message = _knowledge_base_service.get_vector_db_stats()
+        if not success:
+            return jsonify({
+                "success": False,
+                "error": "Failed to get stats",
+                "message": error_message
+            }), 500
+        
+        stats.pop("db_path", None)
+        return jsonify({
+            "success": True,
+            "data": stats
+        }), 200
+        
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error getting knowledge base stats: {error_trace}")
+        
+        return jsonify({
+            "success": False,
+            "error": "Failed to get stats",
+            "message": str(e)
+        }), 500
+
+@knowledge_base_bp.route('/knowledge-base/search', methods=['POST'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'Search in specific files',
+    'description': 'Search for content in specific files using list of filename_uuid',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'query': {
+                        'type': 'string',
+                        'description': 'Search query or question',
+                        'example': 'What is machine learning?'
+                    },
+                    'filename_uuids': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                        'description': 'List of filename_uuid (file_id) to search in',
+                        'example': ['uuid1', 'uuid2', 'uuid3']
+                    },
+                    'max_results': {
+                        'type': 'integer',
+                        'description': 'Maximum number of results to return',
+                        'default': 5,
+                        'example': 5
+                    }
+                },
+                'required': ['query', 'filename_uuids']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Search completed successfully',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean'},
+                    'message': {'type': 'string'},
+                    'data': {
+                        'type': 'object',
+                        'properties': {
+                            'query': {'type': 'string'},
+                            'filename_uuids': {
+                                'type': 'array',
+                                'items': {'type': 'string'}
+                            },
+                            'results': {
+                                'type': 'array',
+                                'items': {
+                                    'type': 'object',
+                                    'properties': {
+                                        'content': {'type': 'string'},
+                                        'similarity_score': {'type': 'number'},
+                                        'source': {
+                                            'type': 'object',
+                                            'properties': {
+                                                'file_id': {'type': 'string'},
+                                                'filename_uuid': {'type': 'string'},
+                                                'title': {'type': 'string'},
+                                                'filename': {'type': 'string'},
+                                                'chunk_index': {'type': 'integer'},
+                                                'chunk_length': {'type': 'integer'},
+                                                'page_start': {'type': 'integer'},
+                                                'page_end': {'type': 'integer'},
+                                                'section': {'type': 'string'},
+                                                'search_method': {'type': 'string', 'example': 'hybrid'},
+                                                'signals': {
+                                                    'type': 'object',
+                                                    'description': 'Thứ hạng của chunk trong từng signal tìm thấy nó',
+                                                    'example': {'vector': 1, 'bm25': 3}
+                                                },
+                                                'rrf_score': {'type': 'number'},
+                                                'matching_words': {
+                                                    'type': 'array',
+                                                    'items': {'type': 'string'}
+                                                }
+                                            }
+                                        }
+                                    }
+                                }
+                            },
+                            'total_results': {'type': 'integer'},
+                            'retrieval': {
+                                'type': 'object',
+                                'description': 'Số hit mỗi signal, số kết quả cuối mỗi signal đóng góp, signal quá thời gian / lỗi',
+                                'properties': {
+                                    'rankings': {'type': 'object', 'example': {'vector': 15, 'vector_keywords': 15, 'bm25': 9}},
+                                    'contributed': {'type': 'object', 'example': {'vector': 5, 'vector_keywords': 4, 'bm25': 2}},
+                                    'timed_out': {'type': 'array', 'items': {'type': 'string'}},
+                                    'errors': {'type': 'object'},
+                                    'elapsed_ms': {'type': 'number'}
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        400: {
+            'description': 'Bad request - Missing required fields',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean'},
+                    'error': {'type': 'string'},
+                    'message': {'type': 'string'}
+                }
+            }
+        }
+    }
+})
+def search_in_specific_files():
+    """
+    Tìm kiếm trong các files cụ thể bằng list filename_uuid
+    """
+    try:
+        # Lấy dữ liệu từ request
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({
+                "success": False,
+                "error": "Missing request body",
+                "message": "Please provide JSON request body"
+            }), 400
+        
+        query = data.get('query', '').strip()
+        filename_uuids = data.get('filename_uuids', [])
+        max_results = data.get('max_results', 5)
+        
+        # Validation
+        if not query:
+            return jsonify({
+                "success": False,
+                "error": "Missing query",
+                "message": "Please provide a search query"
+            }), 400
+        
+        if not filename_uuids or not isinstance(filename_uuids, list):
+            return jsonify({
+                "success": False,
+                "error": "Missing filename_uuids",
+                "message": "Please provide a list of filename_uuid to search in"
+            }), 400
+        
         if len(filename_uuids) == 0:
             return jsonify({
                 "success": False,
@@ -375,8 +1435,8 @@ def search_in_specific_files():
                 "message": "filename_uuids list cannot be empty"
             }), 400
         
-        # Thực hiện search trong files cụ thể
-        success, results, error_message = _knowledge_base_service.search_in_multiple_files(
+        # Thực hiện search trong files cụ thể (vector search + BM25 gộp bằng rank fusion)
+        success, results, retrieval_info, error_message = _knowledge_base_service.hybrid_search(
             query, filename_uuids, max_results
         )
         
@@ -389,7 +1449,8 @@ def search_in_specific_files():
                     "filename_uuids": filename_uuids,
                     "results": results,
                     "total_results": len(results),
-                    "max_results": max_results
+                    "max_results": max_results,
+                    "retrieval": retrieval_info
                 }
             }), 200
         else:
@@ -474,140 +1535,391 @@ def get_all_chunks():
         else:
             return jsonify({
                 "success": False,
-                "error": "Failed to get chunks",
-                "message": error_message
+                "error": "Failed to get chunks",
+                "message": error_message
+            }), 500
+        
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error getting all chunks: {error_trace}")
+        
+        return jsonify({
+            "success": False,
+            "error": "Failed to get chunks",
+            "message": str(e)
+        }), 500
+
+@knowledge_base_bp.route('/knowledge-base/reset', methods=['POST'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'Reset ChromaDB',
+    'description': 'Reset ChromaDB - Delete all chunks and recreate collection',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'confirm_reset': {
+                        'type': 'boolean',
+                        'description': 'Confirm reset operation (required to prevent accidental deletion)',
+                        'example': True
+                    }
+                },
+                'required': ['confirm_reset']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'ChromaDB reset successfully',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean'},
+                    'message': {'type': 'string'},
+                    'data': {
+                        'type': 'object',
+                        'properties': {
+                            'reset_timestamp': {'type': 'string'},
+                            'old_collection_info': {
+                                'type': 'object',
+                                'properties': {
+                                    'total_chunks_deleted': {'type': 'integer'},
+                                    'collection_name': {'type': 'string'}
+                                }
+                            },
+                            'new_collection_created': {'type': 'boolean'},
+                            'db_path': {'type': 'string'}
+                        }
+                    }
+                }
+            }
+        },
+        400: {
+            'description': 'Bad request - Missing confirmation',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean'},
+                    'error': {'type': 'string'},
+                    'message': {'type': 'string'}
+                }
+            }
+        }
+    }
+})
+def reset_chromadb():
+    """
+    Reset ChromaDB - Xóa tất cả chunks và tạo lại collection
+    """
+    try:
+        # Lấy dữ liệu từ request
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({
+                "success": False,
+                "error": "Missing request body",
+                "message": "Please provide JSON request body with confirm_reset field"
+            }), 400
+        
+        confirm_reset = data.get('confirm_reset', False)
+        
+        if not confirm_reset:
+            return jsonify({
+                "success": False,
+                "error": "Reset not confirmed",
+                "message": "Please set confirm_reset=true to confirm reset operation"
+            }), 400
+        
+        # Thực hiện reset
+        success, reset_info, error_message = _knowledge_base_service.reset_chromadb(confirm_reset=True)
+        
+        if success:
+            return jsonify({
+                "success": True,
+                "message": "ChromaDB reset completed successfully",
+                "data": reset_info
+            }), 200
+        else:
+            return jsonify({
+                "success": False,
+                "error": "Reset failed",
+                "message": error_message
+            }), 500
+        
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error in reset ChromaDB: {error_trace}")
+        
+        return jsonify({
+            "success": False,
+            "error": "Reset failed",
+            "message": str(e)
+        }), 500
+
+@knowledge_base_bp.route('/knowledge-base/clear', methods=['POST'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'Clear all chunks',
+    'description': 'Clear all chunks from ChromaDB but keep collection (lighter operation)',
+    'responses': {
+        200: {
+            'description': 'Chunks cleared successfully',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean'},
+                    'message': {'type': 'string'},
+                    'data': {
+                        'type': 'object',
+                        'properties': {
+                            'chunks_cleared': {'type': 'integer'},
+                            'clear_timestamp': {'type': 'string'},
+                            'collection_name': {'type': 'string'}
+                        }
+                    }
+                }
+            }
+        }
+    }
+})
+def clear_all_chunks():
+    """
+    Xóa tất cả chunks nhưng giữ nguyên collection
+    """
+    try:
+        # Thực hiện clear chunks
+        success, clear_info, error_message = _knowledge_base_service.clear_all_chunks()
+        
+        if success:
+            return jsonify({
+                "success": True,
+                "message": "All chunks cleared successfully",
+                "data": clear_info
+            }), 200
+        else:
+            return jsonify({
+                "success": False,
+                "error": "Clear failed",
+                "message": error_message
+            }), 500
+        
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error clearing chunks: {error_trace}")
+        
+        return jsonify({
+            "success": False,
+            "error": "Clear failed",
+            "message": str(e)
+        }), 500
+
+@knowledge_base_bp.route('/knowledge-base/reindex', methods=['POST'])
+@swag_from({
+    'tags': ['knowledge-base'],
+    'summary': 'Re-index files from stored text',
+    'description': 'Rebuild chunks and vectors of some files (or the whole knowledge base) from the stored '
+                   'extracted text with new chunking parameters, without re-parsing the PDFs. Files are '
+                   'processed in parallel and each file is swapped in as soon as it is done, so search keeps '
+                   'serving the old chunks during the rebuild',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'file_ids': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                        'description': 'Files to re-index (omit to re-index the whole knowledge base)'
+                    },
+                    'chunk_size': {'type': 'integer', 'description': 'New chunk size in characters', 'example': 800},
+                    'chunk_overlap': {'type': 'integer', 'description': 'New chunk overlap in characters', 'example': 100},
+                    'workers': {'type': 'integer', 'description': 'Number of files re-indexed in parallel'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'All files re-indexed',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean'},
+                    'message': {'type': 'string'},
+                    'data': {
+                        'type': 'object',
+                        'properties': {
+                            'chunk_size': {'type': 'integer'},
+                            'chunk_overlap': {'type': 'integer'},
+                            'files_total': {'type': 'integer'},
+                            'files_reindexed': {'type': 'integer'},
+                            'files_failed': {'type': 'integer'},
+                            'seconds': {'type': 'number'},
+                            'results': {'type': 'array', 'items': {'type': 'object'}}
+                        }
+                    }
+                }
+            }
+        },
+        400: {'description': 'Invalid chunking parameters or file_ids'},
+        500: {'description': 'Some files could not be re-indexed (their old chunks are kept)'}
+    }
+})
+def reindex_files():
+    """
+    Re-index files từ text đã lưu với tham số chia chunk mới
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        file_ids = data.get('file_ids')
+        if file_ids is not None and (
+            not isinstance(file_ids, list) or not all(isinstance(file_id, str) for file_id in file_ids)
+        ):
+            return jsonify({
+                "success": False,
+                "error": "Invalid file_ids",
+                "message": "file_ids must be a list of file IDs"
+            }), 400
+        
+        workers = data.get('workers')
+        if workers is not None and (not isinstance(workers, int) or workers <= 0):
+            return jsonify({
+                "success": False,
+                "error": "Invalid workers",
+                "message": "workers must be a positive integer"
+            }), 400
+        
+        success, summary, error_message = _knowledge_base_service.reindex_files(
+            file_ids=file_ids,
+            chunk_size=data.get('chunk_size'),
+            overlap=data.get('chunk_overlap'),
+            workers=workers
+        )
+        if not success:
+            return jsonify({
+                "success": False,
+                "error": "Invalid re-index request",
+                "message": error_message
+            }), 400
+        
+        if summary["files_failed"]:
+            return jsonify({
+                "success": False,
+                "error": "Re-index failed",
+                "message": f"{summary['files_failed']} of {summary['files_total']} files could not be re-indexed",
+                "data": summary
             }), 500
         
+        return jsonify({
+            "success": True,
+            "message": f"Re-indexed {summary['files_reindexed']} files",
+            "data": summary
+        }), 200
+        
     except Exception as e:
         error_trace = traceback.format_exc()
-        print(f"Error getting all chunks: {error_trace}")
+        print(f"Error re-indexing knowledge base: {error_trace}")
         
         return jsonify({
             "success": False,
-            "error": "Failed to get chunks",
+            "error": "Re-index failed",
             "message": str(e)
         }), 500
 
-@knowledge_base_bp.route('/knowledge-base/reset', methods=['POST'])
+@knowledge_base_bp.route('/knowledge-base/index', methods=['GET'])
 @swag_from({
     'tags': ['knowledge-base'],
-    'summary': 'Reset ChromaDB',
-    'description': 'Reset ChromaDB - Delete all chunks and recreate collection',
-    'parameters': [
-        {
-            'name': 'body',
-            'in': 'body',
-            'required': True,
-            'schema': {
-                'type': 'object',
-                'properties': {
-                    'confirm_reset': {
-                        'type': 'boolean',
-                        'description': 'Confirm reset operation (required to prevent accidental deletion)',
-                        'example': True
-                    }
-                },
-                'required': ['confirm_reset']
-            }
-        }
-    ],
+    'summary': 'Get vector index parameters',
+    'description': 'HNSW parameters of the knowledge base collection (active) and from KB_HNSW_* (configured)',
     'responses': {
         200: {
-            'description': 'ChromaDB reset successfully',
+            'description': 'Index parameters',
             'schema': {
                 'type': 'object',
                 'properties': {
                     'success': {'type': 'boolean'},
-                    'message': {'type': 'string'},
                     'data': {
                         'type': 'object',
                         'properties': {
-                            'reset_timestamp': {'type': 'string'},
-                            'old_collection_info': {
+                            'active': {
                                 'type': 'object',
-                                'properties': {
-                                    'total_chunks_deleted': {'type': 'integer'},
-                                    'collection_name': {'type': 'string'}
-                                }
+                                'example': {'space': 'l2', 'M': 16, 'construction_ef': 100, 'search_ef': 10}
                             },
-                            'new_collection_created': {'type': 'boolean'},
-                            'db_path': {'type': 'string'}
+                            'configured': {'type': 'object'},
+                            'total_chunks': {'type': 'integer'},
+                            'rebuilding': {'type': 'boolean'}
                         }
                     }
                 }
             }
-        },
-        400: {
-            'description': 'Bad request - Missing confirmation',
-            'schema': {
-                'type': 'object',
-                'properties': {
-                    'success': {'type': 'boolean'},
-                    'error': {'type': 'string'},
-                    'message': {'type': 'string'}
-                }
-            }
         }
     }
 })
-def reset_chromadb():
+def get_index_config():
     """
-    Reset ChromaDB - Xóa tất cả chunks và tạo lại collection
+    Lấy tham số HNSW của vector index
     """
     try:
-        # Lấy dữ liệu từ request
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({
-                "success": False,
-                "error": "Missing request body",
-                "message": "Please provide JSON request body with confirm_reset field"
-            }), 400
-        
-        confirm_reset = data.get('confirm_reset', False)
-        
-        if not confirm_reset:
-            return jsonify({
-                "success": False,
-                "error": "Reset not confirmed",
-                "message": "Please set confirm_reset=true to confirm reset operation"
-            }), 400
-        
-        # Thực hiện reset
-        success, reset_info, error_message = _knowledge_base_service.reset_chromadb(confirm_reset=True)
-        
-        if success:
-            return jsonify({
-                "success": True,
-                "message": "ChromaDB reset completed successfully",
-                "data": reset_info
-            }), 200
-        else:
+        success, config_info, error_message = _knowledge_base_service.get_index_config()
+        if not success:
             return jsonify({
                 "success": False,
-                "error": "Reset failed",
+                "error": "Index unavailable",
                 "message": error_message
             }), 500
         
+        return jsonify({
+            "success": True,
+            "data": config_info
+        }), 200
+        
     except Exception as e:
         error_trace = traceback.format_exc()
-        print(f"Error in reset ChromaDB: {error_trace}")
+        print(f"Error getting index config: {error_trace}")
         
         return jsonify({
             "success": False,
-            "error": "Reset failed",
+            "error": "Failed to get index config",
             "message": str(e)
         }), 500
 
-@knowledge_base_bp.route('/knowledge-base/clear', methods=['POST'])
+@knowledge_base_bp.route('/knowledge-base/index/rebuild', methods=['POST'])
 @swag_from({
     'tags': ['knowledge-base'],
-    'summary': 'Clear all chunks',
-    'description': 'Clear all chunks from ChromaDB but keep collection (lighter operation)',
+    'summary': 'Rebuild vector index with new HNSW parameters',
+    'description': 'Copy all chunks (with their embeddings, nothing is re-embedded) into a new collection '
+                   'created with the given HNSW parameters, then switch search to it. Search keeps using the '
+                   'old index during the copy; uploads, deletes and re-index wait until the switch. '
+                   'Omitted parameters keep their current value. Higher M / construction_ef / search_ef '
+                   'give better recall at the cost of build time, memory and query latency',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'space': {'type': 'string', 'enum': ['l2', 'cosine', 'ip'], 'example': 'cosine'},
+                    'M': {'type': 'integer', 'description': 'Graph edges per node', 'example': 32},
+                    'construction_ef': {'type': 'integer', 'description': 'Search width when building', 'example': 200},
+                    'search_ef': {'type': 'integer', 'description': 'Search width when querying', 'example': 64}
+                }
+            }
+        }
+    ],
     'responses': {
         200: {
-            'description': 'Chunks cleared successfully',
+            'description': 'Index rebuilt',
             'schema': {
                 'type': 'object',
                 'properties': {
@@ -616,47 +1928,206 @@ def reset_chromadb():
                     'data': {
                         'type': 'object',
                         'properties': {
-                            'chunks_cleared': {'type': 'integer'},
-                            'clear_timestamp': {'type': 'string'},
-                            'collection_name': {'type': 'string'}
+                            'previous': {'type': 'object'},
+                            'active': {'type': 'object'},
+                            'chunks': {'type': 'integer'},
+                            'seconds': {'type': 'number'}
                         }
                     }
                 }
             }
-        }
+        },
+        400: {'description': 'Invalid HNSW parameters'},
+        409: {'description': 'A rebuild, ingestion, deletion or re-index is already in progress'}
     }
 })
-def clear_all_chunks():
+def rebuild_vector_index():
     """
-    Xóa tất cả chunks nhưng giữ nguyên collection
+    Dựng lại vector index với tham số HNSW mới
     """
     try:
-        # Thực hiện clear chunks
-        success, clear_info, error_message = _knowledge_base_service.clear_all_chunks()
-        
-        if success:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not data:
             return jsonify({
-                "success": True,
-                "message": "All chunks cleared successfully",
-                "data": clear_info
-            }), 200
-        else:
+                "success": False,
+                "error": "Missing HNSW parameters",
+                "message": "Please provide at least one of: space, M, construction_ef, search_ef"
+            }), 400
+        
+        success, rebuild_info, error_message, status_code = _knowledge_base_service.rebuild_vector_index(**data)
+        if not success:
             return jsonify({
                 "success": False,
-                "error": "Clear failed",
+                "error": "Index rebuild failed",
                 "message": error_message
-            }), 500
+            }), status_code
+        
+        return jsonify({
+            "success": True,
+            "message": f"Rebuilt vector index with {rebuild_info['chunks']} chunks",
+            "data": rebuild_info
+        }), 200
         
     except Exception as e:
         error_trace = traceback.format_exc()
-        print(f"Error clearing chunks: {error_trace}")
+        print(f"Error rebuilding vector index: {error_trace}")
         
         return jsonify({
             "success": False,
-            "error": "Clear failed",
+            "error": "Index rebuild failed",
             "message": str(e)
         }), 500
 
+def _describe_source(source):
+    """Tên nguồn kèm trang / mục để AI trích dẫn chính xác"""
+    parts = [source.get('title') or source.get('filename') or ""]
+    page_start, page_end = source.get('page_start'), source.get('page_end')
+    if page_start:
+        parts.append(f"trang {page_start}" if page_end in (None, page_start) else f"trang {page_start}-{page_end}")
+    if source.get('section'):
+        parts.append(f"mục {source['section']}")
+    return ", ".join(parts)
+
+def _answer_with_knowledge_base(message, max_results, file_ids):
+    """
+    Tìm kiếm tài liệu liên quan và gọi AI trả lời dựa trên knowledge base
+    
+    Chạy trong worker thread của CancellationRegistry: retrieval và lời gọi
+    Azure OpenAI đều dừng khi client ngắt kết nối hoặc request bị hủy.
+    
+    Returns:
+        tuple: (response_body, status_code)
+    """
+    # Bước 2: Tìm kiếm trong knowledge base
+    search_start = time.time()
+    search_clock = time.perf_counter()
+    
+    # Có reranker: lấy K ứng viên, cross-encoder chọn lại max_results chunk đưa vào prompt
+    reranker = _knowledge_base_service.reranker
+    candidate_count = max(max_results, reranker.candidates) if reranker else max_results
+    
+    retrieval_info = {}
+    if file_ids:
+        # Tìm kiếm trong các file cụ thể
+        search_success, search_results, retrieval_info, search_error = _knowledge_base_service.hybrid_search(
+            query=message,
+            filename_uuids=file_ids,
+            max_results=candidate_count
+        )
+    else:
+        # Tìm kiếm trong toàn bộ knowledge base
+        search_success, search_results, search_error = _knowledge_base_service.search_knowledge_base(
+            query=message,
+            max_results=candidate_count
+        )
+    
+    search_time = round(time.time() - search_start, 3)
+    rerank_info = None
+    if search_success and reranker and search_results:
+        search_results, rerank_info = reranker.rerank(message, search_results, max_results, started_at=search_clock)
+    elif search_success:
+        search_results = search_results[:max_results]
+    
+    # Client đã rời đi trong lúc tìm kiếm -> không gọi AI nữa
+    raise_if_cancelled()
+    
+    if not search_success:
+        return {
+            "success": False,
+            "error": f"Search failed: {search_error}"
+        }, 500
+    
+    # Bước 3: Tạo context từ các tài liệu tìm được
+    if not search_results:
+        # Không tìm thấy tài liệu liên quan
+        ai_response = f"""Xin lỗi, tôi không tìm thấy thông tin liên quan đến câu hỏi "{message}" trong knowledge base hiện tại.
+        
+Có thể bạn muốn:
+- Kiểm tra lại từ khóa tìm kiếm
+- Upload thêm tài liệu liên quan
+- Đặt câu hỏi cụ thể hơn
+
+Bạn có thể upload file PDF chứa thông tin bạn cần thông qua trang Knowledge Base."""
+
+        return {
+            "success": True,
+            "response": ai_response,
+            "sources": [],
+            "search_info": {
+                "query": message,
+                "results_found": 0,
+                "search_time": f"{search_time}s",
+                **({"retrieval": retrieval_info} if retrieval_info else {})
+            }
+        }, 200
+    
+    # Bước 4: Tạo context cho AI từ các tài liệu tìm được
+    context_parts = []
+    for i, result in enumerate(search_results[:max_results], 1):
+        source_info = f"[Nguồn {i}: {_describe_source(result['source'])}]"
+        content = result['content']
+        context_parts.append(f"{source_info}\n{content}")
+    
+    context = "\n\n".join(context_parts)
+    
+    # Bước 5: Tạo prompt cho AI
+    ai_prompt = f"""Bạn là một AI Assistant thông minh và thân thiện. Hãy trả lời câu hỏi của người dùng CHÍNH XÁC dựa trên thông tin từ các tài liệu được cung cấp.
+
+Câu hỏi: {message}
+
+Thông tin từ tài liệu:
+{context}
+
+**QUAN TRỌNG - QUY TẮC TRẢ LỜI:**
+- CHỈ trả lời dựa trên thông tin có trong các tài liệu được cung cấp ở trên
+- KHÔNG bịa đặt, suy đoán hoặc thêm thông tin không có trong tài liệu
+- Nếu thông tin không đủ hoặc không có trong tài liệu, hãy nói rõ "Thông tin này không có trong tài liệu được cung cấp"
+- Khi trích dẫn thông tin, hãy đề cập nguồn cụ thể (ví dụ: "Theo tài liệu X, trang Y...")
+
+Hãy trả lời một cách tự nhiên, thân thiện và dễ hiểu. Sử dụng format markdown để trình bày đẹp mắt:
+- Sử dụng **in đậm** cho từ khóa quan trọng
+- Dùng `code` cho các thuật ngữ kỹ thuật
+- Chia thành các đoạn ngắn, dễ đọc
+- Sử dụng bullet points (•) hoặc số thứ tự khi liệt kê
+- Thêm emoji phù hợp để làm sinh động (📝, 💡, ⚠️, ✅, etc.)
+
+Sử dụng tiếng Việt.
+
+Câu trả lời:"""
+
+    # Bước 6: Sử dụng AI service để tạo câu trả lời
+    from services.ai_service import AIService
+    ai_service = AIService()
+    
+    ai_result = ai_service.chat_with_ai(
+        message=ai_prompt,
+        history=[],
+        is_quick_action=False
+    )
+    
+    if ai_result.get("cancelled"):
+        return ai_result, 499
+    
+    if not ai_result["success"]:
+        return {
+            "success": False,
+            "error": f"AI processing failed: {ai_result.get('error', 'Unknown error')}"
+        }, 500
+    
+    # Bước 7: Trả về kết quả
+    return {
+        "success": True,
+        "response": ai_result["response"],
+        "sources": search_results,
+        "search_info": {
+            "query": message,
+            "results_found": len(search_results),
+            "search_time": f"{search_time}s",
+            **({"retrieval": retrieval_info} if retrieval_info else {}),
+            **({"rerank": rerank_info} if rerank_info else {})
+        }
+    }, 200
+
 @knowledge_base_bp.route('/knowledge-base/chat', methods=['POST'])
 @swag_from({
     'tags': ['knowledge-base'],
@@ -686,6 +2157,16 @@ def clear_all_chunks():
                         'items': {'type': 'string'},
                         'description': 'Optional: Search only in specific files (file UUIDs)',
                         'example': ['uuid1', 'uuid2']
+                    },
+                    'include_segments': {
+                        'type': 'boolean',
+                        'description': 'Optional: also return the response pre-split into text/code segments',
+                        'default': False
+                    },
+                    'request_id': {
+                        'type': 'string',
+                        'description': 'Optional: client-generated ID used to cancel the request via /api/chat/cancel (also accepted as X-Request-ID header)',
+                        'example': 'req-5f1c2a'
                     }
                 },
                 'required': ['message']
@@ -703,6 +2184,18 @@ def clear_all_chunks():
                         'type': 'string',
                         'description': 'AI generated response based on knowledge base'
                     },
+                    'segments': {
+                        'type': 'array',
+                        'description': 'Only when include_segments is true: response split into text/code segments',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'type': {'type': 'string', 'enum': ['text', 'code']},
+                                'language': {'type': 'string', 'example': 'java'},
+                                'content': {'type': 'string'}
+                            }
+                        }
+                    },
                     'sources': {
                         'type': 'array',
                         'description': 'Relevant documents used to generate the response',
@@ -711,13 +2204,20 @@ def clear_all_chunks():
                             'properties': {
                                 'content': {'type': 'string'},
                                 'similarity_score': {'type': 'number'},
+                                'rerank_score': {
+                                    'type': 'number',
+                                    'description': 'Cross-encoder score (only when the results were reranked)'
+                                },
                                 'source': {
                                     'type': 'object',
                                     'properties': {
                                         'file_id': {'type': 'string'},
                                         'title': {'type': 'string'},
                                         'filename': {'type': 'string'},
-                                        'chunk_index': {'type': 'integer'}
+                                        'chunk_index': {'type': 'integer'},
+                                        'page_start': {'type': 'integer'},
+                                        'page_end': {'type': 'integer'},
+                                        'section': {'type': 'string'}
                                     }
                                 }
                             }
@@ -728,7 +2228,18 @@ def clear_all_chunks():
                         'properties': {
                             'query': {'type': 'string'},
                             'results_found': {'type': 'integer'},
-                            'search_time': {'type': 'string'}
+                            'search_time': {'type': 'string'},
+                            'rerank': {
+                                'type': 'object',
+                                'description': 'Only when KB_RERANK_MODEL is set: cross-encoder rerank of the top candidates',
+                                'properties': {
+                                    'applied': {'type': 'boolean'},
+                                    'skipped': {'type': 'string', 'example': 'budget_exhausted'},
+                                    'candidates': {'type': 'integer', 'example': 20},
+                                    'elapsed_ms': {'type': 'number'},
+                                    'model': {'type': 'string'}
+                                }
+                            }
                         }
                     }
                 }
@@ -744,6 +2255,17 @@ def clear_all_chunks():
                 }
             }
         },
+        499: {
+            'description': 'Request cancelled (client disconnected or cancelled via /api/chat/cancel)',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'success': {'type': 'boolean', 'example': False},
+                    'cancelled': {'type': 'boolean', 'example': True},
+                    'error': {'type': 'string'}
+                }
+            }
+        },
         500: {
             'description': 'Internal server error',
             'schema': {
@@ -780,116 +2302,33 @@ def chat_with_knowledge_base():
         max_results = data.get('max_results', 3)
         file_ids = data.get('file_ids', None)
         
-        # Bước 2: Tìm kiếm trong knowledge base
-        import time
-        search_start = time.time()
-        
-        if file_ids:
-            # Tìm kiếm trong các file cụ thể
-            search_success, search_results, search_error = _knowledge_base_service.search_in_multiple_files(
-                query=message,
-                filename_uuids=file_ids,
-                max_results=max_results
+        # Bước 2-7: Tìm kiếm và gọi AI trong worker thread có thể hủy
+        token = _cancellation_registry.register(data.get('request_id') or request.headers.get('X-Request-ID'))
+        try:
+            response_body, status_code = _cancellation_registry.run(
+                token, request.environ,
+                _answer_with_knowledge_base, message, max_results, file_ids
             )
-        else:
-            # Tìm kiếm trong toàn bộ knowledge base
-            search_success, search_results, search_error = _knowledge_base_service.search_knowledge_base(
-                query=message,
-                max_results=max_results
-            )
-        
-        search_time = round(time.time() - search_start, 3)
-        
-        if not search_success:
-            return jsonify({
+        except RequestCancelled as e:
+            response_body, status_code = {
                 "success": False,
-                "error": f"Search failed: {search_error}"
-            }), 500
-        
-        # Bước 3: Tạo context từ các tài liệu tìm được
-        if not search_results:
-            # Không tìm thấy tài liệu liên quan
-            ai_response = f"""Xin lỗi, tôi không tìm thấy thông tin liên quan đến câu hỏi "{message}" trong knowledge base hiện tại.
-            
-Có thể bạn muốn:
-- Kiểm tra lại từ khóa tìm kiếm
-- Upload thêm tài liệu liên quan
-- Đặt câu hỏi cụ thể hơn
-
-Bạn có thể upload file PDF chứa thông tin bạn cần thông qua trang Knowledge Base."""
-
-            return jsonify({
-                "success": True,
-                "response": ai_response,
-                "sources": [],
-                "search_info": {
-                    "query": message,
-                    "results_found": 0,
-                    "search_time": f"{search_time}s"
-                }
-            }), 200
-        
-        # Bước 4: Tạo context cho AI từ các tài liệu tìm được
-        context_parts = []
-        for i, result in enumerate(search_results[:max_results], 1):
-            source_info = f"[Nguồn {i}: {result['source']['title']}]"
-            content = result['content']
-            context_parts.append(f"{source_info}\n{content}")
-        
-        context = "\n\n".join(context_parts)
-        
-        # Bước 5: Tạo prompt cho AI
-        ai_prompt = f"""Bạn là một AI Assistant thông minh và thân thiện. Hãy trả lời câu hỏi của người dùng CHÍNH XÁC dựa trên thông tin từ các tài liệu được cung cấp.
-
-Câu hỏi: {message}
-
-Thông tin từ tài liệu:
-{context}
-
-**QUAN TRỌNG - QUY TẮC TRẢ LỜI:**
-- CHỈ trả lời dựa trên thông tin có trong các tài liệu được cung cấp ở trên
-- KHÔNG bịa đặt, suy đoán hoặc thêm thông tin không có trong tài liệu
-- Nếu thông tin không đủ hoặc không có trong tài liệu, hãy nói rõ "Thông tin này không có trong tài liệu được cung cấp"
-- Khi trích dẫn thông tin, hãy đề cập nguồn cụ thể (ví dụ: "Theo tài liệu X...")
-
-Hãy trả lời một cách tự nhiên, thân thiện và dễ hiểu. Sử dụng format markdown để trình bày đẹp mắt:
-- Sử dụng **in đậm** cho từ khóa quan trọng
-- Dùng `code` cho các thuật ngữ kỹ thuật
-- Chia thành các đoạn ngắn, dễ đọc
-- Sử dụng bullet points (•) hoặc số thứ tự khi liệt kê
-- Thêm emoji phù hợp để làm sinh động (📝, 💡, ⚠️, ✅, etc.)
-
-Sử dụng tiếng Việt.
-
-Câu trả lời:"""
-
-        # Bước 6: Sử dụng AI service để tạo câu trả lời
-        from services.ai_service import AIService
-        ai_service = AIService()
+                "cancelled": True,
+                "cancel_reason": e.reason,
+                "tokens_saved": e.tokens_saved,
+                "error": f"Request cancelled: {e.reason}"
+            }, 499
+        finally:
+            _cancellation_registry.unregister(token)
         
-        ai_result = ai_service.chat_with_ai(
-            message=ai_prompt,
-            history=[],
-            is_quick_action=False
-        )
-        
-        if not ai_result["success"]:
-            return jsonify({
-                "success": False,
-                "error": f"AI processing failed: {ai_result.get('error', 'Unknown error')}"
-            }), 500
+        if response_body.get("cancelled"):
+            _cancellation_registry.record_cancellation(
+                response_body.get("cancel_reason"), response_body.get("tokens_saved", 0)
+            )
         
-        # Bước 7: Trả về kết quả
-        return jsonify({
-            "success": True,
-            "response": ai_result["response"],
-            "sources": search_results,
-            "search_info": {
-                "query": message,
-                "results_found": len(search_results),
-                "search_time": f"{search_time}s"
-            }
-        }), 200
+        response_body["request_id"] = token.request_id
+        if data.get('include_segments', False) and response_body.get("success"):
+            response_body["segments"] = segment_response(response_body.get("response", ""))
+        return jsonify(response_body), status_code
         
     except Exception as e:
         error_trace = traceback.format_exc()
@@ -20,6 +20,7 @@ from config.swagger_config import swagger_config, swagger_template
 
 # Import services
 from services.ai_service import AIService
+from services.cancellation_service import CancellationRegistry
 
 # Import API modules
 from api.chat import chat_bp, init_chat_api
@@ -31,10 +32,13 @@ from api.tts import tts_bp
 # Load environment variables
 load_dotenv()
 
-def create_app():
+def create_app(recover_ingestion_jobs=True):
     """
     Application factory pattern để tạo Flask app
     
+    Args:
+        recover_ingestion_jobs: Lấy lại job ingestion dang dở của lần chạy trước
+    
     Returns:
         Flask app instance đã được cấu hình
     """
@@ -50,10 +54,13 @@ def create_app():
     # Initialize AI Service
     ai_service = AIService()
     
+    # Registry dùng chung để hủy request AI theo request_id / khi client ngắt kết nối
+    cancellation_registry = CancellationRegistry()
+    
     # Initialize API modules với dependency injection
-    init_chat_api(ai_service)
+    init_chat_api(ai_service, cancellation_registry)
     init_health_api(ai_service)
-    init_knowledge_base_api()
+    init_knowledge_base_api(cancellation_registry, recover_jobs=recover_ingestion_jobs)
     
     # Register API Blueprints với prefix /api
     app.register_blueprint(chat_bp, url_prefix='/api')
@@ -102,8 +109,14 @@ def create_app():
     
     return app
 
-# Tạo app instance
-app = create_app()
+# Chạy `python app.py` (debug=True): Werkzeug reloader chạy server trong process con (WERKZEUG_RUN_MAIN=true),
+# process cha chỉ theo dõi thay đổi file nên không được lấy lại job ingestion
+_is_reloader_parent = __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
+# Tạo app instance (process con của multiprocessing - forkserver/spawn, vd. worker trích xuất PDF -
+# import lại file này dưới tên __mp_main__ và không được tạo lại app)
+if __name__ != '__mp_main__':
+    app = create_app(recover_ingestion_jobs=not _is_reloader_parent)
 
 if __name__ == '__main__':
     print("🚀 Starting AI Programming Assistant API v3.0.0...")
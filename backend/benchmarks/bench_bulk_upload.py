@@ -0,0 +1,95 @@
+"""
+Benchmark bulk upload: thời gian xử lý archive zip N file PDF theo số worker ingest song song
+
+Archive được ghép từ các trang của PDF trong backend/uploads (mỗi file bắt đầu ở 1 trang khác
+nhau nên SHA-256 khác nhau, không bị chống trùng bỏ qua). ChromaDB và embedding model được thay
+bằng bản giả để đo phần trích xuất PDF + chia chunk + ghi metadata; embedding thật (ONNX Runtime)
+nhả GIL nên cũng chạy song song giữa các worker.
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_bulk_upload.py
+    python benchmarks/bench_bulk_upload.py --files 100 --pages 12 --workers 1,2,4,8
+"""
+
+import argparse
+import glob
+import io
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+import PyPDF2
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from bench_ingestion_memory import NullCollection
+from services.bulk_upload import iter_archive_uploads, scan_archive
+from services.embedding_service import EmbeddingProvider
+from services.knowledge_base_service import KnowledgeBaseService
+
+UPLOADS_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+
+
+def build_archive(source_paths, files, pages):
+    """Tạo archive zip gồm files PDF, mỗi PDF có pages trang"""
+    source_pages = [page for path in source_paths for page in PyPDF2.PdfReader(path).pages]
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for index in range(files):
+            writer = PyPDF2.PdfWriter()
+            for page in range(pages):
+                writer.add_page(source_pages[(index + page) % len(source_pages)])
+            pdf = io.BytesIO()
+            writer.write(pdf)
+            # Cùng nội dung trang vẫn khác SHA-256
+            zip_file.writestr(f"docs/doc_{index:03d}.pdf", pdf.getvalue() + f"\n%{index}\n".encode())
+    return archive.getvalue()
+
+
+def run(archive_bytes, workers):
+    """Ingest toàn bộ archive với số worker cho trước, trả về (giây, số file thành công)"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        service = KnowledgeBaseService(upload_folder=work_dir, chroma_db_path=os.path.join(work_dir, 'chroma'))
+        service.collection = NullCollection()
+        service.embedder = EmbeddingProvider(lambda texts: [[0.0]] * len(texts), "null")
+
+        start = time.perf_counter()
+        with zipfile.ZipFile(io.BytesIO(archive_bytes)) as zip_file:
+            members, _, _ = scan_archive(zip_file, service.allowed_extensions)
+            results = service.process_uploaded_files(iter_archive_uploads(zip_file, members, {}), workers=workers)
+        elapsed = time.perf_counter() - start
+        service.pdf_extractor.shutdown()
+    return elapsed, sum(1 for success, _, _, _ in results if success)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=40, help='Số file PDF trong archive')
+    parser.add_argument('--pages', type=int, default=12, help='Số trang mỗi file')
+    parser.add_argument('--workers', default=None, help='Danh sách số worker (mặc định: 1 và số CPU)')
+    args = parser.parse_args()
+
+    source_paths = sorted(glob.glob(os.path.join(UPLOADS_DIR, '*.pdf')))
+    if not source_paths:
+        print(f"❌ No PDF found in {UPLOADS_DIR}")
+        return 1
+
+    cpu_count = os.cpu_count() or 1
+    worker_counts = [int(w) for w in args.workers.split(',')] if args.workers else sorted({1, cpu_count})
+    archive_bytes = build_archive(source_paths, args.files, args.pages)
+
+    print(f"📊 {args.files} PDFs x {args.pages} pages ({len(archive_bytes) / 1024 / 1024:.1f} MB zip), {cpu_count} CPUs")
+    baseline = None
+    for workers in worker_counts:
+        seconds, succeeded = run(archive_bytes, workers)
+        baseline = baseline or seconds
+        print(f"   workers={workers:<3} {seconds:7.2f}s | {succeeded}/{args.files} files | "
+              f"{args.files / seconds:6.1f} files/s | {baseline / seconds:4.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Benchmark chunk annotator: chuẩn hóa + phát hiện ngôn ngữ + content hash cho mỗi chunk
+
+So sánh:
+- legacy: vòng lặp Python từng ký tự (_detect_language cũ), 2 lượt regex (_normalize_vietnamese_text cũ)
+  và 1 lượt regex cho content hash chống trùng
+- annotate: 1 lần str.lower + str.translate + str.split (services/chunk_annotator.py)
+
+Chunks lấy từ các PDF trong backend/uploads (nhân bản để đủ --chunks). Kết quả 2 cách được so sánh
+từng chunk trước khi đo thời gian.
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_chunk_annotator.py
+    python benchmarks/bench_chunk_annotator.py --chunks 20000 --repeat 5
+"""
+
+import argparse
+import glob
+import hashlib
+import os
+import re
+import sys
+import time
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.chunk_annotator import VIETNAMESE_CHARS, annotate, normalize_text
+from services.pdf_extraction import PdfTextExtractor
+from services.text_chunker import split_text
+
+UPLOADS_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+
+_LEGACY_PUNCTUATION = re.compile(r'[^\w\s' + VIETNAMESE_CHARS + r']')
+_LEGACY_SPACES = re.compile(r'\s+')
+
+
+def legacy_normalize(text):
+    normalized = _LEGACY_PUNCTUATION.sub(' ', text.lower())
+    return _LEGACY_SPACES.sub(' ', normalized).strip()
+
+
+def legacy_language(text):
+    if len(text.strip()) < 10:
+        return 'unknown'
+    vietnamese_count = total_chars = 0
+    for char in text.lower():
+        if char.isalpha():
+            total_chars += 1
+            if char in VIETNAMESE_CHARS:
+                vietnamese_count += 1
+    if total_chars == 0:
+        return 'unknown'
+    ratio = vietnamese_count / total_chars
+    return 'vi' if ratio > 0.05 else 'mixed' if ratio > 0.01 else 'en'
+
+
+def legacy_annotate(text):
+    normalized = legacy_normalize(text)
+    return (normalized, legacy_language(text), len(normalized.split()),
+            hashlib.sha1(_LEGACY_SPACES.sub(' ', text.lower()).strip().encode('utf-8')).hexdigest())
+
+
+def new_annotate(text):
+    annotation = annotate(text)
+    return annotation.normalized, annotation.language, annotation.token_count, annotation.content_hash
+
+
+def load_chunks(count):
+    extractor = PdfTextExtractor(max_workers=1)
+    chunks = []
+    for pdf_path in sorted(glob.glob(os.path.join(UPLOADS_DIR, '*.pdf'))):
+        chunks.extend(split_text("\n".join(extractor.iter_pages(pdf_path, parallel=False))))
+    if not chunks:
+        return []
+    return [chunks[index % len(chunks)] for index in range(count)]
+
+
+def best_of(function, chunks, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for chunk in chunks:
+            function(chunk)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=5000, help='Số chunks cần phân tích')
+    parser.add_argument('--repeat', type=int, default=3, help='Số lần đo (lấy lần nhanh nhất)')
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.chunks)
+    if not chunks:
+        print(f"❌ No PDF found in {UPLOADS_DIR}")
+        return 1
+
+    mismatches = sum(1 for chunk in chunks if legacy_annotate(chunk) != new_annotate(chunk))
+    print(f"📊 {len(chunks)} chunks (avg {sum(map(len, chunks)) / len(chunks):.0f} chars), "
+          f"{mismatches} mismatches")
+
+    for label, legacy, new in (("ingestion", legacy_annotate, new_annotate),
+                               ("search normalize", legacy_normalize, normalize_text)):
+        legacy_seconds = best_of(legacy, chunks, args.repeat)
+        new_seconds = best_of(new, chunks, args.repeat)
+        print(f"   {label:<17} legacy {len(chunks) / legacy_seconds:9.0f} chunks/s | "
+              f"annotator {len(chunks) / new_seconds:9.0f} chunks/s | {legacy_seconds / new_seconds:4.1f}x")
+    return 0 if mismatches == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Benchmark loại bỏ chunk trùng: số chunk được embed/lưu khi ingest các PDF trong backend/uploads
+
+ChromaDB được thay bằng collection giả chỉ đếm số chunk được add (= số lần embed),
+để thấy index giảm bao nhiêu và stage dedup (hash + MinHash/LSH) tốn bao nhiêu thời gian.
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_chunk_dedup.py
+    python benchmarks/bench_chunk_dedup.py --repeat 2   # Upload lại mỗi PDF thêm 1 lần (phiên bản trùng)
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.chunk_dedup import ChunkDedupIndex
+from services.document_index import DocumentIndex
+from services.lexical_index import LexicalIndex
+from services.trigram_index import TrigramIndex
+from services.query_cache import SearchCache
+from services.read_write_lock import ReadWriteLock
+from services.embedding_service import EmbeddingProvider
+from services.pdf_extraction import PdfTextExtractor, join_pages
+
+UPLOADS_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+
+
+class CountingCollection:
+    """Collection giả: đếm số chunk được add (mỗi chunk add = 1 lần embed)"""
+
+    def __init__(self):
+        self.added = 0
+
+    def add(self, documents, metadatas, ids, embeddings=None):
+        self.added += len(ids)
+
+    def update(self, ids, metadatas):
+        pass
+
+    def get(self, **kwargs):
+        return {"ids": [], "documents": [], "metadatas": []}
+
+    def delete(self, ids):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=1, help='Số lần ingest mỗi PDF')
+    args = parser.parse_args()
+
+    from services.knowledge_base_service import KnowledgeBaseService
+
+    pdf_paths = sorted(glob.glob(os.path.join(UPLOADS_DIR, '*.pdf')))
+    if not pdf_paths:
+        print(f"❌ No PDF found in {UPLOADS_DIR}")
+        return 1
+
+    extractor = PdfTextExtractor(max_workers=1)
+    with tempfile.TemporaryDirectory() as work_dir:
+        service = KnowledgeBaseService.__new__(KnowledgeBaseService)
+        service.upload_folder = work_dir
+        service.collection = CountingCollection()
+        service.max_batch_size = 5461
+        service.embedder = EmbeddingProvider(lambda texts: [[0.0]] * len(texts), "null")
+        service.chunk_dedup = ChunkDedupIndex(os.path.join(work_dir, 'chunk_dedup.db'))
+        service.lexical_index = LexicalIndex(os.path.join(work_dir, 'lexical_index.db'))
+        service.trigram_index = TrigramIndex(os.path.join(work_dir, 'trigram_index.db'))
+        service.document_index = DocumentIndex(os.path.join(work_dir, 'document_index.db'))
+        service.search_cache = SearchCache()
+        service._index_ready = threading.Event()
+        service._index_ready.set()
+        service._search_gate = ReadWriteLock()
+        service._active_writes = 0
+        service._active_ingests_lock = threading.Lock()
+
+        print(f"{'file':<45} {'chunks':>7} {'stored':>7} {'exact':>6} {'near':>5} {'dedup time':>11}")
+        for round_index in range(args.repeat):
+            for file_index, pdf_path in enumerate(pdf_paths):
+                text, _ = join_pages(extractor.extract_pages(pdf_path))
+                chunks = service._split_text_into_chunks(text)
+                stats = {}
+                start = time.perf_counter()
+                service.write_chunks_to_vector_db(
+                    f"file{round_index}_{file_index}", os.path.basename(pdf_path), "", chunks,
+                    {"original_filename": os.path.basename(pdf_path)}, dedup_stats=stats
+                )
+                elapsed = time.perf_counter() - start
+                print(f"{os.path.basename(pdf_path)[:45]:<45} {len(chunks):>7} {stats['stored']:>7} "
+                      f"{stats['exact']:>6} {stats['near']:>5} {elapsed * 1000:>9.1f}ms")
+
+        totals = service.chunk_dedup.get_stats()
+        print(f"\nLogical chunks: {totals['logical_chunks']}, embedded/stored: {service.collection.added}, "
+              f"index size reduction: {totals['index_size_reduction']:.1%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Benchmark tìm kiếm từ khóa với câu hỏi gõ không dấu: lexical index có / không dùng dạng bỏ dấu
+
+Các PDF trong backend/uploads được chia chunk và ghi vào LexicalIndex (thư mục tạm). Mỗi query
+trong bench_structured_chunking.QUERIES được chạy 2 lần: nguyên văn và đã bỏ dấu
+(chunk_annotator.fold_diacritics, như người dùng gõ không dấu). So sánh:
+- exact: chỉ khớp đúng dạng của từ (như trước khi có dạng bỏ dấu)
+- folded: LexicalIndex.search (khớp cả dạng bỏ dấu, ưu tiên đúng dấu)
+Chỉ số: hit@k, MRR (chunk đầu tiên chứa đoạn câu trả lời) và thời gian mỗi query; thêm thời gian
+ghi index và thời gian bỏ dấu mỗi chunk so với chunk_annotator.annotate.
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_diacritic_folding.py
+    python benchmarks/bench_diacritic_folding.py --top-k 3 --chunk-size 600 --overlap 100
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from bench_structured_chunking import QUERIES
+from services.chunk_annotator import annotate, fold_diacritics, normalize_text
+from services.lexical_index import LexicalIndex, _folded_positions, _positions_by_term
+from services.pdf_extraction import PdfTextExtractor
+from services.text_chunker import iter_chunks
+
+UPLOADS_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+
+
+def evaluate(index, chunks, queries, top_k, repeat):
+    """hit@k, MRR và thời gian mỗi query (ms)"""
+    hits = reciprocal_ranks = 0
+    elapsed = 0.0
+    for query, answer in queries:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            ranked = index.search(normalize_text(query).split(), limit=top_k)
+            elapsed += time.perf_counter() - start
+        relevant = [position for position, (chunk_id, _, _, _) in enumerate(ranked)
+                    if answer in chunks[int(chunk_id)]]
+        if relevant:
+            hits += 1
+            reciprocal_ranks += 1 / (relevant[0] + 1)
+    return hits / len(queries), reciprocal_ranks / len(queries), elapsed * 1000 / (repeat * len(queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--overlap', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20, help='Số lần chạy mỗi query')
+    args = parser.parse_args()
+
+    pdf_paths = sorted(glob.glob(os.path.join(UPLOADS_DIR, '*.pdf')))
+    if not pdf_paths:
+        print(f"❌ No PDF found in {UPLOADS_DIR}")
+        return 1
+
+    extractor = PdfTextExtractor(max_workers=1)
+    chunks = [chunk.text for path in pdf_paths
+              for chunk in iter_chunks("\n".join(extractor.iter_pages(path, parallel=False)),
+                                       args.chunk_size, args.overlap)]
+    annotations = [annotate(chunk) for chunk in chunks]
+
+    start = time.perf_counter()
+    for annotation in annotations:
+        annotate(annotation.normalized)
+    annotate_us = (time.perf_counter() - start) * 1e6 / len(chunks)
+    positions = [_positions_by_term(annotation.normalized.split()) for annotation in annotations]
+    start = time.perf_counter()
+    for chunk_positions in positions:
+        _folded_positions(chunk_positions)
+    fold_us = (time.perf_counter() - start) * 1e6 / len(chunks)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        index = LexicalIndex(os.path.join(work_dir, 'lexical_index.db'))
+        start = time.perf_counter()
+        for chunk_id, annotation in enumerate(annotations):
+            index.add_chunk(str(chunk_id), annotation.normalized.split())
+        index.commit()
+        ingest_ms = (time.perf_counter() - start) * 1000 / len(chunks)
+        stats = index.get_stats()
+        print(f"📊 {len(chunks)} chunks, {stats['terms']} terms + {stats['folded_terms']} folded terms, "
+              f"{len(QUERIES)} queries, top_k={args.top_k}")
+        print(f"   per chunk: add_chunk {ingest_ms:.2f} ms | fold {fold_us:.1f} us "
+              f"(annotate {annotate_us:.1f} us)")
+
+        unaccented = [(fold_diacritics(query), answer) for query, answer in QUERIES]
+        print(f"   {'index':<7} {'queries':<11} | {f'hit@{args.top_k}':>6} | {'MRR':>5} | {'query ms':>8}")
+        for label, variants in (("exact", lambda terms, expansions=None: {term: (term, 1.0) for term in terms}),
+                                ("folded", index._term_variants)):
+            with patch.object(index, "_term_variants", variants):
+                for query_label, queries in (("accented", QUERIES), ("unaccented", unaccented)):
+                    hit_at_k, mrr, query_ms = evaluate(index, chunks, queries, args.top_k, args.repeat)
+                    print(f"   {label:<7} {query_label:<11} | {hit_at_k:6.2f} | {mrr:5.2f} | {query_ms:8.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
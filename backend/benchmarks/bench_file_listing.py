@@ -0,0 +1,99 @@
+"""
+Benchmark liệt kê file: quét {file_id}_metadata.json (cách cũ) so với file catalog SQLite
+
+Tạo N bản ghi metadata giả (mỗi JSON cũ kèm extracted_text như metadata trước đây),
+rồi đo thời gian liệt kê toàn bộ và lấy 1 trang đã sắp xếp.
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_file_listing.py
+    python benchmarks/bench_file_listing.py --files 5000 --text-size 50000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.file_catalog import FileCatalog
+
+
+def make_metadata(index, text_size):
+    return {
+        "file_id": f"file-{index:06d}",
+        "original_filename": f"tai_lieu_{index}.pdf",
+        "title": f"Tài liệu Java {index}",
+        "description": "",
+        "file_size": 100000 + index,
+        "pages_count": 10 + index % 50,
+        "text_length": text_size,
+        "upload_time": (datetime(2025, 1, 1) + timedelta(minutes=index)).isoformat(),
+        "extracted_text": "x" * text_size
+    }
+
+
+def list_from_json(folder):
+    """Cách cũ: đọc toàn bộ file JSON rồi sắp xếp trong Python"""
+    files = []
+    for filename in os.listdir(folder):
+        if filename.endswith('_metadata.json'):
+            with open(os.path.join(folder, filename), 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            files.append({
+                "file_id": metadata["file_id"],
+                "filename": metadata["original_filename"],
+                "title": metadata["title"],
+                "file_size": metadata["file_size"],
+                "pages_count": metadata["pages_count"],
+                "upload_time": metadata["upload_time"],
+                "description": metadata.get("description", "")
+            })
+    files.sort(key=lambda x: x["upload_time"], reverse=True)
+    return files
+
+
+def measure(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=1000, help='Số file')
+    parser.add_argument('--text-size', type=int, default=20000, help='Độ dài text trong mỗi JSON cũ')
+    parser.add_argument('--repeat', type=int, default=5, help='Số lần đo')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="kb_listing_")
+    try:
+        catalog = FileCatalog(os.path.join(work_dir, "file_catalog.db"))
+        for index in range(args.files):
+            metadata = make_metadata(index, args.text_size)
+            with open(os.path.join(work_dir, f"{metadata['file_id']}_metadata.json"), 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, ensure_ascii=False)
+            catalog.put(metadata)
+
+        json_ms, json_files = measure(lambda: list_from_json(work_dir), args.repeat)
+        all_ms, (catalog_files, _) = measure(lambda: catalog.list_files(), args.repeat)
+        page_ms, _ = measure(lambda: catalog.list_files(limit=50, offset=args.files // 2, sort_by="title"), args.repeat)
+
+        assert [f["file_id"] for f in json_files] == [f["file_id"] for f in catalog_files]
+        print(f"📊 {args.files} files (text {args.text_size} chars / JSON)")
+        print(f"   JSON scan (all)        : {json_ms:9.2f} ms")
+        print(f"   Catalog (all)          : {all_ms:9.2f} ms  ({json_ms / max(all_ms, 1e-9):.1f}x)")
+        print(f"   Catalog (50, by title) : {page_ms:9.2f} ms  ({json_ms / max(page_ms, 1e-9):.1f}x)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Benchmark tham số HNSW: recall@k so với tìm kiếm chính xác và thời gian query / dựng index
+
+Vector tổng hợp (--dim chiều, chia cụm như embedding của các tài liệu cùng chủ đề, chuẩn hóa độ
+dài 1) được lưu vào ChromaDB thật (thư mục tạm). Với mỗi tổ hợp tham số, collection được dựng lại
+bằng KnowledgeBaseService.rebuild_vector_index (cùng đường đi với POST /knowledge-base/index/rebuild)
+rồi đo:
+- recall@k: tỉ lệ k kết quả của HNSW nằm trong k kết quả đúng (numpy, tính trên toàn bộ vector)
+- thời gian query trung bình và thời gian dựng lại
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_hnsw_params.py
+    python benchmarks/bench_hnsw_params.py --vectors 50000 --space cosine --m 16 32 --search-ef 10 64 128
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import chromadb
+import numpy as np
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.hnsw_config import DEFAULT_HNSW_CONFIG, collection_metadata
+from services.knowledge_base_service import KnowledgeBaseService
+from services.query_cache import SearchCache
+from services.read_write_lock import ReadWriteLock
+
+
+def clustered_vectors(count, dim, clusters, rng):
+    """Vector quanh clusters tâm ngẫu nhiên, chuẩn hóa độ dài 1"""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_neighbors(vectors, queries, k, space):
+    """k láng giềng gần nhất chính xác theo hàm khoảng cách của space"""
+    if space == "l2":
+        distances = (queries ** 2).sum(1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(1)[None, :]
+    else:
+        # Vector có độ dài 1: cosine distance và ip distance (1 - tích vô hướng) trùng nhau
+        distances = 1 - queries @ vectors.T
+    return np.argpartition(distances, k, axis=1)[:, :k]
+
+
+def build_service(work_dir, vectors, space):
+    """Service với ChromaDB thật chứa vectors (id = thứ tự), chỉ các thuộc tính cần cho rebuild"""
+    service = KnowledgeBaseService.__new__(KnowledgeBaseService)
+    service.chroma_client = chromadb.PersistentClient(path=os.path.join(work_dir, 'chroma'))
+    service.max_batch_size = service.chroma_client.get_max_batch_size()
+    service.collection = service.chroma_client.get_or_create_collection(
+        "knowledge_base", metadata=collection_metadata(DEFAULT_HNSW_CONFIG._replace(space=space))
+    )
+    service.search_cache = SearchCache()
+    service._index_ready = threading.Event()
+    service._index_ready.set()
+    service._search_gate = ReadWriteLock()
+    service._index_rebuild_lock = threading.Lock()
+    service._reindex_swap_lock = threading.Lock()
+    service._active_ingests = 0
+    service._active_writes = 0
+    service._active_ingests_lock = threading.Lock()
+    service._reindex_staging = {}
+
+    for start in range(0, len(vectors), service.max_batch_size):
+        batch = vectors[start:start + service.max_batch_size]
+        service.collection.add(ids=[str(index) for index in range(start, start + len(batch))],
+                               embeddings=batch.tolist(),
+                               documents=[""] * len(batch))
+    return service
+
+
+def measure(service, queries, truth, k):
+    """recall@k trung bình và thời gian mỗi query (ms)"""
+    recalls = []
+    start = time.perf_counter()
+    for query, expected in zip(queries, truth):
+        ids = service.collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])["ids"][0]
+        recalls.append(len(set(map(int, ids)) & set(expected.tolist())) / k)
+    return float(np.mean(recalls)), (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vectors', type=int, default=10000, help='Số vector trong collection')
+    parser.add_argument('--dim', type=int, default=384, help='Số chiều (all-MiniLM-L6-v2: 384)')
+    parser.add_argument('--clusters', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--space', choices=['l2', 'cosine', 'ip'], default='l2')
+    parser.add_argument('--m', type=int, nargs='+', default=[8, 16, 32])
+    parser.add_argument('--construction-ef', type=int, nargs='+', default=[100, 200])
+    parser.add_argument('--search-ef', type=int, nargs='+', default=[10, 50, 100])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    vectors = clustered_vectors(args.vectors, args.dim, args.clusters, rng)
+    queries = clustered_vectors(args.queries, args.dim, args.clusters, rng)
+    truth = exact_neighbors(vectors, queries, args.k, args.space)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        start = time.perf_counter()
+        service = build_service(work_dir, vectors, args.space)
+        print(f"📊 {args.vectors} vectors x {args.dim} dims, {args.queries} queries, k={args.k}, "
+              f"space={args.space} (load {time.perf_counter() - start:.1f}s)")
+        print(f"   {'M':>3} {'constr_ef':>9} {'search_ef':>9} | {'recall@k':>8} | {'query ms':>8} | {'rebuild s':>9}")
+        for m in args.m:
+            for construction_ef in args.construction_ef:
+                for search_ef in args.search_ef:
+                    success, info, message, _ = service.rebuild_vector_index(
+                        space=args.space, M=m, construction_ef=construction_ef, search_ef=search_ef
+                    )
+                    if not success:
+                        print(f"❌ {message}")
+                        return 1
+                    recall, query_ms = measure(service, queries, truth, args.k)
+                    print(f"   {m:>3} {construction_ef:>9} {search_ef:>9} | {recall:8.3f} | {query_ms:8.2f} | "
+                          f"{info['seconds']:9.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
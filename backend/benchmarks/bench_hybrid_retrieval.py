@@ -0,0 +1,181 @@
+"""
+Benchmark tìm kiếm trong file: các chiến lược tuần tự (cách cũ) vs hybrid retrieval (vector + BM25, RRF)
+
+Các PDF trong backend/uploads được chia chunk và lưu vào ChromaDB thật (thư mục tạm) với
+embedding model mặc định. Mỗi query trong bench_structured_chunking.QUERIES có 1 đoạn text của
+câu trả lời; chunk chứa đoạn đó là chunk đúng. So sánh:
+- sequential: search_in_multiple_files trước đây - query gốc -> query chuẩn hóa -> từ khóa
+  -> text matching, dừng ở chiến lược đầu tiên có kết quả (mỗi chiến lược 1 lần embed + query)
+- hybrid: KnowledgeBaseService.hybrid_search - 1 lần query ChromaDB cho query gốc và từ khóa,
+  BM25 chạy song song, gộp bằng reciprocal rank fusion
+- hybrid cached: như hybrid với cache câu hỏi bật (lần chạy đầu của mỗi query miss, các lần sau hit)
+
+--hashed-embedding dùng vector bag-of-words băm 256 chiều thay cho model (khi không tải được
+model): đo được thời gian và cách gộp, chất lượng vector search không đại diện cho model thật.
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_hybrid_retrieval.py
+    python benchmarks/bench_hybrid_retrieval.py --top-k 3 --chunk-size 600 --overlap 100
+    python benchmarks/bench_hybrid_retrieval.py --hashed-embedding
+"""
+
+import argparse
+import glob
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import chromadb
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from bench_structured_chunking import QUERIES
+from services.chunk_dedup import ChunkDedupIndex
+from services.chunk_annotator import normalize_text
+from services.document_index import DocumentIndex
+from services.embedding_service import EmbeddingProvider, create_embedding_provider
+from services.file_hash_index import FileHashIndex
+from services.hybrid_retrieval import HybridRetriever
+from services.knowledge_base_service import KnowledgeBaseService
+from services.lexical_index import LexicalIndex
+from services.pdf_extraction import PdfTextExtractor
+from services.query_cache import SearchCache
+from services.read_write_lock import ReadWriteLock
+from services.trigram_index import TrigramIndex
+
+UPLOADS_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+
+
+def sequential_search(service, query, file_ids, max_results):
+    """search_in_multiple_files trước đây: thử lần lượt từng chiến lược, dừng khi có kết quả"""
+    filters = service._file_filter(file_ids)
+    success, results, _ = service.search_chunks_with_filters(query, filters, max_results)
+    if success and results:
+        return results
+    normalized_query = service._normalize_vietnamese_text(query)
+    if normalized_query != query:
+        success, results, _ = service.search_chunks_with_filters(normalized_query, filters, max_results)
+        if success and results:
+            return results
+    keywords = service._extract_keywords_vietnamese(query)
+    if keywords:
+        success, results, _ = service.search_chunks_with_filters(" ".join(keywords), filters, max_results)
+        if success and results:
+            return results
+    return service._lexical_hits(query, file_ids, max_results)
+
+
+def hashed_embed(texts, dimensions=256):
+    """Embedding giả: đếm từ (đã chuẩn hóa) băm vào dimensions chiều, chuẩn hóa độ dài 1"""
+    vectors = []
+    for text in texts:
+        vector = [0.0] * dimensions
+        for word in normalize_text(text).split():
+            vector[zlib.crc32(word.encode('utf-8')) % dimensions] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        vectors.append([value / norm for value in vector])
+    return vectors
+
+
+def build_service(work_dir, pdf_paths, chunk_size, overlap, hashed_embedding):
+    """Service với ChromaDB thật trong work_dir, mỗi PDF là 1 file"""
+    service = KnowledgeBaseService.__new__(KnowledgeBaseService)
+    service.upload_folder = work_dir
+    client = chromadb.PersistentClient(path=os.path.join(work_dir, 'chroma'))
+    service.collection = client.get_or_create_collection("knowledge_base")
+    service.max_batch_size = client.get_max_batch_size()
+    service.embedder = (EmbeddingProvider(hashed_embed, "hashed") if hashed_embedding
+                        else create_embedding_provider(cache_size=0))
+    service.file_hash_index = FileHashIndex()
+    service.chunk_dedup = ChunkDedupIndex(os.path.join(work_dir, 'chunk_dedup.db'))
+    service.lexical_index = LexicalIndex(os.path.join(work_dir, 'lexical_index.db'))
+    service.trigram_index = TrigramIndex(os.path.join(work_dir, 'trigram_index.db'))
+    service.document_index = DocumentIndex(os.path.join(work_dir, 'document_index.db'))
+    service.hybrid_retriever = HybridRetriever()
+    # Không cache: mỗi lần lặp query đo thời gian tìm kiếm thật
+    service.search_cache = SearchCache(embedding_entries=0, result_entries=0)
+    service._index_ready = threading.Event()
+    service._index_ready.set()
+    service._search_gate = ReadWriteLock()
+    service._active_writes = 0
+    service._active_ingests_lock = threading.Lock()
+
+    extractor = PdfTextExtractor(max_workers=1)
+    file_ids = []
+    for index, pdf_path in enumerate(pdf_paths):
+        file_id = f"file{index:03d}"
+        text = "\n".join(extractor.iter_pages(pdf_path, parallel=False))
+        service.write_chunks_to_vector_db(file_id, os.path.basename(pdf_path), "",
+                                          service._split_text_into_chunks(text, chunk_size, overlap),
+                                          {"original_filename": os.path.basename(pdf_path)})
+        file_ids.append(file_id)
+    return service, file_ids
+
+
+def evaluate(search, top_k, repeat):
+    """Thời gian trung bình mỗi query, hit@k và MRR (chunk đầu tiên chứa đoạn câu trả lời)"""
+    hits = reciprocal_ranks = 0
+    elapsed = 0.0
+    for query, answer in QUERIES:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = search(query)
+            elapsed += time.perf_counter() - start
+        relevant = [position for position, result in enumerate(results) if answer in result["content"]]
+        if relevant:
+            hits += relevant[0] < top_k
+            reciprocal_ranks += 1 / (relevant[0] + 1)
+    return elapsed / (repeat * len(QUERIES)), hits / len(QUERIES), reciprocal_ranks / len(QUERIES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--overlap', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3, help='Số lần chạy mỗi query')
+    parser.add_argument('--hashed-embedding', action='store_true', help='Embedding bag-of-words băm thay cho model')
+    args = parser.parse_args()
+
+    pdf_paths = sorted(glob.glob(os.path.join(UPLOADS_DIR, '*.pdf')))
+    if not pdf_paths:
+        print(f"❌ No PDF found in {UPLOADS_DIR}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        service, file_ids = build_service(work_dir, pdf_paths, args.chunk_size, args.overlap,
+                                          args.hashed_embedding)
+        print(f"📊 {service.collection.count()} chunks in {len(file_ids)} files, {len(QUERIES)} queries, "
+              f"top_k={args.top_k}, embedding={service.embedder.name}")
+        service.embedder.embed_queries(["warm up"])
+
+        signals = {}
+
+        def hybrid(query):
+            _, results, info, _ = service.hybrid_search(query, file_ids, args.top_k)
+            for ranking, count in info.get("contributed", {}).items():
+                signals[ranking] = signals.get(ranking, 0) + count
+            return results
+
+        for label, search in (("sequential", lambda query: sequential_search(service, query, file_ids, args.top_k)),
+                              ("hybrid", hybrid)):
+            seconds, hit_at_k, mrr = evaluate(search, args.top_k, args.repeat)
+            print(f"   {label:<13} {seconds * 1000:7.2f} ms/query | hit@{args.top_k} {hit_at_k:.2f} | MRR {mrr:.2f}")
+        print(f"   hybrid results per signal: {signals}")
+
+        service.search_cache = SearchCache()
+        seconds, _, _ = evaluate(hybrid, args.top_k, args.repeat)
+        stats = service.search_cache.get_stats()
+        print(f"   {'hybrid cached':<13} {seconds * 1000:7.2f} ms/query | result hit rate "
+              f"{stats['results']['hit_rate']:.2f} | embedding hit rate {stats['embeddings']['hit_rate']:.2f}")
+        service.hybrid_retriever.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+Benchmark bộ nhớ của pipeline ingestion: cách cũ (giữ toàn bộ text) so với streaming
+
+Mỗi lần đo chạy trong 1 process riêng và lấy peak RSS (ru_maxrss). ChromaDB được thay
+bằng collection giả chỉ đếm số chunks, để đo bộ nhớ của pipeline chứ không phải của
+embedding model. PDF tổng hợp được ghép bằng cách lặp lại các trang trong backend/uploads.
+
+Pipeline streaming vẫn còn phần bộ nhớ tăng theo kích thước tài liệu, được kiểm tra bằng
+giới hạn --max-kb-per-page (độ dốc của pipeline RSS giữa PDF nhỏ nhất và lớn nhất, thoát với
+mã lỗi nếu vượt; PDF nhỏ nhất nên có vài trăm trang để batch và cache của pipeline đã đầy):
+- PdfReader của mỗi khoảng trang đọc xref và làm phẳng cây trang của cả file (tạm thời, thu hồi
+  sau mỗi khoảng; chạy trong process con khi trích xuất song song)
+- page_offsets: 1 số nguyên mỗi trang (lưu trong metadata của file)
+- CentroidAccumulator: embedding float32 của các chunk lưu mới (ghi vào document index khi xong;
+  ở đây embedding giả chỉ có 1 chiều)
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_ingestion_memory.py
+    python benchmarks/bench_ingestion_memory.py --pages 500,1000,2000 --max-kb-per-page 5
+"""
+
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import PyPDF2
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.chunk_annotator import detect_language
+
+UPLOADS_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+
+
+class NullCollection:
+    """Collection giả: nhận batch như ChromaDB nhưng không lưu gì"""
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, documents, metadatas, ids, embeddings=None):
+        self.count += len(ids)
+
+    def get(self, **kwargs):
+        return {"ids": [], "documents": [], "metadatas": []}
+
+    def update(self, ids, metadatas):
+        pass
+
+    def delete(self, ids):
+        pass
+
+
+def build_large_pdf(source_paths, pages, output_path):
+    """Ghép PDF lớn bằng cách lặp lại các trang của PDF nguồn"""
+    writer = PyPDF2.PdfWriter()
+    source_pages = [page for path in source_paths for page in PyPDF2.PdfReader(path).pages]
+    for i in range(pages):
+        writer.add_page(source_pages[i % len(source_pages)])
+    with open(output_path, 'wb') as f:
+        writer.write(f)
+
+
+def run_legacy(service, pdf_path, work_dir):
+    """Pipeline cũ: text đầy đủ trong bộ nhớ, metadata chứa text, 1 lần add tất cả chunks"""
+    text = ""
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        pages_count = len(pdf_reader.pages)
+        for page in pdf_reader.pages:
+            text += page.extract_text() + "\n"
+
+    metadata = {"file_id": "bench", "pages_count": pages_count, "text_length": len(text), "extracted_text": text}
+    with open(os.path.join(work_dir, "bench_metadata.json"), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(work_dir, "bench_text.txt"), 'w', encoding='utf-8') as f:
+        f.write(text)
+
+    chunks = service._split_text_into_chunks(text)
+    ids, documents, metadatas = [], [], []
+    for i, chunk in enumerate(chunks):
+        ids.append(f"bench_chunk_{i}")
+        documents.append(chunk)
+        metadatas.append({
+            "file_id": "bench",
+            "chunk_index": i,
+            "chunk_length": len(chunk),
+            "language": detect_language(chunk),
+            "normalized_content": service._normalize_vietnamese_text(chunk)
+        })
+    service.collection.add(documents=documents, metadatas=metadatas, ids=ids)
+    return len(chunks)
+
+
+def run_streaming(service, pdf_path, work_dir):
+    """Pipeline mới: KnowledgeBaseService.ingest_saved_file"""
+    saved_file = {
+        "file_id": "bench",
+        "original_filename": os.path.basename(pdf_path),
+        "stored_filename": os.path.basename(pdf_path),
+        "file_path": pdf_path,
+        "file_size": os.path.getsize(pdf_path)
+    }
+    success, result, message, _ = service.ingest_saved_file(saved_file, "Benchmark", "")
+    if not success:
+        raise RuntimeError(message)
+    return result["vector_chunks_count"]
+
+
+def worker(mode, pdf_path):
+    """Chạy 1 lần đo trong process hiện tại, in kết quả dạng JSON"""
+    from services.knowledge_base_service import KnowledgeBaseService
+    from services.embedding_service import EmbeddingProvider
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        service = KnowledgeBaseService(upload_folder=work_dir, chroma_db_path=os.path.join(work_dir, 'chroma'))
+        service.collection = NullCollection()
+        service.embedder = EmbeddingProvider(lambda texts: [[0.0]] * len(texts), "null")
+        service.pdf_extractor.max_workers = 1   # Đo trong 1 process để ru_maxrss phản ánh toàn bộ pipeline
+
+        baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        chunks = (run_legacy if mode == 'legacy' else run_streaming)(service, pdf_path, work_dir)
+        elapsed = time.perf_counter() - start
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(json.dumps({"baseline_kb": baseline_kb, "peak_kb": peak_kb, "seconds": elapsed, "chunks": chunks}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', default='500,2000', help='Danh sách số trang của PDF tổng hợp')
+    parser.add_argument('--max-kb-per-page', type=float, default=5.0,
+                        help='Mức tăng pipeline RSS tối đa mỗi trang của chế độ streaming')
+    parser.add_argument('--worker', nargs=2, metavar=('MODE', 'PDF'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return 0
+
+    source_paths = sorted(glob.glob(os.path.join(UPLOADS_DIR, '*.pdf')))
+    if not source_paths:
+        print(f"❌ No PDF found in {UPLOADS_DIR}")
+        return 1
+
+    page_counts = sorted(int(p) for p in args.pages.split(','))
+    pipeline_kb = {}   # (mode, pages) -> mức tăng RSS của pipeline
+    print(f"{'pages':>6} {'mode':>10} {'chunks':>7} {'time':>8} {'peak RSS':>10} {'pipeline':>10}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for pages in page_counts:
+            pdf_path = os.path.join(temp_dir, f'synthetic_{pages}_pages.pdf')
+            build_large_pdf(source_paths, pages, pdf_path)
+
+            for mode in ('legacy', 'streaming'):
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--worker', mode, pdf_path],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                pipeline_kb[mode, pages] = result['peak_kb'] - result['baseline_kb']
+                print(f"{pages:>6} {mode:>10} {result['chunks']:>7} {result['seconds']:>7.1f}s "
+                      f"{result['peak_kb'] / 1024:>8.1f}MB "
+                      f"{(result['peak_kb'] - result['baseline_kb']) / 1024:>8.1f}MB")
+
+    if len(page_counts) < 2:
+        return 0
+    smallest, largest = page_counts[0], page_counts[-1]
+    for mode in ('legacy', 'streaming'):
+        kb_per_page = (pipeline_kb[mode, largest] - pipeline_kb[mode, smallest]) / (largest - smallest)
+        print(f"📈 {mode}: +{kb_per_page:.1f} KB/page ({smallest} -> {largest} pages)")
+    if kb_per_page > args.max_kb_per_page:
+        print(f"❌ Streaming pipeline grows {kb_per_page:.1f} KB/page (limit {args.max_kb_per_page} KB/page)")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
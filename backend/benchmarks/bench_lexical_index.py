@@ -0,0 +1,145 @@
+"""
+Benchmark tìm kiếm từ khóa (fallback text matching): quét toàn bộ chunks vs inverted index BM25
+
+Chunks gồm các từ ngẫu nhiên lấy từ các PDF trong backend/uploads, chia đều cho --files file
+và lưu vào ChromaDB thật (thư mục tạm, embedding giả 8 chiều để không phải tải model).
+So sánh thời gian mỗi query:
+- scan: cách cũ, collection.get toàn bộ chunks của các file được chọn, chuẩn hóa bằng regex
+  rồi chấm điểm từng chunk trong Python
+- bm25: KnowledgeBaseService._lexical_hits đọc postings trong lexical index
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_lexical_index.py
+    python benchmarks/bench_lexical_index.py --chunks 20000 --files 40
+"""
+
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import chromadb
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from bench_structured_chunking import QUERIES
+from services.chunk_annotator import VIETNAMESE_CHARS
+from services.chunk_dedup import ChunkDedupIndex
+from services.document_index import DocumentIndex
+from services.embedding_service import EmbeddingProvider
+from services.file_hash_index import FileHashIndex
+from services.knowledge_base_service import KnowledgeBaseService
+from services.lexical_index import LexicalIndex
+from services.pdf_extraction import PdfTextExtractor
+from services.query_cache import SearchCache
+from services.read_write_lock import ReadWriteLock
+from services.trigram_index import TrigramIndex
+
+UPLOADS_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+
+
+def legacy_normalize(text):
+    normalized = re.sub(r'[^\w\s' + VIETNAMESE_CHARS + r']', ' ', text.lower())
+    return re.sub(r'\s+', ' ', normalized).strip()
+
+
+def legacy_search(service, query, file_ids, max_results):
+    """Text matching trước đây: lấy mọi chunk của các file và chấm điểm trong Python"""
+    all_chunks = service.collection.get(where=service._file_filter(file_ids), include=["documents", "metadatas"])
+    normalized_query = legacy_normalize(query)
+    query_keywords = set(normalized_query.split())
+    results = []
+    for doc, metadata in zip(all_chunks["documents"], all_chunks["metadatas"]):
+        normalized_doc = legacy_normalize(doc)
+        matching_words = query_keywords.intersection(normalized_doc.split())
+        if matching_words:
+            score = len(matching_words) / len(query_keywords)
+            if normalized_query in normalized_doc:
+                score += 0.5
+            results.append((min(score, 1.0), doc, metadata))
+    results.sort(key=lambda result: result[0], reverse=True)
+    return results[:max_results]
+
+
+def build_service(work_dir, pdf_paths, chunks, files, seed=7):
+    """Service với ChromaDB thật trong work_dir, đã ingest chunks chia đều cho files file"""
+    extractor = PdfTextExtractor(max_workers=1)
+    words = [word for path in pdf_paths for page in extractor.iter_pages(path, parallel=False)
+             for word in page.split()]
+    rng = random.Random(seed)
+
+    service = KnowledgeBaseService.__new__(KnowledgeBaseService)
+    service.upload_folder = work_dir
+    client = chromadb.PersistentClient(path=os.path.join(work_dir, 'chroma'))
+    service.collection = client.get_or_create_collection("knowledge_base")
+    service.max_batch_size = client.get_max_batch_size()
+    service.embedder = EmbeddingProvider(lambda texts: [[rng.random() for _ in range(8)] for _ in texts], "random")
+    service.file_hash_index = FileHashIndex()
+    service.chunk_dedup = ChunkDedupIndex(os.path.join(work_dir, 'chunk_dedup.db'))
+    service.lexical_index = LexicalIndex(os.path.join(work_dir, 'lexical_index.db'))
+    service.trigram_index = TrigramIndex(os.path.join(work_dir, 'trigram_index.db'))
+    service.document_index = DocumentIndex(os.path.join(work_dir, 'document_index.db'))
+    service.search_cache = SearchCache()
+    service._index_ready = threading.Event()
+    service._index_ready.set()
+    service._search_gate = ReadWriteLock()
+    service._active_writes = 0
+    service._active_ingests_lock = threading.Lock()
+
+    per_file = chunks // files
+    for file_index in range(files):
+        file_chunks = []
+        for _ in range(per_file):
+            # Từ lấy ngẫu nhiên theo tần suất trong PDF: chunks không trùng / gần trùng nhau
+            file_chunks.append(" ".join(rng.choices(words, k=rng.randint(80, 180))))
+        service.write_chunks_to_vector_db(f"file{file_index:03d}", f"File {file_index}", "", file_chunks,
+                                          {"original_filename": f"file{file_index}.pdf"})
+    return service
+
+
+def time_queries(search, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query, _ in QUERIES:
+            search(query)
+    return (time.perf_counter() - start) / (repeat * len(QUERIES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=5000, help='Tổng số chunks')
+    parser.add_argument('--files', type=int, default=20, help='Số file')
+    parser.add_argument('--repeat', type=int, default=3, help='Số lần chạy bộ query')
+    parser.add_argument('--top-k', type=int, default=5)
+    args = parser.parse_args()
+
+    pdf_paths = sorted(glob.glob(os.path.join(UPLOADS_DIR, '*.pdf')))
+    if not pdf_paths:
+        print(f"❌ No PDF found in {UPLOADS_DIR}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        start = time.perf_counter()
+        service = build_service(work_dir, pdf_paths, args.chunks, args.files)
+        stats = service.lexical_index.get_stats()
+        print(f"📊 {service.collection.count()} chunks in {args.files} files, {stats['terms']} terms "
+              f"(ingest {time.perf_counter() - start:.1f}s), {len(QUERIES)} queries, top_k={args.top_k}")
+
+        all_files = [f"file{index:03d}" for index in range(args.files)]
+        for label, file_ids in (("1 file", all_files[:1]), ("1/4 files", all_files[:max(1, args.files // 4)]),
+                                ("all files", all_files)):
+            scan = time_queries(lambda query: legacy_search(service, query, file_ids, args.top_k), args.repeat)
+            bm25 = time_queries(lambda query: service._lexical_hits(query, file_ids, args.top_k), args.repeat)
+            print(f"   {label:<10} scan {scan * 1000:8.1f} ms/query | bm25 {bm25 * 1000:7.2f} ms/query | "
+                  f"{scan / bm25:6.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Benchmark trích xuất text PDF: tuần tự (cách cũ) so với process pool theo khoảng trang
+
+Chạy trên các PDF trong backend/uploads, cộng thêm 1 PDF lớn được ghép bằng cách
+lặp lại các trang (mô phỏng tài liệu tiêu chuẩn 500 trang).
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_pdf_extraction.py
+    python benchmarks/bench_pdf_extraction.py --pages 500 --workers 4
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import PyPDF2
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.pdf_extraction import PdfTextExtractor, join_pages
+
+UPLOADS_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+
+
+def extract_legacy(file_path):
+    """Cách cũ: duyệt tuần tự và cộng chuỗi"""
+    text = ""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page in pdf_reader.pages:
+            text += page.extract_text() + "\n"
+    return text
+
+
+def build_large_pdf(source_paths, pages, output_path):
+    """Ghép PDF lớn bằng cách lặp lại các trang của PDF nguồn"""
+    writer = PyPDF2.PdfWriter()
+    source_pages = [page for path in source_paths for page in PyPDF2.PdfReader(path).pages]
+    for i in range(pages):
+        writer.add_page(source_pages[i % len(source_pages)])
+    with open(output_path, 'wb') as f:
+        writer.write(f)
+
+
+def timed(func, repeat):
+    """Chạy func repeat lần, trả về (thời gian tốt nhất, kết quả)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=500, help='Số trang của PDF tổng hợp (0 = bỏ qua)')
+    parser.add_argument('--workers', type=int, default=None, help='Số process (mặc định: số CPU)')
+    parser.add_argument('--repeat', type=int, default=3, help='Số lần chạy mỗi cách, lấy thời gian tốt nhất')
+    args = parser.parse_args()
+
+    source_paths = sorted(glob.glob(os.path.join(UPLOADS_DIR, '*.pdf')))
+    if not source_paths:
+        print(f"❌ No PDF found in {UPLOADS_DIR}")
+        return 1
+
+    extractor = PdfTextExtractor(max_workers=args.workers)
+    print(f"CPU count: {os.cpu_count()} | pool workers: {extractor.max_workers}")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        targets = list(source_paths)
+        if args.pages:
+            large_pdf = os.path.join(temp_dir, f'synthetic_{args.pages}_pages.pdf')
+            build_large_pdf(source_paths, args.pages, large_pdf)
+            targets.append(large_pdf)
+
+        # Khởi tạo pool trước để không tính thời gian tạo process vào lần đo đầu
+        extractor.extract_pages(targets[0], parallel=True)
+
+        print(f"{'file':45} {'pages':>6} {'legacy':>9} {'serial':>9} {'parallel':>9} {'speedup':>8}")
+        for path in targets:
+            legacy_time, legacy_text = timed(lambda: extract_legacy(path), args.repeat)
+            serial_time, serial_pages = timed(lambda: extractor.extract_pages(path, parallel=False), args.repeat)
+            parallel_time, parallel_pages = timed(lambda: extractor.extract_pages(path, parallel=True), args.repeat)
+
+            parallel_text, _ = join_pages(parallel_pages)
+            assert parallel_pages == serial_pages and parallel_text == legacy_text, f"Text mismatch for {path}"
+
+            print(f"{os.path.basename(path)[:45]:45} {len(parallel_pages):>6} "
+                  f"{legacy_time:>8.3f}s {serial_time:>8.3f}s {parallel_time:>8.3f}s "
+                  f"{legacy_time / parallel_time:>7.2f}x")
+
+    extractor.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Benchmark rerank bằng cross-encoder: thứ tự của retrieval vs thứ tự sau rerank
+
+Các PDF trong backend/uploads được chia chunk và lưu vào ChromaDB thật (thư mục tạm) như
+bench_hybrid_retrieval; mỗi query trong bench_structured_chunking.QUERIES lấy --candidates kết quả
+bằng KnowledgeBaseService.hybrid_search rồi rerank bằng CrossEncoder (--model). Chỉ số:
+- hit@n, MRR: chunk đầu tiên chứa đoạn câu trả lời, với n = số kết quả đưa vào prompt
+- prompt words: số từ (token_count của chunk_annotator) của các chunk tới chunk đúng đầu tiên,
+  tức prompt nhỏ nhất vẫn chứa câu trả lời (query không tìm thấy: toàn bộ candidates)
+- rerank ms: thời gian chấm điểm 1 batch mỗi query (sau lần warm up)
+
+Cần sentence-transformers (pip install sentence-transformers) và tải được model.
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_rerank.py
+    python benchmarks/bench_rerank.py --model cross-encoder/ms-marco-MiniLM-L-6-v2 --candidates 30 --top-n 3
+    python benchmarks/bench_rerank.py --hashed-embedding --threads 2
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from bench_hybrid_retrieval import UPLOADS_DIR, build_service
+from bench_structured_chunking import QUERIES
+from services.chunk_annotator import annotate
+from services.reranker import create_reranker
+
+
+def measure(rankings, top_n):
+    """hit@top_n, MRR và số từ trung bình cần đưa vào prompt để chứa câu trả lời"""
+    hits = reciprocal_ranks = words = 0
+    for (_, answer), results in zip(QUERIES, rankings):
+        relevant = [position for position, result in enumerate(results) if answer in result["content"]]
+        needed = results[:relevant[0] + 1] if relevant else results
+        words += sum(annotate(result["content"]).token_count for result in needed)
+        if relevant:
+            hits += relevant[0] < top_n
+            reciprocal_ranks += 1 / (relevant[0] + 1)
+    return hits / len(QUERIES), reciprocal_ranks / len(QUERIES), words / len(QUERIES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+    parser.add_argument('--candidates', type=int, default=20, help='Số kết quả retrieval được rerank (K)')
+    parser.add_argument('--top-n', type=int, default=3, help='Số kết quả đưa vào prompt')
+    parser.add_argument('--threads', type=int, default=0, help='Số thread PyTorch (0 = mặc định)')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--overlap', type=int, default=200)
+    parser.add_argument('--hashed-embedding', action='store_true', help='Embedding bag-of-words băm thay cho model')
+    args = parser.parse_args()
+
+    pdf_paths = sorted(glob.glob(os.path.join(UPLOADS_DIR, '*.pdf')))
+    if not pdf_paths:
+        print(f"❌ No PDF found in {UPLOADS_DIR}")
+        return 1
+
+    # Không giới hạn thời gian: đo chất lượng của toàn bộ K ứng viên
+    reranker = create_reranker(model=args.model, candidates=args.candidates, time_budget_ms=10 ** 6,
+                               threads=args.threads)
+    reranker.rerank("warm up", [{"content": "warm up"}, {"content": "load model"}], 1)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        service, file_ids = build_service(work_dir, pdf_paths, args.chunk_size, args.overlap,
+                                          args.hashed_embedding)
+        print(f"📊 {service.collection.count()} chunks in {len(file_ids)} files, {len(QUERIES)} queries, "
+              f"K={args.candidates}, top_n={args.top_n}, embedding={service.embedder.name}, reranker={args.model}")
+
+        retrieved, reranked, elapsed = [], [], []
+        for query, _ in QUERIES:
+            _, results, _, _ = service.hybrid_search(query, file_ids, args.candidates)
+            retrieved.append(results)
+            ranking, info = reranker.rerank(query, results, len(results))
+            reranked.append(ranking)
+            elapsed.append(info.get("elapsed_ms", 0.0))
+        service.hybrid_retriever.shutdown()
+
+    print(f"   {'order':<10} | {f'hit@{args.top_n}':>6} | {'MRR':>5} | {'prompt words':>12}")
+    for label, rankings in (("retrieval", retrieved), ("rerank", reranked)):
+        hit_at_n, mrr, words = measure(rankings, args.top_n)
+        print(f"   {label:<10} | {hit_at_n:6.2f} | {mrr:5.2f} | {words:12.0f}")
+    print(f"   rerank {sum(elapsed) / len(elapsed):.1f} ms/query (max {max(elapsed):.1f} ms)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Benchmark chia chunk theo cấu trúc: chất lượng truy xuất và kích thước prompt trên các PDF trong backend/uploads
+
+So sánh 2 chiến lược (KB_CHUNK_STRATEGY):
+- flat: chỉ chia theo kích thước (chunk có thể vượt qua heading)
+- structure: chunk không vượt qua heading, kèm page_start/page_end/section
+
+Mỗi câu hỏi có 1 cụm từ đáp án; chunk liên quan = chunk chứa cụm từ đó. Chunks được xếp hạng
+bằng BM25 (mặc định, không cần model) hoặc embedding model đang cấu hình (--embedding).
+Chỉ số: hit@k, MRR, số ký tự của top-k chunks (prompt) và số ký tự cần gửi tới chunk đúng đầu tiên.
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_structured_chunking.py
+    python benchmarks/bench_structured_chunking.py --embedding --top-k 5
+"""
+
+import argparse
+import glob
+import math
+import os
+import re
+import sys
+from collections import Counter
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.document_structure import StructuredChunker
+from services.pdf_extraction import PdfTextExtractor
+from services.text_chunker import IncrementalChunker
+
+UPLOADS_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+
+# (câu hỏi, cụm từ có trong chunk trả lời được câu hỏi)
+QUERIES = [
+    ("Tên package viết như thế nào?", "com.example.deepspace"),
+    ("Một phương thức nên dài khoảng bao nhiêu dòng code?", "50 đến 150"),
+    ("Đặt tên biến static và enum ra sao?", "MIN_WIDTH"),
+    ("Dấu ngoặc nhọn đặt ở đâu theo tiêu chuẩn Java?", "phải được đặt cùng dòng"),
+    ("Camel case là gì, cho ví dụ", "myProvider"),
+    ("Comment thừa chỉ lặp lại code có nên viết không?", "comment chỉ lặp code"),
+    ("Naming conventions for Class and Interface (PascalCase)", "StudentManager"),
+    ("Indentation: tab or spaces?", "1 tab hoc 4"),
+    ("Which references does the convention document cite? Google Java Style Guide", "Oracle Java Coding Conventions"),
+    ("import java.util.List instead of import all", "import java.util.List"),
+]
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def bm25_ranker(chunks, k1=1.5, b=0.75):
+    """Trả về hàm query -> thứ tự index chunk theo điểm BM25"""
+    documents = [Counter(tokenize(chunk)) for chunk in chunks]
+    lengths = [sum(document.values()) for document in documents]
+    average_length = sum(lengths) / max(len(lengths), 1)
+    document_frequency = Counter(term for document in documents for term in document)
+
+    def rank(query):
+        scores = []
+        for document, length in zip(documents, lengths):
+            score = 0.0
+            for term in set(tokenize(query)):
+                frequency = document.get(term, 0)
+                if frequency:
+                    idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) /
+                                   (document_frequency[term] + 0.5))
+                    score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / average_length))
+            scores.append(score)
+        return sorted(range(len(chunks)), key=lambda index: -scores[index])
+
+    return rank
+
+
+def embedding_ranker(chunks):
+    """Trả về hàm query -> thứ tự index chunk theo cosine similarity của embedding model"""
+    import numpy as np
+    from services.embedding_service import create_embedding_provider
+
+    provider = create_embedding_provider()
+    vectors = np.asarray(provider.embed_documents(chunks), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+
+    def rank(query):
+        query_vector = np.asarray(provider.embed_queries([query])[0], dtype=np.float32)
+        return list(np.argsort(-(vectors @ query_vector)))
+
+    return rank
+
+
+def build_chunks(pdf_paths, strategy, chunk_size, overlap):
+    extractor = PdfTextExtractor(max_workers=1)
+    chunks = []
+    for pdf_path in pdf_paths:
+        chunker = StructuredChunker(
+            lambda: IncrementalChunker(chunk_size, overlap, with_offsets=True),
+            detect_headings=strategy == "structure"
+        )
+        for page_number, page_text in enumerate(extractor.iter_pages(pdf_path, parallel=False), 1):
+            chunks.extend(chunker.feed(page_text + "\n", page_number))
+        chunks.extend(chunker.finish())
+    return chunks
+
+
+def evaluate(chunks, ranker, top_k):
+    texts = [chunk.text for chunk in chunks]
+    rank = ranker(texts)
+    hits, reciprocal_ranks, prompt_chars, chars_to_answer = 0, 0.0, 0, []
+    for query, answer in QUERIES:
+        order = rank(query)
+        relevant = [position for position, index in enumerate(order) if answer in texts[index]]
+        if relevant and relevant[0] < top_k:
+            hits += 1
+        if relevant:
+            reciprocal_ranks += 1 / (relevant[0] + 1)
+            chars_to_answer.append(sum(len(texts[index]) for index in order[:relevant[0] + 1]))
+        prompt_chars += sum(len(texts[index]) for index in order[:top_k])
+    return {
+        "chunks": len(chunks),
+        "avg_chunk_chars": sum(map(len, texts)) / max(len(texts), 1),
+        "hit_at_k": hits / len(QUERIES),
+        "mrr": reciprocal_ranks / len(QUERIES),
+        "prompt_chars": prompt_chars / len(QUERIES),
+        "chars_to_answer": sum(chars_to_answer) / max(len(chars_to_answer), 1),
+        "with_section": sum(1 for chunk in chunks if chunk.section)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--overlap', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=3, help='Số chunks đưa vào prompt')
+    parser.add_argument('--embedding', action='store_true', help='Xếp hạng bằng embedding model thay vì BM25')
+    args = parser.parse_args()
+
+    pdf_paths = sorted(glob.glob(os.path.join(UPLOADS_DIR, '*.pdf')))
+    if not pdf_paths:
+        print(f"❌ No PDF found in {UPLOADS_DIR}")
+        return 1
+
+    ranker = embedding_ranker if args.embedding else bm25_ranker
+    print(f"📊 {len(pdf_paths)} PDFs, {len(QUERIES)} queries, chunk_size={args.chunk_size}, "
+          f"overlap={args.overlap}, top_k={args.top_k}, ranker={'embedding' if args.embedding else 'bm25'}")
+    for strategy in ("flat", "structure"):
+        result = evaluate(build_chunks(pdf_paths, strategy, args.chunk_size, args.overlap), ranker, args.top_k)
+        print(f"   {strategy:<10} {result['chunks']:>3} chunks (avg {result['avg_chunk_chars']:6.1f} chars, "
+              f"{result['with_section']} with section) | hit@{args.top_k} {result['hit_at_k']:.2f} | "
+              f"MRR {result['mrr']:.2f} | prompt {result['prompt_chars']:7.1f} chars | "
+              f"to first answer {result['chars_to_answer']:7.1f} chars")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Benchmark chia chunk: cách cũ (2 lượt regex + rfind từng dấu câu mỗi chunk) so với chunker 1 lượt
+
+Text được sinh từ các câu tiếng Việt / tiếng Anh (nhiều MB), kiểm tra 2 cách cho cùng chunks
+rồi đo thời gian. Text ít dấu câu (đoạn code, bảng) là trường hợp rfind cũ chậm nhất vì phải
+quét toàn bộ cửa sổ cho từng loại dấu câu.
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_text_chunker.py
+    python benchmarks/bench_text_chunker.py --size-mb 8 --chunk-size 1000 --overlap 200
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.text_chunker import IncrementalChunker, split_text
+
+VIETNAMESE_WORDS = ("lập trình biến hằng số lớp đối tượng phương thức kế thừa giao diện ngoại lệ "
+                    "quy tắc đặt tên chú thích mã nguồn kiểm thử hiệu năng bộ nhớ luồng").split()
+ENGLISH_WORDS = ("class method variable constant interface exception naming convention comment "
+                 "source code test performance memory thread package import static final").split()
+SENTENCE_ENDS = [". "] * 6 + ["? ", "! ", "; ", ": "]
+
+
+def legacy_split_text(text, chunk_size=1000, overlap=200):
+    """Cách chia chunk trước đây của KnowledgeBaseService._split_text_into_chunks"""
+    cleaned_text = re.sub(r'\n+', '\n', text.strip())
+    cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
+    if len(cleaned_text) <= chunk_size:
+        return [cleaned_text]
+
+    chunks = []
+    start = 0
+    while start < len(cleaned_text):
+        end = start + chunk_size
+        if end < len(cleaned_text):
+            break_chars = ['. ', '\n', '! ', '? ', '; ', ': ', '.\n', '!\n', '?\n']
+            best_break = -1
+            for break_char in break_chars:
+                break_pos = cleaned_text.rfind(break_char, start, end)
+                if break_pos != -1:
+                    best_break = break_pos + len(break_char)
+                    break
+            if best_break == -1:
+                space_pos = cleaned_text.rfind(' ', start, end)
+                if space_pos != -1 and space_pos > start + chunk_size * 0.7:
+                    best_break = space_pos + 1
+            if best_break != -1:
+                end = best_break
+        chunk = cleaned_text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = max(start + 1, end - overlap)
+        if start >= len(cleaned_text):
+            break
+    return chunks
+
+
+def make_text(words, size, rng, sentence_words):
+    """Sinh text khoảng size ký tự: câu dài sentence_words từ, đoạn văn cách nhau bởi dòng trống"""
+    parts = []
+    length = 0
+    while length < size:
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(*sentence_words)))
+        sentence += rng.choice(SENTENCE_ENDS) if rng.random() < 0.9 else "\n\n"
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)
+
+
+def measure(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def split_incremental(text, chunk_size, overlap, page_size=4000):
+    """IncrementalChunker nhận text theo từng trang (như khi ingest PDF)"""
+    chunker = IncrementalChunker(chunk_size, overlap)
+    chunks = []
+    for start in range(0, len(text), page_size):
+        chunks.extend(chunker.feed(text[start:start + page_size]))
+    chunks.extend(chunker.finish())
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=4, help='Kích thước text mỗi trường hợp (MB)')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--overlap', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    size = int(args.size_mb * 1024 * 1024)
+    cases = [
+        ("Vietnamese prose", make_text(VIETNAMESE_WORDS, size, rng, (6, 25))),
+        ("English prose", make_text(ENGLISH_WORDS, size, rng, (6, 25))),
+        # Đoạn code / bảng: rất ít dấu câu, cách cũ phải rfind cả cửa sổ cho từng loại dấu câu
+        ("Sparse punctuation", make_text(VIETNAMESE_WORDS + ENGLISH_WORDS, size, rng, (300, 600))),
+    ]
+
+    print(f"📊 chunk_size={args.chunk_size}, overlap={args.overlap}, ~{args.size_mb} MB / case")
+    for name, text in cases:
+        legacy_seconds, legacy_chunks = measure(
+            lambda: legacy_split_text(text, args.chunk_size, args.overlap), args.repeat
+        )
+        new_seconds, new_chunks = measure(lambda: split_text(text, args.chunk_size, args.overlap), args.repeat)
+        incremental_seconds, incremental_chunks = measure(
+            lambda: split_incremental(text, args.chunk_size, args.overlap), args.repeat
+        )
+        if not (legacy_chunks == new_chunks == incremental_chunks):
+            print(f"❌ {name}: chunks differ from legacy implementation")
+            return 1
+
+        print(f"   {name:<20} {len(new_chunks):>6} chunks | legacy {legacy_seconds * 1000:8.1f} ms | "
+              f"single-pass {new_seconds * 1000:8.1f} ms ({legacy_seconds / new_seconds:4.1f}x) | "
+              f"incremental {incremental_seconds * 1000:8.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
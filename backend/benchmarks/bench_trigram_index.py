@@ -0,0 +1,125 @@
+"""
+Benchmark tìm identifier gõ thiếu / gõ sai: BM25 (chỉ khớp nguyên từ) vs BM25 + trigram index vs quét chunks
+
+Chunks gồm các từ ngẫu nhiên lấy từ các PDF trong backend/uploads và các identifier tổng hợp
+(CamelCase ghép 2-3 từ ASCII của PDF, như tên lớp / biến trong tài liệu coding standards), được
+ghi vào LexicalIndex và TrigramIndex (thư mục tạm). Mỗi query là 1 identifier đã có trong chunks
+bị biến đổi như khi người dùng gõ:
+- prefix: gõ thiếu phần cuối ("NullPointerExcep")
+- infix: bỏ phần đầu ("PointerException")
+- typo: 1 ký tự bị xóa hoặc 2 ký tự liền nhau bị đảo ("NullPionterException")
+Chunk đúng là chunk chứa identifier gốc. So sánh hit@k và thời gian mỗi query:
+- bm25: LexicalIndex.search như trước (từ không có trong index không khớp chunk nào)
+- bm25+trigram: TrigramIndex.expand rồi LexicalIndex.search với các từ gần đúng
+- scan: quét dạng chuẩn hóa của mọi chunk tìm chuỗi con (chỉ khớp prefix / infix, không khớp typo)
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_trigram_index.py
+    python benchmarks/bench_trigram_index.py --chunks 20000 --identifiers 20000 --queries 300
+"""
+
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.chunk_annotator import normalize_text
+from services.lexical_index import LexicalIndex
+from services.pdf_extraction import PdfTextExtractor
+from services.trigram_index import TrigramIndex
+
+UPLOADS_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+
+
+def mutate(identifier, kind, rng):
+    """Identifier như khi người dùng gõ thiếu / gõ sai"""
+    if kind == "prefix":
+        return identifier[:max(5, int(len(identifier) * 0.7))]
+    if kind == "infix":
+        return identifier[max(2, len(identifier) // 3):]
+    position = rng.randrange(1, len(identifier) - 2)
+    if rng.random() < 0.5:
+        return identifier[:position] + identifier[position + 1:]
+    return identifier[:position] + identifier[position + 1] + identifier[position] + identifier[position + 2:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=5000, help='Tổng số chunks')
+    parser.add_argument('--identifiers', type=int, default=5000, help='Số identifier tổng hợp')
+    parser.add_argument('--queries', type=int, default=150, help='Số query mỗi kiểu biến đổi')
+    parser.add_argument('--top-k', type=int, default=5)
+    args = parser.parse_args()
+
+    pdf_paths = sorted(glob.glob(os.path.join(UPLOADS_DIR, '*.pdf')))
+    if not pdf_paths:
+        print(f"❌ No PDF found in {UPLOADS_DIR}")
+        return 1
+
+    rng = random.Random(5)
+    extractor = PdfTextExtractor(max_workers=1)
+    words = [word for path in pdf_paths for page in extractor.iter_pages(path, parallel=False)
+             for word in page.split()]
+    ascii_words = sorted({word.lower() for word in words if re.fullmatch(r'[A-Za-z]{3,10}', word)})
+    identifiers = list({"".join(part.capitalize() for part in rng.sample(ascii_words, rng.randint(2, 3)))
+                        for _ in range(args.identifiers)})
+
+    chunks, chunks_of = [], {}
+    for index in range(args.chunks):
+        chosen = rng.sample(identifiers, 3)
+        chunk = " ".join(rng.choices(words, k=rng.randint(80, 180)) + chosen)
+        chunks.append(normalize_text(chunk))
+        for identifier in chosen:
+            chunks_of.setdefault(identifier, set()).add(str(index))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        lexical_index = LexicalIndex(os.path.join(work_dir, 'lexical_index.db'))
+        trigram_index = TrigramIndex(os.path.join(work_dir, 'trigram_index.db'))
+        lexical_seconds = trigram_seconds = 0.0
+        for chunk_id, chunk in enumerate(chunks):
+            chunk_words = chunk.split()
+            start = time.perf_counter()
+            lexical_index.add_chunk(str(chunk_id), chunk_words)
+            lexical_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            trigram_index.add_terms(chunk_words)
+            trigram_seconds += time.perf_counter() - start
+        lexical_index.commit()
+        trigram_index.commit()
+        stats = trigram_index.get_stats()
+        print(f"📊 {len(chunks)} chunks, {stats['terms']} terms, {stats['trigrams']} trigrams, "
+              f"top_k={args.top_k}")
+        print(f"   ingest per chunk: lexical {lexical_seconds * 1000 / len(chunks):.2f} ms | "
+              f"trigram {trigram_seconds * 1000 / len(chunks):.2f} ms")
+
+        searches = {
+            "bm25": lambda terms: [chunk_id for chunk_id, _, _, _ in lexical_index.search(terms, limit=args.top_k)],
+            "bm25+trigram": lambda terms: [chunk_id for chunk_id, _, _, _ in lexical_index.search(
+                terms, limit=args.top_k, expansions=trigram_index.expand(terms))],
+            "scan": lambda terms: [str(chunk_id) for chunk_id, chunk in enumerate(chunks)
+                                   if all(term in chunk for term in terms)][:args.top_k]
+        }
+        targets = rng.sample(sorted(chunks_of), args.queries)
+        print(f"   {'kind':<7} {'search':<13} | {f'hit@{args.top_k}':>6} | {'query ms':>8}")
+        for kind in ("prefix", "infix", "typo"):
+            queries = [(normalize_text(mutate(identifier, kind, rng)).split(), chunks_of[identifier])
+                       for identifier in targets]
+            for label, search in searches.items():
+                hits = 0
+                start = time.perf_counter()
+                for terms, relevant in queries:
+                    hits += bool(relevant & set(search(terms)))
+                query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+                print(f"   {kind:<7} {label:<13} | {hits / len(queries):6.2f} | {query_ms:8.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
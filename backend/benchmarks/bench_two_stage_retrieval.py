@@ -0,0 +1,129 @@
+"""
+Benchmark tìm kiếm toàn knowledge base: tìm trên toàn bộ chunks vs tìm 2 bước (chọn file theo centroid)
+
+Vector tổng hợp (--dim chiều): mỗi file có 1 chủ đề (tâm ngẫu nhiên), chunk của file nằm quanh
+tâm đó; câu hỏi được sinh quanh chủ đề của 1 file. Chunks được lưu vào ChromaDB thật (thư mục tạm),
+centroid và embedding chunk của file vào DocumentIndex. Với mỗi số file N của bước 1 đo:
+- recall@k: tỉ lệ k kết quả nằm trong k chunk gần nhất chính xác (numpy, trên toàn bộ chunks)
+- file hit: tỉ lệ câu hỏi có file sinh ra nó nằm trong N file được chọn
+- thời gian mỗi query của KnowledgeBaseService.search_in_vector_db (embedding câu hỏi đã có sẵn)
+
+Cách chạy (từ thư mục backend):
+    python benchmarks/bench_two_stage_retrieval.py
+    python benchmarks/bench_two_stage_retrieval.py --files 1000 --chunks-per-file 100 --top-files 1 3 5 10
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.document_index import CentroidAccumulator, DocumentIndex
+from services.embedding_service import EmbeddingProvider
+from services.hnsw_config import DEFAULT_HNSW_CONFIG, collection_metadata
+from services.knowledge_base_service import KnowledgeBaseService
+from services.query_cache import SearchCache
+from services.read_write_lock import ReadWriteLock
+
+
+def normalized(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_service(work_dir, vectors, file_of_chunk, queries, search_ef):
+    """Service với ChromaDB thật chứa vectors (chunk_index = thứ tự vector) và document index của các file"""
+    service = KnowledgeBaseService.__new__(KnowledgeBaseService)
+    client = chromadb.PersistentClient(path=os.path.join(work_dir, 'chroma'))
+    service.max_batch_size = client.get_max_batch_size()
+    service.collection = client.get_or_create_collection(
+        "knowledge_base", metadata=collection_metadata(DEFAULT_HNSW_CONFIG._replace(search_ef=search_ef))
+    )
+    # Câu hỏi là số thứ tự trong queries
+    service.embedder = EmbeddingProvider(lambda texts: [queries[int(text)].tolist() for text in texts], "synthetic")
+    service.search_cache = SearchCache(embedding_entries=0, result_entries=0)
+    service.document_index = DocumentIndex(os.path.join(work_dir, 'document_index.db'))
+    service._search_gate = ReadWriteLock()
+
+    centroids = {}
+    for start in range(0, len(vectors), service.max_batch_size):
+        end = min(start + service.max_batch_size, len(vectors))
+        ids = [str(index) for index in range(start, end)]
+        file_ids = [f"file{file_of_chunk[index]:05d}" for index in range(start, end)]
+        service.collection.add(ids=ids, embeddings=vectors[start:end].tolist(), documents=[""] * len(ids),
+                               metadatas=[{"file_id": file_id, "filename_uuid": file_id, "chunk_index": int(chunk_id)}
+                                          for chunk_id, file_id in zip(ids, file_ids)])
+        for chunk_id, file_id, vector in zip(ids, file_ids, vectors[start:end]):
+            centroids.setdefault(file_id, CentroidAccumulator()).add([chunk_id], [vector])
+    for file_id, centroid in centroids.items():
+        service.document_index.set_file(file_id, centroid)
+    return service
+
+
+def evaluate(service, queries, query_files, truth, k):
+    """recall@k, tỉ lệ file đúng được chọn ở bước 1 (None khi tìm trên toàn bộ) và thời gian mỗi query (ms)"""
+    recalls, file_hits = [], 0
+    elapsed = 0.0
+    two_stage = service._use_two_stage_search()
+    for index, (expected, query_file) in enumerate(zip(truth, query_files)):
+        start = time.perf_counter()
+        _, results, _ = service.search_in_vector_db(str(index), k)
+        elapsed += time.perf_counter() - start
+        found = {result["metadata"]["chunk_index"] for result in results}
+        recalls.append(len(found & set(expected.tolist())) / k)
+        if two_stage:
+            selected = service.document_index.top_files(queries[index], service.two_stage_top_files)
+            file_hits += f"file{query_file:05d}" in {file_id for file_id, _ in selected}
+    file_hit_rate = file_hits / len(queries) if two_stage else None
+    return float(np.mean(recalls)), file_hit_rate, elapsed * 1000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--chunks-per-file', type=int, default=100)
+    parser.add_argument('--dim', type=int, default=384, help='Số chiều (all-MiniLM-L6-v2: 384)')
+    parser.add_argument('--spread', type=float, default=1.2,
+                        help='Độ lệch của chunk quanh chủ đề của file (lớn hơn thì các file chồng lấn hơn)')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--search-ef', type=int, default=100, help='hnsw:search_ef của collection')
+    parser.add_argument('--top-files', type=int, nargs='+', default=[1, 3, 5, 10])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(11)
+    centers = rng.standard_normal((args.files, args.dim)).astype(np.float32) / np.sqrt(args.dim)
+    noise_scale = args.spread / np.sqrt(args.dim)
+    file_of_chunk = np.repeat(np.arange(args.files), args.chunks_per_file)
+    vectors = normalized(centers[file_of_chunk]
+                         + noise_scale * rng.standard_normal((len(file_of_chunk), args.dim)).astype(np.float32))
+    query_files = rng.integers(0, args.files, args.queries)
+    queries = normalized(centers[query_files]
+                         + noise_scale * rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+    truth = np.argpartition(-(queries @ vectors.T), args.k, axis=1)[:, :args.k]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        start = time.perf_counter()
+        service = build_service(work_dir, vectors, file_of_chunk, queries, args.search_ef)
+        print(f"📊 {len(vectors)} chunks in {args.files} files x {args.dim} dims, {args.queries} queries, "
+              f"k={args.k}, search_ef={args.search_ef} (load {time.perf_counter() - start:.1f}s)")
+        print(f"   {'search':<16} | {'recall@k':>8} | {'file hit':>8} | {'query ms':>8}")
+
+        service.two_stage_min_chunks = 0
+        for top_files in [0] + args.top_files:
+            service.two_stage_top_files = top_files
+            recall, file_hit, query_ms = evaluate(service, queries, query_files, truth, args.k)
+            label = f"two-stage N={top_files}" if top_files else "flat"
+            file_hit = f"{file_hit:8.2f}" if file_hit is not None else f"{'-':>8}"
+            print(f"   {label:<16} | {recall:8.3f} | {file_hit} | {query_ms:8.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
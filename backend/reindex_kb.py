@@ -0,0 +1,50 @@
+"""
+Re-index knowledge base từ text đã lưu ({file_id}_text.txt) với tham số chia chunk mới
+
+Không cần parse lại PDF: chunks và vectors của từng file được dựng lại rồi swap vào
+collection (search vẫn dùng chunks cũ cho tới khi file xong).
+
+Cách chạy (từ thư mục backend, khi API server không chạy - ChromaDB chỉ hỗ trợ 1 process;
+khi server đang chạy dùng POST /api/knowledge-base/reindex):
+    python reindex_kb.py --chunk-size 800 --overlap 100
+    python reindex_kb.py --file-id <file_id> --file-id <file_id> --workers 4
+"""
+
+import argparse
+import sys
+
+from services.knowledge_base_service import KnowledgeBaseService
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file-id', action='append', dest='file_ids',
+                        help='File cần re-index (lặp lại cho nhiều file, bỏ trống = toàn bộ knowledge base)')
+    parser.add_argument('--chunk-size', type=int, help='Kích thước chunk mới (mặc định KB_CHUNK_SIZE)')
+    parser.add_argument('--overlap', type=int, help='Số ký tự overlap mới (mặc định KB_CHUNK_OVERLAP)')
+    parser.add_argument('--workers', type=int, help='Số file re-index song song (mặc định KB_REINDEX_WORKERS)')
+    parser.add_argument('--upload-folder', default='uploads', help='Thư mục uploads')
+    parser.add_argument('--chroma-db-path', default='./chroma_db', help='Đường dẫn ChromaDB')
+    args = parser.parse_args()
+
+    service = KnowledgeBaseService(upload_folder=args.upload_folder, chroma_db_path=args.chroma_db_path)
+    success, summary, error_message = service.reindex_files(
+        file_ids=args.file_ids, chunk_size=args.chunk_size, overlap=args.overlap, workers=args.workers
+    )
+    if not success:
+        print(f"❌ {error_message}")
+        return 2
+
+    for result in summary["results"]:
+        if result["success"]:
+            print(f"  ✅ {result['file_id']}: {result['chunks_before']} -> {result['vector_chunks_count']} chunks "
+                  f"({result['vector_chunks_stored']} embedded, {result['seconds']}s)")
+        else:
+            print(f"  ❌ {result['file_id']}: {result['error']}")
+    print(f"🔁 Re-indexed {summary['files_reindexed']}/{summary['files_total']} files "
+          f"(chunk_size={summary['chunk_size']}, overlap={summary['chunk_overlap']}) in {summary['seconds']}s")
+    return 1 if summary["files_failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
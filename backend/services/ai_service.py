@@ -6,13 +6,17 @@ Class này chứa:
 - Token estimation và calculation
 - Chat với AI Assistant
 - Function calling capabilities
+- Hủy request đang chạy (đóng stream Azure OpenAI) khi client ngắt kết nối
 """
 
 import os
+from types import SimpleNamespace
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 import json
 
+from services.cancellation_service import RequestCancelled, current_cancel_token
+
 # Load environment variables
 load_dotenv()
 
@@ -68,6 +72,19 @@ class AIService:
         # Điều này giúp ước tính chi phí và không vượt quá giới hạn API
         return len(text) // 3
     
+    def estimate_tokens_saved(self, max_tokens, generated_text):
+        """
+        Ước tính số tokens không phải generate khi request bị dừng giữa chừng
+        
+        Args:
+            max_tokens (int): Giới hạn max_tokens của request
+            generated_text (str): Phần text đã generate trước khi dừng
+            
+        Returns:
+            int: max_tokens trừ số tokens đã generate (không âm)
+        """
+        return max(0, max_tokens - self._estimate_tokens(generated_text))
+    
     def _calculate_max_tokens(self, estimated_input_tokens, is_quick_action=False):
         """
         Tính toán max_tokens phù hợp để tối ưu chi phí và chất lượng output
@@ -188,9 +205,9 @@ class AIService:
             }
         ]
     
-    def chat_with_ai(self, message, history=None, is_quick_action=False):
+    def _build_context_messages(self, message, history=None, is_quick_action=False):
         """
-        Giao tiếp với AI Assistant thông qua Azure OpenAI
+        Tạo danh sách messages gửi cho Azure OpenAI (system prompt + history + message)
         
         Args:
             message (str): Tin nhắn từ user
@@ -198,24 +215,17 @@ class AIService:
             is_quick_action (bool): True nếu là quick action
             
         Returns:
-            dict: Response từ AI hoặc error message
+            list: Context messages theo format OpenAI
         """
-        if not self.client:
-            return {
-                "success": False,
-                "error": "AI service not available"
-            }
+        # Bước 1: Tạo context messages dựa trên loại request
+        context_messages = []
         
-        try:
-            # Bước 1: Tạo context messages dựa trên loại request
-            context_messages = []
-            
-            # Chọn system message phù hợp với từng mode
-            if is_quick_action:
-                # System message cho quick actions - chỉ trả về code thuần túy
-                context_messages.append({
-                    "role": "system",
-                    "content": """Bạn là một AI Assistant chuyên về lập trình. Khi nhận được yêu cầu từ Quick Action:
+        # Chọn system message phù hợp với từng mode
+        if is_quick_action:
+            # System message cho quick actions - chỉ trả về code thuần túy
+            context_messages.append({
+                "role": "system",
+                "content": """Bạn là một AI Assistant chuyên về lập trình. Khi nhận được yêu cầu từ Quick Action:
 
 QUAN TRỌNG: CHỈ TRẢ VỀ CODE ĐÃ XỬ LÝ, KHÔNG GIẢI THÍCH THÊM!
 
@@ -234,12 +244,12 @@ Format trả về:
 
 Ví dụ Input: "Hãy thêm comment chi tiết vào code này: [code]"
 Ví dụ Output: [code đã được comment, không có gì khác]"""
-                })
-            else:
-                # System message cho chat thường - trả lời đầy đủ với giải thích
-                context_messages.append({
-                    "role": "system",
-                    "content": """Bạn là một AI Assistant thông minh và hữu ích, chuyên về lập trình và công nghệ. 
+            })
+        else:
+            # System message cho chat thường - trả lời đầy đủ với giải thích
+            context_messages.append({
+                "role": "system",
+                "content": """Bạn là một AI Assistant thông minh và hữu ích, chuyên về lập trình và công nghệ. 
                     
 Nhiệm vụ của bạn:
 - Trả lời câu hỏi về lập trình, debug code, giải thích thuật toán
@@ -286,28 +296,111 @@ def add_numbers(a, b):
 ```
 
 Code này thực hiện phép cộng đơn giản."""
-                })
+            })
 
-            # Bước 2: Thêm lịch sử chat để maintain context (chỉ cho normal chat)
-            if not is_quick_action and history:
-                recent_history = history[-5:] if len(history) > 5 else history  # Chỉ lấy 5 tin nhắn gần nhất
-                for msg in recent_history:
-                    if msg.get('type') == 'user':
-                        context_messages.append({
-                            "role": "user", 
-                            "content": msg.get('content', '')
-                        })
-                    elif msg.get('type') == 'bot':
-                        context_messages.append({
-                            "role": "assistant", 
-                            "content": msg.get('content', '')
-                        })
+        # Bước 2: Thêm lịch sử chat để maintain context (chỉ cho normal chat)
+        if not is_quick_action and history:
+            recent_history = history[-5:] if len(history) > 5 else history  # Chỉ lấy 5 tin nhắn gần nhất
+            for msg in recent_history:
+                if msg.get('type') == 'user':
+                    context_messages.append({
+                        "role": "user", 
+                        "content": msg.get('content', '')
+                    })
+                elif msg.get('type') == 'bot':
+                    context_messages.append({
+                        "role": "assistant", 
+                        "content": msg.get('content', '')
+                    })
+        
+        # Thêm tin nhắn hiện tại vào context
+        context_messages.append({
+            "role": "user",
+            "content": message
+        })
+        
+        return context_messages
+    
+    def _create_completion(self, cancel_token=None, **params):
+        """
+        Gọi Azure OpenAI chat completion, có thể hủy giữa chừng
+        
+        Không có cancel_token: gọi non-streaming như bình thường.
+        Có cancel_token: gọi với stream=True và kiểm tra token sau mỗi chunk,
+        khi bị hủy thì đóng stream (đóng HTTP connection) để Azure dừng generate.
+        
+        Args:
+            cancel_token: CancellationToken của request (optional)
+            **params: Tham số cho chat.completions.create
             
-            # Thêm tin nhắn hiện tại vào context
-            context_messages.append({
-                "role": "user",
-                "content": message
-            })
+        Returns:
+            object: Message có thuộc tính content và function_call
+            
+        Raises:
+            RequestCancelled: Khi token bị hủy trước hoặc trong lúc generate
+        """
+        if cancel_token is None:
+            response = self.client.chat.completions.create(**params)
+            return response.choices[0].message
+        
+        max_tokens = params.get("max_tokens", 0)
+        if cancel_token.is_cancelled:
+            raise RequestCancelled(cancel_token.reason, tokens_saved=max_tokens)
+        
+        content_parts = []
+        function_name = None
+        function_args = []
+        
+        stream = self.client.chat.completions.create(stream=True, **params)
+        try:
+            for chunk in stream:
+                if cancel_token.is_cancelled:
+                    generated_text = "".join(content_parts) + "".join(function_args)
+                    raise RequestCancelled(cancel_token.reason,
+                                           tokens_saved=self.estimate_tokens_saved(max_tokens, generated_text))
+                
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                if getattr(delta, "function_call", None):
+                    if delta.function_call.name:
+                        function_name = delta.function_call.name
+                    if delta.function_call.arguments:
+                        function_args.append(delta.function_call.arguments)
+        finally:
+            stream.close()
+        
+        function_call = None
+        if function_name:
+            function_call = SimpleNamespace(name=function_name, arguments="".join(function_args))
+        return SimpleNamespace(content="".join(content_parts), function_call=function_call)
+    
+    def chat_with_ai(self, message, history=None, is_quick_action=False, cancel_token=None):
+        """
+        Giao tiếp với AI Assistant thông qua Azure OpenAI
+        
+        Args:
+            message (str): Tin nhắn từ user
+            history (list): Lịch sử chat để maintain context
+            is_quick_action (bool): True nếu là quick action
+            cancel_token: CancellationToken để hủy request (mặc định: token của request hiện tại)
+            
+        Returns:
+            dict: Response từ AI hoặc error message
+        """
+        if not self.client:
+            return {
+                "success": False,
+                "error": "AI service not available"
+            }
+        
+        cancel_token = cancel_token or current_cancel_token()
+        
+        try:
+            # Bước 1-2: Tạo context messages (system prompt + lịch sử chat + tin nhắn hiện tại)
+            context_messages = self._build_context_messages(message, history, is_quick_action)
             
             # Bước 3: Tính toán tokens và parameters
             total_input = ' '.join([msg['content'] for msg in context_messages])
@@ -323,7 +416,8 @@ Code này thực hiện phép cộng đơn giản."""
             
             # Gọi OpenAI API với function calling enabled
             # AI sẽ phân tích request và tự quyết định có cần gọi function hay không
-            response = self.client.chat.completions.create(
+            response_message = self._create_completion(
+                cancel_token,
                 model=self.deployment_name,           # GPT-4o-mini deployment model
                 messages=context_messages,            # Context messages đã build với system prompt và history
                 max_tokens=max_tokens,                # Max tokens đã tính toán động dựa trên input
@@ -334,8 +428,6 @@ Code này thực hiện phép cộng đơn giản."""
             )
             
             # Bước 5: Xử lý response - kiểm tra AI có gọi function hay không
-            response_message = response.choices[0].message
-            
             # Kiểm tra xem AI có muốn gọi function không
             if response_message.function_call:
                 # === FUNCTION CALLING WORKFLOW ===
@@ -368,11 +460,12 @@ Code này thực hiện phép cộng đơn giản."""
                     # Đây là pattern chuẩn của OpenAI function calling: gọi 2 lần
                     # Lần 1: AI quyết định gọi function
                     # Lần 2: AI nhận function result và generate final response
-                    final_response = self.client.chat.completions.create(
+                    final_message = self._create_completion(
+                        cancel_token,
                         model=self.deployment_name,
                         messages=context_messages + [
                             # Thêm function call message của AI
-                            {"role": "assistant", "content": None, "function_call": response_message.function_call},
+                            {"role": "assistant", "content": None, "function_call": {"name": function_name, "arguments": function_args}},
                             # Thêm function result message
                             {"role": "function", "name": function_name, "content": function_result}
                         ],
@@ -380,7 +473,7 @@ Code này thực hiện phép cộng đơn giản."""
                         temperature=temperature,
                         top_p=0.9
                     )
-                    ai_response = final_response.choices[0].message.content.strip()
+                    ai_response = final_message.content.strip()
                     
                 except json.JSONDecodeError:
                     ai_response = "Error processing function call"
@@ -414,11 +507,85 @@ Code này thực hiện phép cộng đơn giản."""
                 }
             }
             
+        except RequestCancelled as e:
+            return {
+                "success": False,
+                "cancelled": True,
+                "cancel_reason": e.reason,
+                "tokens_saved": e.tokens_saved,
+                "error": f"Request cancelled: {e.reason}"
+            }
+            
         except Exception as e:
             return {
                 "success": False,
                 "error": f"Error processing chat: {str(e)}"
             }
+    
+    def stream_chat_with_ai(self, message, history=None, is_quick_action=False, cancel_token=None):
+        """
+        Chat với AI Assistant dạng streaming (không dùng function calling)
+        
+        Args:
+            message (str): Tin nhắn từ user
+            history (list): Lịch sử chat để maintain context
+            is_quick_action (bool): True nếu là quick action
+            cancel_token: CancellationToken để hủy stream
+            
+        Yields:
+            dict: {"type": "start", "max_tokens": ...} trước khi gọi Azure,
+                  {"type": "delta", "content": ...} cho từng phần text,
+                  cuối cùng là {"type": "done", "tokens_info": ...}
+            
+        Raises:
+            RequestCancelled: Khi token bị hủy (stream Azure đã được đóng)
+        """
+        if not self.client:
+            raise RuntimeError("AI service not available")
+        
+        context_messages = self._build_context_messages(message, history, is_quick_action)
+        total_input = ' '.join([msg['content'] for msg in context_messages])
+        estimated_input_tokens = self._estimate_tokens(total_input)
+        max_tokens = self._calculate_max_tokens(estimated_input_tokens, is_quick_action)
+        
+        yield {"type": "start", "max_tokens": max_tokens, "estimated_input_tokens": estimated_input_tokens}
+        
+        if cancel_token is not None and cancel_token.is_cancelled:
+            raise RequestCancelled(cancel_token.reason, tokens_saved=max_tokens)
+        
+        generated = []
+        stream = self.client.chat.completions.create(
+            model=self.deployment_name,
+            messages=context_messages,
+            max_tokens=max_tokens,
+            temperature=0.1 if is_quick_action else 0.7,
+            top_p=0.9,
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                if cancel_token is not None and cancel_token.is_cancelled:
+                    raise RequestCancelled(cancel_token.reason,
+                                           tokens_saved=self.estimate_tokens_saved(max_tokens, "".join(generated)))
+                
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                
+                content = chunk.choices[0].delta.content
+                generated.append(content)
+                yield {"type": "delta", "content": content}
+        finally:
+            # Đóng stream khi xong, khi bị hủy hoặc khi generator bị close (client ngắt kết nối)
+            stream.close()
+        
+        yield {
+            "type": "done",
+            "tokens_info": {
+                "estimated_input_tokens": estimated_input_tokens,
+                "max_tokens_used": max_tokens,
+                "estimated_output_tokens": self._estimate_tokens("".join(generated))
+            }
+        }
 
     # =========================================
     # END OF AI SERVICE - ONLY SINGLE CHAT SUPPORT
@@ -0,0 +1,154 @@
+"""
+Bulk Upload - Đọc danh sách file của 1 lần upload nhiều file vào knowledge base
+
+Module này chứa:
+- parse_manifest: Đọc manifest JSON (tên file -> title/description)
+- scan_archive: Liệt kê file PDF, manifest và các mục bị bỏ qua trong archive zip
+- iter_archive_uploads / iter_form_uploads: Lần lượt từng file dưới dạng BulkUpload
+
+File trong archive được đọc dạng stream trực tiếp từ zip (ZipFile.open), không giải nén
+toàn bộ archive vào bộ nhớ; kích thước giải nén vẫn bị chặn khi ghi xuống disk.
+"""
+
+import json
+import os
+import posixpath
+from collections import namedtuple
+
+from werkzeug.datastructures import FileStorage
+
+MANIFEST_FILENAME = "manifest.json"
+
+# 1 file cần xử lý: file_size là kích thước đã biết trước (zip), None nếu phải đo từ stream
+BulkUpload = namedtuple("BulkUpload", ["filename", "file", "title", "description", "file_size"])
+
+
+def parse_manifest(data):
+    """
+    Đọc manifest gán title/description cho từng file
+
+    Hỗ trợ 2 dạng:
+    - list: [{"filename": "a.pdf", "title": "...", "description": "..."}]
+    - dict: {"a.pdf": {"title": "...", "description": "..."}} hoặc {"a.pdf": "title"}
+
+    Args:
+        data: Nội dung manifest (str/bytes JSON) hoặc None
+
+    Returns:
+        tuple: (manifest, error_message) - manifest là dict tên file -> {"title", "description"}
+    """
+    if not data:
+        return {}, None
+    try:
+        entries = json.loads(data)
+    except (ValueError, UnicodeDecodeError) as e:
+        return None, f"Manifest is not valid JSON: {str(e)}"
+
+    if isinstance(entries, dict):
+        entries = [
+            dict(value, filename=name) if isinstance(value, dict) else {"filename": name, "title": value}
+            for name, value in entries.items()
+        ]
+    if not isinstance(entries, list):
+        return None, "Manifest must be a JSON list or object"
+
+    manifest = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("filename"):
+            return None, "Each manifest entry needs a filename"
+        manifest[str(entry["filename"])] = {
+            "title": str(entry.get("title") or "").strip(),
+            "description": str(entry.get("description") or "")
+        }
+    return manifest, None
+
+
+def _manifest_entry(manifest, path):
+    """Tìm entry theo đường dẫn đầy đủ trong archive, sau đó theo tên file"""
+    return manifest.get(path) or manifest.get(posixpath.basename(path)) or {}
+
+
+def _default_title(filename):
+    return os.path.splitext(filename)[0]
+
+
+def scan_archive(zip_file, allowed_extensions):
+    """
+    Phân loại các mục trong archive zip
+
+    Args:
+        zip_file: zipfile.ZipFile đã mở
+        allowed_extensions: Đuôi file được phép (ví dụ {'pdf'})
+
+    Returns:
+        tuple: (members, manifest_info, skipped)
+            members: ZipInfo của các file được phép, theo thứ tự trong archive
+            manifest_info: ZipInfo của manifest.json ở gốc archive (None nếu không có)
+            skipped: list {"filename", "reason"} của các file bị bỏ qua
+    """
+    members, skipped = [], []
+    manifest_info = None
+    for info in zip_file.infolist():
+        name = info.filename
+        basename = posixpath.basename(name)
+        if info.is_dir() or not basename:
+            continue
+        # File hệ thống do macOS/Finder thêm vào khi nén
+        if name.startswith("__MACOSX/") or basename.startswith("."):
+            continue
+        if name == MANIFEST_FILENAME:
+            manifest_info = info
+        elif '.' not in basename or basename.rsplit('.', 1)[1].lower() not in allowed_extensions:
+            skipped.append({"filename": name, "reason": "File type not allowed"})
+        elif info.flag_bits & 0x1:
+            skipped.append({"filename": name, "reason": "Encrypted archive member"})
+        else:
+            members.append(info)
+    return members, manifest_info, skipped
+
+
+def iter_archive_uploads(zip_file, members, manifest):
+    """
+    Lần lượt từng file PDF trong archive, stream đọc trực tiếp từ zip
+
+    Args:
+        zip_file: zipfile.ZipFile đã mở
+        members: ZipInfo trả về từ scan_archive
+        manifest: Dict từ parse_manifest
+
+    Yields:
+        BulkUpload: File cần lưu (title mặc định là tên file nếu manifest không có)
+    """
+    for info in members:
+        filename = posixpath.basename(info.filename)
+        entry = _manifest_entry(manifest, info.filename)
+        yield BulkUpload(
+            filename=info.filename,
+            file=FileStorage(stream=zip_file.open(info), filename=filename),
+            title=entry.get("title") or _default_title(filename),
+            description=entry.get("description", ""),
+            file_size=info.file_size
+        )
+
+
+def iter_form_uploads(files, manifest):
+    """
+    Lần lượt từng file của multipart request
+
+    Args:
+        files: List FileStorage (request.files.getlist)
+        manifest: Dict từ parse_manifest
+
+    Yields:
+        BulkUpload: File cần lưu (title mặc định là tên file nếu manifest không có)
+    """
+    for file in files:
+        filename = file.filename or ""
+        entry = _manifest_entry(manifest, filename)
+        yield BulkUpload(
+            filename=filename,
+            file=file,
+            title=entry.get("title") or _default_title(filename),
+            description=entry.get("description", ""),
+            file_size=None
+        )
@@ -0,0 +1,221 @@
+"""
+Cancellation Service - Hủy request AI khi client ngắt kết nối hoặc yêu cầu hủy
+
+Service này chứa:
+- CancellationToken: Cờ hủy dùng chung giữa endpoint, retrieval và AI service
+- CancellationRegistry: Quản lý token theo request_id, thống kê số lần hủy và tokens tiết kiệm
+- Phát hiện client ngắt kết nối bằng cách peek socket của request
+- Chạy công việc dài trong worker thread và hủy ngay khi client rời đi
+"""
+
+import contextvars
+import select
+import socket
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+# Token của request hiện tại - AIService/KnowledgeBaseService đọc token này
+# khi caller không truyền cancel_token tường minh
+_current_token = contextvars.ContextVar("cancel_token", default=None)
+
+
+class RequestCancelled(Exception):
+    """
+    Exception khi request bị hủy giữa chừng
+
+    Attributes:
+        reason: Lý do hủy (client_disconnected, cancelled_by_client, superseded)
+        tokens_saved: Số tokens ước tính đã tiết kiệm nhờ dừng sớm
+    """
+
+    def __init__(self, reason="cancelled", tokens_saved=0):
+        super().__init__(f"Request cancelled: {reason}")
+        self.reason = reason
+        self.tokens_saved = tokens_saved
+
+
+class CancellationToken:
+    """
+    Cờ hủy thread-safe cho một request
+    """
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or str(uuid.uuid4())
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason="cancelled"):
+        """Đánh dấu request bị hủy (chỉ ghi nhận lý do đầu tiên)"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """Chờ đến khi token bị hủy hoặc hết timeout"""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        """Raise RequestCancelled nếu token đã bị hủy"""
+        if self._event.is_set():
+            raise RequestCancelled(self.reason)
+
+
+def current_cancel_token():
+    """Lấy cancellation token của request đang xử lý (hoặc None)"""
+    return _current_token.get()
+
+
+def raise_if_cancelled():
+    """Kiểm tra token của request hiện tại - dùng giữa các bước xử lý dài"""
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def is_client_disconnected(environ):
+    """
+    Kiểm tra client đã đóng kết nối hay chưa
+
+    Peek 1 byte trên socket của request: socket readable nhưng recv trả về b''
+    nghĩa là client đã gửi FIN. Không xác định được socket (ví dụ SSL termination
+    trong process) thì coi như client vẫn kết nối.
+
+    Args:
+        environ: WSGI environ của request
+
+    Returns:
+        bool: True nếu client đã ngắt kết nối
+    """
+    sock = environ.get("werkzeug.socket") or environ.get("gunicorn.socket")
+    if sock is None:
+        return False
+
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except (OSError, ValueError):
+        return True
+
+
+class CancellationRegistry:
+    """
+    Quản lý cancellation token theo request_id và thống kê việc hủy
+    """
+
+    def __init__(self, poll_interval=0.5):
+        """
+        Args:
+            poll_interval: Chu kỳ (giây) kiểm tra client còn kết nối hay không
+        """
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._stats = Counter()
+        self._reasons = Counter()
+
+    def register(self, request_id=None):
+        """
+        Tạo token mới cho request
+
+        Args:
+            request_id: ID do client cung cấp (tự sinh nếu không có)
+
+        Returns:
+            CancellationToken: Token của request
+        """
+        token = CancellationToken(request_id)
+        with self._lock:
+            # Client gửi lại cùng request_id -> hủy request cũ đang chạy
+            previous = self._tokens.get(token.request_id)
+            if previous is not None:
+                previous.cancel("superseded")
+            self._tokens[token.request_id] = token
+            self._stats["registered"] += 1
+        return token
+
+    def unregister(self, token):
+        """Xóa token khi request kết thúc"""
+        with self._lock:
+            if self._tokens.get(token.request_id) is token:
+                del self._tokens[token.request_id]
+
+    def cancel(self, request_id, reason="cancelled_by_client"):
+        """
+        Hủy request đang chạy theo request_id
+
+        Returns:
+            bool: True nếu tìm thấy request đang chạy
+        """
+        with self._lock:
+            token = self._tokens.get(request_id)
+        if token is None:
+            return False
+        token.cancel(reason)
+        return True
+
+    def record_cancellation(self, reason, tokens_saved=0):
+        """Ghi nhận một request đã dừng sớm và số tokens tiết kiệm được"""
+        with self._lock:
+            self._stats["cancelled"] += 1
+            self._stats["tokens_saved"] += max(0, int(tokens_saved or 0))
+            self._reasons[reason or "cancelled"] += 1
+
+    def run(self, token, environ, func, *args, **kwargs):
+        """
+        Chạy func trong worker thread, hủy token khi client ngắt kết nối
+
+        Thread gọi (thread của WSGI request) chỉ poll socket; func chạy ở worker
+        với token được gắn vào context để AI service và retrieval tự kiểm tra.
+
+        Args:
+            token: CancellationToken của request
+            environ: WSGI environ để kiểm tra kết nối
+            func: Hàm cần chạy
+
+        Returns:
+            Kết quả của func (exception của func được raise lại)
+        """
+        future = Future()
+        context = contextvars.copy_context()
+
+        def worker():
+            context.run(_current_token.set, token)
+            try:
+                future.set_result(context.run(func, *args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        thread = threading.Thread(target=worker, name=f"request-{token.request_id[:8]}", daemon=True)
+        thread.start()
+
+        while True:
+            try:
+                return future.result(timeout=self.poll_interval)
+            except FutureTimeoutError:
+                if not token.is_cancelled and is_client_disconnected(environ):
+                    print(f"🔌 Client disconnected, cancelling request {token.request_id}")
+                    token.cancel("client_disconnected")
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Số request đang chạy, số lần hủy theo lý do, tokens tiết kiệm
+        """
+        with self._lock:
+            return {
+                "active_requests": len(self._tokens),
+                "registered": self._stats["registered"],
+                "cancelled": self._stats["cancelled"],
+                "cancelled_by_reason": dict(self._reasons),
+                "estimated_tokens_saved": self._stats["tokens_saved"]
+            }
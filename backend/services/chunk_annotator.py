@@ -0,0 +1,147 @@
+"""
+Chunk Annotator - Chuẩn hóa và phân tích chunk trong 1 lần xử lý
+
+Module này chứa:
+- normalize_text: Chuẩn hóa text để so khớp (chữ thường, bỏ dấu câu, gộp khoảng trắng),
+  cho kết quả giống KnowledgeBaseService._normalize_vietnamese_text trước đây
+- detect_language: 'vi' / 'en' / 'mixed' / 'unknown' theo tỉ lệ ký tự tiếng Việt
+- annotate: Tính cùng lúc dạng chuẩn hóa, tỉ lệ tiếng Việt, ngôn ngữ, số token và content hash
+  (dùng chung cho ingestion và tìm kiếm)
+- fold_diacritics: Bỏ dấu tiếng Việt ("tiêu chuẩn" -> "tieu chuan") để so khớp câu hỏi gõ không dấu
+
+Thay cho vòng lặp Python từng ký tự và 2 lượt regex: 1 lượt regex \\w+ đã biên dịch tách từ
+(dạng chuẩn hóa là các từ nối bằng dấu cách), ký tự tiếng Việt đếm bằng 1 regex lớp ký tự trên
+các từ. Bảng str.translate cho toàn bộ Unicode chậm hơn regex (tra dict cho từng ký tự) nên không dùng.
+Bỏ dấu dùng str.translate với bảng dựng sẵn dạng list theo code point (tra index thay vì hash, nhanh
+gấp ~3 lần dict), text ASCII được trả về ngay.
+"""
+
+import hashlib
+import re
+import unicodedata
+from collections import namedtuple
+
+# Các ký tự đặc trưng tiếng Việt (chữ thường)
+VIETNAMESE_CHARS = 'àáảãạăắằẳẵặâấầẩẫậèéẻẽẹêếềểễệìíỉĩịòóỏõọôốồổỗộơớờởỡợùúủũụưứừửữựỳýỷỹỵđ'
+
+# Text ngắn hơn (sau khi bỏ khoảng trắng đầu/cuối) không đủ để đoán ngôn ngữ
+MIN_LANGUAGE_LENGTH = 10
+
+# Ngưỡng tỉ lệ ký tự tiếng Việt / tổng số chữ cái
+VIETNAMESE_RATIO = 0.05
+MIXED_RATIO = 0.01
+
+ChunkAnnotation = namedtuple(
+    "ChunkAnnotation", ["normalized", "language", "vietnamese_ratio", "token_count", "content_hash"]
+)
+
+
+# Từ = chuỗi liên tiếp các ký tự \w: giống regex cũ thay [^\w\s] bằng dấu cách rồi gộp khoảng trắng
+_WORD_PATTERN = re.compile(r'\w+')
+_VIETNAMESE_PATTERN = re.compile('[' + VIETNAMESE_CHARS + ']')
+
+
+def _build_fold_table():
+    """Bảng str.translate: phần tử thứ i là ký tự thay cho code point i (code point lớn hơn giữ nguyên)"""
+    accented = VIETNAMESE_CHARS + VIETNAMESE_CHARS.upper()
+    table = [chr(code) for code in range(max(map(ord, accented)) + 1)]
+    for char in accented:
+        # đ/Đ không tách được bằng NFD
+        table[ord(char)] = {'đ': 'd', 'Đ': 'D'}.get(char) or unicodedata.normalize('NFD', char)[0]
+    return table
+
+
+_FOLD_TABLE = _build_fold_table()
+
+
+def _count_letters(words):
+    """Số chữ cái (str.isalpha) trong các từ; chỉ từ có chữ số / _ mới phải xét từng ký tự"""
+    return sum(len(word) if word.isalpha() else sum(map(str.isalpha, word)) for word in words)
+
+
+def _language_of(text, words):
+    """Ngôn ngữ và tỉ lệ ký tự tiếng Việt từ các từ (đã chữ thường) của text"""
+    letters = _count_letters(words)
+    if len(text.strip()) < MIN_LANGUAGE_LENGTH or not letters:
+        return 'unknown', 0.0
+
+    vietnamese_ratio = len(_VIETNAMESE_PATTERN.findall("".join(words))) / letters
+    if vietnamese_ratio > VIETNAMESE_RATIO:
+        return 'vi', vietnamese_ratio
+    if vietnamese_ratio > MIXED_RATIO:
+        return 'mixed', vietnamese_ratio
+    return 'en', vietnamese_ratio
+
+
+def normalize_text(text):
+    """
+    Chuẩn hóa text để tìm kiếm: chữ thường, dấu câu thành dấu cách, gộp khoảng trắng
+
+    Args:
+        text: Text cần chuẩn hóa
+
+    Returns:
+        str: Text đã chuẩn hóa (text rỗng/None được trả về nguyên vẹn)
+    """
+    if not text:
+        return text
+    return " ".join(_WORD_PATTERN.findall(text.lower()))
+
+
+def fold_diacritics(text):
+    """
+    Bỏ dấu tiếng Việt, giữ nguyên độ dài và các ký tự khác (từ thứ i của kết quả ứng với từ thứ i của text)
+
+    Args:
+        text: Text cần bỏ dấu
+
+    Returns:
+        str: Text không dấu (text rỗng/None được trả về nguyên vẹn)
+    """
+    if not text or text.isascii():
+        return text
+    return text.translate(_FOLD_TABLE)
+
+
+def detect_language(text):
+    """
+    Phát hiện ngôn ngữ chính của text
+
+    Returns:
+        str: 'vi' (> 5% chữ cái là ký tự tiếng Việt), 'mixed' (> 1%), 'en', hoặc 'unknown'
+    """
+    if not text:
+        return 'unknown'
+    return _language_of(text, _WORD_PATTERN.findall(text.lower()))[0]
+
+
+def content_hash_of(lowered_words):
+    """SHA-1 của các từ (đã chữ thường, còn dấu câu) nối bằng 1 dấu cách"""
+    return hashlib.sha1(" ".join(lowered_words).encode('utf-8')).hexdigest()
+
+
+def annotate(text):
+    """
+    Phân tích 1 chunk: mọi trường được tính từ cùng 1 bản chữ thường của text
+
+    Args:
+        text: Nội dung chunk
+
+    Returns:
+        ChunkAnnotation:
+            normalized: Giống normalize_text(text)
+            language / vietnamese_ratio: Giống detect_language(text)
+            token_count: Số từ của dạng chuẩn hóa
+            content_hash: Giống chunk_dedup.content_hash(text) (chống trùng chính xác)
+    """
+    text = text or ""
+    lowered = text.lower()
+    words = _WORD_PATTERN.findall(lowered)
+    language, vietnamese_ratio = _language_of(text, words)
+    return ChunkAnnotation(
+        normalized=" ".join(words),
+        language=language,
+        vietnamese_ratio=vietnamese_ratio,
+        token_count=len(words),
+        content_hash=content_hash_of(lowered.split())
+    )
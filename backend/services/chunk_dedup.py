@@ -0,0 +1,366 @@
+"""
+Chunk Dedup - Loại bỏ chunk trùng (chính xác và gần trùng) trước khi embed
+
+Module này chứa:
+- content_hash: Hash SHA-1 của chunk đã chuẩn hóa (chữ thường, gộp khoảng trắng)
+- minhash_signature: Chữ ký MinHash trên shingle 3 từ (numpy, không phụ thuộc PYTHONHASHSEED)
+- ChunkDedupIndex: Index SQLite (hash chính xác + LSH band) của các chunk đã lưu trong ChromaDB
+  và bảng tham chiếu (file_id, chunk_index) -> chunk được lưu thật
+
+Chunk trùng không được embed/lưu lại: file mới chỉ ghi tham chiếu tới chunk đã có,
+ChromaDB đánh dấu chunk đó bằng metadata ref_<file_id> = True để lọc theo file vẫn đúng.
+"""
+
+import threading
+import zlib
+
+import numpy as np
+
+from services.chunk_annotator import content_hash_of
+from services.sqlite_utils import connect_sqlite
+
+# Kiểu khớp của 1 chunk logic với chunk được lưu
+MATCH_STORED = "stored"   # Chunk được lưu mới
+MATCH_EXACT = "exact"     # Trùng chính xác sau chuẩn hóa
+MATCH_NEAR = "near"       # Gần trùng (ước lượng Jaccard >= ngưỡng)
+
+# Tiền tố metadata đánh dấu file tham chiếu tới chunk trong ChromaDB
+REF_KEY_PREFIX = "ref_"
+
+# SQLite giới hạn số tham số mỗi câu lệnh
+_SQL_BATCH = 500
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_SHINGLE_SIZE = 3
+
+
+def ref_key(file_id):
+    """Key metadata ChromaDB đánh dấu file_id tham chiếu tới chunk"""
+    return f"{REF_KEY_PREFIX}{file_id}"
+
+
+def referenced_file_ids(chunk_metadata):
+    """Danh sách file_id tham chiếu tới chunk (ngoài file sở hữu) từ metadata ChromaDB"""
+    return [key[len(REF_KEY_PREFIX):] for key, value in chunk_metadata.items()
+            if key.startswith(REF_KEY_PREFIX) and value]
+
+
+def normalize_chunk(text):
+    """Chuẩn hóa chunk để so sánh: chữ thường, gộp khoảng trắng"""
+    return " ".join(text.lower().split())
+
+
+def content_hash(text):
+    """Hash của chunk đã chuẩn hóa (dùng cho trùng chính xác, giống ChunkAnnotation.content_hash)"""
+    return content_hash_of(text.lower().split())
+
+
+class MinHasher:
+    """
+    Tính chữ ký MinHash với các hoán vị (a*x + b) mod p cố định theo seed
+    """
+
+    def __init__(self, num_perm=64, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+
+    def signature(self, text):
+        """
+        Args:
+            text: Nội dung chunk
+
+        Returns:
+            np.ndarray: Chữ ký uint32 độ dài num_perm
+        """
+        words = normalize_chunk(text).split()
+        if len(words) > _SHINGLE_SIZE:
+            shingles = {" ".join(words[i:i + _SHINGLE_SIZE]) for i in range(len(words) - _SHINGLE_SIZE + 1)}
+        else:
+            shingles = {" ".join(words)}
+
+        # crc32 thay cho hash() để chữ ký giống nhau giữa các process
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                             dtype=np.int64, count=len(shingles)) % _MERSENNE_PRIME
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _MERSENNE_PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+
+class ChunkDedupIndex:
+    """
+    Index các chunk đã lưu để phát hiện chunk trùng trước khi embed
+    """
+
+    def __init__(self, db_path, num_perm=64, bands=16, near_threshold=0.9):
+        """
+        Args:
+            db_path: Đường dẫn file SQLite
+            num_perm: Số hoán vị MinHash
+            bands: Số band LSH (num_perm / bands dòng mỗi band)
+            near_threshold: Ngưỡng Jaccard ước lượng để coi là gần trùng
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.db_path = db_path
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.near_threshold = near_threshold
+        self.minhasher = MinHasher(num_perm)
+
+        self._lock = threading.RLock()
+        self._conn = connect_sqlite(db_path)
+        self._init_schema()
+        self._private_owners = set()  # Chunk của các owner này chỉ khớp với chính owner đó
+
+    def _init_schema(self):
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS stored_chunks (
+                    chunk_id TEXT PRIMARY KEY,
+                    owner_file_id TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    signature BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_stored_chunks_hash ON stored_chunks(content_hash);
+                CREATE INDEX IF NOT EXISTS idx_stored_chunks_owner ON stored_chunks(owner_file_id);
+
+                CREATE TABLE IF NOT EXISTS lsh_buckets (
+                    band INTEGER NOT NULL,
+                    bucket BLOB NOT NULL,
+                    chunk_id TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_lsh_buckets_bucket ON lsh_buckets(band, bucket);
+                CREATE INDEX IF NOT EXISTS idx_lsh_buckets_chunk ON lsh_buckets(chunk_id);
+
+                CREATE TABLE IF NOT EXISTS chunk_refs (
+                    file_id TEXT NOT NULL,
+                    chunk_index INTEGER NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    match TEXT NOT NULL,
+                    PRIMARY KEY (file_id, chunk_index)
+                );
+                CREATE INDEX IF NOT EXISTS idx_chunk_refs_chunk ON chunk_refs(chunk_id);
+            """)
+            self._conn.commit()
+
+    def _band_buckets(self, signature):
+        rows = self.rows_per_band
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+    def set_private_owner(self, owner_id, private=True):
+        """
+        Đánh dấu chunk của owner_id chỉ được khớp bởi chính owner_id
+
+        Dùng cho chunk tạm của re-index: chúng chưa có trong collection knowledge base
+        nên file khác không được ghi tham chiếu tới chúng.
+        """
+        with self._lock:
+            if private:
+                self._private_owners.add(owner_id)
+            else:
+                self._private_owners.discard(owner_id)
+
+    def _is_matchable(self, owner_id, file_id):
+        return owner_id == file_id or owner_id not in self._private_owners
+
+    def _find_near_duplicate(self, signature, file_id):
+        """Tìm chunk đã lưu có chữ ký gần nhất qua LSH, trả về chunk_id nếu vượt ngưỡng"""
+        candidates = set()
+        for band, bucket in self._band_buckets(signature):
+            rows = self._conn.execute(
+                "SELECT chunk_id FROM lsh_buckets WHERE band = ? AND bucket = ?", (band, bucket)
+            ).fetchall()
+            candidates.update(row["chunk_id"] for row in rows)
+
+        best_id, best_similarity = None, 0.0
+        for chunk_id in candidates:
+            row = self._conn.execute(
+                "SELECT signature, owner_file_id FROM stored_chunks WHERE chunk_id = ?", (chunk_id,)
+            ).fetchone()
+            if row is None or not self._is_matchable(row["owner_file_id"], file_id):
+                continue
+            similarity = float(np.mean(np.frombuffer(row["signature"], dtype=np.uint32) == signature))
+            if similarity > best_similarity:
+                best_id, best_similarity = chunk_id, similarity
+
+        return best_id if best_similarity >= self.near_threshold else None
+
+    def match_or_add(self, chunk_id, file_id, chunk_index, text, chunk_hash=None):
+        """
+        Tìm chunk đã lưu trùng với text, nếu không có thì đăng ký chunk_id là chunk mới
+
+        Chưa commit: caller gọi commit() sau khi ghi batch vào ChromaDB.
+
+        Args:
+            chunk_id: ID sẽ dùng nếu chunk được lưu mới
+            file_id: File chứa chunk
+            chunk_index: Vị trí chunk trong file
+            text: Nội dung chunk
+            chunk_hash: content_hash(text) nếu caller đã tính (ChunkAnnotation.content_hash)
+
+        Returns:
+            tuple: (stored_chunk_id, owner_file_id, match) - match là MATCH_STORED nếu cần lưu chunk mới
+        """
+        chunk_hash = chunk_hash or content_hash(text)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id, owner_file_id FROM stored_chunks WHERE content_hash = ?", (chunk_hash,)
+            ).fetchall()
+            row = next((row for row in rows if self._is_matchable(row["owner_file_id"], file_id)), None)
+            match = MATCH_EXACT if row else None
+
+            signature = None
+            if row is None:
+                signature = self.minhasher.signature(text)
+                near_id = self._find_near_duplicate(signature, file_id)
+                if near_id:
+                    row = self._conn.execute(
+                        "SELECT chunk_id, owner_file_id FROM stored_chunks WHERE chunk_id = ?", (near_id,)
+                    ).fetchone()
+                    match = MATCH_NEAR
+
+            if row is not None:
+                stored_id, owner_id = row["chunk_id"], row["owner_file_id"]
+            else:
+                stored_id, owner_id, match = chunk_id, file_id, MATCH_STORED
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO stored_chunks (chunk_id, owner_file_id, content_hash, signature) "
+                    "VALUES (?, ?, ?, ?)",
+                    (chunk_id, file_id, chunk_hash, signature.tobytes())
+                )
+                self._conn.executemany(
+                    "INSERT INTO lsh_buckets (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                    [(band, bucket, chunk_id) for band, bucket in self._band_buckets(signature)]
+                )
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chunk_refs (file_id, chunk_index, chunk_id, match) VALUES (?, ?, ?, ?)",
+                (file_id, chunk_index, stored_id, match)
+            )
+        return stored_id, owner_id, match
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def register_stored_chunk(self, chunk_id, file_id, chunk_index, text):
+        """Đăng ký chunk đã có sẵn trong ChromaDB (dựng lại index), không kiểm tra trùng"""
+        signature = self.minhasher.signature(text)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stored_chunks (chunk_id, owner_file_id, content_hash, signature) "
+                "VALUES (?, ?, ?, ?)",
+                (chunk_id, file_id, content_hash(text), signature.tobytes())
+            )
+            self._conn.executemany(
+                "INSERT INTO lsh_buckets (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                [(band, bucket, chunk_id) for band, bucket in self._band_buckets(signature)]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chunk_refs (file_id, chunk_index, chunk_id, match) VALUES (?, ?, ?, ?)",
+                (file_id, chunk_index, chunk_id, MATCH_STORED)
+            )
+
+    def remove_file(self, file_id):
+        """
+        Xóa tham chiếu của file; chunk file sở hữu mà file khác còn tham chiếu được chuyển chủ
+
+        Returns:
+            dict: {"delete": [chunk_id], "transfer": {chunk_id: (new_owner_file_id, chunk_index)}}
+                chunk của file không có trong index (dữ liệu cũ) không xuất hiện trong kết quả
+        """
+        plan = {"delete": [], "transfer": {}}
+        with self._lock:
+            owned = [row["chunk_id"] for row in self._conn.execute(
+                "SELECT chunk_id FROM stored_chunks WHERE owner_file_id = ?", (file_id,)
+            )]
+            self._conn.execute("DELETE FROM chunk_refs WHERE file_id = ?", (file_id,))
+
+            for chunk_id in owned:
+                row = self._conn.execute(
+                    "SELECT file_id, chunk_index FROM chunk_refs WHERE chunk_id = ? "
+                    "ORDER BY rowid LIMIT 1", (chunk_id,)
+                ).fetchone()
+                if row is None:
+                    plan["delete"].append(chunk_id)
+                    self._conn.execute("DELETE FROM stored_chunks WHERE chunk_id = ?", (chunk_id,))
+                    self._conn.execute("DELETE FROM lsh_buckets WHERE chunk_id = ?", (chunk_id,))
+                else:
+                    plan["transfer"][chunk_id] = (row["file_id"], row["chunk_index"])
+                    self._conn.execute(
+                        "UPDATE stored_chunks SET owner_file_id = ? WHERE chunk_id = ?", (row["file_id"], chunk_id)
+                    )
+                    # Với chủ mới, chunk này là chunk được lưu chứ không còn là bản trùng
+                    self._conn.execute(
+                        "UPDATE chunk_refs SET match = ? WHERE file_id = ? AND chunk_index = ?",
+                        (MATCH_STORED, row["file_id"], row["chunk_index"])
+                    )
+            self._conn.commit()
+        return plan
+
+    def rename_file(self, old_file_id, new_file_id):
+        """Đổi file_id trong index (alias nhận quyền sở hữu nội dung của file gốc)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE stored_chunks SET owner_file_id = ? WHERE owner_file_id = ?", (new_file_id, old_file_id)
+            )
+            self._conn.execute("UPDATE chunk_refs SET file_id = ? WHERE file_id = ?", (new_file_id, old_file_id))
+            self._conn.commit()
+
+    def chunk_indexes(self, file_id):
+        """
+        Returns:
+            dict: chunk_id được lưu -> chunk_index đầu tiên của nó trong file
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id, MIN(chunk_index) AS chunk_index FROM chunk_refs WHERE file_id = ? GROUP BY chunk_id",
+                (file_id,)
+            ).fetchall()
+        return {row["chunk_id"]: row["chunk_index"] for row in rows}
+
+    def chunk_ids_for_files(self, file_ids):
+        """
+        Returns:
+            set: chunk_id được lưu mà các file dùng (chunk file sở hữu và chunk dùng chung với file khác)
+        """
+        file_ids = list(file_ids)
+        chunk_ids = set()
+        with self._lock:
+            for start in range(0, len(file_ids), _SQL_BATCH):
+                batch = file_ids[start:start + _SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT chunk_id FROM chunk_refs WHERE file_id IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                chunk_ids.update(row["chunk_id"] for row in rows)
+        return chunk_ids
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM stored_chunks LIMIT 1").fetchone() is None
+
+    def clear(self):
+        """Xóa toàn bộ index (khi reset/clear ChromaDB)"""
+        with self._lock:
+            self._conn.executescript("DELETE FROM stored_chunks; DELETE FROM lsh_buckets; DELETE FROM chunk_refs;")
+            self._conn.commit()
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Số chunk logic (theo file), số chunk lưu thật, số trùng chính xác/gần trùng và tỷ lệ giảm
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT match, COUNT(*) AS total FROM chunk_refs GROUP BY match").fetchall()
+            stored = self._conn.execute("SELECT COUNT(*) FROM stored_chunks").fetchone()[0]
+        by_match = {row["match"]: row["total"] for row in rows}
+        logical = sum(by_match.values())
+        return {
+            "logical_chunks": logical,
+            "stored_chunks": stored,
+            "exact_duplicates": by_match.get(MATCH_EXACT, 0),
+            "near_duplicates": by_match.get(MATCH_NEAR, 0),
+            "index_size_reduction": round(1 - stored / logical, 4) if logical else 0.0
+        }
@@ -0,0 +1,273 @@
+"""
+Document Index - Embedding đại diện cho từng file (centroid của các chunk) để chọn file trước khi tìm chunk
+
+Module này chứa:
+- CentroidAccumulator: Gom embedding các chunk của 1 file trong lúc ghi chunks (mỗi chunk 1 lần)
+- DocumentIndex: Bảng SQLite file_id -> tổng embedding, chunk ID và embedding các chunk của file;
+  ma trận centroid (đã chuẩn hóa) trong bộ nhớ để xếp hạng file theo cosine similarity với câu hỏi
+
+Tìm kiếm 2 bước: bước 1 chọn N file có centroid gần câu hỏi nhất (nhân ma trận trên số file,
+không phải số chunk), bước 2 tính khoảng cách chính xác tới các chunk của N file đó bằng numpy
+(embedding chunk của file được đọc từ SQLite và giữ trong LRU). Bước 2 không dùng filter where
+của ChromaDB vì filter metadata được quét trên toàn bộ chunks: chậm hơn tìm trên toàn bộ HNSW.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from services.sqlite_utils import connect_sqlite
+
+
+def vector_distances(matrix, query, space):
+    """
+    Khoảng cách giống ChromaDB (hnswlib) giữa các vector và câu hỏi
+
+    Args:
+        matrix: Ma trận (số vector x số chiều)
+        query: Vector câu hỏi
+        space: l2 (bình phương khoảng cách Euclid) / cosine (1 - cosine similarity) / ip (1 - tích vô hướng)
+    """
+    if space == "l2":
+        difference = matrix - query
+        return np.einsum("ij,ij->i", difference, difference)
+    if space == "cosine":
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        return 1 - (matrix @ query) / np.where(norms > 0, norms, 1.0)
+    return 1 - matrix @ query
+
+
+class CentroidAccumulator:
+    """
+    Embedding các chunk của 1 file; chunk đã thêm (ví dụ chunk dùng chung xuất hiện lại) được bỏ qua
+
+    Giữ embedding của mọi chunk trong lúc ingest (4 byte mỗi chiều mỗi chunk) vì ma trận được
+    ghi nguyên vào document index khi file ingest xong.
+    """
+
+    def __init__(self):
+        self.chunk_ids = []
+        self.vectors = []
+        self._seen = set()
+
+    @property
+    def count(self):
+        return len(self.chunk_ids)
+
+    def add(self, chunk_ids, vectors):
+        """
+        Args:
+            chunk_ids: List chunk ID
+            vectors: Embedding tương ứng
+        """
+        for chunk_id, vector in zip(chunk_ids, vectors):
+            if chunk_id in self._seen or vector is None:
+                continue
+            self._seen.add(chunk_id)
+            self.chunk_ids.append(chunk_id)
+            self.vectors.append(np.asarray(vector, dtype=np.float32))
+
+
+class DocumentIndex:
+    """
+    Centroid và embedding chunk của các file trong SQLite, an toàn khi dùng từ nhiều thread
+
+    Ma trận centroid trong bộ nhớ được dựng lại khi có file thay đổi, ở lần xếp hạng tiếp theo;
+    embedding chunk chỉ được đọc cho các file được chọn (giữ max_cached_files file gần nhất).
+    """
+
+    def __init__(self, db_path, max_cached_files=256):
+        """
+        Args:
+            db_path: Đường dẫn file SQLite
+            max_cached_files: Số file giữ embedding chunk trong bộ nhớ
+        """
+        self.db_path = db_path
+        self.max_cached_files = max_cached_files
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path)
+        self._init_schema()
+        self._sums, self._counts = {}, {}
+        for row in self._conn.execute("SELECT file_id, vector_sum, chunk_count FROM document_vectors").fetchall():
+            self._sums[row["file_id"]] = np.frombuffer(row["vector_sum"], dtype=np.float32)
+            self._counts[row["file_id"]] = row["chunk_count"]
+        self._file_ids, self._matrix = [], None
+        self._chunk_cache = OrderedDict()  # file_id -> (chunk_ids, ma trận embedding)
+
+    def _init_schema(self):
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS document_vectors (
+                    file_id TEXT PRIMARY KEY,
+                    vector_sum BLOB NOT NULL,
+                    chunk_count INTEGER NOT NULL,
+                    chunk_ids TEXT NOT NULL,
+                    chunk_vectors BLOB NOT NULL
+                )
+            """)
+            self._conn.commit()
+
+    def set_file(self, file_id, accumulator):
+        """
+        Ghi (hoặc thay) centroid và embedding chunk của file từ CentroidAccumulator
+        (file không có chunk nào thì xóa)
+        """
+        if not accumulator.count:
+            self.remove_file(file_id)
+            return
+        vectors = np.vstack(accumulator.vectors).astype(np.float32)
+        vector_sum = vectors.sum(axis=0)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO document_vectors (file_id, vector_sum, chunk_count, chunk_ids, chunk_vectors) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (file_id, vector_sum.tobytes(), accumulator.count, json.dumps(accumulator.chunk_ids), vectors.tobytes())
+            )
+            self._conn.commit()
+            self._sums[file_id], self._counts[file_id] = vector_sum, accumulator.count
+            self._chunk_cache.pop(file_id, None)
+            self._matrix = None
+
+    def remove_file(self, file_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM document_vectors WHERE file_id = ?", (file_id,))
+            self._conn.commit()
+            self._chunk_cache.pop(file_id, None)
+            if self._sums.pop(file_id, None) is not None:
+                self._counts.pop(file_id, None)
+                self._matrix = None
+
+    def rename_file(self, old_file_id, new_file_id):
+        """Chuyển centroid sang file_id mới (file gốc bị xóa, alias trở thành file gốc)"""
+        with self._lock:
+            if old_file_id not in self._sums:
+                return
+            self._conn.execute("DELETE FROM document_vectors WHERE file_id = ?", (new_file_id,))
+            self._conn.execute("UPDATE document_vectors SET file_id = ? WHERE file_id = ?", (new_file_id, old_file_id))
+            self._conn.commit()
+            self._sums[new_file_id] = self._sums.pop(old_file_id)
+            self._counts[new_file_id] = self._counts.pop(old_file_id)
+            self._chunk_cache.pop(old_file_id, None)
+            self._matrix = None
+
+    def clear(self):
+        """Xóa toàn bộ index (khi reset/clear ChromaDB)"""
+        with self._lock:
+            self._conn.execute("DELETE FROM document_vectors")
+            self._conn.commit()
+            self._sums, self._counts = {}, {}
+            self._chunk_cache.clear()
+            self._matrix = None
+
+    def is_empty(self):
+        with self._lock:
+            return not self._sums
+
+    def file_count(self):
+        with self._lock:
+            return len(self._sums)
+
+    def chunk_count(self):
+        """Tổng số chunk của các file (chunk dùng chung được tính cho mỗi file chứa nó)"""
+        with self._lock:
+            return sum(self._counts.values())
+
+    def _centroid_matrix(self):
+        """Ma trận centroid đã chuẩn hóa độ dài 1 (gọi khi đang giữ lock)"""
+        if self._matrix is None:
+            self._file_ids = list(self._sums)
+            if self._file_ids:
+                matrix = np.vstack([self._sums[file_id] for file_id in self._file_ids])
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                self._matrix = matrix / np.where(norms > 0, norms, 1.0)
+            else:
+                self._matrix = np.zeros((0, 0), dtype=np.float32)
+        return self._file_ids, self._matrix
+
+    def top_files(self, query_vector, limit):
+        """
+        Các file có centroid gần câu hỏi nhất
+
+        Args:
+            query_vector: Embedding câu hỏi
+            limit: Số file tối đa
+
+        Returns:
+            list: (file_id, similarity) theo similarity giảm dần (rỗng nếu số chiều khác embedding đã lưu)
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        with self._lock:
+            file_ids, matrix = self._centroid_matrix()
+        if not file_ids or limit <= 0 or matrix.shape[1] != query.shape[0]:
+            return []
+        similarities = matrix @ (query / (np.linalg.norm(query) or 1.0))
+        if limit < len(file_ids):
+            top = np.argpartition(-similarities, limit - 1)[:limit]
+        else:
+            top = np.arange(len(file_ids))
+        top = top[np.argsort(-similarities[top])]
+        return [(file_ids[index], float(similarities[index])) for index in top]
+
+    def _file_chunks(self, file_id):
+        """(chunk_ids, ma trận embedding) của file, đọc từ SQLite nếu chưa có trong LRU (gọi khi đang giữ lock)"""
+        if file_id in self._chunk_cache:
+            self._chunk_cache.move_to_end(file_id)
+            return self._chunk_cache[file_id]
+        row = self._conn.execute(
+            "SELECT chunk_ids, chunk_vectors FROM document_vectors WHERE file_id = ?", (file_id,)
+        ).fetchone()
+        if row is None:
+            return [], None
+        chunk_ids = json.loads(row["chunk_ids"])
+        vectors = np.frombuffer(row["chunk_vectors"], dtype=np.float32).reshape(len(chunk_ids), -1)
+        self._chunk_cache[file_id] = (chunk_ids, vectors)
+        while len(self._chunk_cache) > self.max_cached_files:
+            self._chunk_cache.popitem(last=False)
+        return chunk_ids, vectors
+
+    def search_chunks(self, file_ids, query_vector, limit, space="l2"):
+        """
+        Chunk gần câu hỏi nhất trong các file (khoảng cách chính xác, chunk dùng chung tính 1 lần)
+
+        Args:
+            file_ids: Danh sách file_id (bước 1)
+            query_vector: Embedding câu hỏi
+            limit: Số chunk tối đa
+            space: Hàm khoảng cách của collection (l2 / cosine / ip)
+
+        Returns:
+            list: (chunk_id, distance) theo distance tăng dần
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        chunk_ids, matrices = [], []
+        with self._lock:
+            for file_id in file_ids:
+                ids, vectors = self._file_chunks(file_id)
+                if ids and vectors.shape[1] == query.shape[0]:
+                    chunk_ids.extend(ids)
+                    matrices.append(vectors)
+        if not chunk_ids or limit <= 0:
+            return []
+        distances = vector_distances(np.vstack(matrices), query, space)
+        ranked, seen = [], set()
+        for index in np.argsort(distances):
+            if chunk_ids[index] not in seen:
+                seen.add(chunk_ids[index])
+                ranked.append((chunk_ids[index], float(distances[index])))
+                if len(ranked) == limit:
+                    break
+        return ranked
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Số file, tổng số chunk trong index và số file đang giữ embedding chunk trong bộ nhớ
+        """
+        with self._lock:
+            return {
+                "files": len(self._sums),
+                "chunks": sum(self._counts.values()),
+                "cached_files": len(self._chunk_cache)
+            }
@@ -0,0 +1,198 @@
+"""
+Document Structure - Chia chunk theo trang và section của tài liệu
+
+Module này chứa:
+- HeadingDetector: Nhận diện heading trong text của trang ("3.1 Tiêu đề", "Chương 2 ...").
+  Heading đánh số phải nối tiếp heading trước (1 -> 1.1 -> 1.2 -> 2) nên dòng code
+  đánh số, mục lục và danh sách trong đoạn văn bị loại.
+- StructuredChunker: Bọc IncrementalChunker, mỗi section có chunker riêng nên chunk không
+  vượt qua heading; mỗi chunk kèm page_start/page_end và đường dẫn section.
+
+PyPDF2 không trả về cỡ chữ, heading chỉ được nhận diện theo dòng text. Ngắt trang không phải
+điểm ngắt bắt buộc (text PDF thường sang trang giữa câu): chunk nằm trên 2 trang có
+page_start < page_end.
+"""
+
+import re
+from bisect import bisect_right
+from collections import namedtuple
+
+CHUNK_STRATEGY_STRUCTURE = "structure"
+CHUNK_STRATEGY_FLAT = "flat"
+CHUNK_STRATEGIES = (CHUNK_STRATEGY_STRUCTURE, CHUNK_STRATEGY_FLAT)
+
+# Ngăn cách các cấp trong đường dẫn section
+SECTION_SEPARATOR = " > "
+
+_NUMBERED_HEADING_RE = re.compile(r'^(\d{1,2}(?:\.\d{1,2}){0,3})\.?\s+(\S.*)$')
+_CHAPTER_HEADING_RE = re.compile(r'^(?:chương|phần|chapter|part)\s+(?:\d+|[ivxlc]+)\b', re.IGNORECASE)
+_DOT_LEADER_RE = re.compile(r'(?:\.\s?){4,}')
+_CODE_CHARS = frozenset('{};=')
+
+MAX_HEADING_LENGTH = 100
+MAX_HEADING_WORDS = 15
+
+# Chunk kèm vị trí trong tài liệu (page_start/page_end = None nếu không biết số trang)
+StructuredChunk = namedtuple("StructuredChunk", ["text", "page_start", "page_end", "section"])
+
+
+def _is_heading_text(text):
+    """Dòng có dạng tiêu đề: ngắn, bắt đầu bằng chữ hoa, không phải code / mục lục / câu văn"""
+    if len(text) > MAX_HEADING_LENGTH or len(text.split()) > MAX_HEADING_WORDS:
+        return False
+    if _DOT_LEADER_RE.search(text) or _CODE_CHARS.intersection(text):
+        return False
+    return text[0].isalpha() and text[0].isupper() and text[-1] not in '.,;:'
+
+
+class HeadingDetector:
+    """
+    Theo dõi heading của tài liệu theo thứ tự đọc
+    """
+
+    def __init__(self):
+        self._chapter = None  # Heading chương ("Chương 2 ...") hiện tại
+        self._number = None   # Số thứ tự của heading đánh số gần nhất, ví dụ (3, 1)
+        self._path = []       # Heading đánh số theo từng cấp
+
+    @property
+    def section(self):
+        """Đường dẫn section hiện tại, ví dụ "3 Quy tắc định dạng > 3.1 Thụt đầu dòng" """
+        return SECTION_SEPARATOR.join(([self._chapter] if self._chapter else []) + self._path)
+
+    def _is_next_number(self, number):
+        """Số heading nối tiếp heading trước: mục con đầu tiên hoặc mục kế tiếp ở 1 cấp nào đó"""
+        if self._number is None:
+            return number[-1] == 1
+        if number == self._number + (1,):
+            return True
+        return any(
+            number == self._number[:level] + (self._number[level] + 1,)
+            for level in range(len(self._number))
+        )
+
+    def match(self, line):
+        """
+        Kiểm tra 1 dòng có phải heading không, nếu có thì cập nhật section hiện tại
+
+        Args:
+            line: Dòng text (đã bỏ khoảng trắng đầu/cuối)
+
+        Returns:
+            bool: True nếu line là heading
+        """
+        if not line:
+            return False
+
+        if _CHAPTER_HEADING_RE.match(line) and len(line) <= MAX_HEADING_LENGTH and not _CODE_CHARS.intersection(line):
+            # Đánh số mục thường bắt đầu lại trong mỗi chương
+            self._chapter = line
+            self._number = None
+            self._path = []
+            return True
+
+        match = _NUMBERED_HEADING_RE.match(line)
+        if not match or not _is_heading_text(match.group(2)):
+            return False
+        number = tuple(int(part) for part in match.group(1).split('.'))
+        if not self._is_next_number(number):
+            return False
+
+        self._number = number
+        self._path = self._path[:len(number) - 1] + [line]
+        return True
+
+
+class StructuredChunker:
+    """
+    Chia chunk theo section (chunk không vượt qua heading) và ghi lại trang của từng chunk
+    """
+
+    def __init__(self, chunker_factory, detect_headings=True):
+        """
+        Args:
+            chunker_factory: Hàm tạo IncrementalChunker(with_offsets=True) mới cho mỗi section
+            detect_headings: Nhận diện heading (False = chỉ ghi lại số trang)
+        """
+        self._chunker_factory = chunker_factory
+        self._detector = HeadingDetector() if detect_headings else None
+        self._chunker = chunker_factory()
+        self._section = ""
+        self._has_body = False     # Section hiện tại đã có nội dung ngoài các dòng heading
+        self._page = None
+        self._mark_positions = []  # Vị trí (trong chunker hiện tại) bắt đầu mỗi đoạn text đã nhận
+        self._mark_pages = []      # Số trang tương ứng
+
+    def feed(self, text, page=None):
+        """
+        Đưa text của 1 trang (hoặc 1 phần trang) vào chunker
+
+        Args:
+            text: Text theo thứ tự đọc
+            page: Số trang (từ 1) của text, None nếu không biết
+
+        Returns:
+            list: StructuredChunk đã hoàn chỉnh
+        """
+        self._page = page
+        if not self._detector:
+            return self._feed_section(text)
+
+        chunks = []
+        section_start = 0
+        line_start = 0
+        for line in text.splitlines(keepends=True):
+            stripped = line.strip()
+            if self._detector.match(stripped):
+                # Heading cha ngay trước heading con (chưa có nội dung) được giữ chung chunk với mục con
+                if self._has_body:
+                    chunks.extend(self._feed_section(text[section_start:line_start]))
+                    chunks.extend(self._finish_section())
+                    section_start = line_start
+                self._section = self._detector.section
+                self._has_body = False
+            elif stripped:
+                self._has_body = True
+            line_start += len(line)
+        chunks.extend(self._feed_section(text[section_start:]))
+        return chunks
+
+    def finish(self):
+        """
+        Returns:
+            list: StructuredChunk còn lại của section cuối
+        """
+        return self._finish_section()
+
+    def _feed_section(self, text):
+        if not text:
+            return []
+        self._mark_positions.append(self._chunker.position)
+        self._mark_pages.append(self._page)
+        chunks = self._wrap(self._chunker.feed(text))
+        self._drop_marks()
+        return chunks
+
+    def _drop_marks(self):
+        """Bỏ mốc trang của phần text đã chia xong, để số mốc không tăng theo số trang của section"""
+        index = bisect_right(self._mark_positions, self._chunker.pending_start) - 1
+        if index > 0:
+            del self._mark_positions[:index]
+            del self._mark_pages[:index]
+
+    def _finish_section(self):
+        chunks = self._wrap(self._chunker.finish())
+        self._chunker = self._chunker_factory()
+        self._mark_positions = []
+        self._mark_pages = []
+        return chunks
+
+    def _page_at(self, position):
+        index = bisect_right(self._mark_positions, position) - 1
+        return self._mark_pages[max(index, 0)] if self._mark_pages else None
+
+    def _wrap(self, chunks):
+        return [
+            StructuredChunk(chunk.text, self._page_at(chunk.start), self._page_at(chunk.end - 1), self._section)
+            for chunk in chunks if chunk.text
+        ]
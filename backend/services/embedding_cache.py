@@ -0,0 +1,156 @@
+"""
+Embedding Cache - Cache embedding bền vững theo (model, hash nội dung chunk)
+
+Module này chứa:
+- EmbeddingCache: Bảng SQLite (model, text_hash) -> vector float32, giới hạn số bản ghi
+  với eviction LRU (theo thời điểm dùng gần nhất) và thống kê hit rate
+
+Cache nằm ngoài ChromaDB nên vẫn còn sau reset/clear collection: upload lại hoặc chia lại
+chunks không phải embed lại những chunk đã từng embed với cùng model.
+"""
+
+import hashlib
+import re
+import threading
+import time
+
+import numpy as np
+
+from services.sqlite_utils import connect_sqlite
+
+# SQLite giới hạn số tham số mỗi câu lệnh
+_SQL_BATCH = 500
+
+
+def text_hash(text):
+    """
+    Hash của text dùng làm key cache
+
+    Chỉ gộp khoảng trắng (không đổi chữ hoa/thường) để text cùng key luôn cho cùng embedding.
+    """
+    return hashlib.sha256(re.sub(r'\s+', ' ', text).strip().encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Cache embedding trong SQLite, an toàn khi dùng từ nhiều thread
+    """
+
+    def __init__(self, db_path, max_entries=50000):
+        """
+        Args:
+            db_path: Đường dẫn file SQLite
+            max_entries: Số embedding tối đa giữ trong cache (vượt quá thì xóa bản ghi ít dùng nhất)
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path)
+        self._init_schema()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _init_schema(self):
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+            self._conn.commit()
+
+    def get_many(self, model, texts):
+        """
+        Tìm embedding đã cache cho danh sách text
+
+        Args:
+            model: ID của embedding model
+            texts: List text
+
+        Returns:
+            dict: index trong texts -> vector (list float) cho các text có trong cache
+        """
+        hashes = [text_hash(text) for text in texts]
+        positions = {}
+        for index, hash_value in enumerate(hashes):
+            positions.setdefault(hash_value, []).append(index)
+
+        found = {}
+        now = time.time()
+        with self._lock:
+            unique_hashes = list(positions)
+            for start in range(0, len(unique_hashes), _SQL_BATCH):
+                batch = unique_hashes[start:start + _SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model] + batch
+                ).fetchall()
+                for row in rows:
+                    vector = np.frombuffer(row["vector"], dtype=np.float32).tolist()
+                    for index in positions[row["text_hash"]]:
+                        found[index] = vector
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                        [(now, model, row["text_hash"]) for row in rows]
+                    )
+            self._conn.commit()
+            self._stats["hits"] += len(found)
+            self._stats["misses"] += len(texts) - len(found)
+        return found
+
+    def put_many(self, model, texts, vectors):
+        """
+        Lưu embedding vào cache và xóa bản ghi ít dùng nhất nếu vượt max_entries
+
+        Args:
+            model: ID của embedding model
+            texts: List text
+            vectors: List vector tương ứng
+        """
+        now = time.time()
+        rows = [
+            (model, text_hash(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Xóa bản ghi dùng lâu nhất khi cache vượt max_entries (gọi khi đang giữ lock)"""
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+        # Xóa thêm 10% để không phải evict sau mỗi lần ghi
+        to_delete = overflow + self.max_entries // 10
+        cursor = self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (to_delete,)
+        )
+        self._stats["evictions"] += cursor.rowcount
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Số bản ghi, hits, misses, hit_rate, evictions
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(
+            entries=entries,
+            max_entries=self.max_entries,
+            hit_rate=round(stats["hits"] / lookups, 4) if lookups else 0.0
+        )
+        return stats
@@ -0,0 +1,270 @@
+"""
+Embedding Service - Lớp provider tạo embedding cho knowledge base
+
+Service này chứa:
+- EmbeddingProvider: Bọc 1 hàm embed (list text -> list vector), chia micro-batch
+  với kích thước cấu hình được, chạy các batch trên thread pool (ONNX Runtime /
+  PyTorch nhả GIL khi inference) và đo tốc độ embed (texts/giây) cho ingestion và query.
+  Nếu có EmbeddingCache, chỉ text chưa có trong cache mới được đưa vào model.
+  token_spans trả về vị trí token theo tokenizer của model (chia chunk theo token).
+- create_embedding_provider: Tạo provider từ biến môi trường
+
+Cấu hình (biến môi trường):
+- KB_EMBEDDING_PROVIDER: "default" (ONNX all-MiniLM-L6-v2 của ChromaDB, giống embedding
+  mặc định trước đây) hoặc "sentence-transformers" (cần cài sentence-transformers)
+- KB_EMBEDDING_MODEL: Tên model cho sentence-transformers (mặc định all-MiniLM-L6-v2)
+- KB_EMBEDDING_BATCH_SIZE: Số text mỗi micro-batch (mặc định 32)
+- KB_EMBEDDING_WORKERS: Số micro-batch chạy song song (mặc định 1)
+- KB_EMBEDDING_THREADS: Số thread intra-op của ONNX Runtime / PyTorch (0 = mặc định của runtime)
+- KB_EMBEDDING_CACHE_SIZE: Số embedding tối đa trong cache bền vững (mặc định 50000, 0 = tắt cache)
+
+Đổi model làm embedding cũ không còn so sánh được: cần reset/clear knowledge base và upload lại.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+
+from services.embedding_cache import EmbeddingCache
+
+DEFAULT_PROVIDER = "default"
+SENTENCE_TRANSFORMERS_PROVIDER = "sentence-transformers"
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+
+
+class EmbeddingProvider:
+    """
+    Tạo embedding theo micro-batch và ghi nhận thống kê tốc độ
+    """
+
+    def __init__(self, embed_fn, name, batch_size=32, workers=1, cache=None, tokenize_fn=None):
+        """
+        Args:
+            embed_fn: Hàm nhận list text, trả về list vector cùng thứ tự
+            name: Tên provider/model (dùng làm model ID trong cache)
+            batch_size: Số text mỗi micro-batch
+            workers: Số micro-batch chạy song song
+            cache: EmbeddingCache dùng trước khi gọi model (optional)
+            tokenize_fn: Hàm text -> list (start, end) của token theo tokenizer của model (optional)
+        """
+        self._embed_fn = embed_fn
+        self._tokenize_fn = tokenize_fn
+        self.name = name
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kb-embed") \
+            if self.workers > 1 else None
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "documents": {"texts": 0, "batches": 0, "seconds": 0.0},
+            "queries": {"texts": 0, "batches": 0, "seconds": 0.0}
+        }
+
+    def _embed(self, texts, kind):
+        """Lấy embedding từ cache, phần còn lại chia micro-batch và embed bằng model"""
+        if not texts:
+            return []
+
+        if not self.cache:
+            return self._embed_uncached(texts, kind)
+
+        embeddings = self.cache.get_many(self.name, texts)
+        missing = [index for index in range(len(texts)) if index not in embeddings]
+        if missing:
+            missing_texts = [texts[index] for index in missing]
+            computed = self._embed_uncached(missing_texts, kind)
+            self.cache.put_many(self.name, missing_texts, computed)
+            embeddings.update(zip(missing, computed))
+        return [embeddings[index] for index in range(len(texts))]
+
+    def _embed_uncached(self, texts, kind):
+        """Chia micro-batch, embed (song song nếu có nhiều worker) và ghi nhận thống kê"""
+        if not texts:
+            return []
+
+        start = time.perf_counter()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if self._executor and len(batches) > 1:
+            results = list(self._executor.map(self._embed_fn, batches))
+        else:
+            results = [self._embed_fn(batch) for batch in batches]
+        embeddings = [embedding for batch_embeddings in results for embedding in batch_embeddings]
+        elapsed = time.perf_counter() - start
+
+        with self._stats_lock:
+            stats = self._stats[kind]
+            stats["texts"] += len(texts)
+            stats["batches"] += len(batches)
+            stats["seconds"] += elapsed
+        return embeddings
+
+    def embed_documents(self, texts):
+        """
+        Tạo embedding cho chunks khi ingest
+
+        Args:
+            texts: List nội dung chunk
+
+        Returns:
+            list: Vector embedding theo cùng thứ tự
+        """
+        return self._embed(list(texts), "documents")
+
+    def embed_queries(self, texts):
+        """
+        Tạo embedding cho câu truy vấn
+
+        Args:
+            texts: List câu truy vấn
+
+        Returns:
+            list: Vector embedding theo cùng thứ tự
+        """
+        return self._embed(list(texts), "queries")
+
+    def token_spans(self, text):
+        """
+        Tách text thành token theo tokenizer của model (không cắt theo độ dài tối đa)
+
+        Args:
+            text: Text cần tách
+
+        Returns:
+            list: (start, end) vị trí ký tự của từng token
+        """
+        if not self._tokenize_fn:
+            raise ValueError(f"Embedding provider {self.name} does not expose a tokenizer")
+        return self._tokenize_fn(text)
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Cấu hình và tốc độ embed (texts/giây) của ingestion và query
+        """
+        with self._stats_lock:
+            stats = {
+                kind: dict(values, texts_per_second=round(values["texts"] / values["seconds"], 2)
+                           if values["seconds"] else 0.0)
+                for kind, values in self._stats.items()
+            }
+        stats.update(provider=self.name, batch_size=self.batch_size, workers=self.workers)
+        if self.cache:
+            stats["cache"] = self.cache.get_stats()
+        return stats
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+
+def _load_onnx_minilm(intra_op_threads):
+    """Embedding function ONNX mặc định của ChromaDB, cho phép đặt số thread intra-op"""
+    from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+
+    if not intra_op_threads:
+        return ONNXMiniLM_L6_V2()
+
+    class ThreadedONNXMiniLM(ONNXMiniLM_L6_V2):
+        """ONNXMiniLM_L6_V2 với SessionOptions.intra_op_num_threads"""
+
+        @cached_property
+        def model(self):
+            session_options = self.ort.SessionOptions()
+            session_options.log_severity_level = 3
+            session_options.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session_options.intra_op_num_threads = intra_op_threads
+            return self.ort.InferenceSession(
+                os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "model.onnx"),
+                providers=self.ort.get_available_providers(),
+                sess_options=session_options
+            )
+
+    return ThreadedONNXMiniLM()
+
+
+def _onnx_token_spans(embedding_function):
+    """Hàm tách token bằng tokenizer của model ONNX (tải model khi dùng lần đầu)"""
+    lock = threading.Lock()
+    tokenizer = None
+
+    def token_spans(text):
+        nonlocal tokenizer
+        with lock:
+            if tokenizer is None:
+                embedding_function._download_model_if_not_exists()
+                # Bản riêng: tokenizer của embedding function bị cắt/pad về 256 token
+                tokenizer = embedding_function.Tokenizer.from_file(os.path.join(
+                    embedding_function.DOWNLOAD_PATH, embedding_function.EXTRACTED_FOLDER_NAME, "tokenizer.json"
+                ))
+                tokenizer.no_truncation()
+                tokenizer.no_padding()
+        return tokenizer.encode(text, add_special_tokens=False).offsets
+
+    return token_spans
+
+
+def _load_sentence_transformer(model_name, intra_op_threads):
+    """Model sentence-transformers (optional dependency)"""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        raise ImportError(
+            "sentence-transformers is not installed. Install it with: pip install sentence-transformers"
+        )
+
+    if intra_op_threads:
+        import torch
+        torch.set_num_threads(intra_op_threads)
+
+    model = SentenceTransformer(model_name, device="cpu")
+
+    def embed(texts):
+        # Micro-batch đã được EmbeddingProvider chia -> encode cả batch 1 lần
+        return model.encode(texts, batch_size=len(texts), convert_to_numpy=True).tolist()
+
+    def token_spans(text):
+        return model.tokenizer(
+            text, add_special_tokens=False, truncation=False, return_offsets_mapping=True
+        )["offset_mapping"]
+
+    return embed, token_spans
+
+
+def create_embedding_provider(provider=None, model=None, batch_size=None, workers=None, threads=None,
+                              cache_path=None, cache_size=None):
+    """
+    Tạo EmbeddingProvider theo tham số hoặc biến môi trường KB_EMBEDDING_*
+
+    Model chỉ được load khi embed lần đầu (provider mặc định) nên khởi tạo không tốn thời gian.
+
+    Args:
+        cache_path: File SQLite của cache embedding (None = không dùng cache)
+        cache_size: Số embedding tối đa trong cache (0 = tắt cache)
+
+    Returns:
+        EmbeddingProvider
+    """
+    provider = provider or os.getenv("KB_EMBEDDING_PROVIDER", DEFAULT_PROVIDER)
+    model = model or os.getenv("KB_EMBEDDING_MODEL", DEFAULT_MODEL)
+    batch_size = batch_size or int(os.getenv("KB_EMBEDDING_BATCH_SIZE", "32"))
+    workers = workers or int(os.getenv("KB_EMBEDDING_WORKERS", "1"))
+    threads = threads if threads is not None else int(os.getenv("KB_EMBEDDING_THREADS", "0"))
+    cache_size = cache_size if cache_size is not None else int(os.getenv("KB_EMBEDDING_CACHE_SIZE", "50000"))
+
+    if provider == SENTENCE_TRANSFORMERS_PROVIDER:
+        embed_fn, tokenize_fn = _load_sentence_transformer(model, threads)
+        name = f"{SENTENCE_TRANSFORMERS_PROVIDER}/{model}"
+    elif provider == DEFAULT_PROVIDER:
+        embed_fn = _load_onnx_minilm(threads)
+        tokenize_fn = _onnx_token_spans(embed_fn)
+        name = f"{DEFAULT_PROVIDER}/{DEFAULT_MODEL}"
+    else:
+        raise ValueError(f"Unknown embedding provider: {provider}")
+
+    cache = EmbeddingCache(cache_path, max_entries=cache_size) if cache_path and cache_size > 0 else None
+    return EmbeddingProvider(embed_fn, name, batch_size=batch_size, workers=workers, cache=cache,
+                             tokenize_fn=tokenize_fn)
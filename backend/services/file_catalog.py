@@ -0,0 +1,163 @@
+"""
+File Catalog - Danh mục file của knowledge base trong SQLite
+
+Module này chứa:
+- FileCatalog: Bảng files (1 dòng / file, kể cả alias) thay cho các file {file_id}_metadata.json.
+  Các trường dùng để liệt kê/sắp xếp/tra cứu (title, upload_time, hash...) là cột có index,
+  metadata đầy đủ lưu dạng JSON. Text đã trích xuất không nằm trong catalog ({file_id}_text.txt).
+
+Liệt kê file là 1 câu truy vấn có index (phân trang, sắp xếp) thay vì đọc từng file JSON.
+"""
+
+import json
+import threading
+
+from services.sqlite_utils import connect_sqlite
+
+# Trường có thể sắp xếp khi liệt kê file -> biểu thức ORDER BY
+FILE_SORT_FIELDS = {
+    "upload_time": "f.upload_time",
+    "title": "f.title COLLATE NOCASE",
+    "filename": "f.original_filename COLLATE NOCASE",
+    "file_size": "f.file_size",
+    "pages_count": "COALESCE(o.pages_count, f.pages_count)"
+}
+
+# Metadata không lưu trong catalog
+_EXCLUDED_FIELDS = ("extracted_text",)
+
+# Cột được tách riêng từ metadata
+_COLUMNS = ("alias_of", "title", "original_filename", "description", "upload_time",
+            "file_size", "pages_count", "text_length", "file_hash", "sha256")
+
+
+class FileCatalog:
+    """
+    Danh mục metadata file, an toàn khi dùng từ nhiều thread
+    """
+
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path: Đường dẫn file SQLite
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path)
+        self._init_schema()
+
+    def _init_schema(self):
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    file_id TEXT PRIMARY KEY,
+                    alias_of TEXT,
+                    title TEXT,
+                    original_filename TEXT,
+                    description TEXT,
+                    upload_time TEXT,
+                    file_size INTEGER,
+                    pages_count INTEGER,
+                    text_length INTEGER,
+                    file_hash TEXT,
+                    sha256 TEXT,
+                    metadata TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_files_upload_time ON files(upload_time);
+                CREATE INDEX IF NOT EXISTS idx_files_title ON files(title COLLATE NOCASE);
+                CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files(sha256);
+                CREATE INDEX IF NOT EXISTS idx_files_file_hash ON files(file_hash);
+                CREATE INDEX IF NOT EXISTS idx_files_alias_of ON files(alias_of);
+
+                CREATE TABLE IF NOT EXISTS catalog_info (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+            self._conn.commit()
+
+    def put(self, metadata):
+        """
+        Thêm hoặc thay metadata của 1 file
+
+        Args:
+            metadata: Metadata của file (phải có file_id), extracted_text bị bỏ qua
+        """
+        metadata = {key: value for key, value in metadata.items() if key not in _EXCLUDED_FIELDS}
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO files (file_id, {', '.join(_COLUMNS)}, metadata) "
+                f"VALUES ({', '.join('?' * (len(_COLUMNS) + 2))})",
+                [metadata["file_id"]] + [metadata.get(column) for column in _COLUMNS]
+                + [json.dumps(metadata, ensure_ascii=False)]
+            )
+            self._conn.commit()
+
+    def get(self, file_id):
+        """
+        Returns:
+            dict: Metadata của file, None nếu không có
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT metadata FROM files WHERE file_id = ?", (file_id,)).fetchone()
+        return json.loads(row["metadata"]) if row else None
+
+    def delete(self, file_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+            self._conn.commit()
+
+    def all_files(self):
+        """
+        Returns:
+            list: Metadata của tất cả file (kể cả alias)
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT metadata FROM files").fetchall()
+        return [json.loads(row["metadata"]) for row in rows]
+
+    def list_files(self, limit=None, offset=0, sort_by="upload_time", descending=True):
+        """
+        Liệt kê file (alias được bổ sung số trang, độ dài text từ file gốc)
+
+        Args:
+            limit: Số file tối đa (None = tất cả)
+            offset: Bỏ qua bao nhiêu file đầu
+            sort_by: Trường sắp xếp (key của FILE_SORT_FIELDS)
+            descending: Sắp xếp giảm dần
+
+        Returns:
+            tuple: (files, total_files)
+        """
+        if sort_by not in FILE_SORT_FIELDS:
+            raise ValueError(f"Unsupported sort field: {sort_by}")
+        direction = "DESC" if descending else "ASC"
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            rows = self._conn.execute(
+                f"""
+                SELECT f.file_id, f.original_filename AS filename, f.title, f.file_size,
+                       COALESCE(o.pages_count, f.pages_count) AS pages_count,
+                       COALESCE(o.text_length, f.text_length) AS text_length,
+                       f.upload_time, COALESCE(f.description, '') AS description, f.alias_of
+                FROM files f LEFT JOIN files o ON o.file_id = f.alias_of
+                ORDER BY {FILE_SORT_FIELDS[sort_by]} {direction}, f.file_id {direction}
+                LIMIT ? OFFSET ?
+                """,
+                (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows], total
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def get_info(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM catalog_info WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_info(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO catalog_info (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
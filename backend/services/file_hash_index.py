@@ -0,0 +1,139 @@
+"""
+File Hash Index - Chỉ mục nội dung file (SHA-256 -> file_id) để chống upload trùng
+
+Module này chứa:
+- FileHashIndex: Map SHA-256 -> file_id của file đã ingest xong, các hash đang được
+  ingest (để gộp các upload đồng thời cùng nội dung) và các bản ghi alias
+  (file_id alias -> file_id gốc sở hữu file PDF, text và chunks)
+
+Index chỉ nằm trong bộ nhớ, được dựng lại từ metadata khi service khởi động.
+"""
+
+import threading
+import time
+
+# Cách xử lý khi upload trùng nội dung với file đã có
+DUPLICATE_RETURN_EXISTING = "return_existing"   # Trả về file đã có, không tạo bản ghi mới
+DUPLICATE_ALIAS = "alias"                       # Tạo bản ghi alias với title/description mới
+
+DUPLICATE_POLICIES = (DUPLICATE_RETURN_EXISTING, DUPLICATE_ALIAS)
+
+
+class FileHashIndex:
+    """
+    Chỉ mục SHA-256 -> file_id, an toàn khi dùng từ nhiều thread
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._files = {}     # sha256 -> file_id đã ingest xong
+        self._pending = {}   # sha256 -> file_id đang ingest
+        self._aliases = {}   # file_id alias -> file_id gốc
+        self._stats = {"duplicates_detected": 0, "aliases_created": 0, "coalesced_uploads": 0}
+
+    def add_file(self, sha256, file_id):
+        """Ghi nhận file đã ingest xong và đánh thức các upload đang chờ cùng hash"""
+        with self._condition:
+            self._files[sha256] = file_id
+            if self._pending.get(sha256) == file_id:
+                del self._pending[sha256]
+            self._condition.notify_all()
+
+    def remove_file(self, sha256, file_id):
+        """Bỏ file khỏi index (chỉ khi hash vẫn trỏ tới file_id này)"""
+        with self._condition:
+            if self._files.get(sha256) == file_id:
+                del self._files[sha256]
+
+    def claim(self, sha256, file_id, wait_timeout=0):
+        """
+        Nhận quyền ingest nội dung có hash sha256 cho file_id
+
+        Nếu cùng nội dung đang được ingest bởi upload khác, chờ tối đa wait_timeout
+        giây để dùng lại kết quả thay vì ingest lần nữa.
+
+        Args:
+            sha256: Hash SHA-256 của nội dung file
+            file_id: file_id của upload hiện tại
+            wait_timeout: Số giây tối đa chờ upload đang ingest cùng nội dung (0 = không chờ)
+
+        Returns:
+            tuple: (owner_file_id, is_pending) - owner_file_id là None nếu file_id nhận được quyền ingest
+        """
+        deadline = time.time() + wait_timeout
+        with self._condition:
+            waited = False
+            while True:
+                existing = self._files.get(sha256)
+                if existing and existing != file_id:
+                    self._record_duplicate(waited)
+                    return existing, False
+
+                pending = self._pending.get(sha256)
+                if pending is None or pending == file_id:
+                    self._pending[sha256] = file_id
+                    return None, False
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._record_duplicate(waited)
+                    return pending, True
+                waited = True
+                self._condition.wait(remaining)
+
+    def _record_duplicate(self, waited):
+        self._stats["duplicates_detected"] += 1
+        if waited:
+            self._stats["coalesced_uploads"] += 1
+
+    def mark_pending(self, sha256, file_id):
+        """Đánh dấu hash đang được ingest (job khôi phục sau restart chưa qua claim)"""
+        with self._condition:
+            if sha256 not in self._files:
+                self._pending.setdefault(sha256, file_id)
+
+    def release(self, sha256, file_id):
+        """Trả lại quyền ingest khi ingestion thất bại, upload đang chờ sẽ tự nhận quyền"""
+        with self._condition:
+            if self._pending.get(sha256) == file_id:
+                del self._pending[sha256]
+            self._condition.notify_all()
+
+    def add_alias(self, alias_id, owner_id, created=False):
+        """Ghi nhận bản ghi alias trỏ tới file gốc"""
+        with self._condition:
+            self._aliases[alias_id] = owner_id
+            if created:
+                self._stats["aliases_created"] += 1
+
+    def remove_alias(self, alias_id):
+        with self._condition:
+            self._aliases.pop(alias_id, None)
+
+    def aliases_of(self, owner_id):
+        """Danh sách alias của 1 file gốc"""
+        with self._condition:
+            return [alias_id for alias_id, owner in self._aliases.items() if owner == owner_id]
+
+    def resolve(self, file_id):
+        """Đổi file_id alias thành file_id gốc (file_id thường giữ nguyên)"""
+        with self._condition:
+            return self._aliases.get(file_id, file_id)
+
+    def resolve_many(self, file_ids):
+        """Đổi danh sách file_id (có thể chứa alias) thành danh sách file_id gốc, bỏ trùng"""
+        resolved = []
+        for file_id in file_ids:
+            owner_id = self.resolve(file_id)
+            if owner_id not in resolved:
+                resolved.append(owner_id)
+        return resolved
+
+    def get_stats(self):
+        with self._condition:
+            return dict(
+                self._stats,
+                indexed_files=len(self._files),
+                pending_hashes=len(self._pending),
+                aliases=len(self._aliases)
+            )
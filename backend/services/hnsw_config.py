@@ -0,0 +1,96 @@
+"""
+HNSW Config - Tham số index HNSW của collection ChromaDB
+
+Module này chứa:
+- HnswConfig: space (hàm khoảng cách), M (số cạnh mỗi node), construction_ef (độ rộng tìm kiếm
+  khi dựng index) và search_ef (độ rộng tìm kiếm khi query)
+- hnsw_config_from_env / merge_hnsw_config: Đọc tham số từ biến môi trường / request và kiểm tra
+- collection_metadata / config_of_collection: Chuyển tham số <-> metadata "hnsw:*" của collection
+
+M, construction_ef cao hơn cho recall cao hơn nhưng dựng index chậm hơn và tốn bộ nhớ hơn;
+search_ef cao hơn cho recall cao hơn nhưng query chậm hơn. ChromaDB chỉ nhận tham số khi tạo
+collection, nên đổi tham số của knowledge base đang có cần dựng lại collection.
+
+Cấu hình (biến môi trường, mặc định là mặc định của ChromaDB):
+- KB_HNSW_SPACE: l2 / cosine / ip
+- KB_HNSW_M, KB_HNSW_CONSTRUCTION_EF, KB_HNSW_SEARCH_EF
+"""
+
+import os
+from collections import namedtuple
+
+HNSW_SPACES = ("l2", "cosine", "ip")
+
+HnswConfig = namedtuple("HnswConfig", ["space", "M", "construction_ef", "search_ef"])
+
+DEFAULT_HNSW_CONFIG = HnswConfig(space="l2", M=16, construction_ef=100, search_ef=10)
+
+# Giới hạn hợp lệ của tham số số nguyên (M < 2 không tạo được đồ thị)
+_MINIMUMS = {"M": 2, "construction_ef": 1, "search_ef": 1}
+
+
+def merge_hnsw_config(base, values):
+    """
+    Ghép các tham số được chỉ định vào cấu hình có sẵn và kiểm tra
+
+    Args:
+        base: HnswConfig gốc
+        values: Dict tên tham số -> giá trị (tham số thiếu giữ theo base)
+
+    Returns:
+        tuple: (config, error_message) - config là None nếu tham số không hợp lệ
+    """
+    unknown = set(values) - set(HnswConfig._fields)
+    if unknown:
+        return None, f"Unknown HNSW parameters: {', '.join(sorted(unknown))}"
+
+    config = base._replace(**values)
+    if config.space not in HNSW_SPACES:
+        return None, f"space must be one of: {', '.join(HNSW_SPACES)}"
+    for field, minimum in _MINIMUMS.items():
+        value = getattr(config, field)
+        if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+            return None, f"{field} must be an integer >= {minimum}"
+    return config, None
+
+
+def hnsw_config_from_env():
+    """
+    Returns:
+        HnswConfig: Tham số từ KB_HNSW_* (thiếu thì dùng mặc định của ChromaDB)
+
+    Raises:
+        ValueError: Tham số không hợp lệ
+    """
+    values = {}
+    space = os.getenv("KB_HNSW_SPACE")
+    if space:
+        values["space"] = space
+    for field, env_name in (("M", "KB_HNSW_M"), ("construction_ef", "KB_HNSW_CONSTRUCTION_EF"),
+                            ("search_ef", "KB_HNSW_SEARCH_EF")):
+        if os.getenv(env_name):
+            values[field] = int(os.getenv(env_name))
+    config, error = merge_hnsw_config(DEFAULT_HNSW_CONFIG, values)
+    if error:
+        raise ValueError(f"Invalid HNSW configuration: {error}")
+    return config
+
+
+def collection_metadata(config, **extra):
+    """Metadata tạo collection ChromaDB với tham số HNSW (kèm các trường khác như description)"""
+    return {
+        **extra,
+        "hnsw:space": config.space,
+        "hnsw:M": config.M,
+        "hnsw:construction_ef": config.construction_ef,
+        "hnsw:search_ef": config.search_ef
+    }
+
+
+def config_of_collection(collection):
+    """Tham số HNSW đang dùng của collection (collection tạo không kèm tham số dùng mặc định của ChromaDB)"""
+    metadata = collection.metadata or {}
+    return HnswConfig(**{
+        field: metadata.get(f"hnsw:{field}", getattr(DEFAULT_HNSW_CONFIG, field))
+        for field in HnswConfig._fields
+    })
@@ -0,0 +1,129 @@
+"""
+Hybrid Retrieval - Chạy song song nhiều cách truy xuất và gộp kết quả bằng reciprocal rank fusion
+
+Module này chứa:
+- reciprocal_rank_fusion: Gộp nhiều danh sách xếp hạng thành 1 (điểm = tổng weight / (k + thứ hạng))
+- HybridRetriever: Chạy các signal (vector search, BM25, ...) đồng thời trong thread pool với
+  giới hạn thời gian mỗi query, gộp bằng RRF và báo signal nào đóng góp vào kết quả
+
+RRF chỉ dùng thứ hạng nên không cần chuẩn hóa điểm của các signal về cùng thang
+(cosine similarity của vector search và điểm BM25 không so sánh trực tiếp được).
+"""
+
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from services.cancellation_service import RequestCancelled
+
+
+def reciprocal_rank_fusion(rankings, k=60, weights=None):
+    """
+    Gộp các danh sách xếp hạng bằng reciprocal rank fusion
+
+    Args:
+        rankings: Dict tên signal -> list ID theo thứ hạng (tốt nhất trước)
+        k: Hằng số làm mượt (lớn hơn thì thứ hạng đầu ít áp đảo hơn)
+        weights: Dict tên signal -> trọng số (mặc định 1)
+
+    Returns:
+        list: (id, score, ranks) theo score giảm dần - ranks là dict signal -> thứ hạng (từ 1)
+    """
+    weights = weights or {}
+    scores, ranks = {}, {}
+    for signal, ranked_ids in rankings.items():
+        weight = weights.get(signal, 1.0)
+        for rank, item_id in enumerate(dict.fromkeys(ranked_ids), 1):
+            scores[item_id] = scores.get(item_id, 0.0) + weight / (k + rank)
+            ranks.setdefault(item_id, {})[signal] = rank
+    fused = sorted(scores, key=lambda item_id: (-scores[item_id], min(ranks[item_id].values())))
+    return [(item_id, scores[item_id], ranks[item_id]) for item_id in fused]
+
+
+class HybridRetriever:
+    """
+    Chạy các signal truy xuất song song và gộp kết quả, an toàn khi dùng từ nhiều thread
+    """
+
+    def __init__(self, time_budget=1.5, rrf_k=60, max_workers=4):
+        """
+        Args:
+            time_budget: Số giây tối đa chờ các signal mỗi query (signal chưa xong bị bỏ qua)
+            rrf_k: Hằng số k của reciprocal rank fusion
+            max_workers: Số thread chạy signal
+        """
+        self.time_budget = time_budget
+        self.rrf_k = rrf_k
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="kb-search")
+            return self._executor
+
+    def retrieve(self, signals, limit, weights=None):
+        """
+        Chạy các signal đồng thời và gộp kết quả
+
+        Mỗi signal là hàm không tham số trả về dict tên ranking -> list hit (1 signal có thể
+        trả nhiều ranking, ví dụ 1 lần query ChromaDB với nhiều query embeddings). Hit là dict
+        có "id". Signal chạy trong context của request (cancellation token vẫn có hiệu lực).
+        Hết time_budget mà chưa signal nào xong thì chờ signal đầu tiên xong.
+
+        Args:
+            signals: Dict tên signal -> callable
+            limit: Số kết quả gộp tối đa
+            weights: Dict tên ranking -> trọng số RRF (mặc định 1)
+
+        Returns:
+            tuple: (results, info)
+                results: list (hits, rrf_score, ranks) - hits là dict tên ranking -> hit của ID đó
+                info: {"rankings": {tên: số hit}, "timed_out": [...], "errors": {...}, "elapsed_ms": ...}
+        """
+        start = time.perf_counter()
+        executor = self._get_executor()
+        futures = {
+            executor.submit(contextvars.copy_context().run, signal): name for name, signal in signals.items()
+        }
+        done, pending = wait(futures, timeout=self.time_budget)
+        if not done and pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+        rankings, errors = {}, {}
+        for future in done:
+            try:
+                rankings.update(future.result())
+            except RequestCancelled:
+                raise
+            except Exception as e:
+                errors[futures[future]] = str(e)
+        for future in pending:
+            future.cancel()
+
+        hits_by_id = {}
+        for ranking, hits in rankings.items():
+            for hit in hits:
+                hits_by_id.setdefault(hit["id"], {}).setdefault(ranking, hit)
+        fused = reciprocal_rank_fusion(
+            {ranking: [hit["id"] for hit in hits] for ranking, hits in rankings.items()},
+            k=self.rrf_k, weights=weights
+        )[:limit]
+
+        info = {
+            "rankings": {ranking: len(hits) for ranking, hits in rankings.items()},
+            "timed_out": sorted(futures[future] for future in pending),
+            "errors": errors,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+        }
+        return [(hits_by_id[item_id], score, ranks) for item_id, score, ranks in fused], info
+
+    def shutdown(self):
+        """Dừng thread pool"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,360 @@
+"""
+Ingestion Jobs - Hàng đợi xử lý nền cho file upload vào knowledge base
+
+Service này chứa:
+- Job table trong SQLite (bền vững qua restart server)
+- Worker pool giới hạn số thread chạy pipeline: trích xuất -> hash -> metadata -> embedding
+- Báo tiến độ theo stage, số trang đã xử lý, số chunks đã embed
+- Retry idempotent (ingest_saved_file xóa chunks cũ của file_id trước khi lưu lại)
+- Khôi phục job queued/running còn dang dở khi server khởi động lại
+- Lease theo process (owner, lease_until): job chỉ được lấy lại khi process giữ job đã dừng
+  (lease hết hạn, không còn được gia hạn), nên nhiều process dùng chung job table không chạy trùng job
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from services.sqlite_utils import connect_sqlite
+
+# Trạng thái của job
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+FINISHED_STATUSES = (JOB_COMPLETED, JOB_FAILED)
+
+# Các cột tiến độ được cập nhật từ progress callback
+_PROGRESS_FIELDS = ("pages_total", "pages_processed", "chunks_total", "chunks_embedded")
+
+
+class IngestionJobQueue:
+    """
+    Hàng đợi ingestion chạy nền cho knowledge base
+    """
+
+    def __init__(self, knowledge_base_service, db_path=None, max_workers=2, max_pending=100,
+                 max_attempts=3, retry_delay=2.0, progress_interval=0.5, lease_seconds=60.0,
+                 recover_jobs=True):
+        """
+        Khởi tạo hàng đợi và khôi phục job dang dở
+
+        Args:
+            knowledge_base_service: Instance của KnowledgeBaseService
+            db_path: Đường dẫn SQLite job table (mặc định trong thư mục uploads)
+            max_workers: Số job chạy song song tối đa
+            max_pending: Số job queued/running tối đa, vượt quá thì từ chối upload
+            max_attempts: Số lần chạy tối đa của 1 job (tính cả lần đầu)
+            retry_delay: Thời gian chờ (giây) trước khi retry, tăng dần theo số lần thử
+            progress_interval: Khoảng cách tối thiểu (giây) giữa 2 lần ghi tiến độ xuống DB
+            lease_seconds: Thời hạn lease của job; process giữ job gia hạn mỗi lease_seconds / 3 giây
+            recover_jobs: False để không lấy lại job của process khác (process cha của Werkzeug reloader)
+        """
+        self.knowledge_base_service = knowledge_base_service
+        self.db_path = db_path or os.path.join(knowledge_base_service.upload_folder, "ingestion_jobs.db")
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.progress_interval = progress_interval
+        self.lease_seconds = lease_seconds
+        self.recover_jobs = recover_jobs
+        # Định danh process giữ job (ghi vào cột owner khi claim)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(self.db_path)
+        self._init_schema()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kb-ingest")
+
+        if recover_jobs:
+            recovered = self.recover()
+            if recovered:
+                print(f"♻️ Recovered {recovered} unfinished ingestion jobs")
+
+        self._stopped = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="kb-ingest-lease", daemon=True)
+        self._heartbeat.start()
+
+    def _init_schema(self):
+        """Tạo job table nếu chưa có"""
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    pages_total INTEGER DEFAULT 0,
+                    pages_processed INTEGER DEFAULT 0,
+                    chunks_total INTEGER DEFAULT 0,
+                    chunks_embedded INTEGER DEFAULT 0,
+                    attempts INTEGER DEFAULT 0,
+                    error TEXT,
+                    result TEXT,
+                    payload TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    owner TEXT,
+                    lease_until REAL
+                )
+            """)
+            # Job table tạo trước khi có lease: thêm cột (job cũ có lease_until NULL, lấy lại được ngay)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(ingestion_jobs)").fetchall()}
+            for name, column_type in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if name not in columns:
+                    self._conn.execute(f"ALTER TABLE ingestion_jobs ADD COLUMN {name} {column_type}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs(status)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_file_id ON ingestion_jobs(file_id)")
+            self._conn.commit()
+
+    # =========================================
+    # JOB TABLE
+    # =========================================
+
+    def _update(self, job_id, **fields):
+        """Cập nhật các cột của job và updated_at"""
+        fields["updated_at"] = datetime.now().isoformat()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE ingestion_jobs SET {columns} WHERE job_id = ?",
+                list(fields.values()) + [job_id]
+            )
+            self._conn.commit()
+
+    def _row_to_job(self, row):
+        """Chuyển row SQLite thành dict trả về cho API"""
+        job = dict(row)
+        payload = json.loads(job.pop("payload"))
+        job["title"] = payload.get("title")
+        job["original_filename"] = payload["saved_file"].get("original_filename")
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def get_job(self, job_id):
+        """
+        Lấy trạng thái job
+
+        Returns:
+            dict: Thông tin job hoặc None nếu không tồn tại
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def find_active_job(self, file_id):
+        """
+        Tìm job queued/running của file_id (upload trùng nội dung dùng chung job này)
+
+        Returns:
+            dict: Thông tin job hoặc None nếu file không có job đang chạy
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM ingestion_jobs WHERE file_id = ? AND status IN (?, ?) "
+                "ORDER BY created_at DESC LIMIT 1",
+                (file_id, JOB_QUEUED, JOB_RUNNING)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_jobs(self, limit=50):
+        """Lấy danh sách job mới nhất"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM ingestion_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def _count_pending(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM ingestion_jobs WHERE status IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchone()[0]
+
+    # =========================================
+    # SUBMIT / RECOVER
+    # =========================================
+
+    def submit(self, saved_file, title, description):
+        """
+        Tạo job ingestion cho file đã lưu và đưa vào hàng đợi
+
+        Args:
+            saved_file: Dict trả về từ KnowledgeBaseService.save_uploaded_file
+            title: Tiêu đề tài liệu
+            description: Mô tả tài liệu
+
+        Returns:
+            tuple: (success, job, error_message)
+        """
+        if self._count_pending() >= self.max_pending:
+            return False, None, "Ingestion queue is full, please try again later"
+
+        job_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        saved_file = dict(saved_file, upload_time=now)
+        payload = json.dumps({"saved_file": saved_file, "title": title, "description": description},
+                             ensure_ascii=False)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO ingestion_jobs (job_id, file_id, status, stage, payload, created_at, updated_at, "
+                "owner, lease_until) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, saved_file["file_id"], JOB_QUEUED, JOB_QUEUED, payload, now, now,
+                 self.owner, time.time() + self.lease_seconds)
+            )
+            self._conn.commit()
+
+        self._executor.submit(self._run, job_id)
+        return True, self.get_job(job_id), None
+
+    def _claim(self, job_id):
+        """
+        Nhận job chưa xong có lease đã hết hạn (1 câu UPDATE: chỉ 1 process claim được)
+
+        Returns:
+            bool: True nếu process này đã nhận job
+        """
+        now = time.time()
+        with self._lock:
+            claimed = self._conn.execute(
+                "UPDATE ingestion_jobs SET owner = ?, lease_until = ?, status = ?, stage = ?, updated_at = ? "
+                "WHERE job_id = ? AND status IN (?, ?) AND (lease_until IS NULL OR lease_until < ?)",
+                (self.owner, now + self.lease_seconds, JOB_QUEUED, JOB_QUEUED, datetime.now().isoformat(),
+                 job_id, JOB_QUEUED, JOB_RUNNING, now)
+            ).rowcount
+            self._conn.commit()
+        return bool(claimed)
+
+    def recover(self):
+        """
+        Đưa lại vào hàng đợi các job chưa xong của process đã dừng (lease hết hạn)
+
+        Job của process còn chạy (kể cả lần chạy trước vừa dừng nhưng lease chưa hết hạn)
+        được lấy lại ở lần gia hạn lease sau khi hết hạn.
+
+        Returns:
+            int: Số job được khôi phục
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM ingestion_jobs WHERE status IN (?, ?) "
+                "AND (lease_until IS NULL OR lease_until < ?) ORDER BY created_at",
+                (JOB_QUEUED, JOB_RUNNING, time.time())
+            ).fetchall()
+
+        recovered = 0
+        for row in rows:
+            if self._claim(row["job_id"]):
+                self._executor.submit(self._run, row["job_id"])
+                recovered += 1
+        return recovered
+
+    def _renew_leases(self):
+        """Gia hạn lease các job chưa xong mà process này đang giữ"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ingestion_jobs SET lease_until = ? WHERE owner = ? AND status IN (?, ?)",
+                (time.time() + self.lease_seconds, self.owner, JOB_QUEUED, JOB_RUNNING)
+            )
+            self._conn.commit()
+
+    def _heartbeat_loop(self):
+        """Thread nền: gia hạn lease, lấy lại job có lease vừa hết hạn"""
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                self._renew_leases()
+                recovered = self.recover() if self.recover_jobs else 0
+                if recovered:
+                    print(f"♻️ Recovered {recovered} unfinished ingestion jobs")
+            except Exception as e:
+                print(f"⚠️ Ingestion lease heartbeat failed: {str(e)}")
+
+    def shutdown(self):
+        """Dừng gia hạn lease và worker pool (job chưa xong được process khác lấy lại khi lease hết hạn)"""
+        self._stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # =========================================
+    # WORKER
+    # =========================================
+
+    def _make_progress_callback(self, job_id):
+        """Progress callback ghi tiến độ xuống DB (giới hạn tần suất ghi)"""
+        state = {"stage": None, "last_write": 0.0}
+
+        def callback(stage, **progress):
+            progress = {name: value for name, value in progress.items() if name in _PROGRESS_FIELDS}
+            now = time.time()
+            # Luôn ghi khi đổi stage (stage cuối "completed" mang tiến độ đầy đủ)
+            if stage == state["stage"] and now - state["last_write"] < self.progress_interval:
+                return
+            state["stage"] = stage
+            state["last_write"] = now
+            self._update(job_id, stage=stage, **progress)
+
+        return callback
+
+    def _run(self, job_id):
+        """Chạy pipeline ingestion cho 1 job, retry khi lỗi"""
+        job = self.get_job(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES or job["owner"] != self.owner:
+            return
+
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        payload = json.loads(row["payload"])
+        saved_file = payload["saved_file"]
+        attempts = job["attempts"]
+
+        if not os.path.exists(saved_file["file_path"]):
+            self._update(job_id, status=JOB_FAILED, stage=JOB_FAILED, error="Uploaded file is missing")
+            return
+
+        while True:
+            attempts += 1
+            self._update(job_id, status=JOB_RUNNING, stage="starting", attempts=attempts, error=None)
+            try:
+                success, result_data, message, status_code = self.knowledge_base_service.ingest_saved_file(
+                    saved_file, payload["title"], payload["description"],
+                    progress_callback=self._make_progress_callback(job_id)
+                )
+            except Exception as e:
+                success, result_data, message = False, None, f"Failed to process file: {str(e)}"
+
+            if success:
+                self._update(job_id, status=JOB_COMPLETED, stage=JOB_COMPLETED,
+                             result=json.dumps(result_data, ensure_ascii=False))
+                print(f"✅ Ingestion job {job_id} completed ({saved_file['original_filename']})")
+                return
+
+            if attempts >= self.max_attempts:
+                self.knowledge_base_service.discard_saved_file(saved_file)
+                self._update(job_id, status=JOB_FAILED, stage=JOB_FAILED, error=message)
+                print(f"❌ Ingestion job {job_id} failed after {attempts} attempts: {message}")
+                return
+
+            print(f"⚠️ Ingestion job {job_id} attempt {attempts} failed, retrying: {message}")
+            self._update(job_id, status=JOB_QUEUED, stage="retrying", error=message)
+            time.sleep(self.retry_delay * attempts)
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Số job theo trạng thái
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS total FROM ingestion_jobs GROUP BY status"
+            ).fetchall()
+        stats = {status: 0 for status in (JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_FAILED)}
+        stats.update({row["status"]: row["total"] for row in rows})
+        stats["max_workers"] = self.max_workers
+        return stats
@@ -2,22 +2,75 @@
 Knowledge Base Service - Xử lý logic nghiệp vụ cho knowledge base
 
 Service này chứa:
-- Xử lý upload file PDF
+- Xử lý upload file PDF (từng file hoặc nhiều file ingest song song)
 - Trích xuất text từ PDF
 - Quản lý metadata
 - Validation file
+- Re-index từ text đã lưu (chia chunk lại, không cần parse lại PDF)
 """
 
 import os
+import functools
 import hashlib
 import json
+import threading
+import time
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from werkzeug.utils import secure_filename
-import PyPDF2
 import chromadb
 from chromadb.config import Settings
-import re
+
+from services.cancellation_service import RequestCancelled, raise_if_cancelled
+from services.pdf_extraction import PdfTextExtractor, join_pages
+from services.text_chunker import CHUNK_UNITS, CHUNK_UNIT_TOKENS, IncrementalChunker, split_text
+from services.file_hash_index import FileHashIndex, DUPLICATE_ALIAS, DUPLICATE_RETURN_EXISTING
+from services.chunk_dedup import ChunkDedupIndex, MATCH_STORED, ref_key, referenced_file_ids
+from services.embedding_service import create_embedding_provider
+from services.file_catalog import FileCatalog
+from services.lexical_index import LexicalIndex
+from services.trigram_index import TrigramIndex
+from services.document_index import CentroidAccumulator, DocumentIndex
+from services.hybrid_retrieval import HybridRetriever
+from services.reranker import create_reranker
+from services.query_cache import SearchCache
+from services.read_write_lock import ReadWriteLock
+from services.hnsw_config import collection_metadata, config_of_collection, hnsw_config_from_env, merge_hnsw_config
+from services.chunk_annotator import annotate, normalize_text
+from services.document_structure import CHUNK_STRATEGIES, CHUNK_STRATEGY_STRUCTURE, StructuredChunk, StructuredChunker
+
+# Kích thước mỗi lần đọc khi ghi file upload / tính hash
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Collection chứa chunks chép sang khi dựng lại vector index (đổi tên thành knowledge_base khi xong)
+REBUILD_COLLECTION_NAME = "knowledge_base_rebuild"
+
+class _VectorDBWriteError(Exception):
+    """Lỗi khi ghi batch vào ChromaDB (phân biệt với lỗi khi đọc chunks)"""
+
+
+def _vector_writer(method):
+    """
+    Method ghi vào collection knowledge base: chờ dựng lại vector index xong rồi được tính là
+    thao tác ghi đang chạy (rebuild_vector_index không bắt đầu khi còn thao tác ghi, xem _active_writes)
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        while True:
+            self._wait_for_index_rebuild()
+            # Kiểm tra và đăng ký trong cùng lock với rebuild: không có lúc rebuild đã bắt đầu mà ghi vẫn vào
+            with self._active_ingests_lock:
+                if self._index_ready.is_set():
+                    self._active_writes += 1
+                    break
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            with self._active_ingests_lock:
+                self._active_writes -= 1
+    return wrapper
+
 
 class KnowledgeBaseService:
     """
@@ -35,14 +88,102 @@ class KnowledgeBaseService:
         self.upload_folder = upload_folder
         self.chroma_db_path = chroma_db_path
         self.allowed_extensions = {'pdf'}
-        self.max_file_size = 10 * 1024 * 1024  # 10MB
+        # Upload 1 request (multipart) và upload nhiều phần (resumable, /knowledge-base/uploads)
+        self.max_file_size = int(os.getenv("KB_MAX_FILE_SIZE_MB", "10")) * 1024 * 1024
+        self.max_resumable_file_size = int(os.getenv("KB_MAX_RESUMABLE_FILE_SIZE_MB", "500")) * 1024 * 1024
+        self.upload_part_size = int(os.getenv("KB_UPLOAD_PART_SIZE_MB", "8")) * 1024 * 1024
+        
+        # Chỉ mục SHA-256 -> file_id để bỏ qua ingest khi upload trùng nội dung
+        self.file_hash_index = FileHashIndex()
+        self.duplicate_wait_timeout = 300  # Giây chờ upload khác đang ingest cùng nội dung
+        
+        # Trích xuất PDF song song theo khoảng trang trên process pool (số process = số CPU)
+        self.pdf_extractor = PdfTextExtractor()
+        
+        # Tham số chia chunk khi ingest (re-index có thể dùng tham số khác)
+        self.chunk_size = int(os.getenv("KB_CHUNK_SIZE", "1000"))
+        self.chunk_overlap = int(os.getenv("KB_CHUNK_OVERLAP", "200"))
+        # Đơn vị của chunk_size/overlap: "chars" hoặc "tokens" (tokenizer của embedding model)
+        self.chunk_unit = os.getenv("KB_CHUNK_UNIT", "chars")
+        if self.chunk_unit not in CHUNK_UNITS:
+            raise ValueError(f"Unknown chunk unit: {self.chunk_unit}")
+        # "structure": chunk không vượt qua heading; "flat": chỉ theo kích thước (cả 2 đều ghi số trang)
+        self.chunk_strategy = os.getenv("KB_CHUNK_STRATEGY", CHUNK_STRATEGY_STRUCTURE)
+        if self.chunk_strategy not in CHUNK_STRATEGIES:
+            raise ValueError(f"Unknown chunk strategy: {self.chunk_strategy}")
+        self.reindex_workers = int(os.getenv("KB_REINDEX_WORKERS", "2"))
+        # Số file ingest song song (bulk upload và worker pool của job nền)
+        self.ingest_workers = int(os.getenv("KB_INGEST_WORKERS", "0")) or os.cpu_count() or 1
+        self.bulk_max_files = int(os.getenv("KB_BULK_MAX_FILES", "200"))  # Số file tối đa mỗi bulk upload
+        self._active_ingests = 0
+        self._active_writes = 0                      # Thao tác ghi chunks đang chạy (xem _vector_writer)
+        self._active_ingests_lock = threading.Lock()
+        self._reindex_locks = {}
+        self._reindex_locks_guard = threading.Lock()
+        self._reindex_swap_lock = threading.Lock()  # Các bước swap (nhanh) chạy lần lượt
+        self._search_gate = ReadWriteLock()         # Search đọc chunks / swap của re-index ghi độc quyền
+        self._reindex_staging = {}                   # staging_id -> file_id đang re-index
+        
+        # Tham số HNSW khi tạo collection knowledge base (collection đã có cần dựng lại để đổi tham số)
+        self.hnsw_config = hnsw_config_from_env()
+        # Đang dựng lại vector index: các thao tác ghi chunks chờ tới khi swap xong
+        self._index_ready = threading.Event()
+        self._index_ready.set()
+        self._index_rebuild_lock = threading.Lock()
+        
+        # Tìm kiếm trong file: vector search và BM25 chạy song song, gộp bằng reciprocal rank fusion
+        self.hybrid_retriever = HybridRetriever(
+            time_budget=int(os.getenv("KB_SEARCH_TIME_BUDGET_MS", "1500")) / 1000,
+            rrf_k=int(os.getenv("KB_RRF_K", "60"))
+        )
+        # Tìm kiếm toàn knowledge base 2 bước khi đủ lớn: chọn N file theo centroid rồi tìm chunk
+        # trong các file đó (KB_TWO_STAGE_TOP_FILES=0: luôn tìm trên toàn bộ chunks)
+        self.two_stage_top_files = int(os.getenv("KB_TWO_STAGE_TOP_FILES", "5"))
+        self.two_stage_min_chunks = int(os.getenv("KB_TWO_STAGE_MIN_CHUNKS", "20000"))
+        # Rerank top-K kết quả bằng cross-encoder trước khi đưa vào prompt (KB_RERANK_MODEL rỗng = tắt)
+        try:
+            self.reranker = create_reranker()
+        except Exception as e:
+            print(f"⚠️ Warning: Could not create reranker ({str(e)}), reranking disabled")
+            self.reranker = None
+        if self.reranker:
+            self.reranker.start_warm_up()
         
         # Tạo thư mục uploads nếu chưa tồn tại
         if not os.path.exists(self.upload_folder):
             os.makedirs(self.upload_folder)
         
+        # Danh mục metadata file (SQLite) thay cho các file {file_id}_metadata.json
+        self.file_catalog = FileCatalog(os.path.join(self.upload_folder, "file_catalog.db"))
+        self._migrate_json_metadata()
+        
+        # Cache embedding câu hỏi (theo dạng chuẩn hóa) và kết quả tìm kiếm (theo generation của
+        # knowledge base); KB_QUERY_CACHE_SHARED=1 dùng chung giữa các worker qua uploads/query_cache.db
+        shared_query_cache = int(os.getenv("KB_QUERY_CACHE_SHARED", "0"))
+        self.search_cache = SearchCache(
+            embedding_entries=int(os.getenv("KB_QUERY_EMBEDDING_CACHE_SIZE", "1000")),
+            result_entries=int(os.getenv("KB_SEARCH_RESULT_CACHE_SIZE", "1000")),
+            shared_path=os.path.join(self.upload_folder, "query_cache.db") if shared_query_cache else None
+        )
+        
+        # Embedding được tạo tường minh (micro-batch, thread pool, thống kê tốc độ)
+        # thay vì để ChromaDB tự gọi embedding function mặc định
+        self._init_embedder()
+        
         # Khởi tạo ChromaDB client và collection
         self._init_chroma_db()
+        
+        # Index chunk đã lưu (hash + MinHash/LSH) để không embed lại chunk trùng giữa các tài liệu
+        self.chunk_dedup = ChunkDedupIndex(os.path.join(self.chroma_db_path, "chunk_dedup.db"))
+        # Inverted index BM25 cho tìm kiếm theo từ khóa (không quét toàn bộ chunks mỗi query)
+        self.lexical_index = LexicalIndex(os.path.join(self.chroma_db_path, "lexical_index.db"))
+        # Trigram của từ vựng cho tìm từ gần đúng (gõ sai, 1 phần identifier)
+        self.trigram_index = TrigramIndex(os.path.join(self.chroma_db_path, "trigram_index.db"))
+        # Centroid embedding của từng file cho bước chọn file của tìm kiếm 2 bước
+        self.document_index = DocumentIndex(os.path.join(self.chroma_db_path, "document_index.db"))
+        self._backfill_chunk_indexes()
+        
+        self._load_file_hash_index()
     
     def is_allowed_file(self, filename):
         """
@@ -80,29 +221,41 @@ class KnowledgeBaseService:
         except Exception as e:
             return False, 0, f"Error checking file size: {str(e)}"
     
-    def extract_text_from_pdf(self, file_path):
+    def extract_pages_from_pdf(self, file_path, progress_callback=None):
         """
-        Trích xuất text từ file PDF
+        Trích xuất text của từng trang PDF (song song với PDF nhiều trang)
         
         Args:
             file_path: Đường dẫn đến file PDF
+            progress_callback: Hàm callback(stage, **progress) báo số trang đã xử lý (optional)
             
         Returns:
-            tuple: (success, text, pages_count, error_message)
+            tuple: (success, pages, error_message)
         """
         try:
-            text = ""
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                pages_count = len(pdf_reader.pages)
-                
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-            
-            return True, text, pages_count, None
+            pages = self.pdf_extractor.extract_pages(file_path, progress_callback=progress_callback)
+            return True, pages, None
             
         except Exception as e:
-            return False, "", 0, f"Error extracting text from PDF: {str(e)}"
+            return False, [], f"Error extracting text from PDF: {str(e)}"
+    
+    def extract_text_from_pdf(self, file_path, progress_callback=None):
+        """
+        Trích xuất text từ file PDF
+        
+        Args:
+            file_path: Đường dẫn đến file PDF
+            progress_callback: Hàm callback(stage, **progress) báo số trang đã xử lý (optional)
+            
+        Returns:
+            tuple: (success, text, pages_count, error_message)
+        """
+        success, pages, error = self.extract_pages_from_pdf(file_path, progress_callback)
+        if not success:
+            return False, "", 0, error
+        
+        text, _ = join_pages(pages)
+        return True, text, len(pages), None
     
     def calculate_file_hash(self, file_path):
         """
@@ -114,11 +267,132 @@ class KnowledgeBaseService:
         Returns:
             str: Hash MD5 của file
         """
+        return self.calculate_file_hashes(file_path)["md5"]
+    
+    def calculate_file_hashes(self, file_path):
+        """
+        Tính hash MD5 và SHA-256 của file trong 1 lượt đọc
+        
+        Args:
+            file_path: Đường dẫn đến file
+            
+        Returns:
+            dict: {"md5": ..., "sha256": ...}
+        """
         hash_md5 = hashlib.md5()
+        hash_sha256 = hashlib.sha256()
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            for chunk in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
                 hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+                hash_sha256.update(chunk)
+        return {"md5": hash_md5.hexdigest(), "sha256": hash_sha256.hexdigest()}
+    
+    def _open_new_upload_file(self, file_path, file_id):
+        """
+        Tạo file mới để ghi upload, không ghi đè file của upload khác cùng tên trong cùng giây
+        
+        Returns:
+            tuple: (file_object, file_path)
+        """
+        try:
+            return open(file_path, 'xb'), file_path
+        except FileExistsError:
+            base, extension = os.path.splitext(file_path)
+            file_path = f"{base}_{file_id[:8]}{extension}"
+            return open(file_path, 'xb'), file_path
+    
+    def _write_upload_stream(self, file, output):
+        """
+        Ghi file upload xuống disk, tính MD5 + SHA-256 trong cùng lượt ghi (không đọc lại file)
+        
+        Args:
+            file: File object từ request
+            output: File đã mở để ghi
+            
+        Returns:
+            tuple: (success, file_info, error_message) - file_info gồm file_size, file_hash (MD5), sha256
+        """
+        hash_md5 = hashlib.md5()
+        hash_sha256 = hashlib.sha256()
+        file_size = 0
+        for chunk in iter(lambda: file.stream.read(HASH_BLOCK_SIZE), b""):
+            file_size += len(chunk)
+            # Content-Length có thể sai -> vẫn chặn kích thước khi đang ghi
+            if file_size > self.max_file_size:
+                return False, None, f"File size must be less than {self.max_file_size // (1024*1024)}MB"
+            hash_md5.update(chunk)
+            hash_sha256.update(chunk)
+            output.write(chunk)
+        
+        return True, {
+            "file_size": file_size,
+            "file_hash": hash_md5.hexdigest(),
+            "sha256": hash_sha256.hexdigest()
+        }, None
+    
+    def _migrate_json_metadata(self):
+        """
+        Import 1 lần các file {file_id}_metadata.json cũ vào file catalog
+        
+        Text đã trích xuất nằm trong JSON cũ được chuyển ra {file_id}_text.txt.
+        File JSON được giữ nguyên (không còn được đọc, có thể xóa sau khi kiểm tra).
+        """
+        if self.file_catalog.get_info("json_metadata_migrated"):
+            return
+        
+        migrated = 0
+        for filename in os.listdir(self.upload_folder):
+            if not filename.endswith('_metadata.json'):
+                continue
+            try:
+                with open(os.path.join(self.upload_folder, filename), 'r', encoding='utf-8') as f:
+                    metadata = json.load(f)
+                
+                extracted_text = metadata.pop('extracted_text', None)
+                text_path = os.path.join(self.upload_folder, f"{metadata['file_id']}_text.txt")
+                if extracted_text is not None and not metadata.get('alias_of') and not os.path.exists(text_path):
+                    with open(text_path, 'w', encoding='utf-8') as f:
+                        f.write(extracted_text)
+                
+                self.file_catalog.put(metadata)
+                migrated += 1
+            except Exception as e:
+                print(f"⚠️ Warning: Could not migrate {filename}: {str(e)}")
+        
+        self.file_catalog.set_info("json_metadata_migrated", datetime.now().isoformat())
+        if migrated:
+            print(f"✅ Migrated {migrated} metadata files to file catalog")
+    
+    def load_file_metadata(self, file_id):
+        """
+        Returns:
+            dict: Metadata của file trong catalog, None nếu không có
+        """
+        return self.file_catalog.get(file_id)
+    
+    def _load_file_hash_index(self):
+        """
+        Dựng chỉ mục hash từ metadata đã lưu
+        
+        Metadata cũ chưa có sha256 được tính 1 lần từ file PDF và ghi lại vào metadata.
+        """
+        for metadata in self.file_catalog.all_files():
+            try:
+                file_id = metadata["file_id"]
+                if metadata.get("alias_of"):
+                    self.file_hash_index.add_alias(file_id, metadata["alias_of"])
+                    continue
+                
+                if not metadata.get("sha256"):
+                    file_path = metadata.get("file_path")
+                    if not file_path or not os.path.exists(file_path):
+                        continue
+                    metadata["sha256"] = self.calculate_file_hashes(file_path)["sha256"]
+                    self.save_file_metadata(file_id, metadata)
+                
+                self.file_hash_index.add_file(metadata["sha256"], file_id)
+            except Exception as e:
+                print(f"⚠️ Warning: Could not index {metadata.get('file_id')}: {str(e)}")
     
     def generate_unique_filename(self, filename):
         """
@@ -144,14 +418,12 @@ class KnowledgeBaseService:
             metadata: Dictionary chứa metadata
             
         Returns:
-            tuple: (success, metadata_path, error_message)
+            tuple: (success, catalog_path, error_message)
         """
         try:
-            metadata_path = os.path.join(self.upload_folder, f"{file_id}_metadata.json")
-            with open(metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            self.file_catalog.put(dict(metadata, file_id=file_id))
             
-            return True, metadata_path, None
+            return True, self.file_catalog.db_path, None
             
         except Exception as e:
             return False, "", f"Error saving metadata: {str(e)}"
@@ -191,14 +463,23 @@ class KnowledgeBaseService:
             
             # Khởi tạo ChromaDB client với persistent storage
             self.chroma_client = chromadb.PersistentClient(path=self.chroma_db_path)
+            # Số bản ghi tối đa mỗi lần add của backend ChromaDB
+            self.max_batch_size = self.chroma_client.get_max_batch_size()
+            
+            self._restore_rebuilt_collection()
             
             # Tạo hoặc lấy collection cho knowledge base
             # Collection này sẽ lưu trữ text chunks và metadata
             self.collection = self.chroma_client.get_or_create_collection(
                 name="knowledge_base",
-                metadata={"description": "PDF document knowledge base with text chunks"}
+                metadata=collection_metadata(self.hnsw_config,
+                                             description="PDF document knowledge base with text chunks")
             )
             
+            active_config = config_of_collection(self.collection)
+            if active_config != self.hnsw_config:
+                print(f"⚠️ Collection uses HNSW {active_config._asdict()}, configured {self.hnsw_config._asdict()}: "
+                      f"rebuild with POST /api/knowledge-base/index/rebuild to apply")
             print(f"✅ ChromaDB initialized successfully at: {self.chroma_db_path}")
             
         except Exception as e:
@@ -206,6 +487,126 @@ class KnowledgeBaseService:
             self.chroma_client = None
             self.collection = None
     
+    def _restore_rebuilt_collection(self):
+        """
+        Dựng lại vector index bị dừng sau khi xóa collection cũ nhưng chưa đổi tên collection mới:
+        chunks nằm trong collection rebuild -> đổi tên thành knowledge_base thay vì tạo collection rỗng
+        """
+        try:
+            self.chroma_client.get_collection(name="knowledge_base")
+            return
+        except Exception:
+            pass
+        try:
+            rebuilt = self.chroma_client.get_collection(name=REBUILD_COLLECTION_NAME)
+        except Exception:
+            return
+        rebuilt.modify(name="knowledge_base")
+        print(f"♻️ Restored knowledge base from collection '{REBUILD_COLLECTION_NAME}' of an interrupted rebuild")
+    
+    def _init_embedder(self):
+        """Tạo embedding provider từ cấu hình KB_EMBEDDING_*, lỗi cấu hình thì dùng provider mặc định"""
+        # Cache embedding nằm trong thư mục uploads (không phải chroma_db) để còn lại sau reset
+        cache_path = os.path.join(self.upload_folder, "embedding_cache.db")
+        try:
+            self.embedder = create_embedding_provider(cache_path=cache_path)
+        except Exception as e:
+            print(f"⚠️ Warning: Could not create embedding provider ({str(e)}), using default")
+            self.embedder = create_embedding_provider(provider="default", cache_path=cache_path)
+        cache_info = f"cache {self.embedder.cache.max_entries} entries" if self.embedder.cache else "no cache"
+        print(f"✅ Embedding provider: {self.embedder.name} "
+              f"(batch size {self.embedder.batch_size}, {self.embedder.workers} workers, {cache_info})")
+    
+    def _add_to_collection(self, ids, documents, metadatas, collection=None):
+        """
+        Embed và lưu chunks vào ChromaDB, chia nhỏ để không vượt max batch size của backend
+        
+        Args:
+            ids: List chunk ID
+            documents: List nội dung chunk
+            metadatas: List metadata
+            collection: Collection đích (mặc định collection knowledge base)
+            
+        Returns:
+            list: Embedding của các chunk theo cùng thứ tự
+        """
+        collection = collection or self.collection
+        embeddings = self.embedder.embed_documents(documents)
+        for start in range(0, len(ids), self.max_batch_size):
+            end = start + self.max_batch_size
+            collection.add(
+                ids=ids[start:end],
+                documents=documents[start:end],
+                metadatas=metadatas[start:end],
+                embeddings=embeddings[start:end]
+            )
+        return embeddings
+    
+    def _backfill_chunk_indexes(self, page_size=500):
+        """
+        Đăng ký các chunk đã có trong ChromaDB vào index chống trùng, lexical index, trigram index
+        và document index (lần đầu chạy với index rỗng)
+        
+        Chunk trùng đã lưu từ trước vẫn được giữ nguyên, chỉ chunk mới được so khớp với chúng.
+        """
+        if not self.collection:
+            return
+        backfill_dedup = self.chunk_dedup.is_empty()
+        backfill_lexical = self.lexical_index.is_empty()
+        backfill_trigrams = self.trigram_index.is_empty()
+        backfill_documents = self.document_index.is_empty()
+        if not backfill_dedup and not backfill_lexical and not backfill_trigrams and not backfill_documents:
+            return
+        
+        try:
+            total = self.collection.count()
+            include = ["documents", "metadatas"] + (["embeddings"] if backfill_documents else [])
+            centroids = {}
+            for offset in range(0, total, page_size):
+                page = self.collection.get(include=include, limit=page_size, offset=offset)
+                for position, (chunk_id, document, chunk_metadata) in enumerate(
+                        zip(page["ids"], page["documents"], page["metadatas"])):
+                    if backfill_documents:
+                        # Chunk thuộc về file sở hữu và các file tham chiếu tới nó
+                        for file_id in [chunk_metadata.get("file_id")] + referenced_file_ids(chunk_metadata):
+                            if file_id:
+                                centroids.setdefault(file_id, CentroidAccumulator()).add(
+                                    [chunk_id], [page["embeddings"][position]]
+                                )
+                    if not document:
+                        continue
+                    if backfill_dedup:
+                        self.chunk_dedup.register_stored_chunk(
+                            chunk_id, chunk_metadata.get("file_id", ""), chunk_metadata.get("chunk_index", 0), document
+                        )
+                    words = normalize_text(document).split()
+                    if backfill_lexical:
+                        self.lexical_index.add_chunk(chunk_id, words)
+                    if backfill_trigrams:
+                        self.trigram_index.add_terms(words)
+            self.chunk_dedup.commit()
+            self.lexical_index.commit()
+            self.trigram_index.commit()
+            for file_id, centroid in centroids.items():
+                self.document_index.set_file(file_id, centroid)
+            if total:
+                print(f"✅ Indexed {total} existing chunks for deduplication, keyword search and file selection")
+        except Exception as e:
+            print(f"⚠️ Warning: Could not index existing chunks: {str(e)}")
+    
+    def _file_filter(self, file_ids, key="filename_uuid"):
+        """
+        Tạo filter ChromaDB lấy chunks của các file, kể cả chunk dùng chung với file khác
+        
+        Args:
+            file_ids: Danh sách file_id
+            key: Trường metadata chứa file_id của file sở hữu chunk
+            
+        Returns:
+            dict: Filter where cho ChromaDB
+        """
+        return {"$or": [{key: {"$in": list(file_ids)}}] + [{ref_key(file_id): True} for file_id in file_ids]}
+    
     def _split_text_into_chunks(self, text, chunk_size=1000, overlap=200):
         """
         Chia text thành các chunks nhỏ để lưu vào vector database
@@ -219,57 +620,184 @@ class KnowledgeBaseService:
         Returns:
             list: Danh sách các text chunks
         """
-        # Làm sạch text: loại bỏ ký tự xuống dòng thừa và khoảng trắng
-        cleaned_text = re.sub(r'\n+', '\n', text.strip())
-        cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
+        return split_text(text, chunk_size, overlap)
+    
+    def _make_chunker(self, chunk_size, overlap):
+        """
+        StructuredChunker theo KB_CHUNK_STRATEGY, mỗi section dùng IncrementalChunker theo
+        đơn vị KB_CHUNK_UNIT (token dùng tokenizer của embedding model)
+        """
+        token_spans = self.embedder.token_spans if self.chunk_unit == CHUNK_UNIT_TOKENS else None
+        return StructuredChunker(
+            lambda: IncrementalChunker(chunk_size, overlap, token_spans=token_spans, with_offsets=True),
+            detect_headings=self.chunk_strategy == CHUNK_STRATEGY_STRUCTURE
+        )
+    
+    def _build_chunk_metadata(self, file_id, chunk_index, chunk, title, description, metadata, annotation=None):
+        """
+        Tạo metadata cho 1 chunk trong ChromaDB
         
-        if len(cleaned_text) <= chunk_size:
-            return [cleaned_text]
+        Nội dung chunk chỉ nằm trong documents, không lưu thêm bản sao trong metadata.
+        chunk là StructuredChunk thì metadata có thêm page_start, page_end, section.
+        annotation: ChunkAnnotation đã tính cho chunk (None = tính lại)
+        """
+        annotation = annotation or annotate(chunk.text)
+        # filename_uuid = file_id gốc để có thể nhóm tất cả chunks của cùng 1 file
+        chunk_metadata = {
+            "file_id": file_id,
+            "chunk_index": chunk_index,
+            "title": title,
+            "description": description,
+            "filename": metadata.get("original_filename", ""),
+            "filename_uuid": file_id,  # Dùng file_id gốc làm filename_uuid để nhóm chunks theo file
+            "upload_time": metadata.get("upload_time", ""),
+            "file_size": metadata.get("file_size", 0),
+            "pages_count": metadata.get("pages_count", 0),
+            "chunk_length": len(chunk.text),
+            "token_count": annotation.token_count,
+            "language": annotation.language  # Ngôn ngữ chính của chunk
+        }
+        if chunk.page_start is not None:
+            chunk_metadata["page_start"] = chunk.page_start
+            chunk_metadata["page_end"] = chunk.page_end
+        if chunk.section:
+            chunk_metadata["section"] = chunk.section
+        return chunk_metadata
+    
+    @staticmethod
+    def _chunk_location(metadata):
+        """
+        Vị trí chunk trong tài liệu để trích dẫn (chunk cũ chưa có thông tin trang trả về None)
+        """
+        return {
+            "page_start": metadata.get("page_start"),
+            "page_end": metadata.get("page_end"),
+            "section": metadata.get("section", "")
+        }
+    
+    @_vector_writer
+    def write_chunks_to_vector_db(self, file_id, title, description, chunks, metadata,
+                                  progress_callback=None, batch_size=64, dedup_stats=None,
+                                  collection=None, chunk_id_prefix=None, centroid=None):
+        """
+        Lưu chunks vào ChromaDB theo từng batch cố định
         
-        chunks = []
-        start = 0
+        chunks có thể là generator: chỉ batch_size chunks được giữ trong bộ nhớ cùng lúc.
+        Lỗi khi đọc chunks (ví dụ lỗi trích xuất PDF) được raise lại cho caller,
+        lỗi của ChromaDB được trả về như kết quả.
         
-        while start < len(cleaned_text):
-            # Tính vị trí kết thúc chunk
-            end = start + chunk_size
-            
-            # Nếu chưa đến cuối text, tìm điểm ngắt tự nhiên (câu, đoạn)
-            if end < len(cleaned_text):
-                # Tìm điểm ngắt gần nhất với ưu tiên cao cho tiếng Việt
-                # Thêm các dấu câu tiếng Việt
-                break_chars = ['. ', '\n', '! ', '? ', '; ', ': ', '.\n', '!\n', '?\n']
-                
-                best_break = -1
-                for break_char in break_chars:
-                    break_pos = cleaned_text.rfind(break_char, start, end)
-                    if break_pos != -1:
-                        best_break = break_pos + len(break_char)
-                        break
-                
-                # Nếu không tìm thấy dấu câu, tìm khoảng trắng gần cuối chunk
-                if best_break == -1:
-                    space_pos = cleaned_text.rfind(' ', start, end)
-                    if space_pos != -1 and space_pos > start + chunk_size * 0.7:
-                        best_break = space_pos + 1
-                
-                if best_break != -1:
-                    end = best_break
-            
-            # Lấy chunk text
-            chunk = cleaned_text[start:end].strip()
-            if chunk:  # Chỉ thêm chunk không rỗng
-                chunks.append(chunk)
-            
-            # Di chuyển start position với overlap
-            start = max(start + 1, end - overlap)
+        Chunk trùng chính xác hoặc gần trùng với chunk đã lưu không được embed lại:
+        file chỉ ghi tham chiếu (ref_<file_id> trong metadata của chunk đã lưu).
+        
+        Args:
+            file_id: UUID của file
+            title: Tiêu đề tài liệu
+            description: Mô tả tài liệu
+            chunks: Iterable các chunk theo thứ tự (text hoặc StructuredChunk kèm trang/section)
+            metadata: Metadata của file (original_filename, upload_time, file_size, pages_count)
+            progress_callback: Hàm callback(stage, **progress) báo số chunks đã embed (optional)
+            batch_size: Số chunks embed và lưu mỗi lần
+            dedup_stats: Dict được cập nhật số chunk lưu mới / trùng chính xác / gần trùng (optional)
+            collection: Collection lưu chunk mới (mặc định collection knowledge base, re-index dùng
+                collection tạm); tham chiếu tới chunk đã lưu luôn ghi vào collection knowledge base
+            chunk_id_prefix: Tiền tố chunk ID (mặc định file_id)
+            centroid: CentroidAccumulator nhận embedding các chunk của file (mặc định: tạo mới và
+                ghi vào document index khi xong nếu ghi vào collection knowledge base)
             
-            # Tránh infinite loop
-            if start >= len(cleaned_text):
-                break
+        Returns:
+            tuple: (success, chunks_count, error_message) - chunks_count tính cả chunk dùng chung
+        """
+        # Kiểm tra ChromaDB đã được khởi tạo chưa
+        if not self.collection:
+            return False, 0, "ChromaDB not initialized"
+        
+        stats = dedup_stats if dedup_stats is not None else {}
+        for match in (MATCH_STORED, "exact", "near"):
+            stats.setdefault(match, 0)
+        publish_centroid = centroid is None and collection is None
+        centroid = centroid if centroid is not None else CentroidAccumulator()
+        
+        chunks_count = 0
+        batch_ids = []
+        batch_documents = []
+        batch_metadatas = []
+        shared_chunk_ids = []   # Chunk của file khác mà file này tham chiếu tới
+        
+        def flush():
+            # Embed và lưu vào ChromaDB (chỉ chunk chưa có)
+            try:
+                if batch_ids:
+                    centroid.add(batch_ids, self._add_to_collection(batch_ids, batch_documents, batch_metadatas,
+                                                                    collection=collection))
+                if shared_chunk_ids:
+                    unique_ids = list(dict.fromkeys(shared_chunk_ids))
+                    self.collection.update(ids=unique_ids, metadatas=[{ref_key(file_id): True}] * len(unique_ids))
+                    # Chunk dùng chung không embed lại: lấy embedding đã lưu cho centroid của file
+                    shared = self.collection.get(ids=unique_ids, include=["embeddings"])
+                    centroid.add(shared["ids"], shared["embeddings"])
+            except Exception as e:
+                raise _VectorDBWriteError(str(e)) from e
+            self.chunk_dedup.commit()
+            self.lexical_index.commit()
+            self.trigram_index.commit()
+            if collection is None:
+                # Chunks ghi vào collection tạm của re-index chưa được search đọc tới (swap mới bump)
+                self.search_cache.bump_generation()
+            if progress_callback:
+                progress_callback("embedding", chunks_embedded=chunks_count)
+            batch_ids.clear()
+            batch_documents.clear()
+            batch_metadatas.clear()
+            shared_chunk_ids.clear()
+        
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = StructuredChunk(chunk, None, None, "")
+                # Tạo unique ID cho mỗi chunk (file_id + chunk_index)
+                chunk_id = f"{chunk_id_prefix or file_id}_chunk_{chunks_count}"
+                # Chuẩn hóa, ngôn ngữ, số token và hash chống trùng tính trong 1 lần
+                annotation = annotate(chunk.text)
+                stored_id, owner_id, match = self.chunk_dedup.match_or_add(
+                    chunk_id, file_id, chunks_count, chunk.text, chunk_hash=annotation.content_hash
+                )
+                stats[match] += 1
+                if match == MATCH_STORED:
+                    words = annotation.normalized.split()
+                    self.lexical_index.add_chunk(chunk_id, words)
+                    self.trigram_index.add_terms(words)
+                    batch_ids.append(chunk_id)
+                    batch_documents.append(chunk.text)
+                    batch_metadatas.append(
+                        self._build_chunk_metadata(file_id, chunks_count, chunk, title, description, metadata,
+                                                   annotation=annotation)
+                    )
+                elif owner_id != file_id:
+                    shared_chunk_ids.append(stored_id)
+                chunks_count += 1
+                if len(batch_ids) + len(shared_chunk_ids) >= batch_size:
+                    flush()
+            
+            if batch_ids or shared_chunk_ids:
+                flush()
+        except _VectorDBWriteError as e:
+            error_msg = f"Error saving to vector DB: {str(e)}"
+            print(f"❌ {error_msg}")
+            return False, 0, error_msg
+        
+        if chunks_count == 0:
+            return False, 0, "No text chunks to save"
+        if publish_centroid:
+            # Kết quả tìm 2 bước tính trước khi file có centroid không được dùng lại
+            self.document_index.set_file(file_id, centroid)
+            self.search_cache.bump_generation()
         
-        return chunks
+        print(f"✅ Saved {stats[MATCH_STORED]} chunks to ChromaDB for file: {title} "
+              f"({stats['exact']} exact / {stats['near']} near duplicates reused)")
+        return True, chunks_count, None
     
-    def save_to_vector_db(self, file_id, title, description, extracted_text, metadata):
+    def save_to_vector_db(self, file_id, title, description, extracted_text, metadata,
+                          progress_callback=None, batch_size=64):
         """
         Lưu text đã trích xuất vào ChromaDB vector database
         
@@ -279,76 +807,56 @@ class KnowledgeBaseService:
             description: Mô tả tài liệu  
             extracted_text: Text đã trích xuất từ PDF
             metadata: Metadata của file
+            progress_callback: Hàm callback(stage, **progress) báo số chunks đã embed (optional)
+            batch_size: Số chunks embed và lưu mỗi lần
             
         Returns:
             tuple: (success, chunks_count, error_message)
         """
         try:
-            # Kiểm tra ChromaDB đã được khởi tạo chưa
-            if not self.collection:
-                return False, 0, "ChromaDB not initialized"
-            
             # Chia text thành các chunks nhỏ
             text_chunks = self._split_text_into_chunks(extracted_text)
-            
-            if not text_chunks:
-                return False, 0, "No text chunks to save"
-            
-            # Chuẩn bị dữ liệu cho ChromaDB
-            chunk_ids = []
-            chunk_documents = []
-            chunk_metadatas = []
-            
-            for i, chunk in enumerate(text_chunks):
-                # Tạo unique ID cho mỗi chunk (file_id + chunk_index)
-                chunk_id = f"{file_id}_chunk_{i}"
-                
-                # Phát hiện ngôn ngữ chính của chunk
-                language = self._detect_language(chunk)
-                
-                # Chuẩn hóa nội dung chunk để tìm kiếm tốt hơn
-                normalized_chunk = self._normalize_vietnamese_text(chunk)
-                
-                # Metadata cho mỗi chunk
-                # filename_uuid = file_id gốc để có thể nhóm tất cả chunks của cùng 1 file
-                chunk_metadata = {
-                    "file_id": file_id,
-                    "chunk_index": i,
-                    "title": title,
-                    "description": description,
-                    "filename": metadata.get("original_filename", ""),
-                    "filename_uuid": file_id,  # Dùng file_id gốc làm filename_uuid để nhóm chunks theo file
-                    "upload_time": metadata.get("upload_time", ""),
-                    "file_size": metadata.get("file_size", 0),
-                    "pages_count": metadata.get("pages_count", 0),
-                    "chunk_length": len(chunk),
-                    "language": language,
-                    "normalized_content": normalized_chunk  # Thêm content đã chuẩn hóa
-                }
-                
-                chunk_ids.append(chunk_id)
-                chunk_documents.append(chunk)
-                chunk_metadatas.append(chunk_metadata)
-            
-            # Lưu vào ChromaDB với auto-generated embeddings
-            self.collection.add(
-                documents=chunk_documents,
-                metadatas=chunk_metadatas,
-                ids=chunk_ids
+            return self.write_chunks_to_vector_db(
+                file_id, title, description, text_chunks, metadata,
+                progress_callback=progress_callback, batch_size=batch_size
             )
             
-            print(f"✅ Saved {len(text_chunks)} chunks to ChromaDB for file: {title}")
-            return True, len(text_chunks), None
-            
         except Exception as e:
             error_msg = f"Error saving to vector DB: {str(e)}"
             print(f"❌ {error_msg}")
             return False, 0, error_msg
     
+    def _embed_queries(self, texts):
+        """
+        Embedding của các câu hỏi, dùng lại embedding đã tính cho câu hỏi cùng dạng chuẩn hóa
+        
+        Args:
+            texts: List câu hỏi
+            
+        Returns:
+            list: Vector embedding theo cùng thứ tự
+        """
+        embeddings = {}
+        for index, text in enumerate(texts):
+            cached = self.search_cache.get_embedding(self.embedder.name, text)
+            if cached is not None:
+                embeddings[index] = cached
+        missing = [index for index in range(len(texts)) if index not in embeddings]
+        if missing:
+            computed = self.embedder.embed_queries([texts[index] for index in missing])
+            for index, embedding in zip(missing, computed):
+                self.search_cache.put_embedding(self.embedder.name, texts[index], embedding)
+                embeddings[index] = embedding
+        return [embeddings[index] for index in range(len(texts))]
+    
     def search_in_vector_db(self, query, n_results=5, file_id=None):
         """
         Tìm kiếm trong vector database
         
+        Tìm trên toàn knowledge base có từ KB_TWO_STAGE_MIN_CHUNKS chunks trở lên: chỉ tìm chunk
+        trong KB_TWO_STAGE_TOP_FILES file có centroid gần câu hỏi nhất (document index), tìm trên
+        toàn bộ chunks nếu các file đó không đủ n_results kết quả.
+        
         Args:
             query: Câu hỏi/từ khóa tìm kiếm
             n_results: Số kết quả trả về
@@ -361,18 +869,25 @@ class KnowledgeBaseService:
             if not self.collection:
                 return False, [], "ChromaDB not initialized"
             
-            # Chuẩn bị filter nếu cần tìm trong file cụ thể
+            query_embeddings = self._embed_queries([query])
+            
+            # Chuẩn bị filter nếu cần tìm trong file cụ thể (alias dùng chunks của file gốc)
             where_filter = None
             if file_id:
-                where_filter = {"file_id": file_id}
-            
-            # Thực hiện tìm kiếm vector similarity
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results,
-                where=where_filter,
-                include=["documents", "metadatas", "distances"]
-            )
+                where_filter = self._file_filter([self.file_hash_index.resolve(file_id)], key="file_id")
+            
+            results = None
+            with self._search_gate.read():
+                if not file_id and self._use_two_stage_search():
+                    results = self._two_stage_query(query_embeddings[0], n_results)
+                if results is None:
+                    # Thực hiện tìm kiếm vector similarity
+                    results = self.collection.query(
+                        query_embeddings=query_embeddings,
+                        n_results=n_results,
+                        where=where_filter,
+                        include=["documents", "metadatas", "distances"]
+                    )
             
             # Format kết quả trả về
             formatted_results = []
@@ -391,6 +906,40 @@ class KnowledgeBaseService:
             error_msg = f"Error searching vector DB: {str(e)}"
             return False, [], error_msg
     
+    def _use_two_stage_search(self):
+        """Knowledge base đủ lớn để tìm 2 bước (chọn file theo centroid trước khi tìm chunk) chưa"""
+        return (self.two_stage_top_files > 0
+                and self.document_index.file_count() > self.two_stage_top_files
+                and self.document_index.chunk_count() >= self.two_stage_min_chunks)
+    
+    def _two_stage_query(self, query_embedding, n_results):
+        """
+        Tìm 2 bước: chọn file theo centroid, xếp hạng chunk của các file đó bằng document index
+        rồi chỉ lấy nội dung các chunk được chọn từ ChromaDB (theo ID, không dùng filter where)
+        
+        Returns:
+            dict: Kết quả cùng dạng collection.query, None nếu các file được chọn không đủ n_results chunks
+        """
+        candidate_files = self.document_index.top_files(query_embedding, self.two_stage_top_files)
+        ranked = self.document_index.search_chunks(
+            [candidate for candidate, _ in candidate_files], query_embedding, n_results,
+            space=config_of_collection(self.collection).space
+        )
+        if len(ranked) < n_results:
+            return None
+        stored = self.collection.get(ids=[chunk_id for chunk_id, _ in ranked], include=["documents", "metadatas"])
+        records = {chunk_id: (document, chunk_metadata) for chunk_id, document, chunk_metadata
+                   in zip(stored["ids"], stored["documents"], stored["metadatas"])}
+        # Chunk vừa bị xóa (document index chưa cập nhật) bị bỏ qua
+        ranked = [(chunk_id, distance) for chunk_id, distance in ranked if chunk_id in records]
+        return {
+            "ids": [[chunk_id for chunk_id, _ in ranked]],
+            "documents": [[records[chunk_id][0] for chunk_id, _ in ranked]],
+            "metadatas": [[records[chunk_id][1] for chunk_id, _ in ranked]],
+            "distances": [[distance for _, distance in ranked]]
+        }
+    
+    @_vector_writer
     def delete_from_vector_db(self, file_id):
         """
         Xóa tất cả chunks của một file khỏi vector database
@@ -405,34 +954,94 @@ class KnowledgeBaseService:
             if not self.collection:
                 return False, "ChromaDB not initialized"
             
+            # Chunk file sở hữu mà file khác còn tham chiếu được chuyển chủ thay vì xóa
+            plan = self.chunk_dedup.remove_file(file_id)
+            
             # Tìm tất cả chunks của file này
             results = self.collection.get(
                 where={"file_id": file_id},
                 include=["documents"]
             )
             
-            if results["ids"]:
+            transfers = plan["transfer"]
+            delete_ids = [chunk_id for chunk_id in results["ids"] if chunk_id not in transfers]
+            # Kể cả chunk đã đăng ký nhưng chưa ghi được vào ChromaDB (ingest lỗi giữa chừng)
+            self._remove_lexical_chunks(set(delete_ids) | set(plan["delete"]))
+            if delete_ids:
                 # Xóa tất cả chunks
-                self.collection.delete(ids=results["ids"])
-                print(f"✅ Deleted {len(results['ids'])} chunks from ChromaDB for file: {file_id}")
+                self.collection.delete(ids=delete_ids)
+                print(f"✅ Deleted {len(delete_ids)} chunks from ChromaDB for file: {file_id}")
+            
+            if transfers:
+                transfer_ids = list(transfers)
+                self.collection.update(
+                    ids=transfer_ids,
+                    metadatas=[
+                        self._owner_chunk_metadata(*transfers[chunk_id]) for chunk_id in transfer_ids
+                    ]
+                )
+                print(f"♻️ Transferred {len(transfer_ids)} shared chunks of file {file_id} to other files")
+            
+            # Bỏ đánh dấu tham chiếu của file trên chunk của file khác
+            referenced = self.collection.get(where={ref_key(file_id): True}, include=["metadatas"])
+            if referenced["ids"]:
+                self.collection.update(
+                    ids=referenced["ids"],
+                    metadatas=[{ref_key(file_id): None}] * len(referenced["ids"])
+                )
             
+            self.document_index.remove_file(file_id)
+            self.search_cache.bump_generation()
             return True, None
             
         except Exception as e:
             error_msg = f"Error deleting from vector DB: {str(e)}"
             return False, error_msg
     
-    def process_uploaded_file(self, file, title, description):
+    def _remove_lexical_chunks(self, chunk_ids):
+        """Xóa chunks khỏi lexical index, bỏ khỏi từ vựng trigram các từ không còn chunk nào chứa"""
+        self.trigram_index.remove_terms(self.lexical_index.remove_chunks(chunk_ids))
+    
+    def _owner_chunk_metadata(self, file_id, chunk_index):
         """
-        Xử lý file upload hoàn chỉnh
+        Metadata chunk khi file_id trở thành file sở hữu chunk dùng chung
+        
+        Returns:
+            dict: Các trường cần cập nhật (ChromaDB gộp với metadata hiện có)
+        """
+        # Chủ mới là phiên bản đang re-index của 1 file -> chunk thuộc về file đó
+        owner_id = self._reindex_staging.get(file_id, file_id)
+        chunk_metadata = {
+            "file_id": owner_id,
+            "filename_uuid": owner_id,
+            "chunk_index": chunk_index,
+            ref_key(file_id): None,
+            ref_key(owner_id): None
+        }
+        file_metadata = self.load_file_metadata(owner_id)
+        if file_metadata:
+            chunk_metadata.update({
+                "title": file_metadata.get("title", ""),
+                "description": file_metadata.get("description", ""),
+                "filename": file_metadata.get("original_filename", ""),
+                "upload_time": file_metadata.get("upload_time", ""),
+                "file_size": file_metadata.get("file_size", 0),
+                "pages_count": file_metadata.get("pages_count", 0)
+            })
+        return chunk_metadata
+    
+    def save_uploaded_file(self, file, file_size=None):
+        """
+        Validate và lưu file upload xuống disk (bước nhanh, chạy trong HTTP request)
         
         Args:
             file: File object từ request
-            title: Tiêu đề tài liệu
-            description: Mô tả tài liệu
+            file_size: Kích thước đã biết trước (ví dụ file trong archive zip), None = đo từ stream
             
         Returns:
-            tuple: (success, result_data, error_message, status_code)
+            tuple: (success, saved_file, error_message, status_code)
+                saved_file gồm file_id, original_filename, stored_filename, file_path, file_size,
+                file_hash (MD5), sha256
         """
         try:
             # Validate file
@@ -442,139 +1051,449 @@ class KnowledgeBaseService:
             if not self.is_allowed_file(file.filename):
                 return False, None, "Only PDF files are allowed", 400
             
-            # Validate file size
-            is_valid_size, file_size, size_error = self.validate_file_size(file)
-            if not is_valid_size:
-                return False, None, size_error, 413
+            # Validate file size (stream trong zip không seek được rẻ -> dùng kích thước đã biết)
+            if file_size is None:
+                is_valid_size, file_size, size_error = self.validate_file_size(file)
+                if not is_valid_size:
+                    return False, None, size_error, 413
+            elif file_size > self.max_file_size:
+                return False, None, f"File size must be less than {self.max_file_size // (1024*1024)}MB", 413
+            
+            # file_id được tạo ngay khi lưu để retry ingestion dùng lại cùng ID
+            file_id = str(uuid.uuid4())
             
             # Generate unique filename
             unique_filename, timestamp = self.generate_unique_filename(file.filename)
+            output, file_path = self._open_new_upload_file(os.path.join(self.upload_folder, unique_filename), file_id)
+            
+            # Save file (hash được tính trong cùng lượt ghi)
+            try:
+                with output:
+                    write_success, file_info, write_error = self._write_upload_stream(file, output)
+            except Exception:
+                os.remove(file_path)
+                raise
+            if not write_success:
+                os.remove(file_path)
+                return False, None, write_error, 413
+            
+            saved_file = {
+                "file_id": file_id,
+                "original_filename": file.filename,
+                "stored_filename": os.path.basename(file_path),
+                "file_path": file_path,
+                **file_info
+            }
+            return True, saved_file, None, 200
+            
+        except Exception as e:
+            return False, None, f"Failed to save file: {str(e)}", 500
+    
+    def save_spooled_file(self, spool_path, original_filename, file_size):
+        """
+        Chuyển file đã upload xong (resumable upload) vào thư mục uploads
+        
+        File được rename/hard link (cùng filesystem) nên không copy dữ liệu; hash
+        được tính bằng 1 lượt đọc vì các phần có thể đến không theo thứ tự.
+        
+        Args:
+            spool_path: Đường dẫn file đã ghép đủ các phần
+            original_filename: Tên file gốc
+            file_size: Kích thước file
+            
+        Returns:
+            tuple: (success, saved_file, error_message, status_code) - cùng dạng save_uploaded_file
+        """
+        try:
+            file_id = str(uuid.uuid4())
+            unique_filename, _ = self.generate_unique_filename(original_filename)
             file_path = os.path.join(self.upload_folder, unique_filename)
+            base, extension = os.path.splitext(file_path)
+            # Không ghi đè file của upload khác cùng tên trong cùng giây (giống _open_new_upload_file)
+            for candidate in (file_path, f"{base}_{file_id[:8]}{extension}"):
+                try:
+                    os.link(spool_path, candidate)
+                except FileExistsError:
+                    continue
+                os.remove(spool_path)
+                file_path = candidate
+                break
+            else:
+                return False, None, "Failed to save file: target file already exists", 500
             
-            # Save file
-            file.save(file_path)
+            hashes = self.calculate_file_hashes(file_path)
+            saved_file = {
+                "file_id": file_id,
+                "original_filename": original_filename,
+                "stored_filename": os.path.basename(file_path),
+                "file_path": file_path,
+                "file_size": file_size,
+                "file_hash": hashes["md5"],
+                "sha256": hashes["sha256"]
+            }
+            return True, saved_file, None, 200
             
-            # Extract text from PDF
-            extract_success, extracted_text, pages_count, extract_error = self.extract_text_from_pdf(file_path)
-            if not extract_success:
-                # Clean up file if extraction failed
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                return False, None, extract_error, 500
+        except Exception as e:
+            return False, None, f"Failed to save file: {str(e)}", 500
+    
+    def check_duplicate_upload(self, saved_file, title, description,
+                               on_duplicate=DUPLICATE_RETURN_EXISTING, wait=True):
+        """
+        Kiểm tra file vừa lưu có trùng nội dung (SHA-256) với file đã có không
+        
+        Nếu không trùng, upload hiện tại nhận quyền ingest nội dung này. Nếu trùng,
+        file vừa lưu bị xóa và không cần trích xuất/embed lại.
+        
+        Args:
+            saved_file: Dict trả về từ save_uploaded_file
+            title: Tiêu đề tài liệu
+            description: Mô tả tài liệu
+            on_duplicate: "return_existing" (trả về file đã có) hoặc "alias" (tạo bản ghi alias)
+            wait: Chờ upload khác đang ingest cùng nội dung xong (True cho upload đồng bộ)
             
-            # Calculate file hash
-            file_hash = self.calculate_file_hash(file_path)
+        Returns:
+            tuple: (is_duplicate, result_data, message, status_code)
+                result_data có duplicate_of (file_id gốc) và ingestion_pending
+        """
+        owner_id, is_pending = self.file_hash_index.claim(
+            saved_file["sha256"], saved_file["file_id"],
+            wait_timeout=self.duplicate_wait_timeout if wait else 0
+        )
+        if owner_id is None:
+            return False, None, None, 200
+        
+        # Nội dung đã có -> bỏ file vừa lưu
+        if os.path.exists(saved_file["file_path"]):
+            os.remove(saved_file["file_path"])
+        print(f"♻️ Duplicate upload of {saved_file['original_filename']} (same content as {owner_id})")
+        
+        if on_duplicate == DUPLICATE_ALIAS:
+            alias_metadata = {
+                "file_id": saved_file["file_id"],
+                "alias_of": owner_id,
+                "original_filename": saved_file["original_filename"],
+                "title": title,
+                "description": description,
+                "file_size": saved_file["file_size"],
+                "file_hash": saved_file["file_hash"],
+                "sha256": saved_file["sha256"],
+                "upload_time": saved_file.get("upload_time") or datetime.now().isoformat()
+            }
+            metadata_success, _, metadata_error = self.save_file_metadata(saved_file["file_id"], alias_metadata)
+            if not metadata_success:
+                return True, None, metadata_error, 500
+            self.file_hash_index.add_alias(saved_file["file_id"], owner_id, created=True)
             
-            # Generate UUID for file_id
-            file_id = str(uuid.uuid4())
+            _, result_data, _ = self.get_file_by_id(saved_file["file_id"], include_text=False)
+            message = "Duplicate content, alias created for existing file"
+        else:
+            found, result_data, _ = self.get_file_by_id(owner_id, include_text=False)
+            if not found:
+                # File gốc vẫn đang ingest, chưa có metadata
+                result_data = {"file_id": owner_id, "file_hash": saved_file["file_hash"], "sha256": saved_file["sha256"]}
+            message = "Duplicate content, returning existing file"
+        
+        result_data["duplicate_of"] = owner_id
+        result_data["ingestion_pending"] = is_pending
+        return True, result_data, message, 200
+    
+    def _iter_document_chunks(self, pages, text_file, document_stats):
+        """
+        Pipeline streaming: trang PDF -> file text -> chunker -> chunks
+        
+        Mỗi trang được ghi ngay vào file text và đưa vào chunker (kèm số trang),
+        nên bộ nhớ chỉ giữ 1 trang và phần text chưa chia thành chunk.
+        
+        Args:
+            pages: Iterable text của từng trang theo thứ tự
+            text_file: File đang mở để ghi text đã trích xuất
+            document_stats: Dict được cập nhật page_offsets và text_length
+            
+        Yields:
+            StructuredChunk: Các chunk theo thứ tự
+        """
+        chunker = self._make_chunker(self.chunk_size, self.chunk_overlap)
+        for page_number, page_text in enumerate(pages, 1):
+            page_text += "\n"
+            document_stats["page_offsets"].append(document_stats["text_length"])
+            document_stats["text_length"] += len(page_text)
+            text_file.write(page_text)
+            yield from chunker.feed(page_text, page_number)
+        yield from chunker.finish()
+    
+    @_vector_writer
+    def ingest_saved_file(self, saved_file, title, description, progress_callback=None):
+        """
+        Trích xuất, lưu metadata và embed file đã lưu vào vector database
+        
+        Các bước chạy theo kiểu streaming (trích xuất -> chia chunk -> embed -> ghi)
+        với batch cố định, nên bộ nhớ không tăng theo số trang của tài liệu.
+        
+        Idempotent: chunks cũ của cùng file_id bị xóa trước khi lưu, nên có thể
+        chạy lại an toàn khi job bị retry hoặc server restart giữa chừng.
+        
+        Args:
+            saved_file: Dict trả về từ save_uploaded_file
+            title: Tiêu đề tài liệu
+            description: Mô tả tài liệu
+            progress_callback: Hàm callback(stage, **progress) báo tiến độ (optional)
+            
+        Returns:
+            tuple: (success, result_data, error_message, status_code)
+        """
+        # Trích xuất và embed chạy xen kẽ -> gộp tiến độ của 2 bước vào stage "ingesting"
+        progress = {}
+        
+        def report(stage, **stage_progress):
+            progress.update(stage_progress)
+            if progress_callback:
+                progress_callback(stage, **progress)
+        
+        def report_ingesting(stage, **stage_progress):
+            report("ingesting", **stage_progress)
+        
+        try:
+            file_id = saved_file["file_id"]
+            file_path = saved_file["file_path"]
+            
+            # Hash được tính khi ghi upload; job tạo trước khi có bước này thì tính lại
+            if not saved_file.get("sha256"):
+                report("hashing")
+                saved_file = dict(saved_file, **self.calculate_file_hashes(file_path))
+                saved_file["file_hash"] = saved_file.pop("md5")
+            self.file_hash_index.mark_pending(saved_file["sha256"], file_id)
+            
+            try:
+                pages_count = self.pdf_extractor.count_pages(file_path)
+            except Exception as e:
+                return False, None, f"Error extracting text from PDF: {str(e)}", 500
             
             # Create metadata
             metadata = {
                 "file_id": file_id,
-                "original_filename": file.filename,
+                "original_filename": saved_file["original_filename"],
                 "title": title,
-                "stored_filename": unique_filename,
+                "stored_filename": saved_file["stored_filename"],
                 "file_path": file_path,
-                "file_size": file_size,
-                "file_hash": file_hash,
+                "file_size": saved_file["file_size"],
+                "file_hash": saved_file["file_hash"],
+                "sha256": saved_file["sha256"],
                 "pages_count": pages_count,
-                "text_length": len(extracted_text),
-                "upload_time": datetime.now().isoformat(),
-                "description": description,
-                "extracted_text": extracted_text
+                "text_length": 0,
+                "chunk_size": self.chunk_size,
+                "chunk_overlap": self.chunk_overlap,
+                "chunk_unit": self.chunk_unit,
+                "chunk_strategy": self.chunk_strategy,
+                "upload_time": saved_file.get("upload_time") or datetime.now().isoformat(),
+                "description": description
             }
             
-            # Save metadata
-            metadata_success, metadata_path, metadata_error = self.save_file_metadata(file_id, metadata)
-            if not metadata_success:
-                # Clean up file if metadata saving failed
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                return False, None, metadata_error, 500
+            # Xóa chunks của lần chạy trước (nếu có) để retry không tạo chunk trùng
+            self.delete_from_vector_db(file_id)
             
-            # Save extracted text
-            text_success, text_path, text_error = self.save_extracted_text(file_id, extracted_text)
-            if not text_success:
-                # Clean up files if text saving failed
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                if os.path.exists(metadata_path):
-                    os.remove(metadata_path)
-                return False, None, text_error, 500
-            
-            # Lưu vào ChromaDB vector database
+            # Extract -> chunk -> embed -> lưu ChromaDB theo từng batch
             # Chức năng này cho phép tìm kiếm semantic trong nội dung PDF
-            vector_success, chunks_count, vector_error = self.save_to_vector_db(
-                file_id, title, description, extracted_text, metadata
-            )
+            report("ingesting", pages_total=pages_count, pages_processed=0, chunks_embedded=0)
+            document_stats = {"page_offsets": [], "text_length": 0}
+            text_path = os.path.join(self.upload_folder, f"{file_id}_text.txt")
+            # Nhiều file ingest cùng lúc: PyPDF2 giữ GIL nên PDF nhỏ cũng được trích xuất trên process pool
+            with self._active_ingests_lock:
+                self._active_ingests += 1
+                parallel_extraction = True if self._active_ingests > 1 and self.pdf_extractor.max_workers > 1 else None
+            try:
+                with open(text_path, 'w', encoding='utf-8', newline='') as text_file:
+                    pages = self.pdf_extractor.iter_pages(
+                        file_path, progress_callback=report_ingesting, pages_count=pages_count,
+                        parallel=parallel_extraction
+                    )
+                    chunks = self._iter_document_chunks(pages, text_file, document_stats)
+                    dedup_stats = {}
+                    vector_success, chunks_count, vector_error = self.write_chunks_to_vector_db(
+                        file_id, title, description, chunks, metadata,
+                        progress_callback=report_ingesting, dedup_stats=dedup_stats
+                    )
+                    # ChromaDB lỗi giữa chừng -> vẫn trích xuất hết để lưu text và metadata
+                    for _ in chunks:
+                        pass
+            except Exception as e:
+                self.delete_from_vector_db(file_id)
+                return False, None, f"Error extracting text from PDF: {str(e)}", 500
+            finally:
+                with self._active_ingests_lock:
+                    self._active_ingests -= 1
             
             # Ghi log nhưng không fail nếu vector DB có lỗi
             if not vector_success:
                 print(f"⚠️ Warning: Could not save to vector DB: {vector_error}")
                 # Không return error vì file đã được lưu thành công
+                self.delete_from_vector_db(file_id)
             else:
                 print(f"✅ Successfully saved {chunks_count} text chunks to vector database")
             
+            # Text đầy đủ nằm trong {file_id}_text.txt, metadata chỉ giữ page_offsets
+            # page_offsets: vị trí bắt đầu của từng trang trong extracted text (dùng cho chunk metadata)
+            metadata["text_length"] = document_stats["text_length"]
+            metadata["page_offsets"] = document_stats["page_offsets"]
+            
+            # Save metadata
+            report("saving_metadata")
+            metadata_success, metadata_path, metadata_error = self.save_file_metadata(file_id, metadata)
+            if not metadata_success:
+                self.delete_from_vector_db(file_id)
+                return False, None, metadata_error, 500
+            
             # Prepare response data (exclude sensitive info)
             response_data = {
                 key: value for key, value in metadata.items() 
-                if key not in ['extracted_text', 'file_path', 'stored_filename']
+                if key not in ['file_path', 'stored_filename', 'page_offsets']
             }
             
             # Thêm thông tin về vector DB vào response
             response_data['vector_chunks_count'] = chunks_count if vector_success else 0
             response_data['vector_db_status'] = 'success' if vector_success else 'warning'
+            if vector_success:
+                response_data['vector_chunks_stored'] = dedup_stats[MATCH_STORED]
+                response_data['vector_chunks_shared'] = dedup_stats['exact'] + dedup_stats['near']
+            
+            self.file_hash_index.add_file(saved_file["sha256"], file_id)
+            
+            report("completed")
+            return True, response_data, "File uploaded and processed successfully", 200
+            
+        except Exception as e:
+            return False, None, f"Failed to process file: {str(e)}", 500
+    
+    def discard_saved_file(self, saved_file):
+        """
+        Dọn dẹp file upload, metadata và text khi ingestion thất bại
+        
+        Args:
+            saved_file: Dict trả về từ save_uploaded_file
+        """
+        file_id = saved_file["file_id"]
+        paths = [
+            saved_file["file_path"],
+            os.path.join(self.upload_folder, f"{file_id}_text.txt")
+        ]
+        self.file_catalog.delete(file_id)
+        # Alias tạo trong lúc file gốc đang ingest không còn gì để trỏ tới
+        for alias_id in self.file_hash_index.aliases_of(file_id):
+            self.file_catalog.delete(alias_id)
+            self.file_hash_index.remove_alias(alias_id)
+        
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        
+        if saved_file.get("sha256"):
+            self.file_hash_index.release(saved_file["sha256"], file_id)
+    
+    def process_uploaded_file(self, file, title, description, on_duplicate=DUPLICATE_RETURN_EXISTING):
+        """
+        Xử lý file upload hoàn chỉnh (đồng bộ trong HTTP request)
+        
+        Args:
+            file: File object từ request
+            title: Tiêu đề tài liệu
+            description: Mô tả tài liệu
+            on_duplicate: Cách xử lý khi nội dung trùng file đã có ("return_existing" hoặc "alias")
             
-            return True, response_data, "File uploaded and processed successfully", 200
+        Returns:
+            tuple: (success, result_data, error_message, status_code)
+        """
+        save_success, saved_file, save_error, status_code = self.save_uploaded_file(file)
+        if not save_success:
+            return False, None, save_error, status_code
+        return self.process_saved_file(saved_file, title, description, on_duplicate=on_duplicate)
+    
+    def process_saved_file(self, saved_file, title, description, on_duplicate=DUPLICATE_RETURN_EXISTING):
+        """
+        Kiểm tra trùng nội dung và ingest file đã lưu (xóa file nếu ingest thất bại)
+        
+        Args:
+            saved_file: Dict trả về từ save_uploaded_file
+            title: Tiêu đề tài liệu
+            description: Mô tả tài liệu
+            on_duplicate: Cách xử lý khi nội dung trùng file đã có ("return_existing" hoặc "alias")
             
-        except Exception as e:
-            return False, None, f"Failed to process file: {str(e)}", 500
+        Returns:
+            tuple: (success, result_data, error_message, status_code)
+        """
+        # Upload trùng nội dung -> dùng lại file đã có (chờ nếu đang được ingest)
+        is_duplicate, result_data, message, status_code = self.check_duplicate_upload(
+            saved_file, title, description, on_duplicate=on_duplicate
+        )
+        if is_duplicate:
+            return result_data is not None, result_data, message, status_code
+        
+        success, result_data, message, status_code = self.ingest_saved_file(saved_file, title, description)
+        if not success:
+            # Clean up files if processing failed
+            self.discard_saved_file(saved_file)
+        return success, result_data, message, status_code
+    
+    def process_uploaded_files(self, uploads, on_duplicate=DUPLICATE_RETURN_EXISTING, workers=None):
+        """
+        Xử lý nhiều file upload (bulk upload) đồng bộ
+        
+        File được lưu xuống disk lần lượt theo thứ tự đọc (request hoặc archive zip); mỗi file
+        lưu xong được đưa ngay vào thread pool giới hạn để ingest trong lúc các file sau
+        tiếp tục được lưu.
+        
+        Args:
+            uploads: Iterable BulkUpload (filename, file, title, description, file_size)
+            on_duplicate: Cách xử lý khi nội dung trùng file đã có ("return_existing" hoặc "alias")
+            workers: Số file ingest song song (mặc định self.ingest_workers)
+            
+        Returns:
+            list: (success, result_data, error_message, status_code) của từng file, cùng thứ tự uploads
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=workers or self.ingest_workers, thread_name_prefix="kb-bulk") as executor:
+            for upload in uploads:
+                save_success, saved_file, save_error, status_code = self.save_uploaded_file(
+                    upload.file, file_size=upload.file_size
+                )
+                if not save_success:
+                    results.append((False, None, save_error, status_code))
+                    continue
+                results.append(executor.submit(
+                    self.process_saved_file, saved_file, upload.title, upload.description, on_duplicate
+                ))
+        
+        processed = []
+        for result in results:
+            if isinstance(result, Future):
+                try:
+                    result = result.result()
+                except Exception as e:
+                    result = (False, None, f"Failed to process file: {str(e)}", 500)
+            processed.append(result)
+        return processed
     
-    def get_uploaded_files(self):
+    def get_uploaded_files(self, limit=None, offset=0, sort_by="upload_time", descending=True):
         """
-        Lấy danh sách các file đã upload
+        Lấy danh sách các file đã upload từ file catalog
+        
+        Args:
+            limit: Số file tối đa mỗi trang (None = tất cả)
+            offset: Vị trí bắt đầu
+            sort_by: Trường sắp xếp (upload_time, title, filename, file_size, pages_count)
+            descending: Sắp xếp giảm dần (mặc định mới nhất trước)
         
         Returns:
             tuple: (success, files_data, error_message)
         """
         try:
-            files_list = []
-            
-            # Kiểm tra thư mục upload tồn tại
-            if not os.path.exists(self.upload_folder):
-                return True, {"files": [], "total_files": 0}, None
-            
-            # Duyệt qua các file metadata
-            for filename in os.listdir(self.upload_folder):
-                if filename.endswith('_metadata.json'):
-                    metadata_path = os.path.join(self.upload_folder, filename)
-                    try:
-                        with open(metadata_path, 'r', encoding='utf-8') as f:
-                            metadata = json.load(f)
-                        
-                        # Chỉ lấy thông tin cần thiết
-                        file_info = {
-                            'file_id': metadata.get('file_id'),
-                            'filename': metadata.get('original_filename'),
-                            'title': metadata.get('title'),
-                            'file_size': metadata.get('file_size'),
-                            'pages_count': metadata.get('pages_count'),
-                            'text_length': metadata.get('text_length'),
-                            'upload_time': metadata.get('upload_time'),
-                            'description': metadata.get('description', '')
-                        }
-                        files_list.append(file_info)
-                        
-                    except Exception as e:
-                        # Skip files with invalid metadata
-                        continue
-            
-            # Sắp xếp theo thời gian upload (mới nhất trước)
-            files_list.sort(key=lambda x: x.get('upload_time', ''), reverse=True)
+            files_list, total_files = self.file_catalog.list_files(
+                limit=limit, offset=offset, sort_by=sort_by, descending=descending
+            )
             
             result_data = {
                 "files": files_list,
-                "total_files": len(files_list)
+                "total_files": total_files,
+                "limit": limit,
+                "offset": offset
             }
             
             return True, result_data, None
@@ -582,29 +1501,55 @@ class KnowledgeBaseService:
         except Exception as e:
             return False, None, f"Failed to list files: {str(e)}"
     
-    def get_file_by_id(self, file_id):
+    def _merge_alias_metadata(self, metadata):
+        """
+        Bổ sung thông tin nội dung (số trang, độ dài text...) của file gốc cho bản ghi alias
+        
+        Args:
+            metadata: Metadata đã đọc từ file catalog
+            
+        Returns:
+            dict: Metadata (alias được bổ sung các trường còn thiếu từ file gốc)
+        """
+        owner_id = metadata.get('alias_of')
+        if not owner_id:
+            return metadata
+        
+        owner_metadata = self.load_file_metadata(owner_id)
+        if not owner_metadata:
+            return metadata
+        return {**owner_metadata, **metadata}
+    
+    def get_file_by_id(self, file_id, include_text=True):
         """
         Lấy thông tin chi tiết của một file theo ID
         
         Args:
             file_id: ID của file
+            include_text: Có trả về extracted_text không
             
         Returns:
             tuple: (success, file_data, error_message)
         """
         try:
-            metadata_path = os.path.join(self.upload_folder, f"{file_id}_metadata.json")
-            
-            if not os.path.exists(metadata_path):
+            metadata = self.load_file_metadata(file_id)
+            if not metadata:
                 return False, None, "File not found"
+            metadata = self._merge_alias_metadata(metadata)
             
-            with open(metadata_path, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
+            # Text đã trích xuất được lưu riêng trong {file_id}_text.txt
+            # Alias dùng chung text của file gốc
+            if include_text:
+                text_owner_id = metadata.get('alias_of') or file_id
+                text_path = os.path.join(self.upload_folder, f"{text_owner_id}_text.txt")
+                if os.path.exists(text_path):
+                    with open(text_path, 'r', encoding='utf-8') as f:
+                        metadata['extracted_text'] = f.read()
             
             # Exclude sensitive information
             file_data = {
                 key: value for key, value in metadata.items() 
-                if key not in ['file_path', 'stored_filename']
+                if key not in ['file_path', 'stored_filename', 'page_offsets']
             }
             
             return True, file_data, None
@@ -612,6 +1557,7 @@ class KnowledgeBaseService:
         except Exception as e:
             return False, None, f"Error retrieving file: {str(e)}"
     
+    @_vector_writer
     def delete_file(self, file_id):
         """
         Xóa file và metadata
@@ -623,17 +1569,29 @@ class KnowledgeBaseService:
             tuple: (success, error_message)
         """
         try:
-            # Paths to delete
-            metadata_path = os.path.join(self.upload_folder, f"{file_id}_metadata.json")
+            # Paths to delete (metadata JSON cũ đã import vào catalog, còn chứa text trích xuất)
+            legacy_metadata_path = os.path.join(self.upload_folder, f"{file_id}_metadata.json")
             text_path = os.path.join(self.upload_folder, f"{file_id}_text.txt")
             
             # Get file path from metadata
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-                    file_path = metadata.get('file_path')
-            else:
+            metadata = self.load_file_metadata(file_id)
+            if not metadata:
                 return False, "File not found"
+            file_path = metadata.get('file_path')
+            
+            # Alias chỉ có bản ghi metadata, file PDF/text/chunks thuộc về file gốc
+            if metadata.get('alias_of'):
+                self.file_catalog.delete(file_id)
+                if os.path.exists(legacy_metadata_path):
+                    os.remove(legacy_metadata_path)
+                self.file_hash_index.remove_alias(file_id)
+                print(f"✅ Successfully deleted alias {file_id} of file {metadata['alias_of']}")
+                return True, None
+            
+            # File gốc còn alias -> chuyển quyền sở hữu nội dung cho alias cũ nhất thay vì xóa
+            alias_ids = self.file_hash_index.aliases_of(file_id)
+            if alias_ids:
+                return self._transfer_file_ownership(metadata, alias_ids)
             
             # Xóa khỏi vector database trước
             # Điều này đảm bảo không còn tham chiếu đến file trong vector DB
@@ -643,7 +1601,8 @@ class KnowledgeBaseService:
                 # Tiếp tục xóa file dù vector DB có lỗi
             
             # Delete files from filesystem
-            files_to_delete = [metadata_path, text_path]
+            self.file_catalog.delete(file_id)
+            files_to_delete = [legacy_metadata_path, text_path]
             if file_path and os.path.exists(file_path):
                 files_to_delete.append(file_path)
             
@@ -651,12 +1610,384 @@ class KnowledgeBaseService:
                 if os.path.exists(file_to_delete):
                     os.remove(file_to_delete)
             
+            if metadata.get('sha256'):
+                self.file_hash_index.remove_file(metadata['sha256'], file_id)
+            
             print(f"✅ Successfully deleted file {file_id} and all associated data")
             return True, None
             
         except Exception as e:
             return False, f"Error deleting file: {str(e)}"
     
+    def _transfer_file_ownership(self, metadata, alias_ids):
+        """
+        Xóa file gốc còn alias: alias cũ nhất trở thành file gốc mới
+        
+        File PDF, text và chunks được giữ nguyên (không embed lại), chỉ đổi file_id,
+        title, description trong metadata của chunks.
+        
+        Args:
+            metadata: Metadata của file gốc đang bị xóa
+            alias_ids: Danh sách file_id alias của file gốc
+            
+        Returns:
+            tuple: (success, error_message)
+        """
+        file_id = metadata["file_id"]
+        aliases = []
+        for alias_id in alias_ids:
+            aliases.append(self.load_file_metadata(alias_id))
+        aliases.sort(key=lambda alias: alias.get("upload_time", ""))
+        new_owner = aliases[0]
+        new_owner_id = new_owner["file_id"]
+        
+        # Chunks: đổi chủ sở hữu sang alias (kể cả tham chiếu tới chunk dùng chung)
+        self.chunk_dedup.rename_file(file_id, new_owner_id)
+        self.document_index.rename_file(file_id, new_owner_id)
+        if self.collection:
+            referenced = self.collection.get(where={ref_key(file_id): True}, include=["metadatas"])
+            if referenced["ids"]:
+                self.collection.update(
+                    ids=referenced["ids"],
+                    metadatas=[{ref_key(file_id): None, ref_key(new_owner_id): True}] * len(referenced["ids"])
+                )
+            chunks = self.collection.get(where={"file_id": file_id}, include=["metadatas"])
+            if chunks["ids"]:
+                self.collection.update(
+                    ids=chunks["ids"],
+                    metadatas=[
+                        dict(chunk_metadata,
+                             file_id=new_owner_id,
+                             filename_uuid=new_owner_id,
+                             title=new_owner.get("title", ""),
+                             description=new_owner.get("description", ""),
+                             filename=new_owner.get("original_filename", ""),
+                             upload_time=new_owner.get("upload_time", ""))
+                        for chunk_metadata in chunks["metadatas"]
+                    ]
+                )
+        
+        text_path = os.path.join(self.upload_folder, f"{file_id}_text.txt")
+        if os.path.exists(text_path):
+            os.replace(text_path, os.path.join(self.upload_folder, f"{new_owner_id}_text.txt"))
+        
+        owner_metadata = {key: value for key, value in metadata.items() if key != "alias_of"}
+        owner_metadata.update({
+            key: new_owner[key] for key in ("file_id", "original_filename", "title", "description", "upload_time")
+            if key in new_owner
+        })
+        self.save_file_metadata(new_owner_id, owner_metadata)
+        self.file_hash_index.remove_alias(new_owner_id)
+        
+        for alias in aliases[1:]:
+            alias["alias_of"] = new_owner_id
+            self.save_file_metadata(alias["file_id"], alias)
+            self.file_hash_index.add_alias(alias["file_id"], new_owner_id)
+        
+        if metadata.get("sha256"):
+            self.file_hash_index.add_file(metadata["sha256"], new_owner_id)
+        self.file_catalog.delete(file_id)
+        legacy_metadata_path = os.path.join(self.upload_folder, f"{file_id}_metadata.json")
+        if os.path.exists(legacy_metadata_path):
+            os.remove(legacy_metadata_path)
+        self.search_cache.bump_generation()
+        
+        print(f"✅ Deleted file {file_id}, content now owned by alias {new_owner_id}")
+        return True, None
+    
+    def _validate_chunking(self, chunk_size, overlap):
+        """
+        Returns:
+            str: Thông báo lỗi nếu tham số chia chunk không hợp lệ, None nếu hợp lệ
+        """
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            return "chunk_size must be a positive integer"
+        if not isinstance(overlap, int) or overlap < 0 or overlap >= chunk_size:
+            return "chunk_overlap must be an integer between 0 and chunk_size - 1"
+        return None
+    
+    def _reindex_lock(self, file_id):
+        """Lock theo file để 2 lần re-index cùng file không chạy đồng thời"""
+        with self._reindex_locks_guard:
+            return self._reindex_locks.setdefault(file_id, threading.Lock())
+    
+    def _get_staging_collection(self):
+        """Collection tạm chứa chunks mới trong lúc re-index (search không đọc collection này)"""
+        return self.chroma_client.get_or_create_collection(
+            name=f"{self.collection.name}_reindex",
+            metadata={"description": "Staging chunks of files being re-indexed"}
+        )
+    
+    def _iter_stored_text_chunks(self, file_id, page_offsets, chunk_size, overlap, block_size=1024 * 1024):
+        """
+        Chia lại text đã trích xuất ({file_id}_text.txt) thành chunks, đọc file theo từng trang
+        (page_offsets trong metadata) hoặc từng block nếu không có vị trí trang
+        
+        Yields:
+            StructuredChunk: Các chunk theo thứ tự
+        """
+        chunker = self._make_chunker(chunk_size, overlap)
+        text_path = os.path.join(self.upload_folder, f"{file_id}_text.txt")
+        with open(text_path, 'r', encoding='utf-8', newline='') as f:
+            if page_offsets:
+                page_ends = page_offsets[1:] + [None]
+                for page_number, (page_start, page_end) in enumerate(zip(page_offsets, page_ends), 1):
+                    page_text = f.read(page_end - page_start) if page_end is not None else f.read()
+                    yield from chunker.feed(page_text, page_number)
+            else:
+                for block in iter(lambda: f.read(block_size), ''):
+                    yield from chunker.feed(block)
+        yield from chunker.finish()
+    
+    def _discard_staged_chunks(self, staging, staging_id):
+        """
+        Xóa chunks tạm và tham chiếu của 1 lần re-index (thất bại hoặc đã swap xong)
+        
+        Chỉ bump generation của search cache khi collection knowledge base bị thay đổi
+        (chunks tạm chưa bao giờ được search đọc tới).
+        """
+        # Chunk tạm là private nên không file nào khác tham chiếu tới; chunk cũ đã được
+        # chuyển cho phiên bản đang re-index (khi file khác bị xóa/re-index) thì xóa hoặc chuyển tiếp
+        plan = self.chunk_dedup.remove_file(staging_id)
+        staged = staging.get(where={"file_id": staging_id}, include=[])
+        if staged["ids"]:
+            staging.delete(ids=staged["ids"])
+        if plan["delete"]:
+            self.collection.delete(ids=plan["delete"])
+            self._remove_lexical_chunks(plan["delete"])
+        if plan["transfer"]:
+            transfer_ids = list(plan["transfer"])
+            self.collection.update(
+                ids=transfer_ids,
+                metadatas=[self._owner_chunk_metadata(*plan["transfer"][chunk_id]) for chunk_id in transfer_ids]
+            )
+        referenced = self.collection.get(where={ref_key(staging_id): True}, include=[])
+        if referenced["ids"]:
+            self.collection.update(
+                ids=referenced["ids"],
+                metadatas=[{ref_key(staging_id): None}] * len(referenced["ids"])
+            )
+        self.chunk_dedup.set_private_owner(staging_id, False)
+        self._reindex_staging.pop(staging_id, None)
+        if plan["delete"] or plan["transfer"] or referenced["ids"]:
+            self.search_cache.bump_generation()
+    
+    def _publish_staged_chunks(self, staging, staging_id, file_id):
+        """
+        Chép chunks tạm (kèm embedding) sang collection knowledge base dưới file_id thật
+        
+        Returns:
+            int: Số chunks đã chép
+        """
+        published = 0
+        while True:
+            page = staging.get(
+                where={"file_id": staging_id},
+                include=["documents", "metadatas", "embeddings"],
+                limit=self.max_batch_size,
+                offset=published
+            )
+            if not page["ids"]:
+                return published
+            self.collection.add(
+                ids=page["ids"],
+                documents=page["documents"],
+                metadatas=[
+                    dict(chunk_metadata, file_id=file_id, filename_uuid=file_id)
+                    for chunk_metadata in page["metadatas"]
+                ],
+                embeddings=page["embeddings"]
+            )
+            published += len(page["ids"])
+    
+    @_vector_writer
+    def reindex_file(self, file_id, chunk_size=None, overlap=None):
+        """
+        Chia chunk lại và embed lại 1 file từ text đã lưu, không parse lại PDF
+        
+        Chunks mới được embed vào collection tạm trong khi search vẫn dùng chunks cũ,
+        sau đó được chép sang collection knowledge base và chunks cũ bị xóa ngay sau đó.
+        Bước chép + xóa giữ lock ghi của search: search thấy chunks cũ hoặc chunks mới, không
+        bao giờ thấy cả 2, và search cache chỉ bị vô hiệu 1 lần sau khi swap xong.
+        Chunk dùng chung với file khác được giữ lại hoặc chuyển chủ như khi xóa file.
+        
+        Args:
+            file_id: ID của file (alias được đổi thành file gốc)
+            chunk_size: Kích thước chunk mới (mặc định KB_CHUNK_SIZE)
+            overlap: Số ký tự overlap mới (mặc định KB_CHUNK_OVERLAP)
+            
+        Returns:
+            tuple: (success, result_data, error_message, status_code)
+        """
+        chunk_size = self.chunk_size if chunk_size is None else chunk_size
+        overlap = self.chunk_overlap if overlap is None else overlap
+        validation_error = self._validate_chunking(chunk_size, overlap)
+        if validation_error:
+            return False, None, validation_error, 400
+        if not self.collection:
+            return False, None, "ChromaDB not initialized", 500
+        
+        file_id = self.file_hash_index.resolve(file_id)
+        
+        with self._reindex_lock(file_id):
+            try:
+                metadata = self.load_file_metadata(file_id)
+                if not metadata:
+                    return False, None, "File not found", 404
+                text_path = os.path.join(self.upload_folder, f"{file_id}_text.txt")
+                if not os.path.exists(text_path):
+                    return False, None, "Extracted text not found, upload the file again", 404
+                
+                start_time = time.time()
+                generation = metadata.get("index_generation", 0) + 1
+                staging_id = f"{file_id}_reindex_g{generation}"
+                staging = self._get_staging_collection()
+                self._discard_staged_chunks(staging, staging_id)  # Lần chạy trước bị dừng giữa chừng
+                self._reindex_staging[staging_id] = file_id
+                self.chunk_dedup.set_private_owner(staging_id)
+                
+                # 1. Chia chunk và embed vào collection tạm (chunk trùng chunk đã lưu chỉ ghi tham chiếu)
+                dedup_stats = {}
+                centroid = CentroidAccumulator()
+                try:
+                    success, chunks_count, error = self.write_chunks_to_vector_db(
+                        staging_id, metadata.get("title", ""), metadata.get("description", ""),
+                        self._iter_stored_text_chunks(file_id, metadata.get('page_offsets'), chunk_size, overlap),
+                        metadata,
+                        dedup_stats=dedup_stats, collection=staging, chunk_id_prefix=f"{file_id}_g{generation}",
+                        centroid=centroid
+                    )
+                except Exception as e:
+                    success, chunks_count, error = False, 0, str(e)
+                if not success:
+                    self._discard_staged_chunks(staging, staging_id)
+                    return False, None, f"Error re-indexing file: {error}", 500
+                
+                # 2. Swap (lần lượt từng file): chép chunks mới rồi mới xóa chunks cũ, search
+                #    chờ tới khi swap xong nên không thấy file thiếu chunks hay có cả 2 phiên bản
+                with self._reindex_swap_lock, self._search_gate.write():
+                    old_ids = self.collection.get(where={"file_id": file_id}, include=[])["ids"]
+                    old_ref_ids = self.collection.get(where={ref_key(file_id): True}, include=[])["ids"]
+                    self._publish_staged_chunks(staging, staging_id, file_id)
+                    
+                    plan = self.chunk_dedup.remove_file(file_id)
+                    self.chunk_dedup.rename_file(staging_id, file_id)
+                    new_ref_ids = set(self.chunk_dedup.chunk_indexes(file_id))
+                    
+                    staged_ref_ids = self.collection.get(where={ref_key(staging_id): True}, include=[])["ids"]
+                    if staged_ref_ids:
+                        self.collection.update(
+                            ids=staged_ref_ids,
+                            metadatas=[{ref_key(staging_id): None, ref_key(file_id): True}] * len(staged_ref_ids)
+                        )
+                    
+                    # Chunk cũ vẫn được dùng (bởi file khác hoặc chính phiên bản mới) được chuyển chủ thay vì xóa
+                    transfers = plan["transfer"]
+                    if transfers:
+                        transfer_ids = list(transfers)
+                        self.collection.update(
+                            ids=transfer_ids,
+                            metadatas=[self._owner_chunk_metadata(*transfers[chunk_id]) for chunk_id in transfer_ids]
+                        )
+                    delete_ids = [
+                        chunk_id for chunk_id in old_ids if chunk_id not in transfers and chunk_id not in new_ref_ids
+                    ]
+                    if delete_ids:
+                        self.collection.delete(ids=delete_ids)
+                        self._remove_lexical_chunks(delete_ids)
+                    
+                    stale_ref_ids = [chunk_id for chunk_id in old_ref_ids if chunk_id not in new_ref_ids]
+                    if stale_ref_ids:
+                        self.collection.update(
+                            ids=stale_ref_ids,
+                            metadatas=[{ref_key(file_id): None}] * len(stale_ref_ids)
+                        )
+                    self.document_index.set_file(file_id, centroid)
+                    self._discard_staged_chunks(staging, staging_id)
+                    self.search_cache.bump_generation()
+                
+                metadata.update({
+                    "index_generation": generation,
+                    "chunk_size": chunk_size,
+                    "chunk_overlap": overlap,
+                    "chunk_unit": self.chunk_unit,
+                    "chunk_strategy": self.chunk_strategy,
+                    "reindexed_at": datetime.now().isoformat()
+                })
+                metadata_success, _, metadata_error = self.save_file_metadata(file_id, metadata)
+                if not metadata_success:
+                    return False, None, metadata_error, 500
+                
+                result_data = {
+                    "file_id": file_id,
+                    "chunk_size": chunk_size,
+                    "chunk_overlap": overlap,
+                    "chunks_before": len(old_ids),
+                    "vector_chunks_count": chunks_count,
+                    "vector_chunks_stored": dedup_stats[MATCH_STORED],
+                    "vector_chunks_shared": dedup_stats["exact"] + dedup_stats["near"],
+                    "index_generation": generation,
+                    "seconds": round(time.time() - start_time, 3)
+                }
+                print(f"🔁 Re-indexed file {file_id}: {len(old_ids)} -> {chunks_count} chunks "
+                      f"(chunk_size={chunk_size}, overlap={overlap})")
+                return True, result_data, "File re-indexed successfully", 200
+                
+            except Exception as e:
+                return False, None, f"Error re-indexing file: {str(e)}", 500
+    
+    def reindex_files(self, file_ids=None, chunk_size=None, overlap=None, workers=None):
+        """
+        Re-index nhiều file (hoặc toàn bộ knowledge base) song song từ text đã lưu
+        
+        Mỗi file được swap riêng ngay khi xong, search luôn có dữ liệu trong lúc re-index.
+        
+        Args:
+            file_ids: Danh sách file_id (None = tất cả file, alias được đổi thành file gốc)
+            chunk_size: Kích thước chunk mới (mặc định KB_CHUNK_SIZE)
+            overlap: Số ký tự overlap mới (mặc định KB_CHUNK_OVERLAP)
+            workers: Số file re-index song song (mặc định KB_REINDEX_WORKERS)
+            
+        Returns:
+            tuple: (success, summary, error_message)
+        """
+        chunk_size = self.chunk_size if chunk_size is None else chunk_size
+        overlap = self.chunk_overlap if overlap is None else overlap
+        validation_error = self._validate_chunking(chunk_size, overlap)
+        if validation_error:
+            return False, None, validation_error
+        
+        if file_ids is None:
+            file_ids = [metadata['file_id'] for metadata in self.file_catalog.all_files() if not metadata.get('alias_of')]
+        else:
+            file_ids = self.file_hash_index.resolve_many(file_ids)
+        
+        start_time = time.time()
+        results = []
+        if file_ids:
+            with ThreadPoolExecutor(max_workers=max(1, min(workers or self.reindex_workers, len(file_ids))),
+                                    thread_name_prefix="kb-reindex") as executor:
+                outcomes = executor.map(lambda file_id: self.reindex_file(file_id, chunk_size, overlap), file_ids)
+                for file_id, (success, result_data, message, status_code) in zip(file_ids, outcomes):
+                    result = {"file_id": file_id, "success": success, "status_code": status_code}
+                    if success:
+                        result.update(result_data)
+                    else:
+                        result["error"] = message
+                    results.append(result)
+        
+        files_reindexed = sum(1 for result in results if result["success"])
+        summary = {
+            "chunk_size": chunk_size,
+            "chunk_overlap": overlap,
+            "files_total": len(results),
+            "files_reindexed": files_reindexed,
+            "files_failed": len(results) - files_reindexed,
+            "seconds": round(time.time() - start_time, 3),
+            "results": results
+        }
+        return True, summary, None
+    
     def search_knowledge_base(self, query, max_results=5, file_id=None):
         """
         Tìm kiếm trong knowledge base sử dụng vector similarity
@@ -670,6 +2001,11 @@ class KnowledgeBaseService:
             tuple: (success, search_results, error_message)
         """
         try:
+            # Câu hỏi đã tìm (cùng dạng chuẩn hóa, cùng file) khi chunks chưa thay đổi
+            cached, generation = self.search_cache.get_results("knowledge_base", query, [file_id or ""], max_results)
+            if cached is not None:
+                return True, cached, None
+            
             # Tìm kiếm trong vector database
             vector_success, vector_results, vector_error = self.search_in_vector_db(
                 query, max_results, file_id
@@ -689,11 +2025,15 @@ class KnowledgeBaseService:
                         "title": result["metadata"].get("title"),
                         "filename": result["metadata"].get("filename"),
                         "filename_uuid": result["metadata"].get("filename_uuid"),
-                        "chunk_index": result["metadata"].get("chunk_index")
+                        "chunk_index": result["metadata"].get("chunk_index"),
+                        **self._chunk_location(result["metadata"]),
+                        "also_in": referenced_file_ids(result["metadata"])
                     }
                 }
                 formatted_results.append(formatted_result)
             
+            self.search_cache.put_results("knowledge_base", query, [file_id or ""], max_results, generation,
+                                          formatted_results)
             return True, formatted_results, None
             
         except Exception as e:
@@ -717,7 +2057,18 @@ class KnowledgeBaseService:
             stats = {
                 "total_chunks": count,
                 "collection_name": self.collection.name,
-                "db_path": self.chroma_db_path
+                "db_path": self.chroma_db_path,
+                "deduplication": self.file_hash_index.get_stats(),
+                "chunk_deduplication": self.chunk_dedup.get_stats(),
+                "lexical_index": self.lexical_index.get_stats(),
+                "trigram_index": self.trigram_index.get_stats(),
+                "document_index": dict(self.document_index.get_stats(),
+                                       two_stage_active=self._use_two_stage_search(),
+                                       two_stage_top_files=self.two_stage_top_files,
+                                       two_stage_min_chunks=self.two_stage_min_chunks),
+                "embedding": self.embedder.get_stats(),
+                "query_cache": self.search_cache.get_stats(),
+                "rerank": self.reranker.get_stats() if self.reranker else None
             }
             
             return True, stats, None
@@ -779,21 +2130,26 @@ class KnowledgeBaseService:
             if not self.collection:
                 return False, [], "ChromaDB not initialized"
             
-            # Tìm tất cả chunks có file_id cụ thể
+            # Tìm tất cả chunks có file_id cụ thể (alias dùng chunks của file gốc),
+            # kể cả chunk dùng chung với file khác
+            owner_id = self.file_hash_index.resolve(file_id)
             results = self.collection.get(
-                where={"file_id": file_id},
+                where=self._file_filter([owner_id], key="file_id"),
                 include=["documents", "metadatas"]
             )
+            # Vị trí của chunk dùng chung trong file này (chunk_index trong metadata là của file sở hữu)
+            chunk_indexes = self.chunk_dedup.chunk_indexes(owner_id)
             
             # Sắp xếp theo chunk_index
             chunks_data = []
             if results["documents"]:
                 for i, doc in enumerate(results["documents"]):
+                    chunk_metadata = results["metadatas"][i] if results["metadatas"] else {}
                     chunk_info = {
                         "id": results["ids"][i],
                         "content": doc,
-                        "metadata": results["metadatas"][i] if results["metadatas"] else {},
-                        "chunk_index": results["metadatas"][i].get("chunk_index", 0) if results["metadatas"] else 0
+                        "metadata": chunk_metadata,
+                        "chunk_index": chunk_indexes.get(results["ids"][i], chunk_metadata.get("chunk_index", 0))
                     }
                     chunks_data.append(chunk_info)
                 
@@ -974,12 +2330,14 @@ class KnowledgeBaseService:
                 return False, [], "ChromaDB not initialized"
             
             # Thực hiện tìm kiếm với filters
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results,
-                where=filters,
-                include=["documents", "metadatas", "distances"]
-            )
+            query_embeddings = self._embed_queries([query])
+            with self._search_gate.read():
+                results = self.collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=n_results,
+                    where=filters,
+                    include=["documents", "metadatas", "distances"]
+                )
             
             # Format kết quả
             formatted_results = []
@@ -1000,7 +2358,7 @@ class KnowledgeBaseService:
     def search_in_multiple_files(self, query, filename_uuids, max_results=5):
         """
         Tìm kiếm trong nhiều files cụ thể dựa trên list filename_uuid
-        Hỗ trợ tìm kiếm tiếng Việt với xử lý văn bản cải tiến
+        Hỗ trợ tìm kiếm tiếng Việt (hybrid: vector search + BM25, xem hybrid_search)
         
         Args:
             query: Câu hỏi tìm kiếm (tiếng Việt hoặc tiếng Anh)
@@ -1010,169 +2368,188 @@ class KnowledgeBaseService:
         Returns:
             tuple: (success, results, error_message)
         """
+        success, results, _, message = self.hybrid_search(query, filename_uuids, max_results)
+        return success, results, message
+    
+    def hybrid_search(self, query, filename_uuids, max_results=5):
+        """
+        Tìm kiếm trong các file bằng nhiều signal cùng lúc, gộp bằng reciprocal rank fusion
+        
+        Signals (chạy song song, giới hạn bởi KB_SEARCH_TIME_BUDGET_MS):
+        - vector / vector_keywords: 1 lần query ChromaDB với embedding của query gốc và của
+          các từ khóa trong query
+        - bm25: lexical index
+        
+        Thay cho thử lần lượt query gốc -> query chuẩn hóa -> từ khóa -> text matching
+        (dừng ở chiến lược đầu tiên có kết quả, kể cả khi kết quả đó kém).
+        
+        Args:
+            query: Câu hỏi tìm kiếm (tiếng Việt hoặc tiếng Anh)
+            filename_uuids: List các filename_uuid để tìm kiếm
+            max_results: Số kết quả tối đa trả về
+            
+        Returns:
+            tuple: (success, results, retrieval_info, message)
+                retrieval_info: Số hit và số kết quả cuối mỗi signal đóng góp, signal quá thời gian / lỗi
+        """
         try:
             if not self.collection:
-                return False, [], "ChromaDB not initialized"
+                return False, [], {}, "ChromaDB not initialized"
             
             if not filename_uuids or len(filename_uuids) == 0:
-                return False, [], "No filename_uuids provided"
-            
-            # Tạo filter để tìm kiếm trong các files cụ thể
-            filters = {
-                "filename_uuid": {"$in": filename_uuids}
+                return False, [], {}, "No filename_uuids provided"
+            
+            # Alias -> file gốc sở hữu chunks
+            filename_uuids = self.file_hash_index.resolve_many(filename_uuids)
+            
+            # Câu hỏi đã tìm (cùng dạng chuẩn hóa, cùng các file) khi chunks chưa thay đổi
+            cached, generation = self.search_cache.get_results("hybrid", query, filename_uuids, max_results)
+            if cached is not None:
+                print(f"⚡ Search cache hit for query: '{query}'")
+                return True, cached["results"], dict(cached["info"], cached=True), cached["message"]
+            
+            # Mỗi signal lấy nhiều ứng viên hơn số kết quả để RRF có dữ liệu gộp
+            depth = max(max_results * 3, 10)
+            dense_queries = {"vector": query}
+            keyword_query = " ".join(self._extract_keywords_vietnamese(query))
+            if keyword_query and keyword_query != normalize_text(query):
+                dense_queries["vector_keywords"] = keyword_query
+            
+            print(f"🔍 Hybrid search for query: '{query}' in files: {filename_uuids}")
+            # Các signal cùng thấy 1 phiên bản chunks của mỗi file (không chạy xen với swap của re-index)
+            with self._search_gate.read():
+                fused, info = self.hybrid_retriever.retrieve({
+                    "vector": lambda: self._dense_hits(dense_queries, self._file_filter(filename_uuids), depth),
+                    "bm25": lambda: {"bm25": self._lexical_hits(query, filename_uuids, depth)}
+                }, limit=max_results)
+            raise_if_cancelled()
+            
+            if not info["rankings"]:
+                return False, [], info, f"Error searching in multiple files: {info['errors']}"
+            
+            results = []
+            for hits, rrf_score, ranks in fused:
+                # Điểm hiển thị: cosine similarity nếu vector search tìm thấy chunk, không thì điểm từ khóa
+                hit = next(hits[ranking] for ranking in ("vector", "vector_keywords", "bm25") if ranking in hits)
+                source = self._result_source(hit, "hybrid")
+                source["signals"] = ranks
+                source["rrf_score"] = round(rrf_score, 6)
+                if "bm25" in hits:
+                    source["matching_words"] = hits["bm25"]["matching_words"]
+                results.append({
+                    "content": hit["content"],
+                    "similarity_score": round(hit["similarity_score"], 4),
+                    "source": source
+                })
+            
+            info["contributed"] = {
+                ranking: sum(1 for result in results if ranking in result["source"]["signals"])
+                for ranking in info["rankings"]
             }
+            print(f"✅ Found {len(results)} results in {info['elapsed_ms']}ms "
+                  f"(contributed: {info['contributed']}, timed out: {info['timed_out']})")
+            message = (f"Found {len(results)} results in {len(filename_uuids)} files" if results
+                       else "No matching results found")
+            # Kết quả thiếu signal (quá thời gian / lỗi) không được cache
+            if not info["timed_out"] and not info["errors"]:
+                self.search_cache.put_results("hybrid", query, filename_uuids, max_results, generation,
+                                              {"results": results, "info": info, "message": message})
+            return True, results, info, message
+            
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            return False, [], {}, f"Error searching in multiple files: {str(e)}"
+    
+    def _dense_hits(self, queries, filters, n_results):
+        """
+        Vector search cho nhiều query trong 1 lần gọi ChromaDB
+        
+        Args:
+            queries: Dict tên ranking -> text query
+            filters: Filter where của ChromaDB
+            n_results: Số hit mỗi query
             
-            print(f"🔍 Searching for query: '{query}' in files: {filename_uuids}")
-            
-            # Chiến lược 1: Tìm kiếm trực tiếp với query gốc
-            success, search_results, error_message = self.search_chunks_with_filters(
-                query, filters, max_results
-            )
-            
-            if success and len(search_results) > 0:
-                print(f"✅ Found {len(search_results)} results with original query")
-                return self._format_search_results(search_results, query, filename_uuids, max_results)
-            
-            # Chiến lược 2: Chuẩn hóa query và thử lại
-            normalized_query = self._normalize_vietnamese_text(query)
-            if normalized_query != query:
-                print(f"🔄 Trying normalized query: '{normalized_query}'")
-                success, search_results, error_message = self.search_chunks_with_filters(
-                    normalized_query, filters, max_results
-                )
-                
-                if success and len(search_results) > 0:
-                    print(f"✅ Found {len(search_results)} results with normalized query")
-                    return self._format_search_results(search_results, query, filename_uuids, max_results)
-            
-            # Chiến lược 3: Tìm kiếm với từ khóa
-            keywords = self._extract_keywords_vietnamese(query)
-            if keywords:
-                keyword_query = " ".join(keywords)
-                print(f"🔑 Trying keyword search: '{keyword_query}'")
-                success, search_results, error_message = self.search_chunks_with_filters(
-                    keyword_query, filters, max_results
+        Returns:
+            dict: Tên ranking -> list hit {"id", "content", "metadata", "similarity_score"}
+        """
+        names = list(queries)
+        results = self.collection.query(
+            query_embeddings=self._embed_queries([queries[name] for name in names]),
+            n_results=n_results,
+            where=filters,
+            include=["documents", "metadatas", "distances"]
+        )
+        return {
+            name: [
+                {"id": chunk_id, "content": document, "metadata": metadata or {}, "similarity_score": 1 - distance}
+                for chunk_id, document, metadata, distance in zip(
+                    results["ids"][index], results["documents"][index],
+                    results["metadatas"][index], results["distances"][index]
                 )
-                
-                if success and len(search_results) > 0:
-                    print(f"✅ Found {len(search_results)} results with keyword search")
-                    return self._format_search_results(search_results, query, filename_uuids, max_results)
-            
-            # Chiến lược 4: Tìm kiếm text matching trực tiếp
-            print("🔍 Trying direct text matching...")
-            text_match_results = self._search_text_matching(query, filename_uuids, max_results)
-            if text_match_results:
-                print(f"✅ Found {len(text_match_results)} results with text matching")
-                return True, text_match_results, f"Found {len(text_match_results)} results using text matching"
-            
-            # Nếu không tìm thấy gì
-            if not success:
-                return False, [], error_message
-            
-            return True, [], "No matching results found"
-            
-        except Exception as e:
-            return False, [], f"Error searching in multiple files: {str(e)}"
+            ]
+            for index, name in enumerate(names)
+        }
     
-    def _search_text_matching(self, query, filename_uuids, max_results=5):
+    def _lexical_hits(self, query, filename_uuids, limit):
         """
-        Tìm kiếm bằng text matching trực tiếp (không dùng vector similarity)
-        Hữu ích cho các từ khóa cụ thể hoặc khi vector search không hiệu quả
+        Tìm kiếm BM25 trên lexical index, chỉ lấy nội dung từ ChromaDB cho các chunk trả về
+        
+        Returns:
+            list: Hit {"id", "content", "metadata", "similarity_score", "matching_words", "bm25_score"}
+                theo điểm BM25 giảm dần; similarity_score giữ thang 0-1 như text matching trước đây
+                (tỉ lệ từ khóa khớp, +0.5 nếu khớp nguyên cụm từ)
         """
-        try:
-            # Lấy tất cả chunks của các files được chỉ định
-            all_chunks = self.collection.get(
-                where={"filename_uuid": {"$in": filename_uuids}},
-                include=["documents", "metadatas"]
-            )
-            
-            if not all_chunks["documents"]:
-                return []
-            
-            # Chuẩn hóa query để so sánh
-            normalized_query = self._normalize_vietnamese_text(query).lower()
-            query_keywords = set(normalized_query.split())
-            
-            # Tìm kiếm text matching
-            matching_results = []
-            for i, doc in enumerate(all_chunks["documents"]):
-                if not doc:
-                    continue
-                
-                normalized_doc = self._normalize_vietnamese_text(doc).lower()
-                doc_words = set(normalized_doc.split())
-                
-                # Tính điểm dựa trên số từ khóa khớp
-                matching_words = query_keywords.intersection(doc_words)
-                if matching_words:
-                    score = len(matching_words) / len(query_keywords)
-                    
-                    # Kiểm tra xem có chứa phrase không
-                    if normalized_query in normalized_doc:
-                        score += 0.5  # Bonus cho exact phrase match
-                    
-                    metadata = all_chunks["metadatas"][i] if i < len(all_chunks["metadatas"]) else {}
-                    
-                    result = {
-                        "content": doc,
-                        "similarity_score": min(score, 1.0),  # Cap at 1.0
-                        "metadata": metadata,
-                        "matching_words": list(matching_words)
-                    }
-                    matching_results.append(result)
-            
-            # Sắp xếp theo điểm số và trả về top results
-            matching_results.sort(key=lambda x: x["similarity_score"], reverse=True)
-            
-            # Format results giống như vector search
-            formatted_results = []
-            for result in matching_results[:max_results]:
-                metadata = result.get("metadata", {})
-                formatted_result = {
-                    "content": result.get("content", ""),
-                    "similarity_score": result.get("similarity_score", 0),
-                    "source": {
-                        "file_id": metadata.get("filename_uuid", ""),
-                        "filename_uuid": metadata.get("filename_uuid", ""),
-                        "title": metadata.get("title", ""),
-                        "filename": metadata.get("filename", ""),
-                        "chunk_index": metadata.get("chunk_index", 0),
-                        "chunk_length": len(result.get("content", "")),
-                        "search_method": "text_matching",
-                        "matching_words": result.get("matching_words", [])
-                    }
-                }
-                formatted_results.append(formatted_result)
-            
-            return formatted_results
-            
-        except Exception as e:
-            print(f"Error in text matching search: {str(e)}")
+        query_terms = normalize_text(query).split()
+        if not query_terms:
             return []
-    
-    def _format_search_results(self, search_results, original_query, filename_uuids, max_results):
-        """
-        Format search results cho API response
-        """
-        formatted_results = []
-        for result in search_results:
-            metadata = result.get("metadata", {})
-            formatted_result = {
-                "content": result.get("content", ""),
-                "similarity_score": result.get("similarity_score", 0),
-                "source": {
-                    "file_id": metadata.get("filename_uuid", ""),
-                    "filename_uuid": metadata.get("filename_uuid", ""),
-                    "title": metadata.get("title", ""),
-                    "filename": metadata.get("filename", ""),
-                    "chunk_index": metadata.get("chunk_index", 0),
-                    "chunk_length": len(result.get("content", "")),
-                    "search_method": "vector_similarity"
-                }
-            }
-            formatted_results.append(formatted_result)
         
-        return True, formatted_results, f"Found {len(formatted_results)} results in {len(filename_uuids)} files"
+        # Chunk của các file được chỉ định, kể cả chunk dùng chung với file khác
+        chunk_ids = self.chunk_dedup.chunk_ids_for_files(filename_uuids)
+        # Từ không có trong knowledge base (gõ sai, gõ thiếu identifier) khớp qua từ gần đúng
+        ranked = self.lexical_index.search(query_terms, chunk_ids=chunk_ids, limit=limit,
+                                           expansions=self.trigram_index.expand(query_terms))
+        if not ranked:
+            return []
+        
+        chunks = self.collection.get(ids=[chunk_id for chunk_id, _, _, _ in ranked],
+                                     include=["documents", "metadatas"])
+        stored = {
+            chunk_id: (document, metadata)
+            for chunk_id, document, metadata in zip(chunks["ids"], chunks["documents"], chunks["metadatas"])
+        }
+        
+        unique_terms = set(query_terms)
+        hits = []
+        for chunk_id, score, matching_words, phrase_match in ranked:
+            if chunk_id not in stored:
+                continue
+            document, metadata = stored[chunk_id]
+            similarity_score = len(matching_words) / len(unique_terms) + (0.5 if phrase_match else 0.0)
+            hits.append({
+                "id": chunk_id,
+                "content": document,
+                "metadata": metadata or {},
+                "similarity_score": min(similarity_score, 1.0),
+                "matching_words": matching_words,
+                "bm25_score": round(score, 4)
+            })
+        return hits
+    
+    def _result_source(self, hit, search_method):
+        """Thông tin nguồn của 1 kết quả tìm kiếm cho API response"""
+        metadata = hit["metadata"]
+        return {
+            "file_id": metadata.get("filename_uuid", ""),
+            "filename_uuid": metadata.get("filename_uuid", ""),
+            "title": metadata.get("title", ""),
+            "filename": metadata.get("filename", ""),
+            "chunk_index": metadata.get("chunk_index", 0),
+            "chunk_length": len(hit["content"] or ""),
+            "search_method": search_method,
+            **self._chunk_location(metadata),
+            "also_in": referenced_file_ids(metadata)
+        }
     
     def _normalize_vietnamese_text(self, text):
         """
@@ -1182,21 +2559,9 @@ class KnowledgeBaseService:
             text: Text cần chuẩn hóa
             
         Returns:
-            str: Text đã được chuẩn hóa
+            str: Text đã được chuẩn hóa (chữ thường, bỏ dấu câu, gộp khoảng trắng)
         """
-        if not text:
-            return text
-        
-        # Chuyển về lowercase
-        normalized = text.lower()
-        
-        # Loại bỏ dấu câu thừa
-        normalized = re.sub(r'[^\w\sàáảãạăắằẳẵặâấầẩẫậèéẻẽẹêếềểễệìíỉĩịòóỏõọôốồổỗộơớờởỡợùúủũụưứừửữựỳýỷỹỵđ]', ' ', normalized)
-        
-        # Loại bỏ multiple spaces
-        normalized = re.sub(r'\s+', ' ', normalized).strip()
-        
-        return normalized
+        return normalize_text(text)
     
     def _extract_keywords_vietnamese(self, text):
         """
@@ -1237,45 +2602,6 @@ class KnowledgeBaseService:
         # Giới hạn số từ khóa trả về
         return keywords[:5]
     
-    def _detect_language(self, text):
-        """
-        Phát hiện ngôn ngữ chính của text (tiếng Việt hoặc tiếng Anh)
-        
-        Args:
-            text: Text cần phân tích
-            
-        Returns:
-            str: 'vi' cho tiếng Việt, 'en' cho tiếng Anh, 'mixed' cho hỗn hợp
-        """
-        if not text or len(text.strip()) < 10:
-            return 'unknown'
-        
-        # Các ký tự đặc trưng tiếng Việt
-        vietnamese_chars = 'àáảãạăắằẳẵặâấầẩẫậèéẻẽẹêếềểễệìíỉĩịòóỏõọôốồổỗộơớờởỡợùúủũụưứừửữựỳýỷỹỵđ'
-        
-        # Đếm ký tự tiếng Việt
-        vietnamese_count = 0
-        total_chars = 0
-        
-        for char in text.lower():
-            if char.isalpha():
-                total_chars += 1
-                if char in vietnamese_chars:
-                    vietnamese_count += 1
-        
-        if total_chars == 0:
-            return 'unknown'
-        
-        vietnamese_ratio = vietnamese_count / total_chars
-        
-        # Nếu > 5% ký tự là tiếng Việt thì coi là tiếng Việt
-        if vietnamese_ratio > 0.05:
-            return 'vi'
-        elif vietnamese_ratio > 0.01:
-            return 'mixed'
-        else:
-            return 'en'
-    
     def debug_chunks_content(self, filename_uuids=None, limit=3):
         """
         Debug method để xem nội dung thực tế của chunks
@@ -1330,6 +2656,7 @@ class KnowledgeBaseService:
         except Exception as e:
             return False, {}, f"Error debugging chunks: {str(e)}"
     
+    @_vector_writer
     def reset_chromadb(self, confirm_reset=False):
         """
         Reset ChromaDB - Xóa tất cả chunks và tạo lại collection mới
@@ -1347,6 +2674,9 @@ class KnowledgeBaseService:
             if not self.chroma_client:
                 return False, {}, "ChromaDB client not initialized"
             
+            # Collection mới giữ tham số HNSW của collection đang dùng (kể cả tham số đã đổi khi dựng lại)
+            hnsw_config = config_of_collection(self.collection) if self.collection else self.hnsw_config
+            
             # Lấy thông tin trước khi reset
             old_collection_info = {}
             if self.collection:
@@ -1366,10 +2696,25 @@ class KnowledgeBaseService:
             except Exception as e:
                 print(f"⚠️ Could not delete old collection (might not exist): {str(e)}")
             
+            # Chunks tạm của các lần re-index bị dừng giữa chừng
+            try:
+                self.chroma_client.delete_collection(name="knowledge_base_reindex")
+            except Exception:
+                pass
+            
+            self.chunk_dedup.clear()
+            self.lexical_index.clear()
+            self.trigram_index.clear()
+            self.document_index.clear()
+            self.search_cache.bump_generation()
+            
             # Tạo collection mới
             self.collection = self.chroma_client.get_or_create_collection(
                 name="knowledge_base",
-                metadata={"description": "PDF document knowledge base with text chunks - Reset on " + datetime.now().isoformat()}
+                metadata=collection_metadata(
+                    hnsw_config,
+                    description="PDF document knowledge base with text chunks - Reset on " + datetime.now().isoformat()
+                )
             )
             
             reset_info = {
@@ -1387,6 +2732,7 @@ class KnowledgeBaseService:
         except Exception as e:
             return False, {}, f"Error resetting ChromaDB: {str(e)}"
     
+    @_vector_writer
     def clear_all_chunks(self):
         """
         Xóa tất cả chunks nhưng giữ nguyên collection
@@ -1408,6 +2754,11 @@ class KnowledgeBaseService:
             
             # Xóa tất cả chunks
             self.collection.delete(ids=all_data["ids"])
+            self.chunk_dedup.clear()
+            self.lexical_index.clear()
+            self.trigram_index.clear()
+            self.document_index.clear()
+            self.search_cache.bump_generation()
             
             clear_info = {
                 "chunks_cleared": total_chunks,
@@ -1421,3 +2772,127 @@ class KnowledgeBaseService:
             
         except Exception as e:
             return False, {}, f"Error clearing chunks: {str(e)}"
+    
+    def _wait_for_index_rebuild(self):
+        """Chờ dựng lại vector index xong trước khi ghi chunks (không dựng lại thì trả về ngay)"""
+        if not self._index_ready.is_set():
+            print("⏳ Waiting for vector index rebuild to finish...")
+            self._index_ready.wait()
+    
+    def get_index_config(self):
+        """
+        Tham số HNSW của collection knowledge base
+        
+        Returns:
+            tuple: (success, config_info, error_message)
+                config_info: active (tham số collection đang dùng), configured (KB_HNSW_*), total_chunks
+        """
+        if not self.collection:
+            return False, {}, "ChromaDB not initialized"
+        return True, {
+            "active": config_of_collection(self.collection)._asdict(),
+            "configured": self.hnsw_config._asdict(),
+            "total_chunks": self.collection.count(),
+            "rebuilding": not self._index_ready.is_set()
+        }, None
+    
+    def rebuild_vector_index(self, **params):
+        """
+        Dựng lại collection knowledge base với tham số HNSW mới
+        
+        ChromaDB chỉ nhận tham số HNSW khi tạo collection: chunks (kèm embedding, không embed lại)
+        được chép sang collection mới, sau đó search chuyển sang collection mới và collection cũ bị
+        xóa. Search vẫn dùng collection cũ trong lúc chép; upload, xóa, re-index, clear, reset chờ
+        tới khi chuyển xong. Không bắt đầu khi còn thao tác ghi đang chạy (409).
+        
+        Args:
+            **params: space, M, construction_ef, search_ef (tham số thiếu giữ như collection đang dùng)
+            
+        Returns:
+            tuple: (success, rebuild_info, error_message, status_code)
+        """
+        if not self.collection:
+            return False, None, "ChromaDB not initialized", 500
+        
+        old_config = config_of_collection(self.collection)
+        config, error = merge_hnsw_config(old_config, params)
+        if error:
+            return False, None, error, 400
+        
+        if not self._index_rebuild_lock.acquire(blocking=False):
+            return False, None, "Vector index rebuild already in progress", 409
+        # Chỉ chép khi không còn thao tác ghi nào đang chạy; kiểm tra và chặn thao tác ghi mới trong
+        # cùng lock mà _vector_writer dùng để đăng ký, nên không thao tác ghi nào lọt vào giữa
+        with self._active_ingests_lock:
+            busy = self._active_writes > 0
+            if not busy:
+                self._index_ready.clear()
+        if busy:
+            self._index_rebuild_lock.release()
+            return False, None, "Ingestion, deletion or re-index in progress, try again when it finishes", 409
+        rebuild = None
+        try:
+            start_time = time.time()
+            # Lần đổi tên trước bị lỗi thì collection đang dùng vẫn mang tên rebuild: chép sang tên chính
+            rebuild_name = (REBUILD_COLLECTION_NAME if self.collection.name != REBUILD_COLLECTION_NAME
+                            else "knowledge_base")
+            try:
+                self.chroma_client.delete_collection(name=rebuild_name)  # Lần dựng trước bị dừng giữa chừng
+            except Exception:
+                pass
+            rebuild = self.chroma_client.create_collection(
+                name=rebuild_name,
+                metadata=collection_metadata(
+                    config, **{key: value for key, value in (self.collection.metadata or {}).items()
+                               if not key.startswith("hnsw:")}
+                )
+            )
+            
+            copied = 0
+            while True:
+                page = self.collection.get(include=["documents", "metadatas", "embeddings"],
+                                           limit=self.max_batch_size, offset=copied)
+                if not len(page["ids"]):
+                    break
+                rebuild.add(ids=page["ids"], documents=page["documents"], metadatas=page["metadatas"],
+                            embeddings=page["embeddings"])
+                copied += len(page["ids"])
+                print(f"🔨 Rebuilt {copied} chunks into new vector index")
+            
+            if rebuild.count() != self.collection.count():
+                raise RuntimeError(f"copied {rebuild.count()} of {self.collection.count()} chunks")
+            
+            # Search chuyển sang collection mới trước khi xóa collection cũ (không có lúc nào thiếu collection),
+            # search đang chạy trên collection cũ xong trước khi collection cũ bị xóa
+            with self._reindex_swap_lock, self._search_gate.write():
+                old_collection, self.collection = self.collection, rebuild
+                rebuild = None  # Đã là collection đang dùng: finally không được xóa
+                self.chroma_client.delete_collection(name=old_collection.name)
+                if self.collection.name != "knowledge_base":
+                    try:
+                        self.collection.modify(name="knowledge_base")
+                    except Exception as e:
+                        # Giữ nguyên collection mới dưới tên rebuild (khởi động lại sẽ đổi tên)
+                        print(f"⚠️ Could not rename rebuilt collection '{self.collection.name}': {str(e)}")
+            self.search_cache.bump_generation()
+            
+            rebuild_info = {
+                "previous": old_config._asdict(),
+                "active": config._asdict(),
+                "chunks": copied,
+                "seconds": round(time.time() - start_time, 3)
+            }
+            print(f"✅ Rebuilt vector index with HNSW {config._asdict()} ({copied} chunks, "
+                  f"{rebuild_info['seconds']}s)")
+            return True, rebuild_info, None, 200
+            
+        except Exception as e:
+            return False, None, f"Error rebuilding vector index: {str(e)}", 500
+        finally:
+            if rebuild is not None:
+                try:
+                    self.chroma_client.delete_collection(name=rebuild.name)
+                except Exception:
+                    pass
+            self._index_ready.set()
+            self._index_rebuild_lock.release()
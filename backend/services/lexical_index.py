@@ -0,0 +1,365 @@
+"""
+Lexical Index - Inverted index BM25 cho tìm kiếm theo từ khóa (không dùng embedding)
+
+Module này chứa:
+- LexicalIndex: Index SQLite term -> postings (chunk_id, tần suất, vị trí từ) của các chunk
+  đã lưu trong ChromaDB, xếp hạng BM25 kèm điểm cộng khi chunk chứa nguyên cụm từ của query
+
+Term là các từ của dạng chuẩn hóa (chunk_annotator.normalize_text). Index được cập nhật khi
+ingest / xóa / re-index, nên tìm kiếm chỉ đọc postings của các term trong query thay vì
+lấy và chuẩn hóa lại toàn bộ chunks của các file ở mỗi query.
+
+Từ có dấu được lưu thêm dạng bỏ dấu (FOLDED_PREFIX + từ không dấu, cùng vị trí) để câu hỏi gõ
+không dấu ("tieu chuan") vẫn khớp. Mỗi từ của query khớp theo cả dạng gốc và dạng bỏ dấu, lấy điểm
+cao hơn; khớp qua dạng bỏ dấu nhân fold_weight nên chunk khớp đúng dấu được xếp trên.
+"""
+
+import functools
+import heapq
+import math
+import threading
+from array import array
+
+from services.chunk_annotator import fold_diacritics
+from services.sqlite_utils import connect_sqlite
+
+# SQLite giới hạn số tham số mỗi câu lệnh
+_SQL_BATCH = 500
+
+# Tiền tố term dạng bỏ dấu (không trùng từ chuẩn hóa nào vì từ chỉ gồm ký tự \w)
+FOLDED_PREFIX = "~"
+
+
+def _positions_by_term(words):
+    """Vị trí (thứ tự từ) của từng term trong chunk"""
+    positions = {}
+    for position, word in enumerate(words):
+        positions.setdefault(word, array('I')).append(position)
+    return positions
+
+
+@functools.lru_cache(maxsize=65536)
+def _folded_term(term):
+    """Term dạng bỏ dấu của 1 từ có dấu (số âm tiết tiếng Việt có hạn nên gần như luôn trúng cache)"""
+    return FOLDED_PREFIX + fold_diacritics(term)
+
+
+def _folded_positions(positions):
+    """Vị trí dạng bỏ dấu của các từ có dấu, gộp các từ cùng dạng bỏ dấu ("tiêu", "tiếu" -> "~tieu")"""
+    folded_positions = {}
+    for term, term_positions in positions.items():
+        if not term.isascii():
+            folded = _folded_term(term)
+            existing = folded_positions.get(folded)
+            folded_positions[folded] = term_positions if existing is None else existing + term_positions
+    return folded_positions
+
+
+def _contains_phrase(terms, positions):
+    """Chunk có chứa các term liền nhau đúng thứ tự của query không"""
+    first = positions.get(terms[0], ())
+    following = [set(positions.get(term, ())) for term in terms[1:]]
+    return any(all(start + offset in term_positions for offset, term_positions in enumerate(following, 1))
+               for start in first)
+
+
+class LexicalIndex:
+    """
+    Inverted index trong SQLite, an toàn khi dùng từ nhiều thread
+
+    Số chunk và tổng độ dài (cho BM25) được giữ trong bộ nhớ, tính lại khi mở index.
+    """
+
+    def __init__(self, db_path, k1=1.5, b=0.75, phrase_boost=0.5, fold_weight=0.8):
+        """
+        Args:
+            db_path: Đường dẫn file SQLite
+            k1: Tham số bão hòa tần suất term của BM25
+            b: Tham số chuẩn hóa theo độ dài chunk của BM25
+            phrase_boost: Tỉ lệ điểm cộng thêm khi chunk chứa nguyên cụm từ của query
+            fold_weight: Hệ số điểm khi từ chỉ khớp sau khi bỏ dấu (dưới 1: ưu tiên khớp đúng dấu khi
+                tần suất và độ dài chunk tương đương)
+        """
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        self.phrase_boost = phrase_boost
+        self.fold_weight = fold_weight
+
+        self._lock = threading.RLock()
+        self._conn = connect_sqlite(db_path)
+        self._init_schema()
+        row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM lexical_docs").fetchone()
+        self._doc_count, self._total_length = row[0], row[1]
+        self._ensure_folded_terms()
+
+    def _init_schema(self):
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS lexical_docs (
+                    chunk_id TEXT PRIMARY KEY,
+                    length INTEGER NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS lexical_postings (
+                    term TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    tf INTEGER NOT NULL,
+                    doc_length INTEGER NOT NULL,
+                    positions BLOB NOT NULL,
+                    PRIMARY KEY (term, chunk_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_lexical_postings_chunk ON lexical_postings(chunk_id);
+
+                CREATE TABLE IF NOT EXISTS lexical_info (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+            self._conn.commit()
+
+    def _ensure_folded_terms(self):
+        """
+        Index tạo trước khi có dạng bỏ dấu được xóa: service dựng lại từ ChromaDB khi index rỗng
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM lexical_info WHERE key = 'folded_terms'").fetchone()
+            if row is None and self._doc_count:
+                print("♻️ Lexical index has no diacritic-folded terms, rebuilding")
+                self.clear()
+            self._conn.execute("INSERT OR REPLACE INTO lexical_info (key, value) VALUES ('folded_terms', '1')")
+            self._conn.commit()
+
+    def _remove_chunk(self, chunk_id):
+        row = self._conn.execute("SELECT length FROM lexical_docs WHERE chunk_id = ?", (chunk_id,)).fetchone()
+        if row is None:
+            return
+        self._conn.execute("DELETE FROM lexical_postings WHERE chunk_id = ?", (chunk_id,))
+        self._conn.execute("DELETE FROM lexical_docs WHERE chunk_id = ?", (chunk_id,))
+        self._doc_count -= 1
+        self._total_length -= row["length"]
+
+    def add_chunk(self, chunk_id, words):
+        """
+        Thêm (hoặc thay) 1 chunk vào index. Chưa commit: caller gọi commit() sau khi ghi batch.
+
+        Args:
+            chunk_id: ID chunk trong ChromaDB
+            words: Các từ của chunk đã chuẩn hóa (ChunkAnnotation.normalized.split())
+        """
+        positions = _positions_by_term(words)
+        positions.update(_folded_positions(positions))
+        with self._lock:
+            self._remove_chunk(chunk_id)
+            self._conn.execute("INSERT INTO lexical_docs (chunk_id, length) VALUES (?, ?)", (chunk_id, len(words)))
+            self._conn.executemany(
+                "INSERT INTO lexical_postings (term, chunk_id, tf, doc_length, positions) VALUES (?, ?, ?, ?, ?)",
+                [(term, chunk_id, len(term_positions), len(words), term_positions.tobytes())
+                 for term, term_positions in positions.items()]
+            )
+            self._doc_count += 1
+            self._total_length += len(words)
+
+    def remove_chunks(self, chunk_ids):
+        """
+        Xóa các chunk khỏi index (chunk không có trong index được bỏ qua) và commit
+
+        Returns:
+            set: Từ (dạng bỏ dấu) của các chunk đã xóa không còn chunk nào chứa, ở dạng gốc hay
+                dạng bỏ dấu (caller bỏ các từ này khỏi từ vựng của trigram index)
+        """
+        with self._lock:
+            removed_terms = set()
+            for chunk_id in chunk_ids:
+                removed_terms.update(row["term"] for row in self._conn.execute(
+                    "SELECT term FROM lexical_postings WHERE chunk_id = ?", (chunk_id,)
+                ).fetchall())
+                self._remove_chunk(chunk_id)
+            self._conn.commit()
+            folded_terms = {term[len(FOLDED_PREFIX):] if term.startswith(FOLDED_PREFIX) else fold_diacritics(term)
+                            for term in removed_terms}
+            return {folded for folded in folded_terms if self._conn.execute(
+                "SELECT 1 FROM lexical_postings WHERE term IN (?, ?) LIMIT 1", (folded, FOLDED_PREFIX + folded)
+            ).fetchone() is None}
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def is_empty(self):
+        with self._lock:
+            return self._doc_count == 0
+
+    def clear(self):
+        """Xóa toàn bộ index (khi reset/clear ChromaDB)"""
+        with self._lock:
+            self._conn.executescript("DELETE FROM lexical_postings; DELETE FROM lexical_docs;")
+            self._conn.commit()
+            self._doc_count, self._total_length = 0, 0
+
+    def _chunk_positions(self, chunk_id, terms):
+        rows = self._conn.execute(
+            f"SELECT term, positions FROM lexical_postings WHERE chunk_id = ? "
+            f"AND term IN ({','.join('?' * len(terms))})",
+            [chunk_id, *terms]
+        ).fetchall()
+        return {row["term"]: array('I', row["positions"]) for row in rows}
+
+    def _term_postings(self, term, candidates=None):
+        """Postings (chunk_id, tf, doc_length) của term, chỉ trong candidates nếu có"""
+        if candidates is None:
+            return self._conn.execute(
+                "SELECT chunk_id, tf, doc_length FROM lexical_postings WHERE term = ?", (term,)
+            ).fetchall()
+        postings = []
+        for start in range(0, len(candidates), _SQL_BATCH):
+            batch = candidates[start:start + _SQL_BATCH]
+            postings.extend(self._conn.execute(
+                f"SELECT chunk_id, tf, doc_length FROM lexical_postings WHERE term = ? "
+                f"AND chunk_id IN ({','.join('?' * len(batch))})",
+                [term, *batch]
+            ).fetchall())
+        return postings
+
+    def _term_variants(self, unique_terms, expansions=None):
+        """
+        Term trong index ứng với mỗi từ của query: dạng gốc (trọng số 1), dạng bỏ dấu của các từ
+        có dấu trong chunk và từ không dấu trong chunk (trọng số fold_weight), rồi các từ gần đúng
+        (dạng bỏ dấu, trọng số do caller tính - xem TrigramIndex.expand)
+
+        Returns:
+            dict: term trong index -> (từ của query, trọng số); dạng gốc được gán trước nên
+                từ query "tieu" khớp đúng "tieu" trong chunk dù query có thêm "tiêu"
+        """
+        variants = {term: (term, 1.0) for term in unique_terms}
+        for term in unique_terms:
+            folded = fold_diacritics(term)
+            for variant in (FOLDED_PREFIX + folded, folded):
+                variants.setdefault(variant, (term, self.fold_weight))
+        for term, similar_terms in (expansions or {}).items():
+            if term not in variants:
+                continue
+            for folded, weight in similar_terms:
+                for variant in (folded, FOLDED_PREFIX + folded):
+                    variants.setdefault(variant, (term, weight))
+        return variants
+
+    def search(self, terms, chunk_ids=None, limit=5, expansions=None):
+        """
+        Xếp hạng chunk theo BM25, chunk chứa nguyên cụm từ của query được cộng thêm phrase_boost
+
+        Mỗi từ của query được tính điểm cao nhất trong các term khớp với nó (dạng gốc / bỏ dấu /
+        gần đúng, xem _term_variants), nên chunk khớp nhiều dạng không bị cộng nhiều lần.
+
+        Term được xét từ hiếm đến phổ biến (MaxScore): khi điểm tối đa các term còn lại đóng góp
+        không đủ đưa 1 chunk mới vào top, term phổ biến chỉ được tra cho các chunk còn khả năng
+        vào top thay vì đọc toàn bộ postings.
+
+        Args:
+            terms: Các từ của query đã chuẩn hóa, theo thứ tự trong query
+            chunk_ids: Chỉ xếp hạng các chunk này (set, None = toàn bộ index)
+            limit: Số kết quả tối đa
+            expansions: Từ gần đúng cho các từ của query, {từ: [(từ dạng bỏ dấu, trọng số)]}
+
+        Returns:
+            list: (chunk_id, score, matched_terms, phrase_match) theo score giảm dần;
+                matched_terms là các từ của query (không phải dạng bỏ dấu)
+        """
+        unique_terms = list(dict.fromkeys(terms))
+        if not unique_terms or limit <= 0:
+            return []
+
+        boost = 1 + self.phrase_boost
+        variants = self._term_variants(unique_terms, expansions)
+        scores, matched = {}, {}
+        term_scores = {}  # (chunk_id, từ của query) -> điểm cao nhất trong các term khớp
+        with self._lock:
+            if not self._doc_count:
+                return []
+            average_length = self._total_length / self._doc_count
+
+            # idf theo df trên toàn bộ index (không chỉ các chunk được lọc), term hiếm trước.
+            # Các term của cùng 1 từ query dùng chung idf của cả họ từ (mọi cách viết dấu:
+            # df dạng bỏ dấu + df từ không dấu) nên chỉ fold_weight quyết định ưu tiên đúng dấu
+            document_frequency = {
+                variant: self._conn.execute(
+                    "SELECT COUNT(*) FROM lexical_postings WHERE term = ?", (variant,)
+                ).fetchone()[0]
+                for variant in variants
+            }
+            weighted_terms = []
+            for variant, (term, weight) in variants.items():
+                df = document_frequency[variant]
+                if df:
+                    folded = fold_diacritics(term)
+                    family_df = min(max(df, document_frequency.get(FOLDED_PREFIX + folded, 0)
+                                        + document_frequency.get(folded, 0)), self._doc_count)
+                    idf = math.log(1 + (self._doc_count - family_df + 0.5) / (family_df + 0.5))
+                    weighted_terms.append((variant, term, df, weight * idf))
+            weighted_terms.sort(key=lambda item: item[3], reverse=True)
+            # Điểm BM25 tối đa 1 term đóng góp là idf * (k1 + 1)
+            remaining = sum(idf for _, _, _, idf in weighted_terms) * (self.k1 + 1)
+            allowed = list(chunk_ids) if chunk_ids is not None else None
+
+            for variant, term, df, idf in weighted_terms:
+                # Lọc còn ít chunk hơn số postings của term: tra từng chunk thay vì đọc hết postings
+                candidates = allowed if allowed is not None and len(allowed) < df else None
+                if len(scores) >= limit:
+                    threshold = heapq.nlargest(limit, scores.values())[-1]
+                    if remaining * boost < threshold:
+                        candidates = [chunk_id for chunk_id, score in scores.items()
+                                      if (score + remaining) * boost >= threshold]
+                remaining -= idf * (self.k1 + 1)
+
+                for chunk_id, tf, doc_length in self._term_postings(variant, candidates):
+                    if chunk_ids is not None and chunk_id not in chunk_ids:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * doc_length / average_length)
+                    score = idf * tf * (self.k1 + 1) / (tf + norm)
+                    previous = term_scores.get((chunk_id, term), 0.0)
+                    if score > previous:
+                        term_scores[chunk_id, term] = score
+                        scores[chunk_id] = scores.get(chunk_id, 0.0) + score - previous
+                    matched.setdefault(chunk_id, set()).add(term)
+
+            ranked = heapq.nlargest(limit * 4, scores, key=scores.get)
+            present = [variant for variant, _, _, _ in weighted_terms]
+            results = []
+            for chunk_id in ranked:
+                # Chỉ kiểm tra cụm từ cho các ứng viên đầu (đọc vị trí từ tốn 1 query mỗi chunk)
+                phrase_match = (
+                    len(terms) > 1 and len(matched[chunk_id]) == len(unique_terms)
+                    and _contains_phrase(terms, self._query_term_positions(chunk_id, present, variants))
+                )
+                score = scores[chunk_id] * boost if phrase_match else scores[chunk_id]
+                matched_terms = [term for term in unique_terms if term in matched[chunk_id]]
+                results.append((chunk_id, score, matched_terms, phrase_match))
+
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results[:limit]
+
+    def _query_term_positions(self, chunk_id, index_terms, variants):
+        """Vị trí trong chunk của mỗi từ query (gộp vị trí các term khớp với từ đó)"""
+        positions = {}
+        for variant, variant_positions in self._chunk_positions(chunk_id, index_terms).items():
+            positions.setdefault(variants[variant][0], set()).update(variant_positions)
+        return positions
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Số chunk, số term khác nhau (gốc và dạng bỏ dấu) và độ dài trung bình (số từ) của chunk
+        """
+        with self._lock:
+            terms = self._conn.execute("SELECT COUNT(DISTINCT term) FROM lexical_postings").fetchone()[0]
+            # Term bỏ dấu nằm trong khoảng [FOLDED_PREFIX, ký tự kế tiếp) của primary key
+            folded_terms = self._conn.execute(
+                "SELECT COUNT(DISTINCT term) FROM lexical_postings WHERE term >= ? AND term < ?",
+                (FOLDED_PREFIX, chr(ord(FOLDED_PREFIX) + 1))
+            ).fetchone()[0]
+            return {
+                "chunks": self._doc_count,
+                "terms": terms - folded_terms,
+                "folded_terms": folded_terms,
+                "average_chunk_words": round(self._total_length / self._doc_count, 1) if self._doc_count else 0.0
+            }
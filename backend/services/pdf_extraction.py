@@ -0,0 +1,202 @@
+"""
+PDF Extraction - Trích xuất text từ PDF song song theo từng khoảng trang
+
+Module này chứa:
+- extract_page_range: Worker trích xuất 1 khoảng trang (chạy trong process con)
+- PdfTextExtractor: Chia PDF thành các khoảng trang, chạy trên process pool
+  (số process = số CPU), trả về text từng trang theo đúng thứ tự (generator,
+  chỉ giữ vài khoảng trang trong bộ nhớ cùng lúc)
+- join_pages: Ghép text các trang và ghi lại vị trí bắt đầu của từng trang
+
+Module chỉ import PyPDF2 để process con khởi động nhanh (không kéo theo ChromaDB).
+"""
+
+import gc
+import math
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import PyPDF2
+
+
+def extract_page_range(file_path, start, end):
+    """
+    Trích xuất text của các trang [start, end) - chạy trong process con
+
+    Args:
+        file_path: Đường dẫn đến file PDF
+        start: Trang bắt đầu (index từ 0)
+        end: Trang kết thúc (không bao gồm)
+
+    Returns:
+        tuple: (start, danh sách text của từng trang)
+    """
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        # Số trang đếm theo /Count của cây trang có thể lớn hơn số trang thật (PDF lỗi)
+        end = min(end, len(pdf_reader.pages))
+        pages = [pdf_reader.pages[i].extract_text() for i in range(start, end)]
+
+    # Object của PyPDF2 tham chiếu vòng tới reader -> thu hồi ngay thay vì đợi GC thế hệ 2,
+    # nếu không bộ nhớ tăng theo số khoảng trang đã đọc
+    del pdf_reader
+    gc.collect()
+    return start, pages
+
+
+def join_pages(pages):
+    """
+    Ghép text các trang thành 1 chuỗi (mỗi trang kết thúc bằng '\\n')
+
+    Args:
+        pages: Danh sách text của từng trang theo thứ tự
+
+    Returns:
+        tuple: (text, page_offsets) - page_offsets[i] là vị trí ký tự đầu tiên của trang i+1
+    """
+    page_offsets = []
+    offset = 0
+    for page_text in pages:
+        page_offsets.append(offset)
+        offset += len(page_text) + 1
+    return "\n".join(pages) + ("\n" if pages else ""), page_offsets
+
+
+class PdfTextExtractor:
+    """
+    Trích xuất text PDF bằng process pool (PyPDF2 là pure Python nên thread không giúp được)
+    """
+
+    def __init__(self, max_workers=None, min_pages_per_range=8, max_pages_per_range=64, parallel_min_pages=16):
+        """
+        Args:
+            max_workers: Số process tối đa (mặc định: số CPU)
+            min_pages_per_range: Số trang tối thiểu của 1 khoảng trang gửi cho process
+            max_pages_per_range: Số trang tối đa của 1 khoảng trang (giới hạn bộ nhớ mỗi lần đọc)
+            parallel_min_pages: PDF ít trang hơn ngưỡng này được trích xuất tuần tự
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_pages_per_range = min_pages_per_range
+        self.max_pages_per_range = max_pages_per_range
+        self.parallel_min_pages = parallel_min_pages
+        self._pool = None
+
+    def _get_pool(self):
+        """
+        Tạo process pool khi cần
+
+        Không dùng fork: fork process server đang chạy nhiều thread (Flask, ChromaDB, embedding)
+        có thể làm process con deadlock vì lock bị copy khi đang bị giữ. forkserver fork từ 1 process
+        sạch đã import sẵn module này (spawn trên hệ điều hành không có forkserver).
+        """
+        if self._pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        return self._pool
+
+    def _page_ranges(self, pages_count):
+        """Chia số trang thành các khoảng, khoảng 4 khoảng mỗi process để cân bằng tải"""
+        range_size = max(self.min_pages_per_range, math.ceil(pages_count / (self.max_workers * 4)))
+        range_size = min(range_size, self.max_pages_per_range)
+        return [(start, min(start + range_size, pages_count)) for start in range(0, pages_count, range_size)]
+
+    def count_pages(self, file_path):
+        """
+        Đếm số trang của PDF
+
+        Đọc /Count của cây trang thay vì len(reader.pages): len() làm phẳng cả cây trang
+        (tạo object cho mọi trang), bộ nhớ tăng theo số trang và chỉ được thu hồi ở lần GC thế hệ 2.
+        """
+        with open(file_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            try:
+                pages_count = int(pdf_reader.trailer["/Root"]["/Pages"]["/Count"])
+            except (KeyError, TypeError, ValueError):
+                pages_count = len(pdf_reader.pages)
+
+        del pdf_reader
+        gc.collect()
+        return pages_count
+
+    def iter_pages(self, file_path, progress_callback=None, parallel=None, pages_count=None):
+        """
+        Trích xuất text từng trang theo thứ tự dưới dạng generator
+
+        Mỗi khoảng trang được đọc bằng 1 PdfReader riêng nên cache object của PyPDF2
+        không tăng theo số trang; chế độ song song chỉ giữ tối đa 2 khoảng mỗi process.
+
+        Args:
+            file_path: Đường dẫn đến file PDF
+            progress_callback: Hàm callback(stage, **progress) báo số trang đã xử lý (optional)
+            parallel: Ép chạy song song (True) / tuần tự (False), None = tự chọn theo số trang
+            pages_count: Số trang nếu caller đã biết (tránh đọc PDF thêm 1 lần)
+
+        Yields:
+            str: Text của từng trang
+        """
+        if pages_count is None:
+            pages_count = self.count_pages(file_path)
+
+        if parallel is None:
+            parallel = self.max_workers > 1 and pages_count >= self.parallel_min_pages
+
+        ranges = deque(self._page_ranges(pages_count))
+        pages_processed = 0
+
+        def report():
+            if progress_callback:
+                progress_callback("extracting", pages_total=pages_count, pages_processed=pages_processed)
+
+        if parallel:
+            in_flight = deque()
+            try:
+                while ranges or in_flight:
+                    while ranges and len(in_flight) < self.max_workers * 2:
+                        start, end = ranges.popleft()
+                        in_flight.append((start, end, self._get_pool().submit(extract_page_range, file_path, start, end)))
+                    start, end, future = in_flight[0]
+                    _, range_pages = future.result()
+                    in_flight.popleft()
+                    pages_processed += len(range_pages)
+                    report()
+                    yield from range_pages
+                return
+            except BrokenProcessPool:
+                # Process con bị kill (OOM...) -> tạo lại pool lần sau, phần còn lại chạy tuần tự
+                print("⚠️ PDF extraction process pool broken, falling back to serial extraction")
+                self._pool = None
+                ranges = deque([(start, end) for start, end, _ in in_flight] + list(ranges))
+
+        while ranges:
+            start, end = ranges.popleft()
+            _, range_pages = extract_page_range(file_path, start, end)
+            pages_processed += len(range_pages)
+            report()
+            yield from range_pages
+
+    def extract_pages(self, file_path, progress_callback=None, parallel=None):
+        """
+        Trích xuất text của từng trang
+
+        Args:
+            file_path: Đường dẫn đến file PDF
+            progress_callback: Hàm callback(stage, **progress) báo số trang đã xử lý (optional)
+            parallel: Ép chạy song song (True) / tuần tự (False), None = tự chọn theo số trang
+
+        Returns:
+            list: Text của từng trang theo thứ tự
+        """
+        return list(self.iter_pages(file_path, progress_callback=progress_callback, parallel=parallel))
+
+    def shutdown(self):
+        """Dừng process pool"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,305 @@
+"""
+Query Cache - Cache embedding của câu hỏi và kết quả tìm kiếm
+
+Module này chứa:
+- QueryCache: LRU giới hạn số mục trong bộ nhớ, tùy chọn thêm tầng SQLite dùng chung giữa
+  các worker process, thống kê hit/miss
+- SharedQueryStore: Tầng SQLite dùng chung (giá trị JSON, LRU theo last_used) kèm generation
+  của knowledge base
+- SearchCache: Cache embedding theo câu hỏi đã chuẩn hóa và cache kết quả theo
+  (loại tìm kiếm, câu hỏi, file, số kết quả) gắn với generation của knowledge base
+
+Generation tăng mỗi khi chunks thay đổi (upload, xóa, re-index, clear, reset): key kết quả
+chứa generation nên kết quả tính trên dữ liệu cũ không bao giờ được trả lại, không cần
+tìm và xóa từng mục. Câu hỏi chỉ khác chữ hoa/thường, dấu câu, khoảng trắng dùng chung key.
+"""
+
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from services.chunk_annotator import normalize_text
+from services.sqlite_utils import connect_sqlite
+
+
+def query_key(query):
+    """Key cache của câu hỏi: dạng chuẩn hóa (câu hỏi chỉ có dấu câu giữ nguyên sau khi bỏ khoảng trắng)"""
+    query = query or ""
+    return normalize_text(query) or query.strip()
+
+
+class SharedQueryStore:
+    """
+    Cache SQLite dùng chung giữa các worker process, an toàn khi dùng từ nhiều thread
+    """
+
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path: Đường dẫn file SQLite
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path)
+        self._init_schema()
+
+    def _init_schema(self):
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                );
+                CREATE INDEX IF NOT EXISTS idx_query_cache_last_used ON query_cache(namespace, last_used);
+
+                CREATE TABLE IF NOT EXISTS kb_generation (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    value INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO kb_generation (id, value) VALUES (1, 0);
+            """)
+            self._conn.commit()
+
+    def get(self, namespace, key):
+        """Giá trị đã lưu (None nếu không có), cập nhật thời điểm dùng"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM query_cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE query_cache SET last_used = ? WHERE namespace = ? AND key = ?", (time.time(), namespace, key)
+            )
+            self._conn.commit()
+        return json.loads(row["value"])
+
+    def put(self, namespace, key, value, max_entries):
+        """
+        Lưu giá trị và xóa mục dùng lâu nhất của namespace nếu vượt max_entries
+
+        Returns:
+            int: Số mục bị xóa
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_cache (namespace, key, value, last_used) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False), time.time())
+            )
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM query_cache WHERE namespace = ?", (namespace,)
+            ).fetchone()[0]
+            evicted = 0
+            if count > max_entries:
+                # Xóa thêm 10% để không phải evict sau mỗi lần ghi
+                evicted = self._conn.execute(
+                    "DELETE FROM query_cache WHERE rowid IN (SELECT rowid FROM query_cache WHERE namespace = ? "
+                    "ORDER BY last_used LIMIT ?)",
+                    (namespace, count - max_entries + max_entries // 10)
+                ).rowcount
+            self._conn.commit()
+        return evicted
+
+    def clear(self, namespace):
+        with self._lock:
+            self._conn.execute("DELETE FROM query_cache WHERE namespace = ?", (namespace,))
+            self._conn.commit()
+
+    def count(self, namespace):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM query_cache WHERE namespace = ?", (namespace,)
+            ).fetchone()[0]
+
+    def generation(self):
+        with self._lock:
+            return self._conn.execute("SELECT value FROM kb_generation WHERE id = 1").fetchone()[0]
+
+    def bump_generation(self):
+        """Tăng generation (mọi worker thấy ngay ở lần tra cứu tiếp theo)"""
+        with self._lock:
+            self._conn.execute("UPDATE kb_generation SET value = value + 1 WHERE id = 1")
+            self._conn.commit()
+            return self._conn.execute("SELECT value FROM kb_generation WHERE id = 1").fetchone()[0]
+
+
+class QueryCache:
+    """
+    LRU giới hạn số mục, an toàn khi dùng từ nhiều thread
+
+    Có SharedQueryStore thì mục không có trong bộ nhớ được tìm tiếp trong SQLite (mục tìm được
+    nạp lại vào bộ nhớ), mục mới được ghi vào cả 2 tầng.
+    """
+
+    def __init__(self, namespace, max_entries=1000, shared_store=None):
+        """
+        Args:
+            namespace: Tên cache trong SharedQueryStore
+            max_entries: Số mục tối đa (mỗi tầng); 0 = tắt cache
+            shared_store: SharedQueryStore dùng chung giữa các worker (optional)
+        """
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.shared_store = shared_store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _put_local(self, key, value):
+        """Thêm vào LRU trong bộ nhớ (gọi khi đang giữ lock)"""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get(self, key):
+        """
+        Returns:
+            Giá trị đã cache hoặc None
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return self._entries[key]
+
+        value = self.shared_store.get(self.namespace, key) if self.shared_store else None
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._stats["shared_hits"] += 1
+            self._put_local(key, value)
+        return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._put_local(key, value)
+        if self.shared_store:
+            evicted = self.shared_store.put(self.namespace, key, value, self.max_entries)
+            with self._lock:
+                self._stats["evictions"] += evicted
+
+    def clear(self, shared=True):
+        """Xóa cache trong bộ nhớ (và tầng dùng chung nếu shared)"""
+        with self._lock:
+            self._entries.clear()
+        if shared and self.shared_store:
+            self.shared_store.clear(self.namespace)
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Số mục, hits (shared_hits: tìm thấy ở tầng dùng chung), misses, hit_rate, evictions
+        """
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(
+            max_entries=self.max_entries,
+            hit_rate=round(stats["hits"] / lookups, 4) if lookups else 0.0
+        )
+        if self.shared_store:
+            stats["shared_entries"] = self.shared_store.count(self.namespace)
+        return stats
+
+
+class SearchCache:
+    """
+    Cache embedding câu hỏi và kết quả tìm kiếm của KnowledgeBaseService
+    """
+
+    def __init__(self, embedding_entries=1000, result_entries=1000, shared_path=None):
+        """
+        Args:
+            embedding_entries: Số embedding câu hỏi tối đa (0 = tắt)
+            result_entries: Số kết quả tìm kiếm tối đa (0 = tắt)
+            shared_path: File SQLite dùng chung giữa các worker (None = chỉ cache trong process)
+        """
+        self.shared_store = SharedQueryStore(shared_path) if shared_path else None
+        self.embeddings = QueryCache("embeddings", embedding_entries, self.shared_store)
+        self.results = QueryCache("results", result_entries, self.shared_store)
+        self._generation = 0
+        self._generation_lock = threading.Lock()
+
+    @property
+    def generation(self):
+        if self.shared_store:
+            return self.shared_store.generation()
+        with self._generation_lock:
+            return self._generation
+
+    def bump_generation(self):
+        """
+        Đánh dấu chunks đã thay đổi: kết quả đã cache không còn được dùng
+
+        Returns:
+            int: Generation mới
+        """
+        # Kết quả cũ không còn key nào trỏ tới: giải phóng bộ nhớ ngay thay vì chờ LRU
+        self.results.clear(shared=False)
+        if self.shared_store:
+            return self.shared_store.bump_generation()
+        with self._generation_lock:
+            self._generation += 1
+            return self._generation
+
+    def get_embedding(self, model, query):
+        if not self.embeddings.enabled:
+            return None
+        return self.embeddings.get(json.dumps([model, query_key(query)], ensure_ascii=False))
+
+    def put_embedding(self, model, query, embedding):
+        if not self.embeddings.enabled:
+            return
+        self.embeddings.put(json.dumps([model, query_key(query)], ensure_ascii=False), list(embedding))
+
+    def _result_key(self, kind, query, file_ids, n_results, generation):
+        return json.dumps([kind, query_key(query), sorted(file_ids or []), n_results, generation],
+                          ensure_ascii=False)
+
+    def get_results(self, kind, query, file_ids, n_results):
+        """
+        Kết quả đã cache cho cùng câu hỏi / file / số kết quả ở generation hiện tại
+
+        Returns:
+            tuple: (value, generation) - value là bản sao (None nếu không có), generation dùng
+                cho put_results để kết quả tính trong lúc chunks thay đổi không được cache
+        """
+        if not self.results.enabled:
+            return None, None
+        generation = self.generation
+        value = self.results.get(self._result_key(kind, query, file_ids, n_results, generation))
+        return copy.deepcopy(value), generation
+
+    def put_results(self, kind, query, file_ids, n_results, generation, value):
+        if not self.results.enabled or generation is None:
+            return
+        self.results.put(self._result_key(kind, query, file_ids, n_results, generation), copy.deepcopy(value))
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Thống kê cache embedding, cache kết quả, generation hiện tại và chế độ dùng chung
+        """
+        return {
+            "embeddings": self.embeddings.get_stats(),
+            "results": self.results.get_stats(),
+            "generation": self.generation,
+            "shared": self.shared_store is not None
+        }
@@ -0,0 +1,327 @@
+"""
+Quick Action Service - Cache, thống kê sử dụng và prefetch cho quick actions
+
+Service này chứa:
+- Nhận diện loại quick action từ message (comment, debug, optimize, test)
+- Cache kết quả quick action theo nội dung message (LRU + TTL)
+- Thống kê tần suất sử dụng từng action
+- Prefetch nền (low-priority) action được dùng nhiều nhất khi user đang sửa code
+"""
+
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from services.cancellation_service import CancellationToken
+
+# Prompt của từng quick action - phải giống hệt prompt frontend gửi lên (App.jsx)
+# để message do prefetch tạo ra trùng cache key với message khi user click
+QUICK_ACTION_PROMPTS = {
+    "comment": "Add detailed comments in Vietnamese to this code, explain what each part does:",
+    "debug": "Find and fix bugs in this code:",
+    "optimize": "Optimize the performance of this code:",
+    "test": "Generate unit tests for this code:"
+}
+
+# Action mặc định khi chưa có thống kê sử dụng
+DEFAULT_QUICK_ACTION = "comment"
+
+
+def build_quick_action_message(action, code, language):
+    """
+    Tạo message quick action theo đúng format frontend
+
+    Args:
+        action: Loại quick action (comment, debug, optimize, test)
+        code: Source code của user
+        language: Ngôn ngữ lập trình
+
+    Returns:
+        str: Message gửi cho AI
+    """
+    prompt = QUICK_ACTION_PROMPTS[action]
+    return f"{prompt}\n\n```{language}\n{code}\n```"
+
+
+class QuickActionService:
+    """
+    Service quản lý cache và prefetch cho quick actions
+
+    Prefetch chạy trên 1 worker thread riêng (low-priority) với các giới hạn:
+    - Độ dài code tối đa cho mỗi lần prefetch
+    - Số lần prefetch tối đa mỗi phút (budget chi phí)
+    - Mỗi editor session chỉ giữ prefetch mới nhất, prefetch cũ bị hủy khi code thay đổi
+      (kể cả khi đang gọi Azure OpenAI - stream bị đóng qua CancellationToken)
+    """
+
+    def __init__(self, ai_service, cache_size=256, cache_ttl=1800,
+                 prefetch_max_code_chars=8000, prefetch_per_minute=6,
+                 inflight_wait_timeout=60, cancellation_registry=None):
+        """
+        Khởi tạo service
+
+        Args:
+            ai_service: Instance của AIService dùng cho prefetch
+            cache_size: Số kết quả tối đa giữ trong cache
+            cache_ttl: Thời gian sống của 1 kết quả cache (giây)
+            prefetch_max_code_chars: Độ dài code tối đa được prefetch
+            prefetch_per_minute: Số lần prefetch tối đa mỗi phút
+            inflight_wait_timeout: Thời gian tối đa (giây) chờ prefetch đang chạy khi user click
+            cancellation_registry: CancellationRegistry để thống kê prefetch bị hủy (optional)
+        """
+        self.ai_service = ai_service
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.prefetch_max_code_chars = prefetch_max_code_chars
+        self.prefetch_per_minute = prefetch_per_minute
+        self.inflight_wait_timeout = inflight_wait_timeout
+        self.cancellation_registry = cancellation_registry
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()          # cache_key -> (timestamp, result, source)
+        self._inflight = {}                  # cache_key -> threading.Event của prefetch đang chạy
+        self._sessions = {}                  # session_id -> (cache_key, CancellationToken) của prefetch mới nhất
+        self._prefetch_times = deque()       # Thời điểm các lần prefetch gần đây (rate limit)
+        self._usage = Counter()
+        self._executor = None
+
+        self._stats = Counter()
+
+    # =========================================
+    # CACHE
+    # =========================================
+
+    def _cache_key(self, message):
+        """Tạo cache key từ nội dung message"""
+        return hashlib.sha256(message.encode("utf-8")).hexdigest()
+
+    def detect_action(self, message):
+        """
+        Nhận diện loại quick action dựa trên prompt ở đầu message
+
+        Returns:
+            str: Tên action hoặc None nếu không khớp prompt nào
+        """
+        for action, prompt in QUICK_ACTION_PROMPTS.items():
+            if message.startswith(prompt):
+                return action
+        return None
+
+    def _fresh_entry(self, key):
+        """Entry còn hạn của cache_key (gọi khi đang giữ _lock); entry hết hạn bị xóa và coi như không có"""
+        entry = self._cache.get(key)
+        if entry is not None and time.time() - entry[0] > self.cache_ttl:
+            del self._cache[key]
+            return None
+        return entry
+
+    def get_cached(self, message, wait_inflight=True):
+        """
+        Lấy kết quả quick action từ cache
+
+        Nếu prefetch cho cùng message đang chạy thì chờ prefetch xong
+        thay vì gọi AI thêm một lần nữa.
+
+        Args:
+            message: Message quick action
+            wait_inflight: Có chờ prefetch đang chạy hay không
+
+        Returns:
+            dict: Kết quả đã cache hoặc None
+        """
+        key = self._cache_key(message)
+
+        with self._lock:
+            inflight = self._inflight.get(key)
+
+        if inflight is not None and wait_inflight:
+            inflight.wait(self.inflight_wait_timeout)
+
+        with self._lock:
+            entry = self._fresh_entry(key)
+            if entry is None:
+                self._stats["cache_misses"] += 1
+                return None
+
+            _, result, source = entry
+            self._cache.move_to_end(key)
+            self._stats["cache_hits"] += 1
+            if source == "prefetch":
+                self._stats["prefetch_hits"] += 1
+
+        return dict(result, cached=True)
+
+    def store(self, message, result, source="request"):
+        """
+        Lưu kết quả quick action thành công vào cache
+
+        Args:
+            message: Message quick action
+            result: Dict kết quả từ AIService.chat_with_ai
+            source: Nguồn tạo kết quả ("request" hoặc "prefetch")
+        """
+        if not result or not result.get("success"):
+            return
+
+        key = self._cache_key(message)
+        with self._lock:
+            self._cache[key] = (time.time(), result, source)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def record_usage(self, message):
+        """Ghi nhận user đã dùng quick action (dùng để chọn action prefetch)"""
+        action = self.detect_action(message)
+        if action:
+            with self._lock:
+                self._usage[action] += 1
+
+    def get_most_used_action(self):
+        """Lấy action được dùng nhiều nhất, mặc định là comment"""
+        with self._lock:
+            if not self._usage:
+                return DEFAULT_QUICK_ACTION
+            return self._usage.most_common(1)[0][0]
+
+    # =========================================
+    # PREFETCH
+    # =========================================
+
+    def _get_executor(self):
+        """Tạo executor 1 worker khi cần (tránh tạo thread lúc khởi động app)"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="quick-action-prefetch")
+        return self._executor
+
+    def _consume_prefetch_budget(self):
+        """Kiểm tra và trừ budget prefetch theo cửa sổ 60 giây"""
+        now = time.time()
+        while self._prefetch_times and now - self._prefetch_times[0] > 60:
+            self._prefetch_times.popleft()
+        if len(self._prefetch_times) >= self.prefetch_per_minute:
+            return False
+        self._prefetch_times.append(now)
+        return True
+
+    def prefetch(self, session_id, code, language, action=None):
+        """
+        Lên lịch prefetch quick action cho code hiện tại của editor
+
+        Args:
+            session_id: ID của editor session (mỗi tab editor một ID)
+            code: Code hiện tại trong editor
+            language: Ngôn ngữ lập trình
+            action: Action cần prefetch (mặc định: action dùng nhiều nhất)
+
+        Returns:
+            dict: {"status": scheduled|cached|skipped, "action": ..., "reason": ...}
+        """
+        action = action or self.get_most_used_action()
+        if action not in QUICK_ACTION_PROMPTS:
+            return {"status": "skipped", "action": action, "reason": "Unknown quick action"}
+
+        if not code or not code.strip():
+            return {"status": "skipped", "action": action, "reason": "Empty code"}
+
+        if len(code) > self.prefetch_max_code_chars:
+            with self._lock:
+                self._stats["prefetch_rejected_budget"] += 1
+            return {"status": "skipped", "action": action, "reason": "Code too large for prefetch"}
+
+        message = build_quick_action_message(action, code, language)
+        key = self._cache_key(message)
+
+        with self._lock:
+            # Code thay đổi -> prefetch cũ của session này không còn cần nữa
+            previous = self._sessions.get(session_id)
+            if previous and previous[0] == key:
+                token = previous[1]
+            else:
+                if previous:
+                    self._stats["prefetch_superseded"] += 1
+                    previous[1].cancel("superseded")
+                token = CancellationToken(f"prefetch-{session_id}")
+                self._sessions[session_id] = (key, token)
+
+            if self._fresh_entry(key) is not None or key in self._inflight:
+                return {"status": "cached", "action": action, "reason": None}
+
+            if not self._consume_prefetch_budget():
+                self._stats["prefetch_rejected_budget"] += 1
+                return {"status": "skipped", "action": action, "reason": "Prefetch budget exhausted"}
+
+            self._inflight[key] = threading.Event()
+            self._stats["prefetch_scheduled"] += 1
+
+        self._get_executor().submit(self._run_prefetch, token, key, message)
+        return {"status": "scheduled", "action": action, "reason": None}
+
+    def _run_prefetch(self, token, key, message):
+        """Worker chạy prefetch - bỏ qua/dừng nếu session đã có code mới hơn"""
+        try:
+            if token.is_cancelled:
+                with self._lock:
+                    self._stats["prefetch_cancelled"] += 1
+                return
+
+            result = self.ai_service.chat_with_ai(
+                message=message,
+                history=[],
+                is_quick_action=True,
+                cancel_token=token
+            )
+
+            if result.get("cancelled"):
+                with self._lock:
+                    self._stats["prefetch_cancelled"] += 1
+                if self.cancellation_registry is not None:
+                    self.cancellation_registry.record_cancellation(
+                        f"prefetch_{result.get('cancel_reason')}", result.get("tokens_saved", 0)
+                    )
+                return
+
+            self.store(message, result, source="prefetch")
+            with self._lock:
+                self._stats["prefetch_completed" if result.get("success") else "prefetch_failed"] += 1
+
+        except Exception as e:
+            print(f"⚠️ Quick action prefetch failed: {str(e)}")
+            with self._lock:
+                self._stats["prefetch_failed"] += 1
+        finally:
+            with self._lock:
+                event = self._inflight.pop(key, None)
+            if event is not None:
+                event.set()
+
+    def get_stats(self):
+        """
+        Lấy thống kê cache và prefetch
+
+        Returns:
+            dict: Thống kê hit/miss, usage và prefetch
+        """
+        with self._lock:
+            hits = self._stats["cache_hits"]
+            misses = self._stats["cache_misses"]
+            return {
+                "cache_size": len(self._cache),
+                "cache_hits": hits,
+                "cache_misses": misses,
+                "cache_hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                "usage": dict(self._usage),
+                "most_used_action": self._usage.most_common(1)[0][0] if self._usage else DEFAULT_QUICK_ACTION,
+                "prefetch": {
+                    "scheduled": self._stats["prefetch_scheduled"],
+                    "completed": self._stats["prefetch_completed"],
+                    "failed": self._stats["prefetch_failed"],
+                    "cancelled": self._stats["prefetch_cancelled"],
+                    "superseded": self._stats["prefetch_superseded"],
+                    "rejected_budget": self._stats["prefetch_rejected_budget"],
+                    "hits": self._stats["prefetch_hits"],
+                    "inflight": len(self._inflight)
+                }
+            }
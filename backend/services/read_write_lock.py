@@ -0,0 +1,53 @@
+"""
+Read-Write Lock - Nhiều thread đọc cùng lúc, thread ghi chạy một mình
+
+Dùng cho các bước đổi dữ liệu gồm nhiều lệnh ChromaDB (không có transaction): search giữ lock đọc,
+bước swap giữ lock ghi nên search không thấy trạng thái nửa chừng. Ưu tiên thread ghi: khi có
+thread ghi đang chờ, thread đọc mới phải chờ (search liên tục không làm swap chờ mãi).
+
+Lock không gắn với thread: thread giữ lock đọc có thể chờ kết quả từ thread khác cũng đọc.
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """Lock đọc dùng chung / ghi độc quyền, ưu tiên thread ghi"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writing = False
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
@@ -0,0 +1,202 @@
+"""
+Reranker - Xếp hạng lại kết quả tìm kiếm bằng cross-encoder trước khi đưa vào prompt
+
+Module này chứa:
+- Reranker: Chấm điểm (câu hỏi, chunk) của top-K kết quả trong 1 lần gọi model (1 batch),
+  giữ top-N theo điểm cross-encoder. Ước lượng thời gian theo tốc độ các lần trước: bỏ bớt
+  ứng viên cho vừa thời gian còn lại của request, không đủ thời gian thì bỏ qua (giữ thứ tự cũ)
+- create_reranker: Tạo reranker từ biến môi trường (tắt nếu không cấu hình model)
+
+Vector search chỉ so embedding của câu hỏi và chunk tính riêng nên độ chính xác của vài kết quả đầu
+thấp; cross-encoder đọc câu hỏi và chunk cùng lúc nên chính xác hơn nhưng chậm hơn nhiều, vì vậy chỉ
+chạy trên top-K. Ít chunk chính xác hơn trong prompt -> ít token hơn, AI trả lời nhanh hơn.
+
+Cấu hình (biến môi trường):
+- KB_RERANK_MODEL: Tên model CrossEncoder của sentence-transformers (rỗng = tắt rerank), ví dụ
+  cross-encoder/mmarco-mMiniLMv2-L12-H384-v1 (đa ngôn ngữ, có tiếng Việt)
+- KB_RERANK_CANDIDATES: Số kết quả (K) lấy từ retrieval để rerank (mặc định 20)
+- KB_RERANK_BUDGET_MS: Thời gian tối đa cho retrieval + rerank mỗi request (mặc định 500)
+- KB_RERANK_THREADS: Số thread intra-op của PyTorch (0 = mặc định)
+"""
+
+import os
+import threading
+import time
+
+from services.cancellation_service import raise_if_cancelled
+
+# Trọng số của lần đo mới nhất khi cập nhật thời gian ước lượng mỗi cặp (câu hỏi, chunk)
+_ESTIMATE_SMOOTHING = 0.3
+
+
+class Reranker:
+    """
+    Bọc 1 hàm chấm điểm cross-encoder, an toàn khi dùng từ nhiều thread
+    """
+
+    def __init__(self, score_fn, name, candidates=20, time_budget=0.5):
+        """
+        Args:
+            score_fn: Hàm nhận list (câu hỏi, chunk), trả về list điểm cùng thứ tự (cao hơn = liên quan hơn)
+            name: Tên model
+            candidates: Số kết quả tối đa được rerank mỗi request (K)
+            time_budget: Số giây tối đa cho retrieval + rerank mỗi request
+        """
+        self._score_fn = score_fn
+        self.name = name
+        self.candidates = candidates
+        self.time_budget = time_budget
+        self._ready = threading.Event()
+        self._ready.set()
+        self._lock = threading.Lock()
+        self._pair_seconds = None  # Ước lượng thời gian chấm mỗi cặp
+        self._stats = {"reranked": 0, "pairs": 0, "seconds": 0.0, "skipped": {}}
+
+    def start_warm_up(self):
+        """
+        Load model và đo tốc độ trong thread nền; rerank bị bỏ qua cho tới khi xong
+        (lần load đầu tốn vài giây, không được tính vào request nào)
+        """
+        self._ready.clear()
+        threading.Thread(target=self._warm_up, name="kb-rerank-warmup", daemon=True).start()
+
+    def _warm_up(self):
+        try:
+            self._score([("warm up", "warm up")])
+            print(f"✅ Reranker ready: {self.name}")
+        except Exception as e:
+            print(f"⚠️ Warning: Could not load reranker {self.name}: {str(e)}")
+        finally:
+            self._ready.set()
+
+    def _score(self, pairs):
+        """Chấm điểm trong 1 lần gọi model và cập nhật ước lượng thời gian mỗi cặp"""
+        start = time.perf_counter()
+        scores = [float(score) for score in self._score_fn(pairs)]
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            pair_seconds = elapsed / len(pairs)
+            self._pair_seconds = pair_seconds if self._pair_seconds is None else (
+                _ESTIMATE_SMOOTHING * pair_seconds + (1 - _ESTIMATE_SMOOTHING) * self._pair_seconds
+            )
+        return scores, elapsed
+
+    def _skip(self, results, top_n, reason, candidates=0):
+        with self._lock:
+            self._stats["skipped"][reason] = self._stats["skipped"].get(reason, 0) + 1
+        return results[:top_n], {"applied": False, "skipped": reason, "candidates": candidates, "model": self.name}
+
+    def rerank(self, query, results, top_n, started_at=None):
+        """
+        Xếp hạng lại kết quả tìm kiếm, giữ top_n
+
+        Args:
+            query: Câu hỏi
+            results: Kết quả tìm kiếm (dict có "content") theo thứ tự retrieval
+            top_n: Số kết quả giữ lại
+            started_at: time.perf_counter() lúc request bắt đầu tìm kiếm (thời gian đã dùng
+                được trừ khỏi time_budget); None = cả time_budget dành cho rerank
+
+        Returns:
+            tuple: (results, info)
+                results: top_n kết quả; đã rerank thì mỗi kết quả có thêm rerank_score
+                    (similarity_score của retrieval giữ nguyên)
+                info: {"applied", "skipped" (lý do nếu không rerank), "candidates", "elapsed_ms", "model"}
+        """
+        candidates = results[:self.candidates]
+        if len(candidates) <= 1 or top_n <= 0:
+            return results[:top_n], {"applied": False, "skipped": "not_enough_results",
+                                     "candidates": len(candidates), "model": self.name}
+        if not self._ready.is_set():
+            return self._skip(results, top_n, "warming_up")
+
+        remaining = self.time_budget - (time.perf_counter() - started_at if started_at is not None else 0.0)
+        with self._lock:
+            pair_seconds = self._pair_seconds
+        if pair_seconds is not None:
+            # Bớt ứng viên cuối (retrieval xếp thấp nhất) cho vừa thời gian còn lại; chỉ còn
+            # top_n ứng viên thì rerank không đổi được tập kết quả -> bỏ qua
+            affordable = int(max(remaining, 0.0) / pair_seconds) if pair_seconds > 0 else len(candidates)
+            if affordable <= min(top_n, len(candidates) - 1):
+                return self._skip(results, top_n, "budget_exhausted", len(candidates))
+            candidates = candidates[:affordable]
+        elif remaining <= 0:
+            return self._skip(results, top_n, "budget_exhausted", len(candidates))
+
+        raise_if_cancelled()
+        try:
+            scores, elapsed = self._score([(query, result["content"]) for result in candidates])
+        except Exception as e:
+            print(f"⚠️ Warning: Rerank failed ({str(e)}), keeping retrieval order")
+            return self._skip(results, top_n, "error", len(candidates))
+
+        with self._lock:
+            self._stats["reranked"] += 1
+            self._stats["pairs"] += len(candidates)
+            self._stats["seconds"] += elapsed
+        ranked = sorted(zip(scores, range(len(candidates))), key=lambda item: (-item[0], item[1]))[:top_n]
+        reranked = [dict(candidates[index], rerank_score=round(score, 4)) for score, index in ranked]
+        return reranked, {"applied": True, "candidates": len(candidates),
+                          "elapsed_ms": round(elapsed * 1000, 1), "model": self.name}
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Model, số request đã rerank / bỏ qua (theo lý do), thời gian trung bình và ước lượng mỗi cặp
+        """
+        with self._lock:
+            stats = dict(self._stats, skipped=dict(self._stats["skipped"]))
+            pair_seconds = self._pair_seconds
+        stats.update(
+            model=self.name,
+            candidates=self.candidates,
+            time_budget_ms=round(self.time_budget * 1000),
+            ready=self._ready.is_set(),
+            average_ms=round(stats["seconds"] * 1000 / stats["reranked"], 1) if stats["reranked"] else 0.0,
+            estimated_pair_ms=round(pair_seconds * 1000, 3) if pair_seconds is not None else None
+        )
+        return stats
+
+
+def _load_cross_encoder(model_name, intra_op_threads):
+    """Hàm chấm điểm CrossEncoder của sentence-transformers (optional dependency, load khi gọi lần đầu)"""
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError:
+        raise ImportError(
+            "sentence-transformers is not installed. Install it with: pip install sentence-transformers"
+        )
+
+    if intra_op_threads:
+        import torch
+        torch.set_num_threads(intra_op_threads)
+
+    lock = threading.Lock()
+    model = None
+
+    def score(pairs):
+        nonlocal model
+        with lock:
+            if model is None:
+                model = CrossEncoder(model_name, device="cpu")
+        # Tất cả ứng viên trong 1 forward pass
+        return model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+
+    return score
+
+
+def create_reranker(model=None, candidates=None, time_budget_ms=None, threads=None):
+    """
+    Tạo Reranker theo tham số hoặc biến môi trường KB_RERANK_*
+
+    Returns:
+        Reranker hoặc None nếu không cấu hình model (rerank tắt)
+    """
+    model = model if model is not None else os.getenv("KB_RERANK_MODEL", "")
+    if not model:
+        return None
+    candidates = candidates or int(os.getenv("KB_RERANK_CANDIDATES", "20"))
+    time_budget_ms = time_budget_ms or int(os.getenv("KB_RERANK_BUDGET_MS", "500"))
+    threads = threads if threads is not None else int(os.getenv("KB_RERANK_THREADS", "0"))
+    return Reranker(_load_cross_encoder(model, threads), model, candidates=candidates,
+                    time_budget=time_budget_ms / 1000)
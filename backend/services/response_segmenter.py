@@ -0,0 +1,206 @@
+"""
+Response Segmenter - Tách câu trả lời của AI thành các segment text/code
+
+Service này chứa:
+- segment_response: Tách 1 lần (single-pass) câu trả lời hoàn chỉnh thành segments,
+  cho kết quả giống hệt parseMessageContent trong frontend/src/utils/messageParser.js
+- StreamingSegmenter: Tách tăng dần theo từng delta của stream, phát event
+  segment_start / segment_delta / segment_end ngay khi gặp ranh giới code block
+
+Format của 1 segment:
+    {"type": "text", "content": "..."}
+    {"type": "code", "language": "python", "content": "..."}
+"""
+
+FENCE = "```"
+
+
+def _is_word_char(ch):
+    """Ký tự thuộc \\w của JavaScript (chỉ ASCII: chữ, số, gạch dưới)"""
+    return ch.isascii() and (ch.isalnum() or ch == "_")
+
+
+def _scan_language(text, start):
+    """
+    Đọc tên ngôn ngữ ngay sau fence mở
+
+    Returns:
+        tuple: (language hoặc None, vị trí bắt đầu nội dung code)
+    """
+    end = start
+    while end < len(text) and _is_word_char(text[end]):
+        end += 1
+    language = text[start:end] or None
+    if end < len(text) and text[end] == "\n":
+        end += 1
+    return language, end
+
+
+def segment_response(text):
+    """
+    Tách câu trả lời thành danh sách segment text/code trong 1 lần duyệt
+
+    Quy tắc giống regex /```(\\w+)?\\n?([\\s\\S]*?)```/g của frontend:
+    - Text giữa các code block được trim, bỏ qua nếu rỗng
+    - Code block rỗng bị bỏ qua, language mặc định là 'text'
+    - Fence mở không có fence đóng được giữ nguyên như text
+    - Không có segment nào -> toàn bộ câu trả lời là 1 segment text
+
+    Args:
+        text: Câu trả lời hoàn chỉnh của AI
+
+    Returns:
+        list: Danh sách segment dạng dict
+    """
+    text = text or ""
+    segments = []
+    last_index = 0
+
+    while True:
+        open_index = text.find(FENCE, last_index)
+        if open_index == -1:
+            break
+
+        language, code_start = _scan_language(text, open_index + len(FENCE))
+        close_index = text.find(FENCE, code_start)
+        if close_index == -1:
+            break
+
+        text_before = text[last_index:open_index].strip()
+        if text_before:
+            segments.append({"type": "text", "content": text_before})
+
+        code = text[code_start:close_index].strip()
+        if code:
+            segments.append({"type": "code", "language": language or "text", "content": code})
+
+        last_index = close_index + len(FENCE)
+
+    text_after = text[last_index:].strip()
+    if text_after:
+        segments.append({"type": "text", "content": text_after})
+
+    if not segments:
+        segments.append({"type": "text", "content": text})
+
+    return segments
+
+
+class StreamingSegmenter:
+    """
+    Tách segment tăng dần khi câu trả lời được stream về
+
+    Mỗi lần feed() trả về danh sách event:
+    - {"type": "segment_start", "index", "segment_type", "language"}
+    - {"type": "segment_delta", "index", "content"}
+    - {"type": "segment_end", "index", "content"}  (content đã trim, giống segment_response)
+
+    Segment chỉ được mở khi gặp ký tự khác khoảng trắng nên không phát segment rỗng.
+    Code block chưa đóng khi stream kết thúc vẫn được đóng như code; client nên dùng
+    danh sách segments trong event done (tính bằng segment_response) làm kết quả cuối.
+    """
+
+    def __init__(self):
+        self._buffer = ""          # Phần chưa xử lý (có thể là 1 phần của fence hoặc tên ngôn ngữ)
+        self._in_code = False
+        self._awaiting_language = False
+        self._language = None
+        self._index = -1
+        self._open = False         # Đã phát segment_start cho segment hiện tại chưa
+        self._parts = []           # Nội dung của segment hiện tại
+
+    def feed(self, delta):
+        """
+        Xử lý 1 delta của stream
+
+        Args:
+            delta: Đoạn text mới nhận được
+
+        Returns:
+            list: Các event segment phát sinh
+        """
+        self._buffer += delta
+        events = []
+
+        while self._buffer:
+            if self._awaiting_language:
+                if not self._read_language(final=False):
+                    break
+                continue
+
+            fence_index = self._buffer.find(FENCE)
+            if fence_index == -1:
+                # Giữ lại backtick cuối vì có thể là phần đầu của fence ở delta sau
+                keep = len(self._buffer) - len(self._buffer.rstrip("`"))
+                keep = min(keep, len(FENCE) - 1)
+                self._emit(self._buffer[:len(self._buffer) - keep], events)
+                self._buffer = self._buffer[len(self._buffer) - keep:]
+                break
+
+            self._emit(self._buffer[:fence_index], events)
+            self._buffer = self._buffer[fence_index + len(FENCE):]
+            self._close(events)
+            if self._in_code:
+                self._in_code = False
+            else:
+                self._in_code = True
+                self._awaiting_language = True
+
+        return events
+
+    def finish(self):
+        """
+        Kết thúc stream, đóng segment đang mở
+
+        Returns:
+            list: Các event segment còn lại
+        """
+        events = []
+        if self._awaiting_language:
+            self._read_language(final=True)
+        self._emit(self._buffer, events)
+        self._buffer = ""
+        self._close(events)
+        return events
+
+    def _read_language(self, final):
+        """Đọc tên ngôn ngữ sau fence mở, trả về False nếu cần thêm dữ liệu"""
+        end = 0
+        while end < len(self._buffer) and _is_word_char(self._buffer[end]):
+            end += 1
+        if end == len(self._buffer) and not final:
+            return False
+        if end < len(self._buffer) and self._buffer[end] == "\n":
+            skip = end + 1
+        else:
+            skip = end
+        self._language = self._buffer[:end] or None
+        self._buffer = self._buffer[skip:]
+        self._awaiting_language = False
+        return True
+
+    def _emit(self, content, events):
+        """Thêm nội dung vào segment hiện tại, mở segment khi gặp ký tự đầu tiên khác khoảng trắng"""
+        if not content:
+            return
+        if not self._open:
+            content = content.lstrip()
+            if not content:
+                return
+            self._open = True
+            self._index += 1
+            event = {"type": "segment_start", "index": self._index,
+                     "segment_type": "code" if self._in_code else "text"}
+            if self._in_code:
+                event["language"] = self._language or "text"
+            events.append(event)
+        self._parts.append(content)
+        events.append({"type": "segment_delta", "index": self._index, "content": content})
+
+    def _close(self, events):
+        """Đóng segment hiện tại (nếu đã mở)"""
+        if self._open:
+            events.append({"type": "segment_end", "index": self._index,
+                           "content": "".join(self._parts).strip()})
+        self._open = False
+        self._parts = []
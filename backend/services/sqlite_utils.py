@@ -0,0 +1,32 @@
+"""
+SQLite Utils - Helper mở kết nối SQLite dùng chung cho các store của backend
+
+SQLite được dùng cho dữ liệu nhỏ cần bền vững qua restart (job table, cache, index),
+không cần thêm service ngoài. Kết nối bật WAL để request đọc không bị chặn bởi worker ghi.
+"""
+
+import os
+import sqlite3
+
+
+def connect_sqlite(db_path):
+    """
+    Mở kết nối SQLite dùng chung giữa các thread
+
+    Caller tự giữ lock khi ghi (kết nối được share giữa nhiều thread).
+
+    Args:
+        db_path: Đường dẫn file database (thư mục cha được tạo nếu chưa có)
+
+    Returns:
+        sqlite3.Connection: Kết nối với row_factory = sqlite3.Row
+    """
+    directory = os.path.dirname(db_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,280 @@
+"""
+Text Chunker - Chia text thành chunks cho vector database
+
+Module này chứa:
+- iter_chunks: Chia toàn bộ text, trả về lần lượt TextChunk (nội dung + vị trí ký tự)
+- split_text: Danh sách nội dung chunk (KnowledgeBaseService._split_text_into_chunks)
+- IncrementalChunker: Nhận text theo từng phần (từng trang PDF), trả về chunk ngay khi
+  đủ dữ liệu, chỉ giữ trong bộ nhớ phần text chưa được chia. Kết quả giống hệt
+  split_text trên toàn bộ text.
+
+Vị trí các dấu câu được tìm 1 lần (1 lượt regex) cho cả text; mỗi chunk chỉ cần tìm nhị phân
+điểm ngắt gần cuối cửa sổ thay vì rfind lại từng loại dấu câu trên toàn bộ cửa sổ.
+
+Kích thước chunk tính theo ký tự (mặc định) hoặc theo token khi truyền token_spans
+(hàm text -> list (start, end) của từng token, ví dụ tokenizer của embedding model).
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+# Điểm ngắt tự nhiên theo thứ tự ưu tiên
+BREAK_CHARS = ['. ', '\n', '! ', '? ', '; ', ': ', '.\n', '!\n', '?\n']
+
+# Text đã làm sạch không còn xuống dòng -> chỉ các điểm ngắt "<dấu câu><dấu cách>" có tác dụng
+_BOUNDARY_MARKS = [break_char[0] for break_char in BREAK_CHARS if break_char[1:] == ' ']
+_BOUNDARY_RE = re.compile('[' + re.escape(''.join(_BOUNDARY_MARKS)) + '] ')
+
+# Chỉ ngắt tại dấu cách khi dấu cách nằm sau 70% cửa sổ chunk
+SPACE_BREAK_RATIO = 0.7
+
+# Đơn vị đo kích thước chunk
+CHUNK_UNIT_CHARS = "chars"
+CHUNK_UNIT_TOKENS = "tokens"
+CHUNK_UNITS = (CHUNK_UNIT_CHARS, CHUNK_UNIT_TOKENS)
+
+# Chunk cùng vị trí [start, end) trong text đã làm sạch
+TextChunk = namedtuple("TextChunk", ["text", "start", "end"])
+
+
+def clean_text(text):
+    """Gộp mọi chuỗi khoảng trắng (kể cả xuống dòng) thành 1 dấu cách, bỏ khoảng trắng đầu/cuối"""
+    return " ".join(text.split())
+
+
+def find_boundaries(text):
+    """
+    Tìm vị trí các điểm ngắt câu trong text đã làm sạch
+
+    Returns:
+        dict: dấu câu -> list vị trí (tăng dần) của dấu câu đứng trước 1 dấu cách
+    """
+    boundaries = {mark: [] for mark in _BOUNDARY_MARKS}
+    for match in _BOUNDARY_RE.finditer(text):
+        position = match.start()
+        boundaries[text[position]].append(position)
+    return boundaries
+
+
+def _find_break(text, boundaries, start, end, space_threshold):
+    """
+    Điểm ngắt tốt nhất trong [start, end): dấu câu cuối cùng theo thứ tự ưu tiên,
+    nếu không có thì dấu cách cuối cùng nằm sau space_threshold
+
+    Returns:
+        int: Vị trí kết thúc chunk, -1 nếu không có điểm ngắt phù hợp
+    """
+    for mark in _BOUNDARY_MARKS:
+        positions = boundaries[mark]
+        index = bisect_right(positions, end - 2) - 1
+        if index >= 0 and positions[index] >= start:
+            return positions[index] + 2
+
+    space_pos = text.rfind(' ', start, end)
+    if space_pos != -1 and space_pos > space_threshold:
+        return space_pos + 1
+    return -1
+
+
+def _next_window(text, boundaries, token_starts, start, chunk_size, overlap):
+    """
+    Tính cửa sổ chunk bắt đầu tại start
+
+    Returns:
+        tuple: (end, next_start) - vị trí kết thúc chunk và vị trí bắt đầu chunk tiếp theo
+    """
+    if token_starts is None:
+        end = start + chunk_size
+        if end < len(text):
+            best_break = _find_break(text, boundaries, start, end, start + chunk_size * SPACE_BREAK_RATIO)
+            if best_break != -1:
+                end = best_break
+        return end, max(start + 1, end - overlap)
+
+    first = bisect_left(token_starts, start)
+    if first + chunk_size < len(token_starts):
+        end = token_starts[first + chunk_size]
+        best_break = _find_break(text, boundaries, start, end, start + (end - start) * SPACE_BREAK_RATIO)
+        if best_break != -1:
+            end = best_break
+    else:
+        end = len(text)
+    next_token = max(first + 1, bisect_left(token_starts, end) - overlap)
+    return end, token_starts[next_token] if next_token < len(token_starts) else len(text)
+
+
+def _make_chunk(text, start, end, offset=0):
+    """Bỏ dấu cách đầu/cuối của text[start:end], None nếu chunk rỗng"""
+    end = min(end, len(text))
+    if start < end and text[start] == ' ':
+        start += 1
+    if end > start and text[end - 1] == ' ':
+        end -= 1
+    if start >= end:
+        return None
+    return TextChunk(text[start:end], offset + start, offset + end)
+
+
+def _token_starts(text, token_spans):
+    return [start for start, _ in token_spans(text)] if token_spans else None
+
+
+def iter_chunks(text, chunk_size=1000, overlap=200, token_spans=None):
+    """
+    Chia text thành chunks, trả về lần lượt từng chunk
+
+    Args:
+        text: Text cần chia (tiếng Việt hoặc tiếng Anh)
+        chunk_size: Kích thước mỗi chunk (số ký tự, hoặc số token nếu có token_spans)
+        overlap: Số ký tự (hoặc token) overlap giữa các chunk
+        token_spans: Hàm text -> list (start, end) của token (None = tính theo ký tự)
+
+    Yields:
+        TextChunk: Nội dung chunk và vị trí trong text đã làm sạch (clean_text)
+    """
+    cleaned_text = clean_text(text)
+    token_starts = _token_starts(cleaned_text, token_spans)
+    size = len(cleaned_text) if token_starts is None else len(token_starts)
+    if size <= chunk_size:
+        yield TextChunk(cleaned_text, 0, len(cleaned_text))
+        return
+
+    boundaries = find_boundaries(cleaned_text)
+    start = 0
+    while start < len(cleaned_text):
+        end, next_start = _next_window(cleaned_text, boundaries, token_starts, start, chunk_size, overlap)
+        chunk = _make_chunk(cleaned_text, start, end)
+        if chunk:
+            yield chunk
+        start = next_start
+
+
+def split_text(text, chunk_size=1000, overlap=200, token_spans=None):
+    """
+    Returns:
+        list: Nội dung các chunk của iter_chunks
+    """
+    return [chunk.text for chunk in iter_chunks(text, chunk_size, overlap, token_spans)]
+
+
+class IncrementalChunker:
+    """
+    Chia text thành chunks khi text được đưa vào theo từng phần
+
+    Text được làm sạch giống clean_text: mọi chuỗi khoảng trắng
+    (kể cả xuống dòng) thành 1 dấu cách, bỏ khoảng trắng đầu/cuối.
+    """
+
+    def __init__(self, chunk_size=1000, overlap=200, token_spans=None, with_offsets=False):
+        """
+        Args:
+            chunk_size: Kích thước mỗi chunk (số ký tự, hoặc số token nếu có token_spans)
+            overlap: Số ký tự (hoặc token) overlap giữa các chunk
+            token_spans: Hàm text -> list (start, end) của token (None = tính theo ký tự).
+                Tokenizer phải tách token tại khoảng trắng/dấu câu để kết quả giống iter_chunks.
+            with_offsets: Trả về TextChunk (kèm vị trí) thay vì chỉ nội dung chunk
+        """
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.token_spans = token_spans
+        self.with_offsets = with_offsets
+        self._buffer = ""            # Text đã làm sạch chưa được chia hết
+        self._offset = 0             # Vị trí của _buffer[0] trong toàn bộ text đã làm sạch
+        self._pending_space = False  # Khoảng trắng ở cuối phần trước, chỉ thêm khi có ký tự tiếp theo
+        self._start = 0              # Vị trí bắt đầu chunk tiếp theo trong _buffer
+        self._has_text = False       # Đã nhận ký tự khác khoảng trắng nào chưa
+        self._splitting = False      # Text đã dài hơn chunk_size (đã bắt đầu chia)
+
+    @property
+    def position(self):
+        """Độ dài text đã làm sạch đã nhận (vị trí của dấu cách nối với phần text tiếp theo)"""
+        return self._offset + len(self._buffer)
+
+    @property
+    def pending_start(self):
+        """Vị trí bắt đầu của chunk tiếp theo (text trước vị trí này đã được trả về trong các chunk)"""
+        return self._offset + self._start
+
+    def feed(self, text):
+        """
+        Đưa thêm text vào chunker
+
+        Args:
+            text: Phần text tiếp theo (ví dụ text của 1 trang)
+
+        Returns:
+            list: Các chunk đã hoàn chỉnh
+        """
+        words = text.split()
+        if not words:
+            self._pending_space = self._pending_space or bool(text)
+            return []
+
+        prefix = " " if self._has_text and (self._pending_space or text[0].isspace()) else ""
+        self._buffer += prefix + " ".join(words)
+        self._has_text = True
+        self._pending_space = text[-1].isspace()
+
+        chunks = []
+        boundaries = find_boundaries(self._buffer)
+        token_starts = _token_starts(self._buffer, self.token_spans)
+        # Chỉ chia khi chắc chắn cửa sổ chunk chưa chạm cuối text (phần sau chưa nhận có thể đổi điểm ngắt)
+        while self._window_complete(token_starts):
+            self._next_chunk(chunks, boundaries, token_starts)
+        self._compact()
+        return chunks
+
+    def finish(self):
+        """
+        Kết thúc text, trả về các chunk còn lại
+
+        Returns:
+            list: Các chunk cuối cùng
+        """
+        token_starts = _token_starts(self._buffer, self.token_spans)
+        size = len(self._buffer) if token_starts is None else len(token_starts)
+        if not self._splitting and size <= self.chunk_size:
+            chunks = [self._output(TextChunk(self._buffer, self._offset, self._offset + len(self._buffer)))]
+            self._reset()
+            return chunks
+
+        chunks = []
+        boundaries = find_boundaries(self._buffer)
+        while self._start < len(self._buffer):
+            self._next_chunk(chunks, boundaries, token_starts)
+        self._reset()
+        return chunks
+
+    def _window_complete(self, token_starts):
+        """Cửa sổ chunk tại _start đã nằm trọn trong phần text đã nhận chưa"""
+        if token_starts is None:
+            return len(self._buffer) > self._start + self.chunk_size
+        # Token cuối có thể còn nối tiếp với phần text sau
+        return bisect_left(token_starts, self._start) + self.chunk_size < len(token_starts) - 1
+
+    def _next_chunk(self, chunks, boundaries, token_starts):
+        """Tạo 1 chunk từ vị trí _start (cùng logic với iter_chunks)"""
+        self._splitting = True
+        end, next_start = _next_window(
+            self._buffer, boundaries, token_starts, self._start, self.chunk_size, self.overlap
+        )
+        chunk = _make_chunk(self._buffer, self._start, end, self._offset)
+        if chunk:  # Chỉ thêm chunk không rỗng
+            chunks.append(self._output(chunk))
+        self._start = min(next_start, len(self._buffer))
+
+    def _output(self, chunk):
+        return chunk if self.with_offsets else chunk.text
+
+    def _compact(self):
+        """Bỏ phần text đã chia xong khỏi buffer để bộ nhớ không tăng theo kích thước tài liệu"""
+        if self._start > 0:
+            self._buffer = self._buffer[self._start:]
+            self._offset += self._start
+            self._start = 0
+
+    def _reset(self):
+        self._offset += len(self._buffer)
+        self._buffer = ""
+        self._start = 0
@@ -0,0 +1,217 @@
+"""
+Trigram Index - Tìm từ gần đúng (gõ sai, gõ thiếu, 1 phần của identifier) trong từ vựng của knowledge base
+
+Module này chứa:
+- term_trigrams / query_trigrams: Tập trigram (3 ký tự liên tiếp) của 1 từ đã index / của từ trong query
+- TrigramIndex: Index SQLite trigram -> từ trên từ vựng (các từ khác nhau của dạng chuẩn hóa
+  các chunk, đã bỏ dấu), cập nhật khi ingest / xóa / re-index; tìm các từ có nhiều trigram chung
+  với từ của query
+
+Index theo từ vựng thay vì theo chunk: số từ khác nhau nhỏ hơn nhiều so với số chunk, và từ tìm
+được dùng để tra postings của lexical index (BM25), không phải đọc lại nội dung chunk. Identifier
+(StudentManager, NullPointerException) là 1 từ sau chuẩn hóa nên "NullPointerExcep" (gõ thiếu) hay
+"PointerException" (1 phần) khớp theo trigram với từ "nullpointerexception".
+
+Điểm của 1 từ (xem _score):
+- coverage = số trigram chung / số trigram của query (1.0 khi query là 1 phần của từ)
+- similarity = số trigram chung / số trigram của hợp 2 từ (Jaccard, ưu tiên từ dài gần bằng query)
+"""
+
+import math
+import threading
+
+from services.chunk_annotator import fold_diacritics
+from services.sqlite_utils import connect_sqlite
+
+# SQLite giới hạn số tham số mỗi câu lệnh
+_SQL_BATCH = 500
+
+# Từ ngắn hơn không được index / mở rộng (quá ít trigram để so khớp có ý nghĩa)
+MIN_TERM_LENGTH = 3
+MIN_QUERY_LENGTH = 4
+
+
+def term_trigrams(term):
+    """Trigram của từ đã index, thêm dấu cách 2 đầu để trigram đầu / cuối từ được tính"""
+    padded = f" {term} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def query_trigrams(term):
+    """
+    Trigram của từ trong query, không thêm dấu cách: từ của query có thể chỉ là
+    1 phần (đầu, giữa hoặc cuối) của từ đã index
+    """
+    return {term[index:index + 3] for index in range(len(term) - 2)}
+
+
+def _score(shared, query_count, term_count):
+    """(coverage, similarity) theo số trigram chung"""
+    return shared / query_count, shared / (query_count + term_count - shared)
+
+
+class TrigramIndex:
+    """
+    Trigram của từ vựng trong SQLite, an toàn khi dùng từ nhiều thread
+
+    Từ vựng (dạng bỏ dấu) được giữ trong bộ nhớ để ingest chỉ ghi từ mới. Từ không còn chunk nào
+    chứa (LexicalIndex.remove_chunks) được bỏ bằng remove_terms: từ vựng không tăng mãi qua các lần
+    re-index, và từ đó lại được mở rộng sang từ gần đúng như từ chưa từng có.
+    """
+
+    def __init__(self, db_path, min_coverage=0.5, max_expansions=3):
+        """
+        Args:
+            db_path: Đường dẫn file SQLite
+            min_coverage: Tỉ lệ trigram của query tối thiểu phải có trong từ
+            max_expansions: Số từ gần đúng tối đa cho mỗi từ của query
+        """
+        self.db_path = db_path
+        self.min_coverage = min_coverage
+        self.max_expansions = max_expansions
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path)
+        self._init_schema()
+        self._terms = {row["term"] for row in self._conn.execute("SELECT term FROM trigram_terms").fetchall()}
+
+    def _init_schema(self):
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS trigram_terms (
+                    term TEXT PRIMARY KEY,
+                    trigram_count INTEGER NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS trigram_postings (
+                    trigram TEXT NOT NULL,
+                    term TEXT NOT NULL,
+                    PRIMARY KEY (trigram, term)
+                ) WITHOUT ROWID;
+            """)
+            self._conn.commit()
+
+    def add_terms(self, words):
+        """
+        Thêm các từ chưa có vào từ vựng. Chưa commit: caller gọi commit() sau khi ghi batch.
+
+        Args:
+            words: Các từ của chunk đã chuẩn hóa (ChunkAnnotation.normalized.split())
+        """
+        with self._lock:
+            new_terms = {fold_diacritics(word) for word in set(words) if len(word) >= MIN_TERM_LENGTH}
+            new_terms -= self._terms
+            if not new_terms:
+                return
+            trigrams = {term: term_trigrams(term) for term in new_terms}
+            self._conn.executemany("INSERT OR IGNORE INTO trigram_terms (term, trigram_count) VALUES (?, ?)",
+                                   [(term, len(term_set)) for term, term_set in trigrams.items()])
+            self._conn.executemany("INSERT OR IGNORE INTO trigram_postings (trigram, term) VALUES (?, ?)",
+                                   [(trigram, term) for term, term_set in trigrams.items() for trigram in term_set])
+            self._terms |= new_terms
+
+    def remove_terms(self, terms):
+        """
+        Bỏ các từ khỏi từ vựng và commit
+
+        Args:
+            terms: Các từ dạng bỏ dấu không còn chunk nào chứa (từ không có trong từ vựng được bỏ qua)
+        """
+        with self._lock:
+            removed = [term for term in set(terms) if term in self._terms]
+            if not removed:
+                return
+            self._conn.executemany("DELETE FROM trigram_postings WHERE trigram = ? AND term = ?",
+                                   [(trigram, term) for term in removed for trigram in term_trigrams(term)])
+            self._conn.executemany("DELETE FROM trigram_terms WHERE term = ?", [(term,) for term in removed])
+            self._conn.commit()
+            self._terms.difference_update(removed)
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def is_empty(self):
+        with self._lock:
+            return not self._terms
+
+    def clear(self):
+        """Xóa toàn bộ index (khi reset/clear ChromaDB)"""
+        with self._lock:
+            self._conn.executescript("DELETE FROM trigram_postings; DELETE FROM trigram_terms;")
+            self._conn.commit()
+            self._terms = set()
+
+    def similar_terms(self, term):
+        """
+        Các từ trong từ vựng gần đúng với 1 từ của query
+
+        Args:
+            term: Từ của query đã chuẩn hóa
+
+        Returns:
+            list: (từ dạng bỏ dấu, coverage, similarity) theo coverage rồi similarity giảm dần,
+                tối đa max_expansions từ, không gồm chính từ đó
+        """
+        folded = fold_diacritics(term)
+        trigrams = list(query_trigrams(folded))
+        if len(folded) < MIN_QUERY_LENGTH or not trigrams:
+            return []
+        min_shared = max(1, math.ceil(self.min_coverage * len(trigrams)))
+        shared_counts = {}
+        with self._lock:
+            # Đếm trigram chung của mỗi từ bằng postings, không duyệt toàn bộ từ vựng
+            for start in range(0, len(trigrams), _SQL_BATCH):
+                batch = trigrams[start:start + _SQL_BATCH]
+                for row in self._conn.execute(
+                    f"SELECT term, COUNT(*) AS shared FROM trigram_postings "
+                    f"WHERE trigram IN ({','.join('?' * len(batch))}) GROUP BY term",
+                    batch
+                ).fetchall():
+                    shared_counts[row["term"]] = shared_counts.get(row["term"], 0) + row["shared"]
+            candidates = [candidate for candidate, shared in shared_counts.items()
+                          if shared >= min_shared and candidate != folded]
+            term_counts = {}
+            for start in range(0, len(candidates), _SQL_BATCH):
+                batch = candidates[start:start + _SQL_BATCH]
+                for row in self._conn.execute(
+                    f"SELECT term, trigram_count FROM trigram_terms WHERE term IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall():
+                    term_counts[row["term"]] = row["trigram_count"]
+
+        scored = [(candidate, *_score(shared_counts[candidate], len(trigrams), term_counts[candidate]))
+                  for candidate in candidates if candidate in term_counts]
+        scored.sort(key=lambda item: (item[1], item[2]), reverse=True)
+        return scored[:self.max_expansions]
+
+    def expand(self, terms):
+        """
+        Từ gần đúng cho các từ của query không có trong từ vựng (kể cả sau khi bỏ dấu)
+
+        Args:
+            terms: Các từ của query đã chuẩn hóa
+
+        Returns:
+            dict: Từ của query -> list (từ dạng bỏ dấu, trọng số); trọng số là trung bình của
+                coverage và similarity (dưới 1, từ khớp chính xác luôn được xếp trên)
+        """
+        expansions = {}
+        for term in dict.fromkeys(terms):
+            with self._lock:
+                known = fold_diacritics(term) in self._terms
+            if known:
+                continue
+            similar = self.similar_terms(term)
+            if similar:
+                expansions[term] = [(candidate, (coverage + similarity) / 2)
+                                    for candidate, coverage, similarity in similar]
+        return expansions
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Số từ trong từ vựng và số trigram khác nhau
+        """
+        with self._lock:
+            trigrams = self._conn.execute("SELECT COUNT(DISTINCT trigram) FROM trigram_postings").fetchone()[0]
+            return {"terms": len(self._terms), "trigrams": trigrams}
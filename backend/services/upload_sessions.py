@@ -0,0 +1,332 @@
+"""
+Upload Sessions - Upload nhiều phần, tiếp tục được khi mất kết nối (resumable upload)
+
+Service này chứa:
+- Bảng upload session + các phần đã nhận trong SQLite (bền vững qua restart server)
+- Ghi từng phần thẳng vào đúng vị trí của 1 file spool (cấp phát sẵn kích thước file),
+  nên khi hoàn tất không cần ghép/copy: file spool được chuyển (rename) vào thư mục uploads
+- Checksum SHA-256 cho từng phần, kiểm tra kích thước trước khi đọc body
+- Dọn các session hết hạn
+
+Giao thức: POST tạo session -> PUT từng phần (thứ tự bất kỳ, gửi lại được) -> GET xem phần còn
+thiếu -> POST complete.
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from services.sqlite_utils import connect_sqlite
+
+# Trạng thái của session
+SESSION_UPLOADING = "uploading"
+SESSION_COMPLETED = "completed"
+
+# Kích thước mỗi lần đọc body khi ghi 1 phần
+_READ_BLOCK_SIZE = 1024 * 1024
+
+
+class UploadSessionStore:
+    """
+    Quản lý upload session, an toàn khi nhiều phần được PUT song song
+    """
+
+    def __init__(self, knowledge_base_service, db_path=None, spool_folder=None,
+                 part_size=8 * 1024 * 1024, max_file_size=500 * 1024 * 1024, session_ttl=24 * 3600):
+        """
+        Args:
+            knowledge_base_service: Instance của KnowledgeBaseService
+            db_path: Đường dẫn SQLite (mặc định trong thư mục uploads)
+            spool_folder: Thư mục chứa file đang upload (phải cùng filesystem với thư mục uploads)
+            part_size: Kích thước mỗi phần (byte), phần cuối có thể nhỏ hơn
+            max_file_size: Kích thước file tối đa (byte)
+            session_ttl: Thời gian (giây) giữ session chưa hoàn tất kể từ lần cập nhật cuối
+        """
+        self.knowledge_base_service = knowledge_base_service
+        upload_folder = knowledge_base_service.upload_folder
+        self.db_path = db_path or os.path.join(upload_folder, "upload_sessions.db")
+        self.spool_folder = spool_folder or os.path.join(upload_folder, "spool")
+        self.part_size = part_size
+        self.max_file_size = max_file_size
+        self.session_ttl = session_ttl
+
+        os.makedirs(self.spool_folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(self.db_path)
+        self._init_schema()
+
+        expired = self.purge_expired()
+        if expired:
+            print(f"🧹 Removed {expired} expired upload sessions")
+
+    def _init_schema(self):
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS upload_sessions (
+                    upload_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    description TEXT,
+                    on_duplicate TEXT,
+                    file_size INTEGER NOT NULL,
+                    part_size INTEGER NOT NULL,
+                    parts_total INTEGER NOT NULL,
+                    sha256 TEXT,
+                    status TEXT NOT NULL,
+                    file_id TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS upload_parts (
+                    upload_id TEXT NOT NULL,
+                    part_number INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    PRIMARY KEY (upload_id, part_number)
+                );
+                CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated_at ON upload_sessions(updated_at);
+            """)
+            self._conn.commit()
+
+    def _spool_path(self, upload_id):
+        return os.path.join(self.spool_folder, f"{upload_id}.upload")
+
+    def _part_length(self, session, part_number):
+        """Kích thước đúng của 1 phần (phần cuối là phần còn lại của file)"""
+        if part_number < session["parts_total"]:
+            return session["part_size"]
+        return session["file_size"] - (session["parts_total"] - 1) * session["part_size"]
+
+    def _get_session_row(self, upload_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM upload_sessions WHERE upload_id = ?", (upload_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _touch(self, upload_id, **fields):
+        fields["updated_at"] = datetime.now().isoformat()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._conn.execute(f"UPDATE upload_sessions SET {columns} WHERE upload_id = ?",
+                           list(fields.values()) + [upload_id])
+
+    # =========================================
+    # SESSION
+    # =========================================
+
+    def create(self, filename, file_size, title, description="", on_duplicate=None, sha256=None):
+        """
+        Tạo upload session và cấp phát file spool
+
+        Args:
+            filename: Tên file gốc
+            file_size: Kích thước file (byte)
+            title: Tiêu đề tài liệu
+            description: Mô tả tài liệu
+            on_duplicate: Cách xử lý khi nội dung trùng file đã có (dùng khi complete)
+            sha256: SHA-256 của toàn bộ file (optional, kiểm tra khi complete)
+
+        Returns:
+            tuple: (success, session, error_message, status_code)
+        """
+        if not filename or not self.knowledge_base_service.is_allowed_file(filename):
+            return False, None, "Only PDF files are allowed", 400
+        if not isinstance(file_size, int) or file_size <= 0:
+            return False, None, "file_size must be a positive integer", 400
+        if file_size > self.max_file_size:
+            return False, None, f"File size must be less than {self.max_file_size // (1024*1024)}MB", 413
+
+        self.purge_expired()
+
+        upload_id = str(uuid.uuid4())
+        parts_total = (file_size + self.part_size - 1) // self.part_size
+        # Cấp phát trước kích thước file (sparse), mỗi phần ghi vào offset riêng
+        with open(self._spool_path(upload_id), 'wb') as spool:
+            spool.truncate(file_size)
+
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO upload_sessions (upload_id, filename, title, description, on_duplicate, file_size, "
+                "part_size, parts_total, sha256, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (upload_id, filename, title, description, on_duplicate, file_size, self.part_size,
+                 parts_total, sha256.lower() if sha256 else None, SESSION_UPLOADING, now, now)
+            )
+            self._conn.commit()
+        return True, self.get(upload_id), None, 201
+
+    def get(self, upload_id):
+        """
+        Trạng thái session: các phần đã nhận và còn thiếu
+
+        Returns:
+            dict: Thông tin session hoặc None nếu không tồn tại
+        """
+        session = self._get_session_row(upload_id)
+        if session is None:
+            return None
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT part_number, size, sha256 FROM upload_parts WHERE upload_id = ? ORDER BY part_number",
+                (upload_id,)
+            ).fetchall()
+        received = {row["part_number"]: row for row in rows}
+        session["parts"] = [dict(row) for row in rows]
+        session["missing_parts"] = [number for number in range(1, session["parts_total"] + 1)
+                                    if number not in received]
+        session["bytes_received"] = sum(row["size"] for row in rows)
+        session["expires_at"] = (datetime.fromisoformat(session["updated_at"]) +
+                                 timedelta(seconds=self.session_ttl)).isoformat()
+        return session
+
+    def abort(self, upload_id):
+        """
+        Hủy session và xóa file spool
+
+        Returns:
+            bool: True nếu session tồn tại
+        """
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM upload_sessions WHERE upload_id = ?", (upload_id,)).rowcount
+            self._conn.execute("DELETE FROM upload_parts WHERE upload_id = ?", (upload_id,))
+            self._conn.commit()
+        spool_path = self._spool_path(upload_id)
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        return bool(deleted)
+
+    def purge_expired(self):
+        """
+        Xóa session chưa hoàn tất quá session_ttl không được cập nhật, session đã hoàn tất quá session_ttl
+
+        Returns:
+            int: Số session bị xóa
+        """
+        cutoff = (datetime.now() - timedelta(seconds=self.session_ttl)).isoformat()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT upload_id FROM upload_sessions WHERE updated_at < ?", (cutoff,)
+            ).fetchall()
+        for row in rows:
+            self.abort(row["upload_id"])
+        return len(rows)
+
+    # =========================================
+    # PARTS
+    # =========================================
+
+    def write_part(self, upload_id, part_number, stream, content_length=None, checksum=None):
+        """
+        Ghi 1 phần vào file spool (ghi lại cùng phần sẽ ghi đè; lần ghi lại bị lỗi làm phần đó
+        trở lại trạng thái còn thiếu)
+
+        Kích thước được kiểm tra từ Content-Length trước khi đọc body, và trong lúc đọc
+        (body không có Content-Length hoặc gửi nhiều hơn khai báo).
+
+        Args:
+            upload_id: ID session
+            part_number: Số thứ tự phần (từ 1)
+            stream: Stream body của request
+            content_length: Content-Length của request (None nếu không có)
+            checksum: SHA-256 (hex) client tính cho phần này (optional)
+
+        Returns:
+            tuple: (success, part, error_message, status_code)
+        """
+        session = self._get_session_row(upload_id)
+        if session is None:
+            return False, None, "Upload session not found", 404
+        if session["status"] != SESSION_UPLOADING:
+            return False, None, "Upload session is already completed", 409
+        if not 1 <= part_number <= session["parts_total"]:
+            return False, None, f"part_number must be between 1 and {session['parts_total']}", 400
+
+        expected = self._part_length(session, part_number)
+        if content_length is not None and content_length != expected:
+            status_code = 413 if content_length > expected else 400
+            return False, None, f"Part {part_number} must be exactly {expected} bytes", status_code
+
+        # Ghi đè thẳng vào file spool: bỏ đánh dấu đã nhận trước, để lần gửi lại bị lỗi (sai checksum,
+        # thiếu/thừa byte) không để lại 1 phần đã hỏng nhưng vẫn được tính là đã nhận
+        with self._lock:
+            self._conn.execute("DELETE FROM upload_parts WHERE upload_id = ? AND part_number = ?",
+                               (upload_id, part_number))
+            self._conn.commit()
+
+        part_hash = hashlib.sha256()
+        written = 0
+        with open(self._spool_path(upload_id), 'r+b') as spool:
+            spool.seek((part_number - 1) * session["part_size"])
+            while written <= expected:
+                block = stream.read(min(_READ_BLOCK_SIZE, expected + 1 - written))
+                if not block:
+                    break
+                written += len(block)
+                if written > expected:
+                    return False, None, f"Part {part_number} must be exactly {expected} bytes", 413
+                part_hash.update(block)
+                spool.write(block)
+
+        if written != expected:
+            return False, None, f"Part {part_number} is incomplete ({written}/{expected} bytes)", 400
+
+        digest = part_hash.hexdigest()
+        if checksum and checksum.lower() != digest:
+            return False, None, f"Checksum mismatch for part {part_number}", 400
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO upload_parts (upload_id, part_number, size, sha256) VALUES (?, ?, ?, ?)",
+                (upload_id, part_number, written, digest)
+            )
+            self._touch(upload_id)
+            self._conn.commit()
+        return True, {"part_number": part_number, "size": written, "sha256": digest}, None, 200
+
+    # =========================================
+    # COMPLETE
+    # =========================================
+
+    def complete(self, upload_id):
+        """
+        Hoàn tất upload: kiểm tra đủ phần, chuyển file spool vào thư mục uploads (không copy)
+
+        Returns:
+            tuple: (success, saved_file, session, error_message, status_code)
+                saved_file cùng dạng KnowledgeBaseService.save_uploaded_file
+        """
+        session = self.get(upload_id)
+        if session is None:
+            return False, None, None, "Upload session not found", 404
+        if session["status"] != SESSION_UPLOADING:
+            return False, None, session, "Upload session is already completed", 409
+        if session["missing_parts"]:
+            return False, None, session, f"Missing parts: {session['missing_parts']}", 400
+
+        with self._lock:
+            # Đánh dấu trước khi chuyển file để 2 request complete đồng thời không cùng xử lý
+            claimed = self._conn.execute(
+                "UPDATE upload_sessions SET status = ? WHERE upload_id = ? AND status = ?",
+                (SESSION_COMPLETED, upload_id, SESSION_UPLOADING)
+            ).rowcount
+            self._conn.commit()
+        if not claimed:
+            return False, None, session, "Upload session is already completed", 409
+
+        success, saved_file, error, status_code = self.knowledge_base_service.save_spooled_file(
+            self._spool_path(upload_id), session["filename"], session["file_size"]
+        )
+        if success and session["sha256"] and saved_file["sha256"] != session["sha256"]:
+            # Các phần đều đúng checksum nhưng file không khớp -> client gửi nhầm phần, upload lại từ đầu
+            os.remove(saved_file["file_path"])
+            success, error, status_code = False, "Checksum mismatch for the assembled file", 400
+        if not success:
+            self.abort(upload_id)
+            return False, None, session, error, status_code
+
+        with self._lock:
+            self._touch(upload_id, file_id=saved_file["file_id"])
+            self._conn.commit()
+        session.update(status=SESSION_COMPLETED, file_id=saved_file["file_id"])
+        return True, saved_file, session, None, 200
@@ -11,6 +11,7 @@ Test suite này bao gồm:
 
 import unittest
 import json
+import time
 from unittest.mock import Mock, patch, MagicMock
 import sys
 import os
@@ -636,6 +637,247 @@ class TestChatPerformance(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class TestQuickActionCache(unittest.TestCase):
+    """Test cases cho cache và prefetch của quick actions"""
+    
+    def setUp(self):
+        """Setup app với mock AI service cho prefetch"""
+        from services.quick_action_service import QuickActionService, build_quick_action_message
+        self.build_message = build_quick_action_message
+        
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        
+        self.mock_ai_service = Mock()
+        self.mock_ai_service.chat_with_ai.return_value = {
+            "success": True,
+            "response": "// Hàm cộng hai số\nfunction add(a, b) { return a + b; }"
+        }
+        self.quick_action_service = QuickActionService(self.mock_ai_service)
+    
+    def test_prefetched_quick_action_served_from_cache(self):
+        """Test click quick action sau khi prefetch không gọi AI thêm lần nào"""
+        code = 'function add(a, b) { return a + b; }'
+        
+        with patch('api.chat._ai_service', self.mock_ai_service), \
+             patch('api.chat._quick_action_service', self.quick_action_service):
+            response = self.client.post('/api/chat/prefetch', json={
+                'session_id': 'editor-test',
+                'code': code,
+                'language': 'javascript'
+            })
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(json.loads(response.data)['status'], 'scheduled')
+            
+            response = self.client.post('/api/chat', json={
+                'message': self.build_message('comment', code, 'javascript'),
+                'history': [],
+                'is_quick_action': True
+            })
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['cached'])
+        self.mock_ai_service.chat_with_ai.assert_called_once()
+        self.assertEqual(self.quick_action_service.get_stats()['prefetch']['hits'], 1)
+    
+    def test_prefetch_uses_most_used_action(self):
+        """Test prefetch chọn action được dùng nhiều nhất"""
+        message = self.build_message('debug', 'int x = 1', 'java')
+        self.quick_action_service.record_usage(message)
+        self.quick_action_service.record_usage(message)
+        
+        self.assertEqual(self.quick_action_service.get_most_used_action(), 'debug')
+    
+    def test_prefetch_budget_caps(self):
+        """Test prefetch bị từ chối khi code quá lớn hoặc hết budget"""
+        self.quick_action_service.prefetch_per_minute = 1
+        
+        result = self.quick_action_service.prefetch('s1', 'x' * 100000, 'python')
+        self.assertEqual(result['status'], 'skipped')
+        
+        self.assertEqual(self.quick_action_service.prefetch('s1', 'a = 1', 'python')['status'], 'scheduled')
+        self.assertEqual(self.quick_action_service.prefetch('s1', 'a = 2', 'python')['status'], 'skipped')
+    
+    def test_prefetch_refreshes_expired_cache(self):
+        """Test prefetch lên lịch lại khi kết quả cache của code đã hết hạn"""
+        message = self.build_message('comment', 'a = 1', 'python')
+        self.quick_action_service.store(message, self.mock_ai_service.chat_with_ai.return_value)
+        self.assertEqual(self.quick_action_service.prefetch('s1', 'a = 1', 'python', 'comment')['status'], 'cached')
+        
+        with patch('services.quick_action_service.time.time', return_value=time.time() + 3600):
+            result = self.quick_action_service.prefetch('s1', 'a = 1', 'python', 'comment')
+        
+        self.assertEqual(result['status'], 'scheduled')
+        self.assertEqual(self.quick_action_service.get_stats()['prefetch']['scheduled'], 1)
+    
+    def test_prefetch_missing_fields(self):
+        """Test prefetch thiếu tham số trả về 400"""
+        response = self.client.post('/api/chat/prefetch', json={'code': 'x = 1'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestRequestCancellation(unittest.TestCase):
+    """Test cases cho việc hủy request AI khi client ngắt kết nối / yêu cầu hủy"""
+    
+    def setUp(self):
+        """Setup test client và registry riêng cho mỗi test"""
+        from services.cancellation_service import CancellationRegistry
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        self.registry = CancellationRegistry(poll_interval=0.05)
+    
+    def test_cancel_requires_request_id(self):
+        """Test cancel không có request_id trả về 400"""
+        response = self.client.post('/api/chat/cancel', json={})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_cancel_unknown_request(self):
+        """Test cancel request không tồn tại trả về 404"""
+        with patch('api.chat._cancellation_registry', self.registry):
+            response = self.client.post('/api/chat/cancel', json={'request_id': 'khong-ton-tai'})
+        self.assertEqual(response.status_code, 404)
+    
+    def test_cancelled_chat_returns_499_and_records_stats(self):
+        """Test chat bị hủy trả về 499 và được tính vào thống kê"""
+        mock_ai_service = Mock()
+        mock_ai_service.chat_with_ai.return_value = {
+            "success": False,
+            "cancelled": True,
+            "cancel_reason": "client_disconnected",
+            "tokens_saved": 1500,
+            "error": "Request cancelled: client_disconnected"
+        }
+        
+        with patch('api.chat._ai_service', mock_ai_service), \
+             patch('api.chat._cancellation_registry', self.registry):
+            response = self.client.post('/api/chat', json={
+                'message': 'Giải thích đoạn code này',
+                'request_id': 'req-1'
+            })
+        
+        self.assertEqual(response.status_code, 499)
+        self.assertEqual(json.loads(response.data)['request_id'], 'req-1')
+        stats = self.registry.get_stats()
+        self.assertEqual(stats['cancelled'], 1)
+        self.assertEqual(stats['estimated_tokens_saved'], 1500)
+        self.assertEqual(stats['active_requests'], 0)
+    
+    def test_stream_closed_when_token_cancelled(self):
+        """Test AI service đóng stream Azure OpenAI ngay khi token bị hủy"""
+        from services.cancellation_service import CancellationToken, RequestCancelled
+        
+        token = CancellationToken('req-stream')
+        
+        def chunks():
+            for text in ['Xin ', 'chào ', 'bạn']:
+                yield Mock(choices=[Mock(delta=Mock(content=text, function_call=None))])
+                token.cancel('cancelled_by_client')
+        
+        mock_stream = MagicMock()
+        mock_stream.__iter__.return_value = chunks()
+        
+        ai_service = AIService()
+        ai_service.client = Mock()
+        ai_service.client.chat.completions.create.return_value = mock_stream
+        
+        with self.assertRaises(RequestCancelled) as ctx:
+            ai_service._create_completion(cancel_token=token, model='gpt', messages=[], max_tokens=100)
+        
+        self.assertEqual(ctx.exception.reason, 'cancelled_by_client')
+        self.assertGreater(ctx.exception.tokens_saved, 0)
+        mock_stream.close.assert_called_once()
+    
+    def test_stream_disconnect_unregisters_token(self):
+        """Test client ngắt kết nối giữa stream: token được gỡ khỏi registry và tính tokens tiết kiệm"""
+        def events(**kwargs):
+            yield {"type": "start", "max_tokens": 100}
+            yield {"type": "delta", "content": "Xin chào"}
+            yield {"type": "done"}
+        
+        ai_service = AIService()
+        ai_service.stream_chat_with_ai = Mock(side_effect=events)
+        
+        with patch('api.chat._ai_service', ai_service), \
+             patch('api.chat._cancellation_registry', self.registry):
+            response = self.client.post('/api/chat/stream', json={'message': 'Xin chào', 'request_id': 'req-sse'},
+                                        buffered=False)
+            next(response.response)
+            self.assertEqual(self.registry.get_stats()['active_requests'], 1)
+            response.close()
+        
+        stats = self.registry.get_stats()
+        self.assertEqual(stats['active_requests'], 0)
+        self.assertEqual(stats['cancelled'], 1)
+        self.assertEqual(stats['estimated_tokens_saved'], 100)
+
+
+class TestResponseSegments(unittest.TestCase):
+    """Test cases cho việc tách câu trả lời thành segments text/code"""
+    
+    def setUp(self):
+        """Setup test client và câu trả lời mẫu có code block"""
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        self.response_text = (
+            "Đây là ví dụ:\n\n```java\npublic class Test {}\n```\n\n"
+            "Và code không khai báo ngôn ngữ:\n```\nx = 1\n```"
+        )
+        self.expected_segments = [
+            {"type": "text", "content": "Đây là ví dụ:"},
+            {"type": "code", "language": "java", "content": "public class Test {}"},
+            {"type": "text", "content": "Và code không khai báo ngôn ngữ:"},
+            {"type": "code", "language": "text", "content": "x = 1"}
+        ]
+    
+    def test_segment_response_matches_frontend_parser(self):
+        """Test segment_response cho kết quả giống parseMessageContent"""
+        from services.response_segmenter import segment_response
+        
+        self.assertEqual(segment_response(self.response_text), self.expected_segments)
+        # Fence không đóng giữ nguyên là text, code block rỗng bị bỏ qua
+        self.assertEqual(segment_response("a ```python\nx"), [{"type": "text", "content": "a ```python\nx"}])
+        self.assertEqual(segment_response("```\n```"), [{"type": "text", "content": "```\n```"}])
+    
+    def test_streaming_segmenter_with_split_fences(self):
+        """Test tách segment tăng dần khi fence bị cắt giữa các delta"""
+        from services.response_segmenter import StreamingSegmenter
+        
+        segmenter = StreamingSegmenter()
+        events = []
+        for i in range(0, len(self.response_text), 2):
+            events.extend(segmenter.feed(self.response_text[i:i + 2]))
+        events.extend(segmenter.finish())
+        
+        starts = [e for e in events if e["type"] == "segment_start"]
+        ends = [e for e in events if e["type"] == "segment_end"]
+        self.assertEqual([e["segment_type"] for e in starts], ["text", "code", "text", "code"])
+        self.assertEqual([e.get("language") for e in starts], [None, "java", None, "text"])
+        self.assertEqual([e["content"] for e in ends], [s["content"] for s in self.expected_segments])
+        for index, segment in enumerate(self.expected_segments):
+            streamed = "".join(e["content"] for e in events
+                               if e["type"] == "segment_delta" and e["index"] == index)
+            self.assertEqual(streamed.strip(), segment["content"])
+    
+    def test_chat_include_segments(self):
+        """Test /api/chat trả về segments khi include_segments=true"""
+        mock_ai_service = Mock()
+        mock_ai_service.chat_with_ai.return_value = {"success": True, "response": self.response_text}
+        
+        with patch('api.chat._ai_service', mock_ai_service):
+            response = self.client.post('/api/chat', json={'message': 'Ví dụ Java', 'include_segments': True})
+            plain = self.client.post('/api/chat', json={'message': 'Ví dụ Java'})
+        
+        data = json.loads(response.data)
+        self.assertEqual(data['response'], self.response_text)
+        self.assertEqual(data['segments'], self.expected_segments)
+        self.assertNotIn('segments', json.loads(plain.data))
+
+
 if __name__ == '__main__':
     # Run tất cả test cases
     unittest.main(verbosity=2)
@@ -0,0 +1,2006 @@
+"""
+Test cases cho Knowledge Base - Kiểm thử xử lý tài liệu và hàng đợi ingestion
+
+Test suite này bao gồm:
+- Unit tests cho ingestion job queue (tiến độ, retry, khôi phục sau restart)
+- Unit tests cho trích xuất PDF song song theo khoảng trang
+- Unit tests cho pipeline ingestion streaming (chunker tăng dần, ghi ChromaDB theo batch)
+- Unit tests cho chống upload trùng nội dung (hash khi ghi file, alias, gộp upload đồng thời)
+- Unit tests cho loại bỏ chunk trùng chính xác / gần trùng trước khi embed
+- Unit tests cho embedding provider (micro-batch, chia batch theo giới hạn ChromaDB)
+- Unit tests cho cache embedding bền vững (chỉ embed phần thiếu, còn lại sau reset, eviction LRU)
+- Unit tests cho re-index từ text đã lưu (swap theo file, giữ chunk dùng chung, rollback khi lỗi)
+- API tests cho bulk upload (archive zip + manifest, nhiều file multipart, kết quả từng file)
+- API tests cho upload nhiều phần (checksum từng phần, tiếp tục phần còn thiếu, giới hạn kích thước)
+- Unit tests cho chunk annotator (cùng kết quả với chuẩn hóa regex / phát hiện ngôn ngữ cũ)
+- Unit tests cho lexical index BM25 (lọc theo file, cụm từ, cập nhật khi xóa / re-index)
+- Unit tests cho hybrid retrieval (rank fusion, giới hạn thời gian, signal đóng góp vào kết quả)
+- Unit tests cho cache câu hỏi (LRU, dùng chung giữa worker, kết quả hết hiệu lực khi chunks thay đổi)
+- Unit tests cho tham số HNSW (cấu hình, dựng lại vector index trên ChromaDB thật, ghi chờ khi dựng lại)
+- Unit tests cho tìm kiếm 2 bước (centroid file cập nhật khi ingest / xóa / re-index, chọn file trước khi tìm chunk)
+- Unit/API tests cho rerank cross-encoder (1 batch, giới hạn thời gian, chat chỉ đưa top kết quả đã rerank vào prompt)
+- Unit tests cho trigram index (identifier gõ thiếu / gõ sai / 1 phần khớp qua từ gần đúng trong từ vựng)
+- Mock tests cho KnowledgeBaseService
+"""
+
+import unittest
+import json
+import os
+import hashlib
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO
+from unittest.mock import Mock, patch
+import sys
+import zipfile
+
+import chromadb
+import PyPDF2
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+
+# Add backend directory to path để import modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from services.ingestion_jobs import IngestionJobQueue
+from services.pdf_extraction import PdfTextExtractor, join_pages
+from services.text_chunker import IncrementalChunker, clean_text, iter_chunks
+from services.knowledge_base_service import REBUILD_COLLECTION_NAME, KnowledgeBaseService
+from services.file_hash_index import FileHashIndex
+from services.chunk_dedup import ChunkDedupIndex, content_hash, ref_key
+from services.chunk_annotator import VIETNAMESE_CHARS, annotate, detect_language, fold_diacritics, normalize_text
+from services.embedding_service import EmbeddingProvider
+from services.embedding_cache import EmbeddingCache
+from services.file_catalog import FileCatalog
+from services.document_structure import StructuredChunker
+from services.upload_sessions import UploadSessionStore
+from services.lexical_index import FOLDED_PREFIX, LexicalIndex
+from services.trigram_index import TrigramIndex
+from services.document_index import CentroidAccumulator, DocumentIndex
+from services.hybrid_retrieval import HybridRetriever, reciprocal_rank_fusion
+from services.reranker import Reranker, create_reranker
+from services.cancellation_service import CancellationRegistry
+from services.query_cache import QueryCache, SearchCache, SharedQueryStore
+from services.read_write_lock import ReadWriteLock
+from services.hnsw_config import (DEFAULT_HNSW_CONFIG, HnswConfig, collection_metadata, config_of_collection,
+                                  hnsw_config_from_env, merge_hnsw_config)
+import api.knowledge_base as knowledge_base_api
+
+UPLOADS_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+SAMPLE_PDF = os.path.join(UPLOADS_DIR, '20250809_152419_Tieu_chuan_coding_trong_Java.pdf')
+
+
+def wait_for_job(queue, job_id, timeout=5):
+    """Chờ job kết thúc (completed/failed) và trả về trạng thái cuối"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get_job(job_id)
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} did not finish in {timeout}s")
+
+
+class TestIngestionJobQueue(unittest.TestCase):
+    """Test cases cho hàng đợi ingestion chạy nền"""
+
+    def setUp(self):
+        """Tạo thư mục tạm, file upload giả và mock KnowledgeBaseService"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.temp_dir, "doc.pdf")
+        with open(self.file_path, "wb") as f:
+            f.write(b"%PDF-1.4")
+
+        self.saved_file = {
+            "file_id": "file-1",
+            "original_filename": "doc.pdf",
+            "stored_filename": "doc.pdf",
+            "file_path": self.file_path,
+            "file_size": 8
+        }
+        self.kb_service = Mock()
+        self.kb_service.upload_folder = self.temp_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _make_queue(self, **kwargs):
+        kwargs.setdefault("retry_delay", 0)
+        kwargs.setdefault("progress_interval", 0)
+        return IngestionJobQueue(self.kb_service, **kwargs)
+
+    def test_job_reports_progress_and_result(self):
+        """Test job chạy nền ghi lại tiến độ và kết quả cuối"""
+        def ingest(saved_file, title, description, progress_callback=None):
+            progress_callback("extracting", pages_total=3, pages_processed=3)
+            progress_callback("embedding", chunks_total=10, chunks_embedded=10)
+            return True, {"file_id": saved_file["file_id"], "vector_chunks_count": 10}, "ok", 200
+
+        self.kb_service.ingest_saved_file.side_effect = ingest
+        queue = self._make_queue()
+
+        success, job, error = queue.submit(self.saved_file, "Tài liệu", "Mô tả")
+        self.assertTrue(success)
+        self.assertEqual(job["file_id"], "file-1")
+
+        job = wait_for_job(queue, job["job_id"])
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["pages_processed"], 3)
+        self.assertEqual(job["chunks_embedded"], 10)
+        self.assertEqual(job["result"]["vector_chunks_count"], 10)
+        self.assertEqual(queue.get_stats()["completed"], 1)
+
+    def test_failed_job_is_retried_then_discarded(self):
+        """Test job lỗi được retry, hết số lần thử thì dọn file"""
+        self.kb_service.ingest_saved_file.return_value = (False, None, "Error extracting text", 500)
+        queue = self._make_queue(max_attempts=2)
+
+        _, job, _ = queue.submit(self.saved_file, "Tài liệu", "")
+        job = wait_for_job(queue, job["job_id"])
+
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["attempts"], 2)
+        self.assertEqual(job["error"], "Error extracting text")
+        self.assertEqual(self.kb_service.ingest_saved_file.call_count, 2)
+        self.kb_service.discard_saved_file.assert_called_once()
+
+    def _stop_while_running(self, queue):
+        """Giả lập server dừng khi job đang chạy: worker không chạy job, không còn gia hạn lease"""
+        queue._executor.submit = Mock()
+        _, job, _ = queue.submit(self.saved_file, "Tài liệu", "")
+        queue._update(job["job_id"], status="running", stage="embedding")
+        queue.shutdown()
+        return job["job_id"]
+
+    def test_unfinished_jobs_recovered_after_restart(self):
+        """Test job đang chạy khi server dừng được chạy lại khi khởi động (lease đã hết hạn)"""
+        self.kb_service.ingest_saved_file.return_value = (True, {"file_id": "file-1"}, "ok", 200)
+        queue = self._make_queue()
+        job_id = self._stop_while_running(queue)
+        queue._update(job_id, lease_until=time.time() - 1)   # Server dừng lâu hơn thời hạn lease
+
+        reloader_parent = self._make_queue(recover_jobs=False)
+        self.assertNotEqual(reloader_parent.get_job(job_id)["owner"], reloader_parent.owner)
+
+        restarted = self._make_queue()
+        job = wait_for_job(restarted, job_id)
+
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["owner"], restarted.owner)
+        self.kb_service.ingest_saved_file.assert_called_once()
+
+    def test_job_with_live_lease_not_recovered(self):
+        """Test job của process khác còn gia hạn lease không bị lấy lại; lấy lại khi lease hết hạn"""
+        self.kb_service.ingest_saved_file.return_value = (True, {"file_id": "file-1"}, "ok", 200)
+        job_id = self._stop_while_running(self._make_queue(lease_seconds=60))
+
+        other = self._make_queue()
+        self.assertEqual(other.recover(), 0)
+        job = other.get_job(job_id)
+        self.assertEqual(job["status"], "running")
+        self.assertNotEqual(job["owner"], other.owner)
+
+        other._update(job_id, lease_until=time.time() - 1)
+        self.assertEqual(other.recover(), 1)
+        self.assertEqual(other.recover(), 0)
+        self.assertEqual(wait_for_job(other, job_id)["status"], "completed")
+        self.kb_service.ingest_saved_file.assert_called_once()
+
+    def test_queue_full_rejects_submit(self):
+        """Test từ chối job mới khi hàng đợi đầy"""
+        queue = self._make_queue(max_pending=0)
+        success, job, error = queue.submit(self.saved_file, "Tài liệu", "")
+
+        self.assertFalse(success)
+        self.assertIsNone(job)
+        self.assertIn("full", error)
+
+
+class TestPdfExtraction(unittest.TestCase):
+    """Test cases cho trích xuất text PDF theo khoảng trang"""
+
+    def test_join_pages_records_page_offsets(self):
+        """Test ghép trang giữ format cũ và ghi vị trí bắt đầu từng trang"""
+        text, page_offsets = join_pages(["Trang 1", "", "Trang 3"])
+
+        self.assertEqual(text, "Trang 1\n\nTrang 3\n")
+        self.assertEqual(page_offsets, [0, 8, 9])
+        self.assertEqual(text[page_offsets[2]:].strip(), "Trang 3")
+
+    @unittest.skipUnless(os.path.exists(SAMPLE_PDF), "Sample PDF not available")
+    def test_parallel_extraction_matches_serial(self):
+        """Test trích xuất bằng process pool cho kết quả đúng thứ tự như tuần tự"""
+        extractor = PdfTextExtractor(max_workers=2, min_pages_per_range=2)
+        try:
+            serial_pages = extractor.extract_pages(SAMPLE_PDF, parallel=False)
+            progress = []
+            parallel_pages = extractor.extract_pages(
+                SAMPLE_PDF, parallel=True,
+                progress_callback=lambda stage, **p: progress.append(p["pages_processed"])
+            )
+        finally:
+            extractor.shutdown()
+
+        self.assertEqual(parallel_pages, serial_pages)
+        self.assertEqual(progress[-1], len(serial_pages))
+
+    def test_count_pages_reads_page_tree_count(self):
+        """Test đếm trang theo /Count của cây trang; /Count lớn hơn số trang thật không làm lỗi trích xuất"""
+        writer = PyPDF2.PdfWriter()
+        for _ in range(3):
+            writer.add_blank_page(width=200, height=200)
+        writer._root_object["/Pages"][PyPDF2.generic.NameObject("/Count")] = PyPDF2.generic.NumberObject(5)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "broken_count.pdf")
+            with open(file_path, "wb") as f:
+                writer.write(f)
+
+            extractor = PdfTextExtractor(max_workers=1)
+            self.assertEqual(extractor.count_pages(file_path), 5)
+            self.assertEqual(extractor.extract_pages(file_path, parallel=False), ["", "", ""])
+
+
+def matches_where(metadata, where):
+    """Đánh giá filter where kiểu ChromaDB (hỗ trợ $or, $in và so sánh bằng)"""
+    if not where:
+        return True
+    if "$or" in where:
+        return any(matches_where(metadata, condition) for condition in where["$or"])
+    for key, condition in where.items():
+        if isinstance(condition, dict) and "$in" in condition:
+            if metadata.get(key) not in condition["$in"]:
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    """Collection giả ghi lại các batch được add, update gộp metadata như ChromaDB"""
+
+    def __init__(self, name="knowledge_base", metadata=None):
+        self.name = name
+        # query() xếp hạng theo cosine distance
+        self.metadata = dict(metadata or {}, **{"hnsw:space": "cosine"})
+        self.batches = []
+        self.records = {}
+        self.embeddings = {}
+
+    def add(self, documents, metadatas, ids, embeddings=None):
+        self.batches.append((list(documents), list(metadatas), list(ids)))
+        self.embeddings.update(zip(ids, embeddings or []))
+        for chunk_id, document, metadata in zip(ids, documents, metadatas):
+            self.records[chunk_id] = (document, dict(metadata))
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=0):
+        ids = [chunk_id for chunk_id, (_, metadata) in self.records.items()
+               if matches_where(metadata, where) and (ids is None or chunk_id in ids)]
+        ids = ids[offset:offset + limit if limit else None]
+        return {
+            "ids": ids,
+            "documents": [self.records[chunk_id][0] for chunk_id in ids],
+            "metadatas": [self.records[chunk_id][1] for chunk_id in ids],
+            "embeddings": [self.embeddings.get(chunk_id) for chunk_id in ids]
+        }
+
+    def count(self):
+        return len(self.records)
+
+    def update(self, ids, metadatas):
+        for chunk_id, metadata in zip(ids, metadatas):
+            document, current = self.records[chunk_id]
+            current.update(metadata)
+            self.records[chunk_id] = (document, {key: value for key, value in current.items() if value is not None})
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            self.records.pop(chunk_id, None)
+
+    def query(self, query_embeddings, n_results, where=None, include=None):
+        """Xếp hạng theo cosine distance trên embeddings đã lưu, mỗi query embedding 1 danh sách"""
+        def distance(left, right):
+            dot = sum(a * b for a, b in zip(left, right))
+            norms = (sum(a * a for a in left) * sum(b * b for b in right)) ** 0.5
+            return 1 - dot / norms if norms else 1.0
+
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query_embedding in query_embeddings:
+            ranked = sorted(
+                (distance(query_embedding, self.embeddings[chunk_id]), chunk_id)
+                for chunk_id, (_, metadata) in self.records.items() if matches_where(metadata, where)
+            )[:n_results]
+            results["ids"].append([chunk_id for _, chunk_id in ranked])
+            results["documents"].append([self.records[chunk_id][0] for _, chunk_id in ranked])
+            results["metadatas"].append([self.records[chunk_id][1] for _, chunk_id in ranked])
+            results["distances"].append([value for value, _ in ranked])
+        return results
+
+
+class FakeChromaClient:
+    """Client giả tạo FakeCollection theo tên"""
+
+    def __init__(self):
+        self.collections = {}
+
+    def get_or_create_collection(self, name, metadata=None):
+        return self.collections.setdefault(name, FakeCollection(name, metadata))
+
+
+def fake_embed(texts):
+    """Embedding giả: vector 2 chiều từ độ dài và số từ của text"""
+    return [[float(len(text)), float(len(text.split()))] for text in texts]
+
+
+def legacy_split_text(text, chunk_size, overlap):
+    """Cách chia chunk trước đây (2 lượt regex, rfind từng dấu câu) - dùng làm chuẩn so sánh"""
+    cleaned_text = re.sub(r'\s+', ' ', re.sub(r'\n+', '\n', text.strip()))
+    if len(cleaned_text) <= chunk_size:
+        return [cleaned_text]
+    chunks, start = [], 0
+    while start < len(cleaned_text):
+        end = start + chunk_size
+        if end < len(cleaned_text):
+            best_break = -1
+            for break_char in ['. ', '\n', '! ', '? ', '; ', ': ', '.\n', '!\n', '?\n']:
+                break_pos = cleaned_text.rfind(break_char, start, end)
+                if break_pos != -1:
+                    best_break = break_pos + len(break_char)
+                    break
+            if best_break == -1:
+                space_pos = cleaned_text.rfind(' ', start, end)
+                if space_pos != -1 and space_pos > start + chunk_size * 0.7:
+                    best_break = space_pos + 1
+            if best_break != -1:
+                end = best_break
+        chunk = cleaned_text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = max(start + 1, end - overlap)
+    return chunks
+
+
+def word_token_spans(text):
+    """Tokenizer đơn giản: từ hoặc dấu câu"""
+    return [match.span() for match in re.finditer(r'\w+|[^\w\s]', text)]
+
+
+def make_service(upload_folder):
+    """KnowledgeBaseService với thư mục tạm và collection giả (không cần ChromaDB thật)"""
+    service = KnowledgeBaseService.__new__(KnowledgeBaseService)
+    service.upload_folder = upload_folder
+    service.allowed_extensions = {'pdf'}
+    service.max_file_size = 10 * 1024 * 1024
+    service.chroma_client = FakeChromaClient()
+    service.collection = service.chroma_client.get_or_create_collection("knowledge_base")
+    service.max_batch_size = 5461
+    service.embedder = EmbeddingProvider(fake_embed, "fake", batch_size=8)
+    service.pdf_extractor = PdfTextExtractor(max_workers=1, min_pages_per_range=2, max_pages_per_range=2)
+    service.file_hash_index = FileHashIndex()
+    service.file_catalog = FileCatalog(os.path.join(upload_folder, "file_catalog.db"))
+    service.duplicate_wait_timeout = 30
+    service.chunk_dedup = ChunkDedupIndex(os.path.join(upload_folder, "chunk_dedup.db"))
+    service.lexical_index = LexicalIndex(os.path.join(upload_folder, "lexical_index.db"))
+    service.trigram_index = TrigramIndex(os.path.join(upload_folder, "trigram_index.db"))
+    service.document_index = DocumentIndex(os.path.join(upload_folder, "document_index.db"))
+    service.two_stage_top_files = 5
+    service.two_stage_min_chunks = 50000
+    service.reranker = None
+    service.chunk_size = 1000
+    service.chunk_overlap = 200
+    service.chunk_unit = "chars"
+    service.chunk_strategy = "structure"
+    service.reindex_workers = 2
+    service.ingest_workers = 2
+    service.bulk_max_files = 200
+    service._active_ingests = 0
+    service._active_writes = 0
+    service._active_ingests_lock = threading.Lock()
+    service._reindex_locks = {}
+    service._reindex_locks_guard = threading.Lock()
+    service._reindex_swap_lock = threading.Lock()
+    service._search_gate = ReadWriteLock()
+    service._reindex_staging = {}
+    service.hybrid_retriever = HybridRetriever(time_budget=5)
+    service.search_cache = SearchCache()
+    service.hnsw_config = DEFAULT_HNSW_CONFIG
+    service._index_ready = threading.Event()
+    service._index_ready.set()
+    service._index_rebuild_lock = threading.Lock()
+    return service
+
+
+class TestStreamingIngestion(unittest.TestCase):
+    """Test cases cho pipeline ingestion streaming"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_incremental_chunker_matches_full_text_split(self):
+        """Test chunker tăng dần cho kết quả giống _split_text_into_chunks trên toàn bộ text"""
+        rng = random.Random(42)
+        pieces = ["Lập trình Java", ". ", "\n", " ", "  ", "biến", "? ", "; ", "x", "\n\n", "hàm main"]
+        for _ in range(200):
+            pages = ["".join(rng.choice(pieces) for _ in range(rng.randint(0, 120))) for _ in range(rng.randint(0, 5))]
+            chunk_size = rng.choice([20, 50, 100])
+            overlap = rng.choice([0, 5, chunk_size // 2])
+
+            chunker = IncrementalChunker(chunk_size, overlap)
+            chunks = []
+            for page in pages:
+                chunks.extend(chunker.feed(page + "\n"))
+            chunks.extend(chunker.finish())
+
+            text, _ = join_pages(pages)
+            self.assertEqual(chunks, self.service._split_text_into_chunks(text, chunk_size, overlap))
+
+    def test_chunker_matches_legacy_boundaries(self):
+        """Test chunker 1 lượt cho cùng điểm ngắt với cách chia cũ, vị trí trỏ đúng vào text đã làm sạch"""
+        rng = random.Random(7)
+        pieces = ["Lập trình Java", "Naming rules", ". ", "\n", " ", "\t", "biến", "! ", "? ", "; ", ": ",
+                  ".", "x", "\n\n", "hàm main"]
+        for _ in range(300):
+            text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 400)))
+            chunk_size = rng.choice([10, 50, 100])
+            overlap = rng.choice([0, 3, chunk_size // 2, chunk_size - 1])
+
+            chunks = list(iter_chunks(text, chunk_size, overlap))
+            self.assertEqual([chunk.text for chunk in chunks], legacy_split_text(text, chunk_size, overlap))
+            cleaned_text = clean_text(text)
+            self.assertTrue(all(cleaned_text[chunk.start:chunk.end] == chunk.text for chunk in chunks))
+
+    def test_token_chunks_respect_token_budget(self):
+        """Test chia theo token: mỗi chunk không quá chunk_size token, chunker tăng dần cho cùng kết quả"""
+        rng = random.Random(3)
+        pieces = ["Lập trình Java", "naming", ". ", "\n", " ", "biến", "? ", "x", "hàm main()", "; "]
+        for _ in range(200):
+            pages = ["".join(rng.choice(pieces) for _ in range(rng.randint(0, 80))) for _ in range(rng.randint(1, 4))]
+            chunk_size = rng.choice([8, 20, 40])
+            overlap = rng.choice([0, chunk_size // 4])
+
+            chunker = IncrementalChunker(chunk_size, overlap, token_spans=word_token_spans, with_offsets=True)
+            chunks = []
+            for page in pages:
+                chunks.extend(chunker.feed(page + "\n"))
+            chunks.extend(chunker.finish())
+
+            text, _ = join_pages(pages)
+            self.assertEqual(chunks, list(iter_chunks(text, chunk_size, overlap, token_spans=word_token_spans)))
+            self.assertTrue(all(len(word_token_spans(chunk.text)) <= chunk_size for chunk in chunks))
+
+    @unittest.skipUnless(os.path.exists(SAMPLE_PDF), "Sample PDF not available")
+    def test_ingest_writes_fixed_size_batches(self):
+        """Test ingestion ghi chunks theo batch, metadata không chứa toàn bộ text"""
+        saved_file = {
+            "file_id": "file-1",
+            "original_filename": "java.pdf",
+            "stored_filename": "java.pdf",
+            "file_path": SAMPLE_PDF,
+            "file_size": os.path.getsize(SAMPLE_PDF)
+        }
+        success, result, message, status_code = self.service.ingest_saved_file(saved_file, "Java", "Mô tả")
+        self.assertTrue(success, message)
+
+        with open(os.path.join(self.temp_dir, "file-1_text.txt"), encoding="utf-8") as f:
+            extracted_text = f.read()
+        expected_chunks = self.service._split_text_into_chunks(extracted_text)
+
+        documents = [doc for docs, _, _ in self.service.collection.batches for doc in docs]
+        ids = [chunk_id for _, _, batch_ids in self.service.collection.batches for chunk_id in batch_ids]
+        self.assertEqual(documents, expected_chunks)
+        self.assertEqual(ids, [f"file-1_chunk_{i}" for i in range(len(expected_chunks))])
+        self.assertTrue(all(len(docs) <= 64 for docs, _, _ in self.service.collection.batches))
+        self.assertEqual(result["vector_chunks_count"], len(expected_chunks))
+
+        metadata = self.service.load_file_metadata("file-1")
+        self.assertNotIn("extracted_text", metadata)
+        self.assertEqual(metadata["text_length"], len(extracted_text))
+        self.assertEqual(len(metadata["page_offsets"]), metadata["pages_count"])
+
+
+
+@unittest.skipUnless(os.path.exists(SAMPLE_PDF), "Sample PDF not available")
+class TestUploadDeduplication(unittest.TestCase):
+    """Test cases cho chống upload trùng nội dung"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+        with open(SAMPLE_PDF, "rb") as f:
+            self.pdf_bytes = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _upload(self, title, **kwargs):
+        file = FileStorage(stream=BytesIO(self.pdf_bytes), filename="java.pdf")
+        return self.service.process_uploaded_file(file, title, "", **kwargs)
+
+    def test_hashes_computed_while_saving(self):
+        """Test MD5/SHA-256 tính khi ghi file giống hash tính lại từ file trên disk"""
+        file = FileStorage(stream=BytesIO(self.pdf_bytes), filename="java.pdf")
+        success, saved_file, _, _ = self.service.save_uploaded_file(file)
+
+        self.assertTrue(success)
+        self.assertEqual(saved_file["file_size"], len(self.pdf_bytes))
+        hashes = self.service.calculate_file_hashes(saved_file["file_path"])
+        self.assertEqual(saved_file["file_hash"], hashes["md5"])
+        self.assertEqual(saved_file["sha256"], hashes["sha256"])
+
+    def test_concurrent_duplicate_uploads_ingest_once(self):
+        """Test upload đồng thời cùng nội dung chỉ ingest 1 lần và trả về cùng file_id"""
+        results = []
+        with patch.object(self.service, "ingest_saved_file", wraps=self.service.ingest_saved_file) as ingest:
+            threads = [threading.Thread(target=lambda: results.append(self._upload("Java"))) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(ingest.call_count, 1)
+        self.assertTrue(all(success for success, _, _, _ in results))
+        self.assertEqual(len({data["file_id"] for _, data, _, _ in results}), 1)
+        self.assertEqual(sum(1 for _, data, _, _ in results if data.get("duplicate_of")), 2)
+        self.assertEqual(len([name for name in os.listdir(self.temp_dir) if name.endswith(".pdf")]), 1)
+
+    def test_alias_shares_chunks_and_survives_owner_deletion(self):
+        """Test alias dùng chunks của file gốc và nhận quyền sở hữu khi file gốc bị xóa"""
+        _, original, _, _ = self._upload("Bản gốc")
+        chunks_count = len(self.service.collection.records)
+        success, alias, _, _ = self._upload("Bản alias", on_duplicate="alias")
+
+        self.assertTrue(success)
+        self.assertEqual(alias["alias_of"], original["file_id"])
+        self.assertEqual(alias["title"], "Bản alias")
+        self.assertEqual(alias["pages_count"], original["pages_count"])
+        self.assertEqual(len(self.service.collection.records), chunks_count)
+        _, alias_chunks, _ = self.service.get_chunks_by_file_id(alias["file_id"])
+        self.assertEqual(len(alias_chunks), chunks_count)
+
+        success, _ = self.service.delete_file(original["file_id"])
+        self.assertTrue(success)
+        self.assertFalse(self.service.get_file_by_id(original["file_id"])[0])
+
+        _, promoted, _ = self.service.get_file_by_id(alias["file_id"])
+        self.assertNotIn("alias_of", promoted)
+        self.assertTrue(promoted["extracted_text"])
+        chunks = self.service.collection.get(where={"file_id": alias["file_id"]})
+        self.assertEqual(len(chunks["ids"]), chunks_count)
+        self.assertTrue(all(metadata["title"] == "Bản alias" for metadata in chunks["metadatas"]))
+
+        # Upload lại sau khi xóa vẫn được nhận diện là trùng với file đã nhận quyền sở hữu
+        _, again, _, _ = self._upload("Lần 3")
+        self.assertEqual(again["duplicate_of"], alias["file_id"])
+
+
+
+class TestChunkDeduplication(unittest.TestCase):
+    """Test cases cho loại bỏ chunk trùng trước khi embed"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+        rng = random.Random(7)
+        words = ["class", "method", "biến", "hằng", "số", "Java", "đặt", "tên", "quy", "tắc", "khoảng", "trắng"]
+        self.chunks = [" ".join(rng.choice(words) for _ in range(150)) for _ in range(6)]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _write(self, file_id, chunks):
+        stats = {}
+        success, count, error = self.service.write_chunks_to_vector_db(
+            file_id, f"Tài liệu {file_id}", "", iter(chunks), {"original_filename": f"{file_id}.pdf"},
+            batch_size=4, dedup_stats=stats
+        )
+        self.assertTrue(success, error)
+        self.assertEqual(count, len(chunks))
+        return stats
+
+    def test_exact_and_near_duplicates_are_shared(self):
+        """Test chunk trùng chính xác/gần trùng không được lưu lại, file mới chỉ tham chiếu"""
+        self._write("a", self.chunks)
+        # Phiên bản mới: 3 chunk giữ nguyên (khác hoa/thường), 1 chunk sửa 1 từ, 2 chunk mới
+        near = self.chunks[3].rsplit(" ", 1)[0] + " hằng"
+        new_chunks = ["nội dung mới " * 40, "chương khác hoàn toàn " * 30]
+        stats = self._write("b", [self.chunks[0].upper(), self.chunks[1], self.chunks[2], near] + new_chunks)
+
+        self.assertEqual(stats, {"stored": 2, "exact": 3, "near": 1})
+        self.assertEqual(len(self.service.collection.records), len(self.chunks) + 2)
+
+        # Tìm theo file b vẫn thấy chunk dùng chung, kết quả ghi nhận file tham chiếu
+        _, chunks_b, _ = self.service.get_chunks_by_file_id("b")
+        self.assertEqual([chunk["chunk_index"] for chunk in chunks_b], list(range(6)))
+        shared = self.service.collection.get(where={"file_id": "a"})
+        self.assertTrue(all(metadata.get("ref_b") for metadata in shared["metadatas"][:4]))
+
+        dedup_stats = self.service.chunk_dedup.get_stats()
+        self.assertEqual(dedup_stats["logical_chunks"], 12)
+        self.assertEqual(dedup_stats["stored_chunks"], 8)
+        self.assertAlmostEqual(dedup_stats["index_size_reduction"], 1 - 8 / 12, places=3)
+
+    def test_delete_transfers_shared_chunks(self):
+        """Test xóa file sở hữu chunk dùng chung: chunk chuyển cho file tham chiếu, chunk riêng bị xóa"""
+        self._write("a", self.chunks)
+        self._write("b", self.chunks[:2])
+
+        success, _ = self.service.delete_from_vector_db("a")
+        self.assertTrue(success)
+
+        remaining = self.service.collection.get()
+        self.assertEqual(len(remaining["ids"]), 2)
+        self.assertTrue(all(metadata["file_id"] == "b" and "ref_b" not in metadata
+                            for metadata in remaining["metadatas"]))
+
+        # Xóa nốt file b: không còn chunk và index rỗng
+        self.service.delete_from_vector_db("b")
+        self.assertEqual(self.service.collection.get()["ids"], [])
+        self.assertTrue(self.service.chunk_dedup.is_empty())
+
+
+
+class TestEmbeddingProvider(unittest.TestCase):
+    """Test cases cho embedding provider"""
+
+    def test_micro_batches_keep_order_and_record_throughput(self):
+        """Test chia micro-batch (song song) giữ đúng thứ tự và ghi nhận thống kê"""
+        batch_sizes = []
+
+        def embed(texts):
+            batch_sizes.append(len(texts))
+            return fake_embed(texts)
+
+        provider = EmbeddingProvider(embed, "fake", batch_size=3, workers=2)
+        try:
+            texts = ["x" * i for i in range(10)]
+            embeddings = provider.embed_documents(texts)
+            provider.embed_queries(["câu hỏi"])
+        finally:
+            provider.shutdown()
+
+        self.assertEqual([embedding[0] for embedding in embeddings], [float(i) for i in range(10)])
+        self.assertEqual(sorted(batch_sizes), [1, 1, 3, 3, 3])
+        stats = provider.get_stats()
+        self.assertEqual(stats["documents"]["texts"], 10)
+        self.assertEqual(stats["documents"]["batches"], 4)
+        self.assertEqual(stats["queries"]["texts"], 1)
+        self.assertGreater(stats["documents"]["texts_per_second"], 0)
+
+    def test_writes_split_under_backend_batch_limit(self):
+        """Test mỗi lần add không vượt max batch size của ChromaDB và có embedding tường minh"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            service = make_service(temp_dir)
+            service.max_batch_size = 5
+            chunks = [f"chunk số {i} " * (i + 1) for i in range(12)]
+            success, count, _ = service.write_chunks_to_vector_db("a", "A", "", chunks, {}, batch_size=64)
+
+            self.assertTrue(success)
+            self.assertEqual([len(ids) for _, _, ids in service.collection.batches], [5, 5, 2])
+            self.assertEqual(service.collection.embeddings["a_chunk_3"], fake_embed([chunks[3]])[0])
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    """Test cases cho cache embedding theo (model, hash chunk)"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "embedding_cache.db")
+        self.embedded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _provider(self, name="fake", max_entries=100):
+        def embed(texts):
+            self.embedded.extend(texts)
+            return fake_embed(texts)
+
+        return EmbeddingProvider(embed, name, batch_size=4, cache=EmbeddingCache(self.db_path, max_entries))
+
+    def test_only_missing_texts_are_embedded(self):
+        """Test text đã cache không được embed lại, kết quả giữ đúng thứ tự"""
+        provider = self._provider()
+        provider.embed_documents(["alpha", "beta"])
+        embeddings = provider.embed_documents(["beta", "gamma  delta", "alpha"])
+
+        self.assertEqual(self.embedded, ["alpha", "beta", "gamma  delta"])
+        self.assertEqual(embeddings, fake_embed(["beta", "gamma  delta", "alpha"]))
+        stats = provider.get_stats()["cache"]
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 3))
+
+        # Model khác không dùng chung cache
+        self._provider(name="other").embed_documents(["alpha"])
+        self.assertEqual(self.embedded[-1], "alpha")
+
+    def test_cache_survives_collection_reset(self):
+        """Test ingest lại sau khi clear collection dùng embedding đã cache"""
+        service = make_service(self.temp_dir)
+        service.embedder = self._provider()
+        chunks = [f"đoạn văn số {i}" for i in range(6)]
+        service.write_chunks_to_vector_db("a", "A", "", chunks, {})
+
+        service.collection = FakeCollection()
+        service.chunk_dedup.clear()
+        service.embedder = self._provider()  # Như khởi động lại: cache mở lại từ file
+        service.write_chunks_to_vector_db("a", "A", "", chunks, {})
+
+        self.assertEqual(len(self.embedded), 6)
+        self.assertEqual(len(service.collection.records), 6)
+        self.assertEqual(service.embedder.get_stats()["cache"]["hit_rate"], 1.0)
+
+    def test_lru_eviction(self):
+        """Test vượt max_entries thì xóa bản ghi dùng lâu nhất"""
+        cache = EmbeddingCache(self.db_path, max_entries=10)
+        cache.put_many("m", ["giữ lại"], [[1.0]])
+        time.sleep(0.01)
+        cache.put_many("m", [f"text {i}" for i in range(9)], [[float(i)] for i in range(9)])
+        time.sleep(0.01)
+        cache.get_many("m", ["giữ lại"])
+        time.sleep(0.01)
+        cache.put_many("m", ["mới"], [[2.0]])
+
+        stats = cache.get_stats()
+        self.assertEqual(stats["evictions"], 2)
+        self.assertEqual(stats["entries"], 9)
+        self.assertEqual(cache.get_many("m", ["giữ lại", "mới"]), {0: [1.0], 1: [2.0]})
+
+
+class TestReindex(unittest.TestCase):
+    """Test cases cho re-index từ text đã lưu"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+        self.text = " ".join(f"Câu số {i} mô tả quy tắc đặt tên biến trong Java." for i in range(120))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _add_file(self, file_id, text, **extra):
+        metadata = dict({"file_id": file_id, "title": file_id.upper(), "description": "",
+                         "original_filename": f"{file_id}.pdf", "upload_time": "2025-01-01T00:00:00"}, **extra)
+        self.service.save_file_metadata(file_id, metadata)
+        with open(os.path.join(self.temp_dir, f"{file_id}_text.txt"), 'w', encoding='utf-8') as f:
+            f.write(text)
+        if "alias_of" not in extra:
+            self.service.write_chunks_to_vector_db(
+                file_id, metadata["title"], "", self.service._split_text_into_chunks(text), metadata
+            )
+
+    def _chunk_texts(self, file_ids):
+        result = self.service.collection.get(where=self.service._file_filter(file_ids))
+        return sorted(result["documents"])
+
+    def test_reindex_swaps_chunks_with_new_parameters(self):
+        """Test re-index toàn bộ KB chia chunk theo tham số mới, bỏ qua alias, không để lại chunk tạm"""
+        b_text = self.text[:1500] + " Phần riêng của tài liệu B."
+        self._add_file("a", self.text)
+        self._add_file("b", b_text)
+        self._add_file("c", "", alias_of="a")
+
+        success, summary, _ = self.service.reindex_files(chunk_size=300, overlap=30)
+
+        self.assertTrue(success)
+        self.assertEqual((summary["files_total"], summary["files_failed"]), (2, 0))
+        expected = sorted(self.service._split_text_into_chunks(self.text, chunk_size=300, overlap=30))
+        self.assertEqual(self._chunk_texts(["a"]), expected)
+        self.assertEqual(set(self._chunk_texts(["b"])),
+                         set(self.service._split_text_into_chunks(b_text, chunk_size=300, overlap=30)))
+        ids = self.service.collection.get(where={"file_id": "a"})["ids"]
+        self.assertTrue(all(chunk_id.startswith("a_g1_chunk_") for chunk_id in ids))
+        self.assertFalse(self.service.chroma_client.collections["knowledge_base_reindex"].records)
+        metadata = self.service.load_file_metadata("a")
+        self.assertEqual((metadata["chunk_size"], metadata["chunk_overlap"], metadata["index_generation"]),
+                         (300, 30, 1))
+
+        # Re-index lại cùng tham số dùng lại toàn bộ chunk đã lưu, không embed lại
+        success, result, _, _ = self.service.reindex_file("a", chunk_size=300, overlap=30)
+        self.assertTrue(success)
+        self.assertEqual(result["vector_chunks_stored"], 0)
+        self.assertEqual(self._chunk_texts(["a"]), expected)
+
+    def test_reindex_rejects_zero_chunk_size(self):
+        """Test chunk_size = 0 truyền vào bị từ chối thay vì dùng giá trị mặc định"""
+        self._add_file("a", self.text)
+
+        success, _, error = self.service.reindex_files(chunk_size=0)
+        self.assertFalse(success)
+        self.assertIn("chunk_size", error)
+        success, _, _, status = self.service.reindex_file("a", chunk_size=0)
+        self.assertEqual((success, status), (False, 400))
+
+    def test_search_during_reindex_swap_sees_one_version(self):
+        """Test search chạy lúc swap chờ swap xong, chỉ thấy chunks mới, cache bị vô hiệu đúng 1 lần"""
+        self._add_file("a", self.text)
+        new_chunks = set(self.service._split_text_into_chunks(self.text, chunk_size=300, overlap=30))
+        publish = self.service._publish_staged_chunks
+        bumps, searches = [], []
+        
+        def publish_and_search(*args):
+            published = publish(*args)
+            # Chunks mới đã chép, chunks cũ chưa xóa: search phải chờ
+            searcher = threading.Thread(target=lambda: searches.append(
+                self.service.search_in_vector_db("quy tắc đặt tên biến", 500, "a")))
+            searcher.start()
+            searcher.join(0.2)
+            searches.append(searcher)
+            return published
+        
+        with patch.object(self.service, "_publish_staged_chunks", side_effect=publish_and_search), \
+             patch.object(self.service.search_cache, "bump_generation", side_effect=lambda: bumps.append(1)):
+            success, _, _, _ = self.service.reindex_file("a", chunk_size=300, overlap=30)
+        searcher = searches.pop(0)
+        searcher.join(5)
+        
+        self.assertTrue(success)
+        self.assertEqual(len(bumps), 1)
+        (search_success, results, _), = searches
+        self.assertTrue(search_success)
+        self.assertEqual({result["content"] for result in results}, new_chunks)
+    
+    def test_reindex_keeps_shared_chunks_and_rolls_back_on_error(self):
+        """Test chunk file khác dùng chung vẫn còn sau re-index, lỗi embed thì giữ nguyên chunks cũ"""
+        self._add_file("a", self.text)
+        self._add_file("b", self.text[:2500])
+        b_chunks = self._chunk_texts(["b"])
+        self.assertTrue(self.service.collection.get(where={ref_key("b"): True})["ids"])
+
+        success, _, _, _ = self.service.reindex_file("a", chunk_size=400, overlap=0)
+        self.assertTrue(success)
+        self.assertEqual(self._chunk_texts(["b"]), b_chunks)
+
+        a_chunks = self._chunk_texts(["a"])
+        stats = self.service.chunk_dedup.get_stats()
+        self.service.embedder = EmbeddingProvider(Mock(side_effect=RuntimeError("model crashed")), "fake")
+        success, _, message, status_code = self.service.reindex_file("a", chunk_size=700, overlap=50)
+
+        self.assertFalse(success)
+        self.assertEqual(status_code, 500)
+        self.assertIn("model crashed", message)
+        self.assertEqual(self._chunk_texts(["a"]), a_chunks)
+        self.assertEqual(self._chunk_texts(["b"]), b_chunks)
+        self.assertEqual(self.service.chunk_dedup.get_stats(), stats)
+        self.assertFalse(self.service.chroma_client.collections["knowledge_base_reindex"].records)
+
+
+class TestStructuredChunking(unittest.TestCase):
+    """Test cases cho chia chunk theo trang và section"""
+
+    PAGES = [
+        "Quy tắc code Java\nMục lục\n1 Giới thiệu . . . . . . . . 2\n2 Quy tắc đặt tên . . . . . . 2\n",
+        "1 Giới thiệu\nTài liệu mô tả quy tắc viết code Java thống nhất. Áp dụng cho mọi dự án.\n"
+        "2 Quy tắc đặt tên\n2.1 Lớp\nTên lớp dùng PascalCase, ví dụ StudentManager. Tên lớp là danh từ.\n"
+        "1public class Example {\n2 Lớp con kế thừa ví dụ = 1;\n",
+        "2.2 Biến\nTên biến dùng camelCase và có ý nghĩa rõ ràng. " * 3 + "\n5 Quy tắc khác\nKhông phải heading.\n"
+    ]
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _chunk(self, pages, chunk_size=120, overlap=20, detect_headings=True):
+        chunker = StructuredChunker(lambda: IncrementalChunker(chunk_size, overlap, with_offsets=True),
+                                    detect_headings=detect_headings)
+        chunks = []
+        for page_number, page in enumerate(pages, 1):
+            chunks.extend(chunker.feed(page + "\n", page_number))
+        chunks.extend(chunker.finish())
+        return chunks
+
+    def test_page_marks_bounded_within_long_section(self):
+        """Test section dài nhiều trang: chỉ giữ mốc trang của phần chưa chia chunk, số trang vẫn đúng"""
+        pages = [f"Nội dung trang {page_number} của tài liệu rất dài không có heading." for page_number in range(1, 201)]
+        chunker = StructuredChunker(lambda: IncrementalChunker(120, 20, with_offsets=True))
+        chunks = []
+        for page_number, page in enumerate(pages, 1):
+            chunks.extend(chunker.feed(page + "\n", page_number))
+            self.assertLessEqual(len(chunker._mark_positions), 4)
+        chunks.extend(chunker.finish())
+
+        with patch.object(StructuredChunker, "_drop_marks", lambda chunker: None):
+            self.assertEqual(chunks, self._chunk(pages))
+        self.assertEqual((chunks[-1].page_start, chunks[-1].page_end), (199, 200))
+
+    def test_chunks_follow_sections_and_pages(self):
+        """Test chunk không vượt qua heading, có đường dẫn section và trang; mục lục / code không là heading"""
+        chunks = self._chunk(self.PAGES)
+
+        sections = list(dict.fromkeys(chunk.section for chunk in chunks))
+        self.assertEqual(sections, ["", "1 Giới thiệu", "2 Quy tắc đặt tên > 2.1 Lớp", "2 Quy tắc đặt tên > 2.2 Biến"])
+        self.assertFalse(any("dự án" in chunk.text and "Quy tắc đặt tên" in chunk.text for chunk in chunks))
+        self.assertFalse(any("StudentManager" in chunk.text and "2.2 Biến" in chunk.text for chunk in chunks))
+        self.assertTrue(all(chunk.page_start == chunk.page_end == 1 for chunk in chunks if not chunk.section))
+        self.assertEqual({chunk.page_start for chunk in chunks if chunk.section.endswith("2.2 Biến")}, {3})
+        self.assertTrue(any("2 Quy tắc đặt tên 2.1 Lớp" in chunk.text for chunk in chunks))
+        self.assertTrue(any("5 Quy tắc khác" in chunk.text and chunk.section.endswith("2.2 Biến") for chunk in chunks))
+
+        # Không nhận diện heading: cùng nội dung chunk với chunker thường, vẫn có số trang
+        flat = self._chunk(self.PAGES, detect_headings=False)
+        text, _ = join_pages(self.PAGES)
+        self.assertEqual([chunk.text for chunk in flat], self.service._split_text_into_chunks(text, 120, 20))
+        self.assertTrue(any(chunk.page_start < chunk.page_end for chunk in flat))
+
+    def test_reindex_stores_page_and_section_metadata(self):
+        """Test chunk metadata có page_start/page_end/section khi chia lại từ text đã lưu theo trang"""
+        text, page_offsets = join_pages(self.PAGES)
+        metadata = {"file_id": "doc", "title": "Java", "description": "", "original_filename": "doc.pdf",
+                    "upload_time": "2025-01-01T00:00:00", "page_offsets": page_offsets}
+        self.service.save_file_metadata("doc", metadata)
+        with open(os.path.join(self.temp_dir, "doc_text.txt"), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+        success, _, message, _ = self.service.reindex_file("doc", chunk_size=120, overlap=20)
+
+        self.assertTrue(success, message)
+        metadatas = self.service.collection.get(where={"file_id": "doc"})["metadatas"]
+        self.assertTrue(metadatas)
+        self.assertTrue(all(1 <= m["page_start"] <= m["page_end"] <= 3 for m in metadatas))
+        self.assertIn("2 Quy tắc đặt tên > 2.1 Lớp", {m.get("section") for m in metadatas})
+        source = self.service._result_source({"content": "", "metadata": metadatas[-1]}, "vector_similarity")
+        self.assertEqual(source["page_end"], metadatas[-1]["page_end"])
+
+    def test_reindex_pages_with_carriage_returns(self):
+        """Test page_offsets (số ký tự) vẫn đúng khi text trang có \\r\\n hoặc \\r: trang không bị lệch"""
+        pages = [page.replace("\n", "\r\n") for page in self.PAGES[:2]] + [self.PAGES[2].replace("\n", "\r")]
+        text, page_offsets = join_pages(pages)
+        metadata = {"file_id": "doc", "title": "Java", "description": "", "original_filename": "doc.pdf",
+                    "upload_time": "2025-01-01T00:00:00", "page_offsets": page_offsets}
+        self.service.save_file_metadata("doc", metadata)
+        # Ghi như ingest_saved_file
+        with open(os.path.join(self.temp_dir, "doc_text.txt"), 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+
+        success, _, message, _ = self.service.reindex_file("doc", chunk_size=120, overlap=20)
+
+        self.assertTrue(success, message)
+        chunker = self.service._make_chunker(120, 20)
+        page_texts = [text[start:end] for start, end in zip(page_offsets, page_offsets[1:] + [None])]
+        expected = [chunk for page_number, page_text in enumerate(page_texts, 1)
+                    for chunk in chunker.feed(page_text, page_number)] + list(chunker.finish())
+        stored = self.service.collection.get(where={"file_id": "doc"})["metadatas"]
+        self.assertEqual([(m["page_start"], m["page_end"]) for m in sorted(stored, key=lambda m: m["chunk_index"])],
+                         [(chunk.page_start, chunk.page_end) for chunk in expected])
+
+
+@unittest.skipUnless(os.path.exists(SAMPLE_PDF), "Sample PDF not available")
+class TestBulkUpload(unittest.TestCase):
+    """Test cases cho endpoint bulk upload"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+        with open(SAMPLE_PDF, "rb") as f:
+            self.pdf_bytes = f.read()
+        # Thêm comment sau %%EOF -> cùng nội dung PDF nhưng khác SHA-256
+        self.other_pdf_bytes = self.pdf_bytes + b"\n%bulk copy\n"
+
+        app = Flask(__name__)
+        app.register_blueprint(knowledge_base_api.knowledge_base_bp, url_prefix='/api')
+        self.client = app.test_client()
+        self.patches = [
+            patch.object(knowledge_base_api, "_knowledge_base_service", self.service),
+            patch.object(knowledge_base_api, "_ingestion_queue", Mock())
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_archive_ingested_with_manifest_titles(self):
+        """Test archive zip: file PDF được ingest song song, title lấy từ manifest, file khác bị bỏ qua"""
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr("docs/java.pdf", self.pdf_bytes)
+            zip_file.writestr("docs/java-copy.pdf", self.other_pdf_bytes)
+            zip_file.writestr("docs/notes.txt", "không phải PDF")
+            zip_file.writestr("__MACOSX/docs/._java.pdf", b"")
+            zip_file.writestr("manifest.json", json.dumps(
+                [{"filename": "java.pdf", "title": "Quy tắc Java", "description": "Tài liệu gốc"}]
+            ))
+        archive.seek(0)
+
+        with patch.object(self.service, "ingest_saved_file", wraps=self.service.ingest_saved_file) as ingest:
+            response = self.client.post("/api/knowledge-base/upload/bulk",
+                                        data={"archive": (archive, "docs.zip")},
+                                        content_type="multipart/form-data")
+
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()["data"]
+        self.assertEqual((data["total"], data["succeeded"], data["failed"]), (2, 2, 0))
+        self.assertEqual(ingest.call_count, 2)
+        self.assertEqual(data["skipped"], [{"filename": "docs/notes.txt", "reason": "File type not allowed"}])
+        self.assertEqual([result["filename"] for result in data["files"]], ["docs/java.pdf", "docs/java-copy.pdf"])
+        titles = [result["data"]["title"] for result in data["files"]]
+        self.assertEqual(titles, ["Quy tắc Java", "java-copy"])
+        self.assertEqual(data["files"][0]["data"]["description"], "Tài liệu gốc")
+        self.assertEqual(self.service.file_catalog.count(), 2)
+
+    def test_multiple_files_report_per_file_results(self):
+        """Test nhiều file multipart: file trùng nội dung dùng lại file đã có, file sai loại báo lỗi riêng"""
+        response = self.client.post("/api/knowledge-base/upload/bulk", data={
+            "files": [
+                (BytesIO(self.pdf_bytes), "a.pdf"),
+                (BytesIO(self.pdf_bytes), "b.pdf"),
+                (BytesIO(b"text"), "c.txt")
+            ],
+            "manifest": json.dumps({"b.pdf": "Bản B"})
+        }, content_type="multipart/form-data")
+
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()["data"]["files"]
+        self.assertEqual([result["success"] for result in results], [True, True, False])
+        self.assertEqual(results[1]["data"]["duplicate_of"], results[0]["data"]["file_id"])
+        self.assertEqual(results[2]["status_code"], 400)
+        self.assertEqual(len([name for name in os.listdir(self.temp_dir) if name.endswith(".pdf")]), 1)
+
+        response = self.client.post("/api/knowledge-base/upload/bulk", data={"manifest": "{"},
+                                    content_type="multipart/form-data")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["error"], "Invalid manifest")
+
+
+@unittest.skipUnless(os.path.exists(SAMPLE_PDF), "Sample PDF not available")
+class TestResumableUpload(unittest.TestCase):
+    """Test cases cho upload nhiều phần (resumable upload)"""
+
+    PART_SIZE = 100 * 1024
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+        self.service.max_file_size = self.PART_SIZE
+        self.sessions = UploadSessionStore(self.service, part_size=self.PART_SIZE, max_file_size=1024 * 1024)
+        with open(SAMPLE_PDF, "rb") as f:
+            self.pdf_bytes = f.read()
+
+        app = Flask(__name__)
+        app.register_blueprint(knowledge_base_api.knowledge_base_bp, url_prefix='/api')
+        self.client = app.test_client()
+        self.patches = [
+            patch.object(knowledge_base_api, "_knowledge_base_service", self.service),
+            patch.object(knowledge_base_api, "_ingestion_queue", Mock()),
+            patch.object(knowledge_base_api, "_upload_sessions", self.sessions)
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _create_session(self, **overrides):
+        body = dict({"filename": "manual.pdf", "file_size": len(self.pdf_bytes), "title": "Sổ tay Java"}, **overrides)
+        return self.client.post("/api/knowledge-base/uploads", json=body)
+
+    def _put_part(self, upload_id, part_number, checksum=None):
+        part = self.pdf_bytes[(part_number - 1) * self.PART_SIZE:part_number * self.PART_SIZE]
+        return self.client.put(f"/api/knowledge-base/uploads/{upload_id}/parts/{part_number}", data=part,
+                               headers={"X-Part-SHA256": checksum or hashlib.sha256(part).hexdigest()})
+
+    def test_parts_resume_and_complete(self):
+        """Test file lớn hơn giới hạn upload 1 request: gửi từng phần, phần sai checksum gửi lại, hoàn tất rồi ingest"""
+        response = self.client.post("/api/knowledge-base/upload", data={
+            "file": (BytesIO(self.pdf_bytes), "manual.pdf"), "title": "Sổ tay Java"
+        }, content_type="multipart/form-data")
+        self.assertEqual(response.status_code, 413)
+
+        response = self._create_session(sha256=hashlib.sha256(self.pdf_bytes).hexdigest())
+        self.assertEqual(response.status_code, 201)
+        session = response.get_json()["data"]
+        upload_id = session["upload_id"]
+        self.assertEqual(session["parts_total"], 3)
+
+        self.assertEqual(self._put_part(upload_id, 3).status_code, 200)
+        self.assertEqual(self._put_part(upload_id, 1).status_code, 200)
+        self.assertEqual(self._put_part(upload_id, 2, checksum="0" * 64).status_code, 400)
+
+        status = self.client.get(f"/api/knowledge-base/uploads/{upload_id}").get_json()["data"]
+        self.assertEqual(status["missing_parts"], [2])
+        self.assertEqual(self.client.post(f"/api/knowledge-base/uploads/{upload_id}/complete").status_code, 400)
+
+        self.assertEqual(self._put_part(upload_id, 2).status_code, 200)
+        response = self.client.post(f"/api/knowledge-base/uploads/{upload_id}/complete")
+        self.assertEqual(response.status_code, 200)
+        result = response.get_json()["data"]
+        self.assertEqual(result["title"], "Sổ tay Java")
+        self.assertEqual(result["sha256"], hashlib.sha256(self.pdf_bytes).hexdigest())
+        self.assertGreater(result["vector_chunks_count"], 0)
+        self.assertEqual(os.listdir(self.sessions.spool_folder), [])
+        self.assertEqual(self.client.post(f"/api/knowledge-base/uploads/{upload_id}/complete").status_code, 409)
+
+    def test_failed_resend_marks_part_missing(self):
+        """Test gửi lại 1 phần đã nhận nhưng sai checksum: phần đó trở lại danh sách còn thiếu"""
+        upload_id = self._create_session(sha256=hashlib.sha256(self.pdf_bytes).hexdigest()).get_json()["data"]["upload_id"]
+        for part_number in (1, 2, 3):
+            self.assertEqual(self._put_part(upload_id, part_number).status_code, 200)
+        self.assertEqual(self.sessions.get(upload_id)["missing_parts"], [])
+
+        self.assertEqual(self._put_part(upload_id, 2, checksum="0" * 64).status_code, 400)
+        session = self.sessions.get(upload_id)
+        self.assertEqual(session["missing_parts"], [2])
+        self.assertEqual([part["part_number"] for part in session["parts"]], [1, 3])
+        self.assertEqual(self.client.post(f"/api/knowledge-base/uploads/{upload_id}/complete").status_code, 400)
+
+        self.assertEqual(self._put_part(upload_id, 2).status_code, 200)
+        self.assertEqual(self.client.post(f"/api/knowledge-base/uploads/{upload_id}/complete").status_code, 200)
+
+    def test_limits_checked_before_reading_body(self):
+        """Test giới hạn kích thước file / phần được kiểm tra trước khi ghi, session hết hạn bị dọn"""
+        self.assertEqual(self._create_session(file_size=2 * 1024 * 1024).status_code, 413)
+        self.assertEqual(self._create_session(filename="manual.exe").status_code, 400)
+
+        upload_id = self._create_session().get_json()["data"]["upload_id"]
+        response = self.client.put(f"/api/knowledge-base/uploads/{upload_id}/parts/1",
+                                   data=b"x" * (self.PART_SIZE + 1))
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.client.put(f"/api/knowledge-base/uploads/{upload_id}/parts/4", data=b"x").status_code, 400)
+        with open(os.path.join(self.sessions.spool_folder, f"{upload_id}.upload"), "rb") as f:
+            self.assertEqual(f.read(16), b"\0" * 16)
+
+        self.sessions.session_ttl = -1
+        self.assertEqual(self.sessions.purge_expired(), 1)
+        self.assertEqual(self.client.get(f"/api/knowledge-base/uploads/{upload_id}").status_code, 404)
+        self.assertEqual(os.listdir(self.sessions.spool_folder), [])
+
+
+class TestFileCatalog(unittest.TestCase):
+    """Test cases cho file catalog thay cho metadata JSON"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_migrates_legacy_json_metadata_once(self):
+        """Test metadata JSON cũ được import 1 lần, text trong JSON chuyển ra file text"""
+        legacy = {"file_id": "old", "title": "Java cũ", "original_filename": "old.pdf", "file_size": 10,
+                  "pages_count": 2, "upload_time": "2024-01-01T00:00:00", "extracted_text": "Nội dung cũ"}
+        with open(os.path.join(self.temp_dir, "old_metadata.json"), 'w', encoding='utf-8') as f:
+            json.dump(legacy, f, ensure_ascii=False)
+
+        self.service._migrate_json_metadata()
+
+        metadata = self.service.load_file_metadata("old")
+        self.assertEqual(metadata["title"], "Java cũ")
+        self.assertNotIn("extracted_text", metadata)
+        with open(os.path.join(self.temp_dir, "old_text.txt"), encoding='utf-8') as f:
+            self.assertEqual(f.read(), "Nội dung cũ")
+        self.assertEqual(self.service.get_file_by_id("old")[1]["extracted_text"], "Nội dung cũ")
+
+        # Đã migrate thì JSON không còn được đọc lại
+        self.service.file_catalog.delete("old")
+        self.service._migrate_json_metadata()
+        self.assertIsNone(self.service.load_file_metadata("old"))
+
+    def test_list_files_paginates_and_sorts(self):
+        """Test liệt kê file phân trang, sắp xếp theo trường có index, alias lấy số trang từ file gốc"""
+        for index, title in enumerate(["Gamma", "alpha", "Beta"]):
+            self.service.save_file_metadata(f"f{index}", {
+                "file_id": f"f{index}", "title": title, "original_filename": f"{title}.pdf", "file_size": 100 + index,
+                "pages_count": index + 1, "upload_time": f"2025-01-0{index + 1}T00:00:00", "description": ""
+            })
+        self.service.save_file_metadata("f3", {
+            "file_id": "f3", "alias_of": "f2", "title": "Delta", "original_filename": "Delta.pdf",
+            "file_size": 102, "upload_time": "2025-01-04T00:00:00", "description": ""
+        })
+
+        success, page, _ = self.service.get_uploaded_files(limit=2, offset=0)
+        self.assertTrue(success)
+        self.assertEqual(page["total_files"], 4)
+        self.assertEqual([f["file_id"] for f in page["files"]], ["f3", "f2"])
+        self.assertEqual(page["files"][0]["pages_count"], 3)
+
+        _, page, _ = self.service.get_uploaded_files(limit=2, offset=1, sort_by="title", descending=False)
+        self.assertEqual([f["title"] for f in page["files"]], ["Beta", "Delta"])
+
+        _, everything, _ = self.service.get_uploaded_files()
+        self.assertEqual(len(everything["files"]), 4)
+
+
+def legacy_normalize(text):
+    """Chuẩn hóa bằng regex như KnowledgeBaseService._normalize_vietnamese_text trước đây"""
+    if not text:
+        return text
+    normalized = re.sub(r'[^\w\s' + VIETNAMESE_CHARS + r']', ' ', text.lower())
+    return re.sub(r'\s+', ' ', normalized).strip()
+
+
+def legacy_detect_language(text):
+    """Vòng lặp từng ký tự như KnowledgeBaseService._detect_language trước đây"""
+    if not text or len(text.strip()) < 10:
+        return 'unknown'
+    vietnamese_count = total_chars = 0
+    for char in text.lower():
+        if char.isalpha():
+            total_chars += 1
+            if char in VIETNAMESE_CHARS:
+                vietnamese_count += 1
+    if total_chars == 0:
+        return 'unknown'
+    ratio = vietnamese_count / total_chars
+    return 'vi' if ratio > 0.05 else 'mixed' if ratio > 0.01 else 'en'
+
+
+class TestChunkAnnotator(unittest.TestCase):
+    """Test cases cho chuẩn hóa và phân tích chunk trong 1 lần xử lý"""
+
+    ALPHABET = ("abcdefghij XYZ 0123456789 _ ÀÁẢÃẠăắằẳẵặÂấầẩẫậđĐêếềểễệ ôốồổỗộơớờởỡợưứừửữự "
+                ".,;:!?()[]{}\"'-–—…/\\@#%*+=<>|~`^ \t\n\r\x0b\x0c\u00a0\u2003\u3000 "
+                "ßİΣσς日本語한국어١٢٣²½ℕ\u0301\u200b🙂")
+
+    def test_matches_legacy_normalize_and_language(self):
+        """Test normalize_text / detect_language / annotate cho kết quả giống bản regex và vòng lặp cũ"""
+        rng = random.Random(42)
+        samples = ["", None, "   ", "ngắn", "Xin chào!!", "Hello, world... (again)",
+                   "Tiêu chuẩn coding trong Java: đặt tên biến theo camelCase.",
+                   "Mixed: English text with một vài từ tiếng Việt here and there, mostly English words."]
+        for _ in range(300):
+            samples.append("".join(rng.choice(self.ALPHABET) for _ in range(rng.randint(0, 200))))
+
+        for text in samples:
+            self.assertEqual(normalize_text(text), legacy_normalize(text), repr(text))
+            self.assertEqual(detect_language(text), legacy_detect_language(text), repr(text))
+            if text is None:
+                continue
+            annotation = annotate(text)
+            self.assertEqual(annotation.normalized, legacy_normalize(text))
+            self.assertEqual(annotation.language, legacy_detect_language(text))
+            self.assertEqual(annotation.token_count, len(legacy_normalize(text).split()))
+
+    def test_content_hash_matches_dedup_and_metadata_has_token_count(self):
+        """Test content hash giống chunk_dedup (hash đã lưu vẫn khớp), metadata chunk có token_count"""
+        for text in ["Tên  lớp dùng PascalCase.\n", "  XIN CHÀO thế giới  ", ""]:
+            legacy = hashlib.sha1(re.sub(r'\s+', ' ', text.lower()).strip().encode('utf-8')).hexdigest()
+            self.assertEqual(annotate(text).content_hash, content_hash(text))
+            self.assertEqual(annotate(text).content_hash, legacy)
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            service = make_service(temp_dir)
+            text = ("Tên lớp dùng PascalCase, ví dụ StudentManager. Tên biến dùng camelCase. " * 40)
+            service.write_chunks_to_vector_db("doc", "Java", "", service._split_text_into_chunks(text, 200, 40), {})
+            documents, metadatas, _ = service.collection.batches[0]
+            for document, metadata in zip(documents, metadatas):
+                self.assertEqual(metadata["token_count"], len(legacy_normalize(document).split()))
+                self.assertEqual(metadata["language"], legacy_detect_language(document))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+
+class TestLexicalIndex(unittest.TestCase):
+    """Test cases cho tìm kiếm từ khóa BM25 bằng inverted index"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_bm25_ranking_and_phrase_bonus(self):
+        """Test BM25: term hiếm xếp trên term phổ biến, chunk chứa nguyên cụm từ được cộng điểm, lọc theo chunk"""
+        index = LexicalIndex(os.path.join(self.temp_dir, "bm25.db"))
+        index.add_chunk("c1", "tên lớp dùng pascal case ví dụ student manager".split())
+        index.add_chunk("c2", "manager student tên lớp".split())
+        index.add_chunk("c3", "tên biến dùng camel case".split())
+        index.add_chunk("c4", "tên hằng số viết hoa".split())
+        index.commit()
+
+        ranked = index.search("student manager".split(), limit=5)
+        self.assertEqual([chunk_id for chunk_id, _, _, _ in ranked], ["c1", "c2"])
+        self.assertEqual([phrase for _, _, _, phrase in ranked], [True, False])
+        self.assertEqual(ranked[0][2], ["student", "manager"])
+
+        ranked = index.search("tên camel".split(), limit=5)
+        self.assertEqual(ranked[0][0], "c3")
+        self.assertEqual(len(ranked), 4)
+        self.assertEqual(index.search("tên".split(), chunk_ids={"c4"}, limit=5)[0][0], "c4")
+        self.assertEqual(index.search("không có".split()), [])
+
+        # Bỏ qua postings của term phổ biến (MaxScore) cho cùng top-k với chấm điểm toàn bộ
+        rng = random.Random(3)
+        vocab = [f"w{i}" for i in range(80)]
+        weights = [1 / (i + 1) for i in range(80)]
+        for i in range(300):
+            index.add_chunk(f"r{i}", rng.choices(vocab, weights, k=rng.randint(10, 60)))
+        for _ in range(40):
+            query = rng.choices(vocab, weights, k=rng.randint(1, 5))
+            pruned = index.search(query, limit=5)
+            with patch.object(index, "_term_postings",
+                              lambda term, candidates=None: LexicalIndex._term_postings(index, term)):
+                exhaustive = index.search(query, limit=5)
+            self.assertEqual([round(r[1], 9) for r in pruned], [round(r[1], 9) for r in exhaustive])
+        index.commit()
+
+        # Mở lại: index bền vững, thêm lại chunk thay bản cũ, xóa chunk
+        index = LexicalIndex(os.path.join(self.temp_dir, "bm25.db"))
+        index.add_chunk("c2", "nội dung mới".split())
+        index.remove_chunks(["c1"])
+        self.assertEqual(index.search("student manager".split()), [])
+        self.assertEqual(index.get_stats()["chunks"], 303)
+
+    def test_text_matching_follows_ingest_delete_and_reindex(self):
+        """Test text matching chỉ trả chunk của file được chọn (kể cả chunk dùng chung), cập nhật khi xóa / re-index"""
+        shared = "Quy tắc chung: mỗi lớp Java nằm trong một file riêng cùng tên với lớp. " * 3
+        texts = {
+            "a": shared + "Tên lớp dùng PascalCase, ví dụ StudentManager và OrderService.",
+            "b": shared + "Tên biến dùng camelCase, ví dụ studentName và orderTotal."
+        }
+        for file_id, text in texts.items():
+            self.service.save_file_metadata(file_id, {"file_id": file_id, "title": file_id.upper(),
+                                                      "original_filename": f"{file_id}.pdf", "description": "",
+                                                      "upload_time": "2025-01-01T00:00:00"})
+            with open(os.path.join(self.temp_dir, f"{file_id}_text.txt"), 'w', encoding='utf-8') as f:
+                f.write(text)
+            chunks = self.service._split_text_into_chunks(text, 220, 0)
+            self.service.write_chunks_to_vector_db(file_id, file_id.upper(), "", chunks, {})
+
+        hits = self.service._lexical_hits("StudentManager", ["a", "b"], 5)
+        self.assertEqual([hit["metadata"]["file_id"] for hit in hits], ["a"])
+        self.assertEqual(hits[0]["matching_words"], ["studentmanager"])
+        self.assertEqual(self.service._lexical_hits("StudentManager", ["b"], 5), [])
+        # Chunk của "a" trùng với "b" vẫn tìm được khi chỉ chọn "b"
+        hits = self.service._lexical_hits("mỗi lớp Java nằm trong một file riêng", ["b"], 5)
+        self.assertTrue(hits)
+        self.assertEqual(hits[0]["similarity_score"], 1.0)
+
+        success, _, message, _ = self.service.reindex_file("a", chunk_size=120, overlap=0)
+        self.assertTrue(success, message)
+        hits = self.service._lexical_hits("StudentManager OrderService", ["a"], 5)
+        self.assertTrue(hits)
+        self.assertTrue(all(hit["content"] in self.service.collection.get(where={"file_id": "a"})["documents"]
+                            for hit in hits))
+
+        self.service.delete_file("a")
+        self.assertEqual(self.service._lexical_hits("StudentManager", ["a", "b"], 5), [])
+        self.assertTrue(self.service._lexical_hits("mỗi lớp Java", ["b"], 5))
+        self.assertEqual(self.service.lexical_index.get_stats()["chunks"],
+                         len(self.service.collection.get()["ids"]))
+
+    def test_unaccented_query_matches_accented_chunks(self):
+        """Test query không dấu khớp chunk có dấu, khớp đúng dấu được ưu tiên, index cũ được dựng lại"""
+        self.assertEqual(fold_diacritics("Tiêu chuẩn ĐẶT TÊN đường dẫn"), "Tieu chuan DAT TEN duong dan")
+        self.assertEqual(fold_diacritics("camelCase"), "camelCase")
+        path = os.path.join(self.temp_dir, "fold.db")
+        index = LexicalIndex(path)
+        index.add_chunk("accented", "tiêu chuẩn đặt tên lớp".split())
+        index.add_chunk("other_tone", "tiếu chuẩn đặt tên lớp".split())
+        index.add_chunk("plain", "tieu chuan dat ten bien".split())
+        index.add_chunk("english", "naming standard for classes".split())
+        index.commit()
+
+        ranked = index.search("tieu chuan dat ten".split(), limit=5)
+        self.assertEqual({chunk_id for chunk_id, _, _, _ in ranked}, {"accented", "other_tone", "plain"})
+        self.assertEqual(ranked[0][0], "plain")  # Khớp đúng như đã gõ
+        self.assertTrue(all(phrase for _, _, _, phrase in ranked))
+        self.assertEqual(ranked[1][2], ["tieu", "chuan", "dat", "ten"])
+
+        ranked = index.search("tiêu chuẩn".split(), limit=5)
+        self.assertEqual(ranked[0][:3], ("accented", ranked[0][1], ["tiêu", "chuẩn"]))
+        self.assertEqual({chunk_id for chunk_id, _, _, _ in ranked}, {"accented", "other_tone", "plain"})
+        self.assertGreater(ranked[0][1], ranked[1][1])
+        # Chunk khớp cả dạng gốc và dạng bỏ dấu chỉ được tính điểm 1 lần mỗi từ của query
+        exact_only = LexicalIndex(os.path.join(self.temp_dir, "exact.db"), fold_weight=0.0)
+        for chunk_id, words in (("accented", "tiêu chuẩn đặt tên lớp"), ("other_tone", "tiếu chuẩn đặt tên lớp"),
+                                ("plain", "tieu chuan dat ten bien"), ("english", "naming standard for classes")):
+            exact_only.add_chunk(chunk_id, words.split())
+        exact_only.commit()
+        self.assertAlmostEqual(exact_only.search(["tiêu"])[0][1], index.search(["tiêu"])[0][1])
+        stats = index.get_stats()
+        self.assertEqual((stats["terms"], stats["folded_terms"]), (15, 5))
+
+        # Index tạo trước khi có dạng bỏ dấu: xóa để service dựng lại từ ChromaDB
+        index._conn.execute("DELETE FROM lexical_info")
+        index._conn.execute(f"DELETE FROM lexical_postings WHERE term LIKE '{FOLDED_PREFIX}%'")
+        index.commit()
+        self.assertTrue(LexicalIndex(path).is_empty())
+        self.assertFalse(LexicalIndex(os.path.join(self.temp_dir, "exact.db")).is_empty())
+
+    def test_text_matching_without_diacritics(self):
+        """Test text matching với câu hỏi gõ không dấu tìm được chunk tiếng Việt có dấu"""
+        text = ("Tiêu chuẩn đặt tên: tên lớp dùng PascalCase. " * 4 + "Ghi chú: chú thích phải giải thích lý do. " * 4)
+        self.service.save_file_metadata("vi", {"file_id": "vi", "title": "VI", "original_filename": "vi.pdf",
+                                               "description": "", "upload_time": "2025-01-01T00:00:00"})
+        self.service.write_chunks_to_vector_db("vi", "VI", "", self.service._split_text_into_chunks(text, 180, 0), {})
+
+        hits = self.service._lexical_hits("tieu chuan dat ten lop", ["vi"], 5)
+        self.assertTrue(hits)
+        self.assertIn("Tiêu chuẩn đặt tên", hits[0]["content"])
+        self.assertEqual(hits[0]["matching_words"], ["tieu", "chuan", "dat", "ten", "lop"])
+        self.assertEqual(hits[0]["similarity_score"], 1.0)
+        hits = self.service._lexical_hits("chu thich giai thich ly do", ["vi"], 5)
+        self.assertIn("chú thích", hits[0]["content"])
+
+
+class TestTrigramIndex(unittest.TestCase):
+    """Test cases cho tìm từ gần đúng bằng trigram index trên từ vựng"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_similar_terms_and_weighted_expansion(self):
+        """Test gõ thiếu / 1 phần / gõ sai tìm được identifier, từ đã có không mở rộng, từ khớp đúng xếp trên"""
+        path = os.path.join(self.temp_dir, "trigram.db")
+        index = TrigramIndex(path)
+        lexical = LexicalIndex(os.path.join(self.temp_dir, "lexical.db"))
+        chunks = {
+            "npe": "ném nullpointerexception khi đối tượng null",
+            "camel": "tên biến dùng camelcase ví dụ studentname",
+            "pascal": "tên lớp dùng pascalcase như studentmanager",
+            "animal": "camel là con lạc đà"
+        }
+        for chunk_id, text in chunks.items():
+            index.add_terms(text.split())
+            lexical.add_chunk(chunk_id, text.split())
+        index.commit()
+        lexical.commit()
+
+        for query, expected in (("nullpointerexcep", "nullpointerexception"), ("pointerexception", "nullpointerexception"),
+                                ("studnetmanager", "studentmanager"), ("camelcas", "camelcase")):
+            self.assertEqual(index.similar_terms(query)[0][0], expected, query)
+        self.assertEqual(index.similar_terms("pointerexception")[0][1], 1.0)  # Chuỗi con: coverage 1
+        self.assertEqual(index.similar_terms("xyzw"), [])
+        # Từ đã có (kể cả chỉ khác dấu) và từ quá ngắn không được mở rộng
+        expansions = index.expand(["camel", "doi", "tuong", "nul", "camelcas"])
+        self.assertEqual(list(expansions), ["camelcas"])
+        self.assertEqual([term for term, _ in expansions["camelcas"]], ["camelcase", "camel"])
+        self.assertTrue(all(0 < weight < 1 for _, weight in expansions["camelcas"]))
+
+        self.assertEqual(lexical.search(["camelcas"]), [])
+        ranked = lexical.search(["camelcas"], expansions=expansions)
+        self.assertEqual([chunk_id for chunk_id, _, _, _ in ranked], ["camel", "animal"])
+        self.assertEqual(ranked[0][2], ["camelcas"])
+        ranked = lexical.search(["ném", "nullpointerexcep"], expansions=index.expand(["nullpointerexcep"]))
+        self.assertEqual((ranked[0][0], ranked[0][3]), ("npe", True))
+
+        # Mở lại: từ vựng bền vững, từ mới được thêm, clear xóa hết
+        index = TrigramIndex(path)
+        self.assertEqual(index.get_stats()["terms"], 18)
+        index.add_terms(["orderservice", "camelcase"])
+        self.assertEqual(index.get_stats()["terms"], 19)
+        index.clear()
+        self.assertTrue(index.is_empty())
+        self.assertEqual(index.similar_terms("camelcas"), [])
+
+    def test_vocabulary_follows_deleted_chunks(self):
+        """Test từ không còn chunk nào chứa bị bỏ khỏi từ vựng (lại được mở rộng), từ còn ở dạng khác dấu được giữ"""
+        lexical = LexicalIndex(os.path.join(self.temp_dir, "lexical.db"))
+        for chunk_id, text in (("c1", "tiêu chuẩn studentmanager"), ("c2", "tieu chuan"), ("c3", "studentmanagerimpl")):
+            lexical.add_chunk(chunk_id, text.split())
+        lexical.commit()
+        self.assertEqual(lexical.remove_chunks(["c2"]), set())
+        self.assertEqual(lexical.remove_chunks(["c1", "missing"]), {"tieu", "chuan", "studentmanager"})
+
+        for file_id, text in (("a", "Lớp StudentManager quản lý sinh viên. " * 3),
+                              ("b", "Lớp StudentManagerImpl cài đặt giao diện. " * 3)):
+            self.service.save_file_metadata(file_id, {"file_id": file_id, "title": file_id, "description": "",
+                                                      "original_filename": f"{file_id}.pdf",
+                                                      "upload_time": "2025-01-01T00:00:00"})
+            self.service.write_chunks_to_vector_db(file_id, file_id, "", [text], {})
+        self.assertEqual(self.service.trigram_index.expand(["studentmanager"]), {})
+        terms = self.service.trigram_index.get_stats()["terms"]
+
+        self.service.delete_from_vector_db("a")
+
+        self.assertEqual(self.service.trigram_index.get_stats()["terms"], terms - 4)  # studentmanager quản sinh viên
+        self.assertIn("lop", self.service.trigram_index._terms)
+        hits = self.service._lexical_hits("StudentManager", ["b"], 5)
+        self.assertEqual([hit["metadata"]["file_id"] for hit in hits], ["b"])
+
+    def test_text_matching_finds_partial_identifiers(self):
+        """Test text matching tìm identifier gõ thiếu / gõ sai, trigram index theo ingest / backfill / clear"""
+        text = ("Ngoại lệ NullPointerException xảy ra khi gọi phương thức trên đối tượng null. " * 3
+                + "Tên lớp dùng PascalCase, ví dụ StudentManager và OrderService. " * 3)
+        self.service.save_file_metadata("java", {"file_id": "java", "title": "Java", "original_filename": "java.pdf",
+                                                 "description": "", "upload_time": "2025-01-01T00:00:00"})
+        self.service.write_chunks_to_vector_db("java", "Java", "", self.service._split_text_into_chunks(text, 200, 0), {})
+
+        for query, expected in (("NullPointerExcep", "NullPointerException"), ("StudnetManager", "StudentManager"),
+                                ("OrderServ", "OrderService")):
+            hits = self.service._lexical_hits(query, ["java"], 5)
+            self.assertTrue(hits, query)
+            self.assertIn(expected, hits[0]["content"])
+            self.assertEqual(hits[0]["matching_words"], [normalize_text(query)])
+        self.assertEqual(self.service._lexical_hits("NullPointerExcep", ["other"], 5), [])
+
+        # Index trigram rỗng (knowledge base có từ trước) được dựng lại từ ChromaDB
+        terms = self.service.trigram_index.get_stats()["terms"]
+        self.service.trigram_index.clear()
+        self.service._backfill_chunk_indexes()
+        self.assertEqual(self.service.trigram_index.get_stats()["terms"], terms)
+
+        success, _, message = self.service.clear_all_chunks()
+        self.assertTrue(success, message)
+        self.assertTrue(self.service.trigram_index.is_empty())
+
+
+class TestHybridRetrieval(unittest.TestCase):
+    """Test cases cho hybrid retrieval: vector search và BM25 song song, gộp bằng rank fusion"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+
+    def tearDown(self):
+        self.service.hybrid_retriever.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_rank_fusion_and_time_budget(self):
+        """Test RRF ưu tiên item có mặt ở nhiều ranking; signal chậm bị bỏ qua, signal lỗi được báo"""
+        fused = reciprocal_rank_fusion({"vector": ["x", "y", "z"], "bm25": ["y", "w"]}, k=60)
+        self.assertEqual([item_id for item_id, _, _ in fused], ["y", "x", "w", "z"])
+        self.assertEqual(fused[0][2], {"vector": 2, "bm25": 1})
+        self.assertAlmostEqual(fused[0][1], 1 / 62 + 1 / 61)
+        weighted = reciprocal_rank_fusion({"vector": ["x", "y"], "bm25": ["y"]}, k=1, weights={"bm25": 0.1})
+        self.assertEqual(weighted[0][0], "x")
+
+        release = threading.Event()
+        retriever = HybridRetriever(time_budget=0.2)
+        try:
+            def slow():
+                release.wait(5)
+                return {"slow": [{"id": "late"}]}
+
+            def broken():
+                raise RuntimeError("index unavailable")
+
+            results, info = retriever.retrieve({
+                "fast": lambda: {"fast_a": [{"id": "x"}, {"id": "y"}], "fast_b": [{"id": "y", "extra": 1}]},
+                "slow": slow,
+                "broken": broken
+            }, limit=5)
+            self.assertEqual([hits for hits, _, _ in results][0], {"fast_a": {"id": "y"}, "fast_b": {"id": "y", "extra": 1}})
+            self.assertEqual(info["rankings"], {"fast_a": 2, "fast_b": 1})
+            self.assertEqual(info["timed_out"], ["slow"])
+            self.assertIn("index unavailable", info["errors"]["broken"])
+            release.set()
+
+            # Hết thời gian mà chưa signal nào xong: vẫn chờ signal đầu tiên
+            results, info = retriever.retrieve({"slow": lambda: time.sleep(0.4) or {"slow": [{"id": "a"}]}}, limit=5)
+            self.assertEqual(info["rankings"], {"slow": 1})
+            self.assertEqual(info["timed_out"], [])
+        finally:
+            release.set()
+            retriever.shutdown()
+
+    def test_hybrid_search_merges_vector_and_lexical_signals(self):
+        """Test hybrid_search gộp kết quả vector + BM25, báo signal đóng góp, vẫn trả kết quả khi 1 signal lỗi"""
+        texts = {
+            "a": "Tên lớp dùng PascalCase, ví dụ StudentManager và OrderService. " * 2,
+            "b": "Tên biến dùng camelCase, ví dụ studentName và orderTotal. " * 2,
+            "c": "StudentManager của file không được chọn. " * 2
+        }
+        for file_id, text in texts.items():
+            chunks = self.service._split_text_into_chunks(text, 120, 0)
+            self.service.write_chunks_to_vector_db(file_id, file_id.upper(), "", chunks, {})
+
+        success, results, info, message = self.service.hybrid_search("StudentManager", ["a", "b"], 3)
+        self.assertTrue(success, message)
+        self.assertEqual(results[0]["source"]["file_id"], "a")
+        self.assertIn("bm25", results[0]["source"]["signals"])
+        self.assertEqual(results[0]["source"]["matching_words"], ["studentmanager"])
+        self.assertTrue(all(r["source"]["search_method"] == "hybrid" for r in results))
+        self.assertTrue(all(r["source"]["file_id"] in ("a", "b") for r in results))
+        self.assertEqual(set(info["rankings"]), {"vector", "bm25"})
+        self.assertEqual(info["contributed"]["bm25"], 1)
+        self.assertGreaterEqual(info["contributed"]["vector"], 1)
+
+        # Query có từ khóa khác query gốc: embed cả 2 trong 1 lần query ChromaDB
+        with patch.object(self.service.collection, "query", wraps=self.service.collection.query) as query:
+            _, _, info, _ = self.service.hybrid_search("Tên lớp là gì?", ["a", "b"], 3)
+        self.assertEqual(query.call_count, 1)
+        self.assertEqual(len(query.call_args.kwargs["query_embeddings"]), 2)
+        self.assertIn("vector_keywords", info["rankings"])
+
+        self.service.search_cache.results.clear()  # Không dùng kết quả đã cache của lần tìm đầu
+        with patch.object(self.service.lexical_index, "search", side_effect=RuntimeError("index locked")):
+            success, results, message = self.service.search_in_multiple_files("StudentManager", ["a", "b"], 3)
+        self.assertTrue(success, message)
+        self.assertTrue(results)
+        self.assertTrue(all("bm25" not in r["source"]["signals"] for r in results))
+
+
+class TestQueryCache(unittest.TestCase):
+    """Test cases cho cache embedding câu hỏi và cache kết quả tìm kiếm"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+
+    def tearDown(self):
+        self.service.hybrid_retriever.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_lru_bounds_and_shared_store(self):
+        """Test LRU giới hạn số mục; 2 worker dùng chung SQLite thấy embedding và generation của nhau"""
+        cache = QueryCache("test", max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)  # "a" mới dùng -> "b" bị đẩy ra
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        stats = cache.get_stats()
+        self.assertEqual((stats["entries"], stats["hits"], stats["misses"], stats["evictions"]), (2, 1, 1, 1))
+        self.assertIsNone(QueryCache("off", max_entries=0).get("a"))
+
+        shared_path = os.path.join(self.temp_dir, "query_cache.db")
+        worker_a = SearchCache(shared_path=shared_path)
+        worker_b = SearchCache(shared_path=shared_path)
+        worker_a.put_embedding("model", "Tên lớp là gì?", [0.5, 0.25])
+        self.assertEqual(worker_b.get_embedding("model", "tên LỚP là gì"), [0.5, 0.25])
+        self.assertIsNone(worker_b.get_embedding("other-model", "tên lớp là gì"))
+        self.assertEqual(worker_b.get_stats()["embeddings"]["shared_hits"], 1)
+
+        _, generation = worker_b.get_results("hybrid", "camelCase", ["f1", "f2"], 5)
+        worker_b.put_results("hybrid", "camelCase", ["f1", "f2"], 5, generation, {"results": [1]})
+        self.assertEqual(worker_a.get_results("hybrid", "camelcase", ["f2", "f1"], 5)[0], {"results": [1]})
+        self.assertIsNone(worker_a.get_results("hybrid", "camelcase", ["f1"], 5)[0])
+        worker_a.bump_generation()
+        self.assertEqual(worker_b.generation, generation + 1)
+        self.assertIsNone(worker_b.get_results("hybrid", "camelCase", ["f1", "f2"], 5)[0])
+
+        store = SharedQueryStore(shared_path)
+        for index in range(30):
+            store.put("bounded", f"k{index}", index, max_entries=20)
+        self.assertLessEqual(store.count("bounded"), 20)
+
+    def test_search_results_invalidated_when_chunks_change(self):
+        """Test câu hỏi lặp lại dùng cache (embedding theo dạng chuẩn hóa), upload/xóa/clear làm cache hết hiệu lực"""
+        texts = {
+            "a": "Tên lớp dùng PascalCase, ví dụ StudentManager và OrderService. " * 2,
+            "b": "Tên biến dùng camelCase, ví dụ studentName và orderTotal. " * 2
+        }
+        for file_id, text in texts.items():
+            self.service.save_file_metadata(file_id, {"file_id": file_id, "title": file_id.upper(),
+                                                      "original_filename": f"{file_id}.pdf", "description": "",
+                                                      "upload_time": "2025-01-01T00:00:00"})
+            chunks = self.service._split_text_into_chunks(text, 120, 0)
+            self.service.write_chunks_to_vector_db(file_id, file_id.upper(), "", chunks, {})
+
+        embedded = lambda: self.service.embedder.get_stats()["queries"]["texts"]
+        success, first, info, _ = self.service.hybrid_search("StudentManager", ["a", "b"], 3)
+        self.assertTrue(success)
+        self.assertNotIn("cached", info)
+        queries_embedded = embedded()
+        with patch.object(self.service.collection, "query", wraps=self.service.collection.query) as query:
+            _, cached, info, _ = self.service.hybrid_search("  studentmanager! ", ["b", "a"], 3)
+            self.assertTrue(info["cached"])
+            self.assertEqual(cached, first)
+            cached[0]["content"] = "changed by caller"
+            self.assertEqual(self.service.hybrid_search("StudentManager", ["a", "b"], 3)[1], first)
+            self.assertEqual(query.call_count, 0)
+
+            # Kết quả khác (số kết quả khác) nhưng embedding câu hỏi được dùng lại
+            self.service.hybrid_search("StudentManager.", ["a", "b"], 2)
+            self.assertEqual(query.call_count, 1)
+        self.assertEqual(embedded(), queries_embedded)
+
+        success, kb_results, _ = self.service.search_knowledge_base("StudentManager", 5)
+        self.assertTrue(success)
+        self.assertEqual(self.service.search_knowledge_base("studentmanager", 5)[1], kb_results)
+
+        # Upload: kết quả mới gồm cả file vừa thêm
+        self.service.write_chunks_to_vector_db("c", "C", "", ["StudentManager quản lý danh sách sinh viên."], {})
+        _, results, info, _ = self.service.hybrid_search("StudentManager", ["a", "b", "c"], 3)
+        self.assertNotIn("cached", info)
+        self.assertIn("c", [r["source"]["file_id"] for r in results])
+        self.assertEqual(len(self.service.search_knowledge_base("StudentManager", 5)[1]), len(kb_results) + 1)
+
+        # Xóa file và clear: không trả lại kết quả cũ
+        self.service.hybrid_search("StudentManager", ["a", "b"], 3)
+        self.service.delete_file("a")
+        _, results, info, _ = self.service.hybrid_search("StudentManager", ["a", "b"], 3)
+        self.assertNotIn("cached", info)
+        self.assertNotIn("a", [r["source"]["file_id"] for r in results])
+        self.service.clear_all_chunks()
+        self.assertEqual(self.service.search_knowledge_base("StudentManager", 5)[1], [])
+        stats = self.service.search_cache.get_stats()
+        self.assertGreater(stats["results"]["hits"], 0)
+        self.assertGreater(stats["generation"], 0)
+
+
+class TestHnswConfig(unittest.TestCase):
+    """Test cases cho tham số HNSW và dựng lại vector index"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+
+    def tearDown(self):
+        self.service.hybrid_retriever.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_rebuild_rename_failure_keeps_rebuilt_collection(self):
+        """Test đổi tên collection mới lỗi: không xóa chunks, lần dựng sau / khởi động lại lấy lại tên chính"""
+        service = self.service
+        service.chroma_client = chromadb.PersistentClient(path=os.path.join(self.temp_dir, "chroma"))
+        service.collection = service.chroma_client.get_or_create_collection(
+            "knowledge_base", metadata=collection_metadata(DEFAULT_HNSW_CONFIG))
+        text = "Tên lớp dùng PascalCase, ví dụ StudentManager. Tên biến dùng camelCase. " * 10
+        service.write_chunks_to_vector_db("a", "A", "", service._split_text_into_chunks(text, 100, 0), {})
+        chunks = service.collection.count()
+
+        with patch.object(type(service.collection), "modify", side_effect=RuntimeError("rename failed")):
+            success, _, message, _ = service.rebuild_vector_index(M=8)
+        self.assertTrue(success, message)
+        self.assertEqual(service.collection.name, REBUILD_COLLECTION_NAME)
+        self.assertEqual(service.collection.count(), chunks)
+        self.assertTrue(service.hybrid_search("StudentManager", ["a"], 3)[1])
+
+        # Dựng lại từ collection mang tên rebuild chép sang tên chính
+        success, _, message, _ = service.rebuild_vector_index(M=16)
+        self.assertTrue(success, message)
+        self.assertEqual([c.name for c in service.chroma_client.list_collections()], ["knowledge_base"])
+        self.assertEqual(service.collection.count(), chunks)
+
+        # Khởi động lại sau lần dựng dở: collection rebuild được đổi tên thay vì tạo knowledge base rỗng
+        service.collection.modify(name=REBUILD_COLLECTION_NAME)
+        service._restore_rebuilt_collection()
+        self.assertEqual(service.chroma_client.get_collection("knowledge_base").count(), chunks)
+
+    def test_config_from_env_and_collection_metadata(self):
+        """Test đọc KB_HNSW_*, kiểm tra tham số, chuyển qua lại metadata collection"""
+        with patch.dict(os.environ, {"KB_HNSW_SPACE": "cosine", "KB_HNSW_M": "32", "KB_HNSW_SEARCH_EF": "64"}):
+            config = hnsw_config_from_env()
+        self.assertEqual(config, HnswConfig("cosine", 32, 100, 64))
+        with patch.dict(os.environ, {"KB_HNSW_SPACE": "dot"}):
+            self.assertRaises(ValueError, hnsw_config_from_env)
+
+        self.assertEqual(merge_hnsw_config(config, {"search_ef": 128})[0], config._replace(search_ef=128))
+        for values in ({"M": 1}, {"search_ef": "10"}, {"construction_ef": True}, {"ef": 10}):
+            merged, error = merge_hnsw_config(config, values)
+            self.assertIsNone(merged)
+            self.assertTrue(error)
+
+        client = chromadb.PersistentClient(path=os.path.join(self.temp_dir, "chroma"))
+        collection = client.get_or_create_collection("knowledge_base",
+                                                     metadata=collection_metadata(config, description="KB"))
+        self.assertEqual(config_of_collection(collection), config)
+        self.assertEqual(collection.metadata["description"], "KB")
+        # Collection tạo trước đây (không kèm tham số) dùng mặc định của ChromaDB
+        self.assertEqual(config_of_collection(client.get_or_create_collection("legacy_kb")), DEFAULT_HNSW_CONFIG)
+
+    def test_rebuild_keeps_chunks_and_switches_parameters(self):
+        """Test dựng lại trên ChromaDB thật: giữ chunks + embedding, đổi tham số, ghi chunks chờ tới khi xong"""
+        service = self.service
+        service.chroma_client = chromadb.PersistentClient(path=os.path.join(self.temp_dir, "chroma"))
+        service.collection = service.chroma_client.get_or_create_collection(
+            "knowledge_base", metadata=collection_metadata(DEFAULT_HNSW_CONFIG, description="KB"))
+        service.max_batch_size = 3  # Chép nhiều trang
+        text = "Tên lớp dùng PascalCase, ví dụ StudentManager. Tên biến dùng camelCase. " * 10
+        service.write_chunks_to_vector_db("a", "A", "", service._split_text_into_chunks(text, 100, 0), {})
+        before = service.collection.get(include=["documents", "metadatas", "embeddings"])
+
+        success, info, message, status = service.rebuild_vector_index(space="cosine", M=8, search_ef=32)
+        self.assertTrue(success, message)
+        self.assertEqual(info["active"], {"space": "cosine", "M": 8, "construction_ef": 100, "search_ef": 32})
+        self.assertEqual(info["chunks"], len(before["ids"]))
+        self.assertEqual(service.collection.name, "knowledge_base")
+        self.assertEqual(service.collection.metadata["description"], "KB")
+        self.assertEqual(service.get_index_config()[1]["active"], info["active"])
+        self.assertEqual([c.name for c in service.chroma_client.list_collections()], ["knowledge_base"])
+        after = service.collection.get(ids=before["ids"], include=["documents", "metadatas", "embeddings"])
+        self.assertEqual(after["documents"], before["documents"])
+        self.assertEqual([list(e) for e in after["embeddings"]], [list(e) for e in before["embeddings"]])
+        self.assertTrue(service.hybrid_search("StudentManager", ["a"], 3)[1])
+
+        self.assertEqual(service.rebuild_vector_index(space="dot")[3], 400)
+        # Đang xóa chunks (không qua ingest): không dựng lại, xóa không bị swap ghi đè
+        statuses = []
+        remove_file = service.chunk_dedup.remove_file
+        
+        def remove_and_rebuild(file_id):
+            statuses.append(service.rebuild_vector_index(M=16)[3])
+            return remove_file(file_id)
+        
+        with patch.object(service.chunk_dedup, "remove_file", side_effect=remove_and_rebuild):
+            service.delete_from_vector_db("missing")
+        self.assertEqual(statuses, [409])
+        self.assertTrue(service._index_ready.is_set())
+
+        # Đang dựng lại: ghi chunks chờ tới khi swap xong
+        service._index_ready.clear()
+        writer = threading.Thread(target=service.write_chunks_to_vector_db,
+                                  args=("b", "B", "", ["Nội dung file B về hằng số."], {}))
+        writer.start()
+        writer.join(0.2)
+        self.assertTrue(writer.is_alive())
+        service._index_ready.set()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(service.collection.count(), len(before["ids"]) + 1)
+
+
+def topic_embed(texts):
+    """Embedding giả: số lần xuất hiện của từng chủ đề (java, python, sql) cộng 1 thành phần nhỏ"""
+    return [[text.lower().count(topic) + 0.1 for topic in ("java", "python", "sql")] for text in texts]
+
+
+class TestTwoStageRetrieval(unittest.TestCase):
+    """Test cases cho document index (centroid từng file) và tìm kiếm 2 bước"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = make_service(self.temp_dir)
+        self.service.embedder = EmbeddingProvider(topic_embed, "topic")
+
+    def tearDown(self):
+        self.service.hybrid_retriever.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_document_index_ranks_and_persists_centroids(self):
+        """Test centroid = trung bình chunk (chunk lặp lại chỉ tính 1 lần), xếp hạng, đổi tên / xóa, mở lại"""
+        db_path = os.path.join(self.temp_dir, "documents.db")
+        index = DocumentIndex(db_path)
+        java, sql = CentroidAccumulator(), CentroidAccumulator()
+        java.add(["j1", "j2", "j1"], [[1.0, 0.0], [0.8, 0.2], [1.0, 0.0]])
+        sql.add(["s1"], [[0.0, 3.0]])
+        self.assertEqual(java.count, 2)
+        index.set_file("java", java)
+        index.set_file("sql", sql)
+
+        self.assertEqual([file_id for file_id, _ in index.top_files([1.0, 0.1], 2)], ["java", "sql"])
+        self.assertEqual([file_id for file_id, _ in index.top_files([0.1, 1.0], 1)], ["sql"])
+        self.assertAlmostEqual(index.top_files([0.0, 2.0], 1)[0][1], 1.0, places=5)
+        self.assertEqual(index.top_files([1.0, 0.0, 0.0], 2), [])  # Embedding model khác số chiều
+        # Bước 2: khoảng cách chính xác tới chunk của các file được chọn, giống ChromaDB
+        self.assertEqual([chunk_id for chunk_id, _ in index.search_chunks(["java", "sql"], [1.0, 0.0], 2)],
+                         ["j1", "j2"])
+        self.assertAlmostEqual(index.search_chunks(["java"], [0.8, 0.2], 1, space="l2")[0][1], 0.0, places=5)
+        self.assertAlmostEqual(index.search_chunks(["sql"], [0.0, 1.0], 1, space="cosine")[0][1], 0.0, places=5)
+
+        index.rename_file("java", "java2")
+        index.remove_file("sql")
+        reopened = DocumentIndex(db_path)
+        self.assertEqual((reopened.file_count(), reopened.chunk_count()), (1, 2))
+        self.assertEqual(reopened.top_files([1.0, 0.0], 5)[0][0], "java2")
+
+    def test_two_stage_search_follows_ingest_delete_and_reindex(self):
+        """Test tìm 2 bước chỉ tìm chunk trong file gần nhất, tìm lại toàn bộ khi thiếu kết quả, centroid luôn cập nhật"""
+        service = self.service
+        texts = {
+            "java": "Java class naming. Java interface naming. ",
+            "python": "Python module naming. Python function naming. ",
+            "sql": "SQL table naming. SQL index naming. "
+        }
+        for file_id, text in texts.items():
+            with open(os.path.join(self.temp_dir, f"{file_id}_text.txt"), "w", encoding="utf-8") as f:
+                f.write(text)
+            service.save_file_metadata(file_id, {"file_id": file_id, "title": file_id})
+            service.write_chunks_to_vector_db(file_id, file_id, "", service._split_text_into_chunks(text, 25, 0), {})
+        # File chỉ gồm chunk dùng chung với file khác vẫn có centroid
+        service.write_chunks_to_vector_db("copy", "copy", "", ["Java class naming."], {})
+        self.assertEqual((service.document_index.file_count(), service.document_index.chunk_count()), (4, 7))
+
+        flat_results = service.search_knowledge_base("python naming", 2)[1]
+        service.two_stage_top_files, service.two_stage_min_chunks = 1, 0
+        service.search_cache.results.clear()
+        with patch.object(service.collection, "query", wraps=service.collection.query) as query:
+            success, results, _ = service.search_knowledge_base("python naming", 2)
+        self.assertTrue(success)
+        self.assertEqual([r["source"]["file_id"] for r in results], ["python", "python"])
+        self.assertEqual(query.call_count, 0)  # Không query HNSW trên toàn bộ chunks
+        self.assertEqual([(r["content"], r["similarity_score"]) for r in results],
+                         [(r["content"], r["similarity_score"]) for r in flat_results])
+
+        # File được chọn không đủ kết quả: tìm lại trên toàn bộ chunks
+        success, results, _ = service.search_knowledge_base("python naming", 4)
+        self.assertEqual(len(results), 4)
+        self.assertGreater(len({r["source"]["file_id"] for r in results}), 1)
+
+        # Xóa / re-index cập nhật centroid (và kết quả đã cache không còn dùng)
+        service.delete_from_vector_db("python")
+        self.assertEqual(service.document_index.file_count(), 3)
+        self.assertNotEqual(service.search_knowledge_base("python naming", 2)[1][0]["source"]["file_id"], "python")
+        success, _, message, _ = service.reindex_file("sql", chunk_size=1000, overlap=0)
+        self.assertTrue(success, message)
+        self.assertEqual(service.document_index.chunk_count(), 4)
+        self.assertEqual(service.search_knowledge_base("sql naming", 1)[1][0]["source"]["file_id"], "sql")
+
+
+def overlap_score(pairs):
+    """Cross-encoder giả: số từ của câu hỏi có trong chunk"""
+    return [len(set(query.lower().split()) & set(content.lower().split())) for query, content in pairs]
+
+
+class TestReranker(unittest.TestCase):
+    """Test cases cho rerank bằng cross-encoder trước khi đưa kết quả vào prompt"""
+
+    def setUp(self):
+        self.results = [
+            {"content": f"chunk {i} về chủ đề khác", "similarity_score": 0.9 - i / 100,
+             "source": {"filename": "quy_uoc.pdf"}} for i in range(8)
+        ]
+        self.results[5]["content"] = "tên lớp dùng PascalCase"
+        self.results[7]["content"] = "tên biến dùng camelCase"
+
+    def test_rerank_in_one_batch_within_budget(self):
+        """Test chấm điểm top-K trong 1 lần gọi, giữ top_n, bớt ứng viên / bỏ qua khi hết thời gian"""
+        score_fn = Mock(side_effect=overlap_score)
+        reranker = Reranker(score_fn, "fake", candidates=6, time_budget=10)
+        results, info = reranker.rerank("tên lớp là gì", self.results, 2)
+        self.assertEqual(score_fn.call_count, 1)
+        self.assertEqual(len(score_fn.call_args.args[0]), 6)  # Chỉ top-K, chunk thứ 8 không được chấm
+        self.assertEqual(results[0]["content"], "tên lớp dùng PascalCase")
+        self.assertEqual(results[0]["rerank_score"], 2)
+        self.assertEqual(results[0]["similarity_score"], self.results[5]["similarity_score"])
+        self.assertEqual(len(results), 2)
+        self.assertTrue(info["applied"])
+        self.assertEqual(info["candidates"], 6)
+
+        # Ước lượng 1 giây mỗi cặp: còn 4.5 giây -> chấm 4 ứng viên, chunk đúng (thứ 6) bị bớt
+        reranker._pair_seconds = 1.0
+        results, info = reranker.rerank("tên lớp là gì", self.results, 2, started_at=time.perf_counter() - 5.5)
+        self.assertEqual(info["candidates"], 4)
+        self.assertEqual(len(score_fn.call_args.args[0]), 4)
+
+        # Thời gian còn lại chỉ đủ cho top_n ứng viên -> giữ thứ tự retrieval
+        reranker._pair_seconds = 1.0
+        results, info = reranker.rerank("tên lớp là gì", self.results, 2, started_at=time.perf_counter() - 8.5)
+        self.assertFalse(info["applied"])
+        self.assertEqual(info["skipped"], "budget_exhausted")
+        self.assertEqual(results, self.results[:2])
+
+        failing = Reranker(Mock(side_effect=RuntimeError("model crashed")), "broken")
+        results, info = failing.rerank("tên lớp", self.results, 3)
+        self.assertEqual((results, info["skipped"]), (self.results[:3], "error"))
+        stats = reranker.get_stats()
+        self.assertEqual((stats["reranked"], stats["skipped"]), (2, {"budget_exhausted": 1}))
+        self.assertIsNone(create_reranker(model=""))
+
+    def test_chat_passes_reranked_top_results_to_prompt(self):
+        """Test chat lấy K ứng viên, chỉ max_results chunk đã rerank vào prompt, search_info có rerank"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, True)
+        service = make_service(temp_dir)
+        self.addCleanup(service.hybrid_retriever.shutdown)
+        service.reranker = Reranker(overlap_score, "fake", candidates=8, time_budget=10)
+        app = Flask(__name__)
+        app.register_blueprint(knowledge_base_api.knowledge_base_bp, url_prefix='/api')
+        ai_service = Mock()
+        ai_service.chat_with_ai.return_value = {"success": True, "response": "Dùng PascalCase."}
+
+        with patch.object(knowledge_base_api, "_knowledge_base_service", service), \
+                patch.object(knowledge_base_api, "_cancellation_registry", CancellationRegistry()), \
+                patch.object(service, "search_knowledge_base", return_value=(True, self.results, None)) as search, \
+                patch("services.ai_service.AIService", return_value=ai_service):
+            response = app.test_client().post('/api/knowledge-base/chat',
+                                              json={"message": "tên lớp là gì", "max_results": 1})
+
+        body = response.get_json()
+        self.assertEqual(response.status_code, 200, body)
+        self.assertEqual(search.call_args.kwargs["max_results"], 8)
+        self.assertEqual([source["content"] for source in body["sources"]], ["tên lớp dùng PascalCase"])
+        self.assertTrue(body["search_info"]["rerank"]["applied"])
+        prompt = ai_service.chat_with_ai.call_args.kwargs["message"]
+        self.assertIn("tên lớp dùng PascalCase", prompt)
+        self.assertNotIn("chunk 0", prompt)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
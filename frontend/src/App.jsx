@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import { Prism as SyntaxHighlighter } from 'react-syntax-highlighter';
 import { tomorrow } from 'react-syntax-highlighter/dist/esm/styles/prism';
@@ -9,6 +9,7 @@ import KnowledgeBasePage from './pages/KnowledgeBasePage';
 import './App.css';
 
 const API_BASE_URL = 'http://localhost:8888/api';
+const PREFETCH_DEBOUNCE_MS = 1500;
 
 function App() {
   const [code, setCode] = useState('');
@@ -28,6 +29,9 @@ function App() {
     }
     return 'home';
   }); // Add page state
+  // Editor session ID cho prefetch - Mỗi tab editor có một ID riêng
+  const editorSessionId = useRef(`editor-${Math.random().toString(36).slice(2)}`);
+  const prefetchController = useRef(null);
 
   useEffect(() => {
     // Fetch supported languages - Lấy danh sách ngôn ngữ được hỗ trợ
@@ -45,6 +49,29 @@ function App() {
     fetchLanguages();
   }, []);
 
+  // Prefetch quick action khi user ngừng gõ - Kết quả được cache ở backend để click trả về gần như ngay lập tức
+  useEffect(() => {
+    if (!code.trim()) return;
+
+    const timer = setTimeout(() => {
+      // Hủy request prefetch cũ khi code thay đổi
+      if (prefetchController.current) {
+        prefetchController.current.abort();
+      }
+      prefetchController.current = new AbortController();
+
+      axios.post(`${API_BASE_URL}/chat/prefetch`, {
+        session_id: editorSessionId.current,
+        code: code,
+        language: language
+      }, { signal: prefetchController.current.signal }).catch(() => {
+        // Prefetch là best-effort, bỏ qua lỗi
+      });
+    }, PREFETCH_DEBOUNCE_MS);
+
+    return () => clearTimeout(timer);
+  }, [code, language]);
+
   const handleLanguageChange = (newLanguage) => {
     setLanguage(newLanguage);
     setCommentedCode('');
@@ -83,7 +83,8 @@ const ChatAssistant = ({ isVisible, onToggle, currentCode, currentLanguage, onCh
       const response = await axios.post(`${API_BASE_URL}/chat`, {
         message: finalMessage, // Send message with context to API - Gửi tin nhắn với context đến API
         history: messages.slice(-10), // Last 10 messages for context - 10 tin nhắn cuối để làm context
-        is_quick_action: isQuickAction // Add flag so backend knows this is quick action - Thêm flag để backend biết đây là quick action
+        is_quick_action: isQuickAction, // Add flag so backend knows this is quick action - Thêm flag để backend biết đây là quick action
+        include_segments: !isQuickAction // Backend splits text/code blocks once - Backend tách sẵn text/code blocks
       });
 
       if (response.data.success) {
@@ -97,6 +98,7 @@ const ChatAssistant = ({ isVisible, onToggle, currentCode, currentLanguage, onCh
           const botMessage = {
             type: 'bot',
             content: response.data.response,
+            segments: response.data.segments,
             timestamp: new Date()
           };
           setMessages(prev => [...prev, botMessage]);
@@ -172,7 +174,7 @@ const ChatAssistant = ({ isVisible, onToggle, currentCode, currentLanguage, onCh
             </div>
           ) : (
             <div className="message-text">
-              {renderMessageContent(message.content)}
+              {renderMessageContent(message.content, message.segments)}
             </div>
           )}
           <div className="message-time">
@@ -186,9 +188,9 @@ const ChatAssistant = ({ isVisible, onToggle, currentCode, currentLanguage, onCh
     );
   };
 
-  const renderMessageContent = (content) => {
-    // Parse content để tách text và code blocks
-    const parts = parseMessageContent(content);
+  const renderMessageContent = (content, segments) => {
+    // Dùng segments backend đã tách sẵn, chỉ parse lại khi không có (tin nhắn user, response cũ)
+    const parts = segments || parseMessageContent(content);
     
     return (
       <div className="message-parts">
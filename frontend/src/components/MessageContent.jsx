@@ -4,68 +4,90 @@ import remarkGfm from 'remark-gfm';
 import rehypeHighlight from 'rehype-highlight';
 import './MessageContent.css';
 
-const MessageContent = ({ content, type }) => {
+const markdownComponents = {
+  // Custom components for better styling
+  p: ({ children }) => <p className="markdown-paragraph">{children}</p>,
+  h1: ({ children }) => <h1 className="markdown-h1">{children}</h1>,
+  h2: ({ children }) => <h2 className="markdown-h2">{children}</h2>,
+  h3: ({ children }) => <h3 className="markdown-h3">{children}</h3>,
+  h4: ({ children }) => <h4 className="markdown-h4">{children}</h4>,
+  h5: ({ children }) => <h5 className="markdown-h5">{children}</h5>,
+  h6: ({ children }) => <h6 className="markdown-h6">{children}</h6>,
+  ul: ({ children }) => <ul className="markdown-ul">{children}</ul>,
+  ol: ({ children }) => <ol className="markdown-ol">{children}</ol>,
+  li: ({ children }) => <li className="markdown-li">{children}</li>,
+  blockquote: ({ children }) => <blockquote className="markdown-blockquote">{children}</blockquote>,
+  code: ({ inline, className, children, ...props }) => {
+    const match = /language-(\w+)/.exec(className || '');
+    return !inline && match ? (
+      <div className="code-block-wrapper">
+        <div className="code-block-header">
+          <span className="code-language">{match[1]}</span>
+          <button 
+            className="copy-button"
+            onClick={() => navigator.clipboard.writeText(String(children).replace(/\n$/, ''))}
+          >
+            📋 Copy
+          </button>
+        </div>
+        <pre className="code-block">
+          <code className={className} {...props}>
+            {children}
+          </code>
+        </pre>
+      </div>
+    ) : (
+      <code className="inline-code" {...props}>
+        {children}
+      </code>
+    );
+  },
+  table: ({ children }) => (
+    <div className="table-wrapper">
+      <table className="markdown-table">{children}</table>
+    </div>
+  ),
+  th: ({ children }) => <th className="markdown-th">{children}</th>,
+  td: ({ children }) => <td className="markdown-td">{children}</td>,
+  a: ({ children, href }) => (
+    <a className="markdown-link" href={href} target="_blank" rel="noopener noreferrer">
+      {children}
+    </a>
+  ),
+  strong: ({ children }) => <strong className="markdown-strong">{children}</strong>,
+  em: ({ children }) => <em className="markdown-em">{children}</em>,
+};
+
+const renderMarkdown = (markdown) => (
+  <ReactMarkdown
+    remarkPlugins={[remarkGfm]}
+    rehypePlugins={[rehypeHighlight]}
+    components={markdownComponents}
+  >
+    {markdown}
+  </ReactMarkdown>
+);
+
+// segments: text/code blocks do backend tách sẵn (include_segments) - code block lớn
+// được render trực tiếp, không cần markdown parser quét lại mỗi lần render
+const MessageContent = ({ content, segments, type }) => {
   return (
     <div className={`message-content-wrapper ${type}`}>
-      <ReactMarkdown
-        remarkPlugins={[remarkGfm]}
-        rehypePlugins={[rehypeHighlight]}
-        components={{
-          // Custom components for better styling
-          p: ({ children }) => <p className="markdown-paragraph">{children}</p>,
-          h1: ({ children }) => <h1 className="markdown-h1">{children}</h1>,
-          h2: ({ children }) => <h2 className="markdown-h2">{children}</h2>,
-          h3: ({ children }) => <h3 className="markdown-h3">{children}</h3>,
-          h4: ({ children }) => <h4 className="markdown-h4">{children}</h4>,
-          h5: ({ children }) => <h5 className="markdown-h5">{children}</h5>,
-          h6: ({ children }) => <h6 className="markdown-h6">{children}</h6>,
-          ul: ({ children }) => <ul className="markdown-ul">{children}</ul>,
-          ol: ({ children }) => <ol className="markdown-ol">{children}</ol>,
-          li: ({ children }) => <li className="markdown-li">{children}</li>,
-          blockquote: ({ children }) => <blockquote className="markdown-blockquote">{children}</blockquote>,
-          code: ({ inline, className, children, ...props }) => {
-            const match = /language-(\w+)/.exec(className || '');
-            return !inline && match ? (
-              <div className="code-block-wrapper">
-                <div className="code-block-header">
-                  <span className="code-language">{match[1]}</span>
-                  <button 
-                    className="copy-button"
-                    onClick={() => navigator.clipboard.writeText(String(children).replace(/\n$/, ''))}
-                  >
-                    📋 Copy
-                  </button>
-                </div>
-                <pre className="code-block">
-                  <code className={className} {...props}>
-                    {children}
-                  </code>
-                </pre>
-              </div>
+      {segments
+        ? segments.map((segment, index) => (
+            segment.type === 'code' ? (
+              <React.Fragment key={index}>
+                {markdownComponents.code({
+                  inline: false,
+                  className: `language-${segment.language}`,
+                  children: segment.content
+                })}
+              </React.Fragment>
             ) : (
-              <code className="inline-code" {...props}>
-                {children}
-              </code>
-            );
-          },
-          table: ({ children }) => (
-            <div className="table-wrapper">
-              <table className="markdown-table">{children}</table>
-            </div>
-          ),
-          th: ({ children }) => <th className="markdown-th">{children}</th>,
-          td: ({ children }) => <td className="markdown-td">{children}</td>,
-          a: ({ children, href }) => (
-            <a className="markdown-link" href={href} target="_blank" rel="noopener noreferrer">
-              {children}
-            </a>
-          ),
-          strong: ({ children }) => <strong className="markdown-strong">{children}</strong>,
-          em: ({ children }) => <em className="markdown-em">{children}</em>,
-        }}
-      >
-        {content}
-      </ReactMarkdown>
+              <React.Fragment key={index}>{renderMarkdown(segment.content)}</React.Fragment>
+            )
+          ))
+        : renderMarkdown(content)}
     </div>
   );
 };
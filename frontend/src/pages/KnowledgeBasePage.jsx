@@ -21,6 +21,42 @@ function base64ToBlob(base64, mime) {
   return new Blob([byteArray], { type: mime });
 }
 
+// Theo dõi job ingestion nền qua SSE, resolve khi job completed, reject khi failed
+function waitForIngestionJob(jobId, onProgress) {
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(`${API_BASE_URL}/knowledge-base/jobs/${jobId}/events`);
+    source.onmessage = (event) => {
+      const job = JSON.parse(event.data);
+      onProgress(job);
+      if (job.status === 'completed') {
+        source.close();
+        resolve(job);
+      } else if (job.status === 'failed') {
+        source.close();
+        reject(new Error(job.error || 'Processing failed'));
+      }
+    };
+    source.onerror = () => {
+      source.close();
+      reject(new Error('Lost connection while processing file'));
+    };
+  });
+}
+
+// Mô tả tiến độ job để hiển thị cho user
+function describeJobProgress(job) {
+  if (job.stage === 'ingesting' && job.pages_total) {
+    return `page ${job.pages_processed}/${job.pages_total}, ${job.chunks_embedded} chunks embedded`;
+  }
+  if (job.stage === 'extracting' && job.pages_total) {
+    return `Extracting text: page ${job.pages_processed}/${job.pages_total}`;
+  }
+  if (job.stage === 'embedding' && job.chunks_total) {
+    return `Embedding: ${job.chunks_embedded}/${job.chunks_total} chunks`;
+  }
+  return `Processing (${job.stage})...`;
+}
+
 function KnowledgeBasePage({ onNavigate }) {
   const [uploadedFile, setUploadedFile] = useState(null);
   const [messages, setMessages] = useState([
@@ -167,6 +203,7 @@ function KnowledgeBasePage({ onNavigate }) {
       formData.append('file', uploadedFile);
       formData.append('title', uploadedFile.name);
       formData.append('description', `Uploaded on ${new Date().toLocaleString()}`);
+      formData.append('async', 'true'); // Server trả về job_id ngay, xử lý PDF chạy nền
 
       const response = await axios.post(`${API_BASE_URL}/knowledge-base/upload`, formData, {
         headers: {
@@ -175,12 +212,31 @@ function KnowledgeBasePage({ onNavigate }) {
       });
 
       if (response.data.success) {
-        const newMessage = {
-          id: Date.now(),
+        const progressMessageId = Date.now();
+        setMessages(prev => [...prev, {
+          id: progressMessageId,
           type: 'bot',
-          content: `Great! I've received the file "${uploadedFile.name}" with ID: ${response.data.file_id}. You can now ask me about the content of this file.`
-        };
-        setMessages(prev => [...prev, newMessage]);
+          content: `Processing "${uploadedFile.name}"...`
+        }]);
+        
+        // File trùng nội dung đã xử lý xong thì server trả về ngay, không có job_id
+        if (response.data.job_id) {
+          await waitForIngestionJob(response.data.job_id, (job) => {
+            setMessages(prev => prev.map(msg => (
+              msg.id === progressMessageId
+                ? { ...msg, content: `Processing "${uploadedFile.name}": ${describeJobProgress(job)}` }
+                : msg
+            )));
+          });
+        }
+        
+        const fileId = response.data.file_id || response.data.data?.file_id;
+        const duplicateNote = response.data.data?.duplicate_of ? ' (same content as an existing file, reused it)' : '';
+        setMessages(prev => prev.map(msg => (
+          msg.id === progressMessageId
+            ? { ...msg, content: `Great! I've received the file "${uploadedFile.name}" with ID: ${fileId}${duplicateNote}. You can now ask me about the content of this file.` }
+            : msg
+        )));
         
         // Reset uploaded file và reload available files
         setUploadedFile(null);
@@ -225,7 +281,8 @@ function KnowledgeBasePage({ onNavigate }) {
       // Prepare chat request
       const chatData = {
         message: currentInput,
-        max_results: 50
+        max_results: 50,
+        include_segments: true
       };
 
       // Add selected files if any
@@ -240,6 +297,7 @@ function KnowledgeBasePage({ onNavigate }) {
           id: Date.now() + 1,
           type: 'bot',
           content: response.data.response,
+          segments: response.data.segments,
           sources: response.data.sources || []
         };
         setMessages(prev => [...prev, botMessage]);
@@ -384,7 +442,7 @@ function KnowledgeBasePage({ onNavigate }) {
                   {messages.map((message, index) => (
                     <div key={message.id} className={`message ${message.type}`}>
                       <div className="message-content">
-                        <MessageContent content={message.content} type={message.type} />
+                        <MessageContent content={message.content} segments={message.segments} type={message.type} />
                         {message.type === 'bot' && (
                           <div className="message-actions">
                             <button